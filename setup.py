@@ -11,12 +11,14 @@ for f in sorted(glob.glob(os.path.join('slapos', 'README.*.rst'))):
 
 long_description += open("CHANGES.txt").read() + "\n"
 
-prediction_require = ['statsmodels>=0.14.0', 'scipy', 'pandas']
+prediction_require = ['numpy', 'pandas']
 test_require = [
   'cryptography',
   'jsonschema',
   'mock',
   'websockets',
+  # to compare check_free_disk_space prediction with ARIMA
+  'statsmodels>=0.14.0',
 ] + prediction_require
 
 setup(name=name,
@@ -65,7 +67,8 @@ setup(name=name,
         'zodbpack': ['ZODB3'], # needed to play with ZODB
         'flask_auth' : ["Flask-Auth"],
         'pandas' : ['pandas'], # needed to monitor_partition_space promise
-        'prediction' : prediction_require, # needed to use ARIMA in check_free_disk_space
+        'prediction' : prediction_require, # needed to predict disk usage in check_free_disk_space
+        'amarisoft' : ['numpy'], # needed by the Amarisoft stats log promises
         'test': test_require,
       },
       tests_require=test_require,
@@ -79,8 +82,10 @@ setup(name=name,
           'check-feed-as-promise = slapos.checkfeedaspromise:main',
           'check-apachedex-result = slapos.promise.check_apachedex_result:main',
           'check-slow-queries-digest-result = slapos.promise.check_slow_queries_digest_result:main',
+          'collectordb-snapshot = slapos.promise.collectordb:main',
           'equeue = slapos.equeue:main',
           'generatefeed = slapos.generatefeed:main',
+          'gzip-log-index = slapos.gzipindex:main',
           'htpasswd = slapos.htpasswd:main',
           'is-local-tcp-port-opened = slapos.promise.is_local_tcp_port_opened:main',
           'is-process-older-than-dependency-set = slapos.promise.is_process_older_than_dependency_set:main',
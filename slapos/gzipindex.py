@@ -0,0 +1,481 @@
+# coding: utf-8
+"""
+Random access to gzip compressed logs.
+
+Rotated logs are usually compressed by logrotate, and reading their last
+lines, or the lines of a time range, means decompressing them from their
+beginning. As zran.c (from zlib examples), GzipIndex records access points
+every "span" bytes of decompressed data: the position of the start of a
+deflate block in the compressed file and the 32KB of data decompressed
+before it. Decompression can then start at any access point, so reading
+at an offset only decompresses the span which contains it.
+
+The index is built once per file (for example by gzip-log-index, run by
+logrotate after compression) and stored in an index folder given by the
+caller, never next to the file, under the folder and the inode of the
+file, so that it stays valid when logrotate renames the file. Without
+index folder, or when no index exists and none can be stored, openGzip
+falls back to a sequential read with the gzip module.
+
+Access points inside a gzip member need inflate(Z_BLOCK), which Python's
+zlib module does not provide, so the zlib library is called with ctypes.
+When it can not be loaded, there is an access point at the start of each
+gzip member only.
+"""
+
+import argparse
+import bisect
+import ctypes
+import ctypes.util
+import gzip
+import hashlib
+import io
+import marshal
+import os
+import zlib
+
+GZIP_INDEX_VERSION = 1
+# distance in bytes of decompressed data between 2 access points
+GZIP_INDEX_SPAN = 1024 * 1024
+
+READ_SIZE = 64 * 1024
+WINDOW_SIZE = 32 * 1024
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+Z_BLOCK = 5
+
+
+class GzipIndexError(Exception):
+  pass
+
+
+class _ZStream(ctypes.Structure):
+  _fields_ = [
+    ('next_in', ctypes.c_void_p),
+    ('avail_in', ctypes.c_uint),
+    ('total_in', ctypes.c_ulong),
+    ('next_out', ctypes.c_void_p),
+    ('avail_out', ctypes.c_uint),
+    ('total_out', ctypes.c_ulong),
+    ('msg', ctypes.c_char_p),
+    ('state', ctypes.c_void_p),
+    ('zalloc', ctypes.c_void_p),
+    ('zfree', ctypes.c_void_p),
+    ('opaque', ctypes.c_void_p),
+    ('data_type', ctypes.c_int),
+    ('adler', ctypes.c_ulong),
+    ('reserved', ctypes.c_ulong),
+  ]
+
+
+_zlib_library = None
+
+def _loadZlib():
+  """
+    Return the zlib library used by the zlib module, or None.
+  """
+  global _zlib_library
+  if _zlib_library is None:
+    _zlib_library = False
+    for path in (getattr(zlib, '__file__', None),
+                 ctypes.util.find_library('z')):
+      try:
+        library = ctypes.CDLL(path)
+        library.zlibVersion.restype = ctypes.c_char_p
+        library.inflateInit2_.argtypes = [
+          ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_char_p,
+          ctypes.c_int]
+        for name in 'inflate', 'inflateReset', 'inflateEnd':
+          getattr(library, name).argtypes = [ctypes.POINTER(_ZStream)] + (
+            [ctypes.c_int] if name == 'inflate' else [])
+      except (OSError, AttributeError):
+        continue
+      _zlib_library = library
+      break
+  return _zlib_library or None
+
+
+def _getWindow(window, position, total_out):
+  """
+    Return the last decompressed data (at most WINDOW_SIZE bytes) of the
+    circular buffer window, written until position.
+  """
+  data = window.raw
+  data = data[position:] + data[:position]
+  return data[WINDOW_SIZE - total_out:] if total_out < WINDOW_SIZE else data
+
+
+def _getBlockPointList(f, span):
+  """
+    Return the access points of the gzip file f, at the start of deflate
+    blocks, and its decompressed size.
+  """
+  library = _loadZlib()
+  stream = _ZStream()
+  if library.inflateInit2_(ctypes.byref(stream), 32 + 15,
+      library.zlibVersion(), ctypes.sizeof(stream)) != Z_OK:
+    raise GzipIndexError("Can not initialize zlib")
+  input_buffer = ctypes.create_string_buffer(READ_SIZE)
+  window = ctypes.create_string_buffer(WINDOW_SIZE)
+  point_list = []
+  total_in = total_out = 0
+  # decompressed offset of the last access point, None at a member start
+  last = None
+  member_in = 0
+  try:
+    while True:
+      if not stream.avail_in:
+        data = f.read(READ_SIZE)
+        if not data:
+          if total_in != member_in:
+            raise GzipIndexError("%s: truncated gzip file" % f.name)
+          break
+        ctypes.memmove(input_buffer, data, len(data))
+        stream.next_in = ctypes.addressof(input_buffer)
+        stream.avail_in = len(data)
+      if not stream.avail_out:
+        stream.next_out = ctypes.addressof(window)
+        stream.avail_out = WINDOW_SIZE
+      total_in += stream.avail_in
+      total_out += stream.avail_out
+      ret = library.inflate(ctypes.byref(stream), Z_BLOCK)
+      total_in -= stream.avail_in
+      total_out -= stream.avail_out
+      if ret == Z_STREAM_END:
+        # another member may follow
+        library.inflateReset(ctypes.byref(stream))
+        last = None
+        member_in = total_in
+        continue
+      if ret not in (Z_OK, Z_BUF_ERROR):
+        if last is None and point_list:
+          # not a gzip member, ignored like gzip does with padding
+          break
+        raise GzipIndexError("%s: %s" % (f.name, stream.msg))
+      data_type = stream.data_type
+      # at the end of the header or of a block, but not of the last one
+      if data_type & 128 and not data_type & 64 and (
+          last is None or total_out - last > span):
+        point_list.append((
+          total_out, total_in, data_type & 7, zlib.compress(_getWindow(
+            window, WINDOW_SIZE - stream.avail_out, total_out))))
+        last = total_out
+  finally:
+    library.inflateEnd(ctypes.byref(stream))
+  return point_list, total_out
+
+
+def _getMemberPointList(f):
+  """
+    Return access points at the start of the gzip members of f, and its
+    decompressed size.
+  """
+  point_list = []
+  total_out = 0
+  data = b''
+  offset = 0
+  while True:
+    if not data:
+      data = f.read(READ_SIZE)
+      if not data:
+        return point_list, total_out
+    if not data.startswith(b'\x1f\x8b'):
+      # padding
+      return point_list, total_out
+    # -1 bit means that decompression starts with the gzip header
+    point_list.append((total_out, offset, -1, b''))
+    decompressor = zlib.decompressobj(16 + 15)
+    while not decompressor.eof:
+      if not data:
+        data = f.read(READ_SIZE)
+        if not data:
+          raise GzipIndexError("%s: truncated gzip file" % f.name)
+      total_out += len(decompressor.decompress(data))
+      offset += len(data)
+      data = b''
+    data = decompressor.unused_data
+    offset -= len(data)
+
+
+def _shiftBits(data, shift):
+  """
+    Return data[:-1] as the deflate stream starting "shift" bits later.
+  """
+  return (int.from_bytes(data, 'little') >> shift).to_bytes(
+    len(data), 'little')[:-1]
+
+
+class GzipIndex(object):
+  """
+    Access points of a gzip file, every "span" bytes of decompressed data.
+  """
+
+  def __init__(self, path, index_folder, span=GZIP_INDEX_SPAN):
+    self.path = path
+    self.span = span
+    self.index_folder = index_folder
+    self.log_folder = os.path.dirname(os.path.abspath(path))
+    # indexes of the files of a folder share this prefix
+    self.prefix = hashlib.md5(
+      self.log_folder.encode('utf-8')).hexdigest() + '-'
+    self.index = None
+
+  def _getIndexFile(self, stat):
+    return os.path.join(self.index_folder,
+                        '%s%s.index' % (self.prefix, stat.st_ino))
+
+  def _getKey(self, stat):
+    return [GZIP_INDEX_VERSION, self.span, stat.st_size, stat.st_mtime_ns]
+
+  def load(self, stat):
+    try:
+      with open(self._getIndexFile(stat), 'rb') as f:
+        index = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+      return None
+    if not isinstance(index, dict) or index.get('key') != self._getKey(stat):
+      return None
+    return index
+
+  def build(self, f):
+    stat = os.fstat(f.fileno())
+    f.seek(0)
+    if _loadZlib() is None:
+      point_list, size = _getMemberPointList(f)
+    else:
+      point_list, size = _getBlockPointList(f, self.span)
+    return {
+      'key': self._getKey(stat),
+      'size': size,
+      'point-list': point_list,
+    }
+
+  def save(self, stat):
+    index_file = self._getIndexFile(stat)
+    tmp_file = '%s.%s.tmp' % (index_file, os.getpid())
+    try:
+      if not os.path.isdir(self.index_folder):
+        os.makedirs(self.index_folder)
+      with open(tmp_file, 'wb') as f:
+        f.write(marshal.dumps(self.index))
+      os.rename(tmp_file, index_file)
+      self.removeStaleIndex()
+    except OSError:
+      # the index is built again next time
+      pass
+
+  def canSave(self):
+    """
+      Tell if an index can be stored in the index folder.
+    """
+    try:
+      if not os.path.isdir(self.index_folder):
+        os.makedirs(self.index_folder)
+    except OSError:
+      return False
+    return os.access(self.index_folder, os.W_OK)
+
+  def removeStaleIndex(self):
+    """
+      Remove the index of the files of the same folder which were removed
+      (by logrotate).
+    """
+    inode_set = set(entry.inode() for entry in os.scandir(self.log_folder))
+    for name in os.listdir(self.index_folder):
+      if not name.startswith(self.prefix):
+        continue
+      inode = name[len(self.prefix):].split('.', 1)[0]
+      if not (inode.isdigit() and int(inode) in inode_set):
+        try:
+          os.remove(os.path.join(self.index_folder, name))
+        except OSError:
+          pass
+
+  def update(self, f, build=True):
+    """
+      Load the index of the opened gzip file f, or build it. Return False
+      if there is no index and build is false.
+    """
+    stat = os.fstat(f.fileno())
+    self.index = self.load(stat)
+    if self.index is None:
+      if not build:
+        return False
+      self.index = self.build(f)
+      self.save(stat)
+    self.offset_list = [q[0] for q in self.index['point-list']]
+    return True
+
+  @property
+  def size(self):
+    return self.index['size']
+
+  def getSpanIndex(self, offset):
+    """
+      Return the index of the span containing the decompressed offset.
+    """
+    return bisect.bisect_right(self.offset_list, offset) - 1
+
+  def readSpan(self, f, i):
+    """
+      Return the offset and the decompressed data of the span i.
+    """
+    point_list = self.index['point-list']
+    start, start_in, bits, window = point_list[i]
+    if i + 1 < len(point_list):
+      end = point_list[i + 1][0]
+    else:
+      end = self.size
+    if bits == -1:
+      decompressor = zlib.decompressobj(16 + 15)
+    else:
+      decompressor = zlib.decompressobj(-15, zdict=zlib.decompress(window))
+      if bits:
+        # the stream starts in the previous byte
+        start_in -= 1
+    shift = 8 - bits if bits > 0 else 0
+    f.seek(start_in)
+    data_list = []
+    length = end - start
+    pending = b''
+    while length and not decompressor.eof:
+      data = decompressor.unconsumed_tail
+      if not data:
+        data = f.read(READ_SIZE)
+        if shift:
+          if data:
+            data, pending = _shiftBits(pending + data, shift), data[-1:]
+          elif pending:
+            data, pending = bytes([pending[0] >> shift]), b''
+        if not data:
+          break
+      data = decompressor.decompress(data, length)
+      data_list.append(data)
+      length -= len(data)
+    if length:
+      raise GzipIndexError("%s: truncated gzip file" % self.path)
+    return start, b''.join(data_list)
+
+
+class GzipIndexReader(io.RawIOBase):
+  """
+    Seekable reader of a gzip file, decompressing the spans of its index
+    (see GzipIndex) which are read, and keeping the last one.
+  """
+
+  def __init__(self, path, index_folder, span=GZIP_INDEX_SPAN, index=None):
+    self.name = path
+    self._file = open(path, 'rb')
+    try:
+      if index is None:
+        index = GzipIndex(path, index_folder, span)
+      if index.index is None:
+        index.update(self._file)
+      self._index = index
+    except BaseException:
+      self._file.close()
+      raise
+    self._position = 0
+    self._span_start = 0
+    self._span = b''
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def fileno(self):
+    return self._file.fileno()
+
+  def tell(self):
+    return self._position
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self._position
+    elif whence == os.SEEK_END:
+      offset += self._index.size
+    if offset < 0:
+      raise ValueError("negative seek position %r" % offset)
+    self._position = offset
+    return offset
+
+  def readinto(self, buffer):
+    position = self._position
+    if position >= self._index.size:
+      return 0
+    span_offset = position - self._span_start
+    if not 0 <= span_offset < len(self._span):
+      self._span_start, self._span = self._index.readSpan(
+        self._file, self._index.getSpanIndex(position))
+      span_offset = position - self._span_start
+    data = self._span[span_offset:span_offset + len(buffer)]
+    buffer[:len(data)] = data
+    self._position += len(data)
+    return len(data)
+
+  def close(self):
+    if not self.closed:
+      self._file.close()
+      self._span = b''
+    super(GzipIndexReader, self).close()
+
+
+def openGzip(path, mode='rb', span=GZIP_INDEX_SPAN, index_folder=None,
+             fallback=True):
+  """
+    Open a gzip file for reading, in binary ('rb') or text ('r', 'rt')
+    mode, with cheap seeks (see GzipIndexReader) if its index is in
+    index_folder or can be stored there.
+
+    Otherwise, the file is opened with the gzip module, so it is only
+    decompressed while it is read, but it can not be seeked from its end
+    and seeking backwards decompresses it again from its beginning. If
+    fallback is false, GzipIndexError is raised instead.
+  """
+  if mode not in ('r', 'rt', 'rb'):
+    raise ValueError("invalid mode: %r" % mode)
+  index = None
+  if index_folder is not None:
+    index = GzipIndex(path, index_folder, span)
+    with open(path, 'rb') as f:
+      if not (index.update(f, build=False) or index.canSave()):
+        index = None
+  if index is None:
+    if not fallback:
+      raise GzipIndexError("%s: no index in %s" % (path, index_folder))
+    f = gzip.open(path, 'rb')
+  else:
+    f = io.BufferedReader(GzipIndexReader(path, index_folder, span, index))
+  if mode == 'rb':
+    return f
+  return io.TextIOWrapper(f)
+
+
+def openLog(path, mode='r', index_folder=None):
+  """
+    Open a log for reading, with openGzip if it is compressed (.gz).
+  """
+  if path.endswith('.gz'):
+    return openGzip(path, mode, index_folder=index_folder)
+  return open(path, mode)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Index gzip compressed logs, for random access")
+  parser.add_argument('--span', type=int, default=GZIP_INDEX_SPAN,
+    help="Bytes of decompressed data between 2 access points")
+  parser.add_argument('--index-folder', required=True,
+    help="Folder of the indexes, the one given to the readers of the files")
+  parser.add_argument('file_list', nargs='+', metavar='FILE')
+  args = parser.parse_args()
+  for path in args.file_list:
+    GzipIndexReader(path, args.index_folder, args.span).close()
+
+
+if __name__ == '__main__':
+  main()
@@ -19,11 +19,11 @@
 # See https://www.nexedi.com/licensing for rationale and options.
 
 import datetime
-import gzip
 import re
-import contextlib
 import click
 
+from slapos.logscan import ChunkScanner
+
 TIMESTAMP_DETECT = re.compile(r'\[(?P<timestamp>.*)\].*')
 PROCESSING_DETECT = re.compile(
   r'\[(?P<timestamp>.*)\].* Processing Computer Partition (?P<partition>.*)\.')
@@ -34,14 +34,83 @@ SOFTWARE_DETECT = re.compile(r'.*Software URL: (?P<software_release>.*)')
 VERSION_DETECT = re.compile(r'.*(?P<version>1\.0\.[0-9]+)/.*')
 
 
-@contextlib.contextmanager
-def auto_open(filename, mode):
-  if filename.endswith('.gz'):
-    with gzip.open(filename, mode) as f:
-      yield f
-  else:
-    with open(filename, mode) as f:
-      yield f
+def scanChunk(data, start, end):
+  """
+  Return the events of the lines of data[start:end], in order:
+  ('processing', timestamp, partition), ('error',), ('software', url) and
+  ('timestamp', timestamp) for the last timestamp before a processing line
+  or the end of the chunk.
+  """
+  event_list = []
+  timestamp = None
+  for line in data[start:end].decode('utf-8', 'replace').split('\n'):
+    line = line.strip()[:500]
+    if not line.startswith('['):
+      continue
+    # the literal parts of the expressions are looked up first, as most
+    # lines match none of them
+    processing = ' Processing Computer Partition ' in line and \
+      PROCESSING_DETECT.fullmatch(line)
+    if processing:
+      if timestamp is not None:
+        event_list.append(('timestamp', timestamp))
+        timestamp = None
+      event_list.append(('processing',
+        processing.groupdict()['timestamp'].split(',')[0],
+        processing.groupdict()['partition']))
+      continue
+    timestamp_end = line.rfind(']')
+    if timestamp_end == -1:
+      timestamp = TIMESTAMP_DETECT.fullmatch(line).groupdict()['timestamp']
+    else:
+      # same as TIMESTAMP_DETECT, whose timestamp ends at the last "]"
+      timestamp = line[1:timestamp_end]
+    timestamp = timestamp.split(',')[0]
+    if ' ERROR' in line and ERROR_DETECT.fullmatch(line):
+      event_list.append(('error',))
+    software = 'Software URL: ' in line and SOFTWARE_DETECT.fullmatch(line)
+    if software:
+      event_list.append(('software',
+        software.groupdict()['software_release']))
+  if timestamp is not None:
+    event_list.append(('timestamp', timestamp))
+  return event_list
+
+
+def processEvent(processing_state, event):
+  if event[0] == 'processing':
+    _, run_id, partition = event
+    timestamp = datetime.datetime.strptime(
+      run_id, '%Y-%m-%d %H:%M:%S').timestamp()
+    if 'start' not in processing_state:
+      processing_state['run_id'] = run_id
+      processing_state['start'] = timestamp
+      processing_state['partition'] = partition
+      processing_state['status'] = 'OK'
+    else:
+      processing_state['end'] = datetime.datetime.strptime(
+        processing_state['previous_timestamp'], '%Y-%m-%d %H:%M:%S'
+      ).timestamp()
+      processing_state['elapsed'] = int(
+        processing_state['end'] - processing_state['start'])
+      print(
+        '%(partition)s;%(run_id)s;%(version)s;%(status)s;%(elapsed)s'
+        % processing_state)
+      processing_state['run_id'] = run_id
+      processing_state['start'] = timestamp
+      processing_state['partition'] = partition
+      processing_state['status'] = 'OK'
+  elif event[0] == 'timestamp':
+    processing_state['previous_timestamp'] = event[1]
+  elif event[0] == 'error':
+    processing_state['status'] = 'ERR'
+  elif event[0] == 'software':
+    software_release = event[1]
+    version = VERSION_DETECT.fullmatch(software_release)
+    if version is not None:
+      processing_state['version'] = version['version']
+    else:
+      processing_state['version'] = software_release
 
 
 @click.command(short_help="Times slapos instance log files")
@@ -51,56 +120,26 @@ def auto_open(filename, mode):
   type=click.Path(),  # can't use click.File, as existence is required and
                       # that increases usage complexity
 )
-def main(file_list):
+@click.option(
+  '--process-count', type=int, default=None,
+  help="Number of processes scanning the files (default: number of CPUs)")
+@click.option(
+  '--gzip-index-folder', type=click.Path(file_okay=False), default=None,
+  help="Folder where the index of compressed (.gz) files is written, to "
+       "scan them in parallel (default: they are decompressed whole, by one "
+       "process, and nothing is written)")
+def main(file_list, process_count, gzip_index_folder):
   """
   Allows to analyze and time slapos node log files.
   FILE_LIST can be provided in order, then analysis continuity will be kept.
   """
   processing_state = {}
+  scanner = ChunkScanner(process_count, gzip_index_folder=gzip_index_folder)
   for filename in file_list:
-    with auto_open(filename, mode='rt') as fh:
-      for line in fh.readlines():
-        line = line.strip()[:500]
-        if not line.startswith('['):
-          continue
-        processing = PROCESSING_DETECT.fullmatch(line)
-        if processing:
-          run_id = processing.groupdict()['timestamp'].split(',')[0]
-          timestamp = datetime.datetime.strptime(
-            run_id, '%Y-%m-%d %H:%M:%S').timestamp()
-          if 'start' not in processing_state:
-            processing_state['run_id'] = run_id
-            processing_state['start'] = timestamp
-            processing_state['partition'] = processing.groupdict()['partition']
-            processing_state['status'] = 'OK'
-          else:
-            processing_state['end'] = datetime.datetime.strptime(
-              processing_state['previous_timestamp'], '%Y-%m-%d %H:%M:%S'
-            ).timestamp()
-            processing_state['elapsed'] = int(
-              processing_state['end'] - processing_state['start'])
-            print(
-              '%(partition)s;%(run_id)s;%(version)s;%(status)s;%(elapsed)s'
-              % processing_state)
-            processing_state['run_id'] = run_id
-            processing_state['start'] = timestamp
-            processing_state['partition'] = processing.groupdict()['partition']
-            processing_state['status'] = 'OK'
-          continue
-        processing_state['previous_timestamp'] = TIMESTAMP_DETECT.fullmatch(
-          line).groupdict()['timestamp'].split(',')[0]
-        error = ERROR_DETECT.fullmatch(line)
-        if error:
-          processing_state['status'] = 'ERR'
-        software = SOFTWARE_DETECT.fullmatch(line)
-        if software:
-          software_release = software.groupdict()['software_release']
-          version = VERSION_DETECT.fullmatch(software_release)
-          if version is not None:
-            processing_state['version'] = version['version']
-          else:
-            processing_state['version'] = software_release
-          continue
+    # files are scanned by chunks in parallel, events are processed in order
+    for event_list in scanner.scan(filename, scanChunk):
+      for event in event_list:
+        processEvent(processing_state, event)
   else:
     processing_state['end'] = datetime.datetime.strptime(
       processing_state['previous_timestamp'], '%Y-%m-%d %H:%M:%S').timestamp()
@@ -0,0 +1,199 @@
+# coding: utf-8
+"""
+Parallel scanning of large log files.
+
+ChunkScanner maps the file in memory, splits it in chunks ending on a
+newline and runs a scan function on each chunk in a pool of processes.
+The results are returned in the order of the chunks, so merging them
+gives the same result whatever the number of processes is.
+
+A scan function is called as scan_chunk(data, start, end) and must only
+look at data[start:end] (lines never cross a chunk boundary). It must be
+picklable (a function of a module, or a picklable object like
+RegexMatcher) to be run in another process. Compiled regular expressions
+can search the mapped file without copying it:
+
+  pattern.finditer(data, start, end)
+
+Compressed (.gz) files can not be mapped: they are decompressed whole and
+scanned as one chunk, unless an index folder is given (gzip_index_folder)
+where their index is or can be written, in which case they are read with
+their index (see slapos.gzipindex), each process decompressing only its
+chunk. Nothing is
+written next to the scanned files, whose folder may be read-only.
+"""
+
+import gzip
+import mmap
+import multiprocessing
+import os
+import re
+
+from slapos.gzipindex import openGzip
+
+# size of the chunks scanned by each process, in bytes
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _scanChunk(args):
+  path, start, end, scan_chunk = args
+  with open(path, 'rb') as f:
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      return scan_chunk(data, start, end)
+    finally:
+      data.close()
+
+
+def _scanGzipChunk(args):
+  path, start, end, scan_chunk, index_folder = args
+  with openGzip(path, index_folder=index_folder) as f:
+    # the chunk has the lines starting between start and end
+    if start:
+      f.seek(start - 1)
+      f.readline()
+      start = f.tell()
+    if start >= end:
+      data = b''
+    else:
+      data = f.read(end - start)
+      if not data.endswith(b'\n'):
+        data += f.readline()
+  return scan_chunk(data, 0, len(data))
+
+
+class ChunkScanner(object):
+  """
+    Scan files by chunks, with process_count processes (default: the
+    number of CPUs). Compressed files are only split in chunks if
+    gzip_index_folder is given, where their index is kept.
+  """
+
+  def __init__(self, process_count=None, chunk_size=CHUNK_SIZE,
+               gzip_index_folder=None):
+    self.process_count = process_count or os.cpu_count() or 1
+    self.chunk_size = chunk_size
+    self.gzip_index_folder = gzip_index_folder
+
+  def getChunkList(self, data):
+    """
+      Return the (start, end) of the chunks of data, each ending after a
+      newline (or at the end of data).
+    """
+    chunk_list = []
+    size = len(data)
+    start = 0
+    while start < size:
+      end = start + self.chunk_size
+      if end < size:
+        newline = data.find(b'\n', end - 1)
+        end = size if newline == -1 else newline + 1
+      else:
+        end = size
+      chunk_list.append((start, end))
+      start = end
+    return chunk_list
+
+  def scan(self, path, scan_chunk):
+    """
+      Return the list of the results of scan_chunk on the chunks of the
+      file, in the order of the chunks.
+    """
+    if path.endswith('.gz'):
+      index_folder = self.gzip_index_folder
+      if self.process_count == 1 or index_folder is None:
+        with gzip.open(path) as f:
+          data = f.read()
+        return [scan_chunk(data, 0, len(data))]
+      with openGzip(path, index_folder=index_folder) as f:
+        if isinstance(f, gzip.GzipFile):
+          # the index can not be stored
+          data = f.read()
+          return [scan_chunk(data, 0, len(data))]
+        size = f.seek(0, os.SEEK_END)
+        if size <= self.chunk_size:
+          f.seek(0)
+          data = f.read()
+          return [scan_chunk(data, 0, len(data))]
+      arg_list = [(path, start, min(start + self.chunk_size, size),
+                   scan_chunk, index_folder)
+                  for start in range(0, size, self.chunk_size)]
+      scan = _scanGzipChunk
+    else:
+      with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+          return []
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+          chunk_list = self.getChunkList(data)
+          if self.process_count == 1 or len(chunk_list) == 1:
+            return [scan_chunk(data, start, end)
+                    for start, end in chunk_list]
+        finally:
+          data.close()
+      arg_list = [(path, start, end, scan_chunk)
+                  for start, end in chunk_list]
+      scan = _scanChunk
+    pool = multiprocessing.Pool(min(self.process_count, len(arg_list)))
+    try:
+      return pool.map(scan, arg_list, chunksize=1)
+    finally:
+      pool.terminate()
+      pool.join()
+
+
+class RegexMatcher(object):
+  """
+    Scan function returning the matches of a bytes regular expression in
+    a chunk, as tuples of their groups (or the matched bytes if the
+    expression has no group). Lines are matched with re.MULTILINE.
+  """
+
+  def __init__(self, pattern, flags=0):
+    self.pattern = pattern
+    self.flags = flags | re.MULTILINE
+    self._regex = None
+
+  def __getstate__(self):
+    # the compiled expression is compiled again in the other process
+    return {'pattern': self.pattern, 'flags': self.flags, '_regex': None}
+
+  @property
+  def regex(self):
+    if self._regex is None:
+      self._regex = re.compile(self.pattern, self.flags)
+    return self._regex
+
+  def __call__(self, data, start, end):
+    regex = self.regex
+    if regex.groups:
+      return [m.groups() for m in regex.finditer(data, start, end)]
+    return [m.group() for m in regex.finditer(data, start, end)]
+
+
+class RegexCounter(RegexMatcher):
+  """
+    Scan function returning the number of matches in a chunk.
+  """
+
+  def __call__(self, data, start, end):
+    return sum(1 for _ in self.regex.finditer(data, start, end))
+
+
+def findAll(path, pattern, flags=0, scanner=None):
+  """
+    Return the matches of pattern in the file, in order (see RegexMatcher).
+  """
+  result_list = []
+  for chunk_result in (scanner or ChunkScanner()).scan(
+      path, RegexMatcher(pattern, flags)):
+    result_list.extend(chunk_result)
+  return result_list
+
+
+def countMatches(path, pattern, flags=0, scanner=None):
+  """
+    Return the number of matches of pattern in the file.
+  """
+  return sum((scanner or ChunkScanner()).scan(
+    path, RegexCounter(pattern, flags)))
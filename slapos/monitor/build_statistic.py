@@ -2,10 +2,21 @@ import json
 import sys
 import glob
 import time
+import calendar
+import datetime
 import os
+import errno
 import argparse
 
-import six
+# Number of bytes at the beginning of a history file used to recognize it.
+# It contains the creation date of the file, so a history file which was
+# recreated (broken json, ...) has a different signature.
+SIGNATURE_SIZE = 32
+CHECKPOINT_VERSION = 3
+# Number of days before the day of the last entry whose counters are kept in
+# the checkpoint. Older days are final and were already written to the stats
+# file, they are only kept in case of entries slightly out of order.
+DAY_RETENTION = 3
 
 def parseArguments():
   """
@@ -14,63 +25,283 @@ def parseArguments():
   parser = argparse.ArgumentParser()
   parser.add_argument('--history_folder',
                       help='Path where history files are located and where stats will be generated.')
+  parser.add_argument('--checkpoint_folder', required=True,
+                      help='Path of the private folder where processing '
+                           'checkpoints are stored.')
 
   return parser
 
 
-def buildStatistic(history_folder):
-  now = time.time()
-  for p in glob.glob("%s/*.history.json" % history_folder):
-    result = {}
-    stats_list = []
-    promise_name = p.split("/")[-1].replace(".history.json", "")
+def parseDate(date_string):
+  """
+    Convert a promise date (2026-01-01T10:00:00+0000) to a timestamp.
+    A date without offset is in UTC.
+  """
+  try:
+    return calendar.timegm(datetime.datetime.strptime(
+      date_string, '%Y-%m-%dT%H:%M:%S%z').utctimetuple())
+  except ValueError:
+    return calendar.timegm(time.strptime(date_string, '%Y-%m-%dT%H:%M:%S'))
 
-    stat_file_path = p.replace(".history.json", ".stats.json")
-    if os.path.exists(stat_file_path):
-      with open(stat_file_path) as f:
-        stats_dict = json.load(f)
-        f.close()
+
+def getDay(timestamp):
+  return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def loadJson(path):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (IOError, OSError) as e:
+    if e.errno != errno.ENOENT:
+      raise
+  except ValueError:
+    pass
+  return None
+
+
+def writeJson(path, content):
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(content, f)
+  os.rename(tmp_path, path)
+
+
+class PromiseStatistic(object):
+  """
+    Incremental statistics of one promise history file.
+
+    The checkpoint remembers up to which offset the history file was read,
+    the last seen status and the running counters of the last days. Each run
+    only decodes the entries appended since then.
+
+    Each run with new entries appends one record per day modified by these
+    entries to the stats file, oldest first. The last record of a day gives
+    its final statistic, so the full per-day picture is the last record of
+    every day. Records also give the day, the availability, the mean time to
+    recover and the flap count of the day.
+  """
+
+  def __init__(self, history_path, stat_file_path, checkpoint_path):
+    self.history_path = history_path
+    self.stat_file_path = stat_file_path
+    self.checkpoint_path = checkpoint_path
+    checkpoint = loadJson(checkpoint_path)
+    if checkpoint is None or checkpoint.get('version') != CHECKPOINT_VERSION:
+      checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'signature': '',
+        'offset': 0,
+        'stats-offset': 0,
+      }
+      self.resetCounter(checkpoint)
+    self.checkpoint = checkpoint
+
+  def resetCounter(self, checkpoint):
+    checkpoint.update({
+      'last-date': None,
+      'last-status': None,
+      'error-since': None,
+      'day-dict': {},
+    })
+
+  def readNewEntryList(self):
+    """
+      Return the history entries appended since the last run.
+    """
+    with open(self.history_path, 'rb') as f:
+      signature = f.read(SIGNATURE_SIZE).decode('utf-8', 'replace')
+      f.seek(0, 2)
+      size = f.tell()
+      offset = self.checkpoint['offset']
+      if signature != self.checkpoint['signature'] or size < offset:
+        # new history file, read it from the beginning
+        offset = 0
+        self.resetCounter(self.checkpoint)
+      if size == offset:
+        return []
+      # entries are appended by overwriting the final "]}" of the document
+      start = max(offset - 2, 0)
+      f.seek(start)
+      data = f.read(size - start).decode('utf-8')
+
+    if not data.endswith(']}'):
+      # file is being written, try again next time
+      return []
+    if start == 0:
+      entry_list = json.loads(data)['data']
     else:
-      stats_dict = {"date": now, "data": []}
+      decoder = json.JSONDecoder()
+      entry_list = []
+      position = 0
+      end = len(data) - 2
+      while position < end:
+        if data[position] in ', \n':
+          position += 1
+          continue
+        entry, position = decoder.raw_decode(data, position)
+        entry_list.append(entry)
+    self.checkpoint['signature'] = signature
+    self.checkpoint['offset'] = size
+    return entry_list
 
-    last_date = None
-    if stats_dict["data"]:
-      if "start-date" in stats_dict["data"][-1]:
-        last_date = stats_dict["data"][-1]["start-date"]
-      else:
-        last_date = stats_dict["data"][-1]["date"]
+  def _getDayStat(self, day):
+    return self.checkpoint['day-dict'].setdefault(day, {
+      'OK': 0,
+      'ERROR': 0,
+      'ok-seconds': 0,
+      'error-seconds': 0,
+      'flap-count': 0,
+      'recover-seconds': 0,
+      'recover-count': 0,
+    })
 
-    with open(p) as f:
-      j = json.load(f)
+  def _addDuration(self, status, start, end, touched_day_set):
+    # split [start, end[ on day boundaries
+    key = 'ok-seconds' if status == 'OK' else 'error-seconds'
+    while start < end:
+      day_end = (start // 86400 + 1) * 86400
+      stop = min(end, day_end)
+      day = getDay(start)
+      self._getDayStat(day)[key] += stop - start
+      touched_day_set.add(day)
+      start = stop
 
-      j_last_date = j['data'][-1]["date"]
-      if last_date == j_last_date:
-        # This file was already loaded, so skip
+  def processEntryList(self, entry_list):
+    """
+      Update the running counters, return the set of modified days.
+    """
+    checkpoint = self.checkpoint
+    touched_day_set = set()
+    for entry in entry_list:
+      try:
+        timestamp = parseDate(entry['date'])
+      except (KeyError, ValueError):
         continue
+      status = str(entry['status'])
+      day = getDay(timestamp)
+      day_stat = self._getDayStat(day)
+      day_stat.setdefault(status, 0)
+      day_stat[status] += 1
+      touched_day_set.add(day)
+
+      last_status = checkpoint['last-status']
+      if last_status is not None and timestamp >= checkpoint['last-date']:
+        self._addDuration(last_status, checkpoint['last-date'], timestamp,
+                          touched_day_set)
+        if status != last_status:
+          day_stat['flap-count'] += 1
+      if status == 'ERROR':
+        if checkpoint['error-since'] is None:
+          checkpoint['error-since'] = timestamp
+      elif checkpoint['error-since'] is not None:
+        day_stat['recover-seconds'] += timestamp - checkpoint['error-since']
+        day_stat['recover-count'] += 1
+        checkpoint['error-since'] = None
+      checkpoint['last-status'] = status
+      checkpoint['last-date'] = timestamp
+    return touched_day_set
 
-      for entry in j['data']:
-        day = entry["date"].split("T")[0]
-        result.setdefault(day, {"ERROR": 0, "OK": 0})
-        result[day][str(entry["status"])] += 1
-      f.close()
+  def pruneDayDict(self):
+    """
+      Drop the counters of the final days, already in the stats file.
+    """
+    last_date = self.checkpoint['last-date']
+    if last_date is None:
+      return
+    oldest_day = getDay(last_date - DAY_RETENTION * 86400)
+    day_dict = self.checkpoint['day-dict']
+    for day in list(day_dict):
+      if day < oldest_day:
+        del day_dict[day]
 
-    for date, stat in six.iteritems(result):
-      stats_list.append(
-        {"status": "ERROR" if stat["ERROR"] > 0 else "OK",
-         "change-time": now,
-         "date": j_last_date,
-         "message": stat})
+  def getDayStatus(self, day_stat):
+    if day_stat["ERROR"]:
+      return "ERROR"
+    if not day_stat["OK"] and day_stat["error-seconds"]:
+      # no entry this day, the promise stayed in error
+      return "ERROR"
+    return "OK"
 
+  def getDayStatistic(self, day, now, last_date):
+    day_stat = self.checkpoint['day-dict'][day]
+    covered = day_stat['ok-seconds'] + day_stat['error-seconds']
+    availability = None
+    if covered:
+      availability = round(100. * day_stat['ok-seconds'] / covered, 2)
+    time_to_recover = None
+    if day_stat['recover-count']:
+      time_to_recover = day_stat['recover-seconds'] / day_stat['recover-count']
+    return {
+      "status": self.getDayStatus(day_stat),
+      "change-time": now,
+      "date": last_date,
+      "day": day,
+      "message": {"ERROR": day_stat["ERROR"], "OK": day_stat["OK"]},
+      "availability": availability,
+      "time-to-recover": time_to_recover,
+      "flap-count": day_stat['flap-count'],
+    }
 
-    stats_dict["data"].extend(stats_list)
+  def appendStatistic(self, stats_list, now):
+    """
+      Append stats_list to the stats file without reading it, when it was
+      not modified since the last run.
+    """
+    if not stats_list:
+      return
+    try:
+      size = os.path.getsize(self.stat_file_path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      size = None
+    if size is not None and size == self.checkpoint['stats-offset']:
+      with open(self.stat_file_path, 'rb+') as f:
+        f.seek(size - 3)
+        # no separator after the opening bracket of an empty list
+        separator = '' if f.read(1) == b'[' else ','
+        f.seek(size - 2)
+        f.write(('%s%s]}' % (separator, json.dumps(stats_list)[1:-1])
+                ).encode('utf-8'))
+    else:
+      stats_dict = loadJson(self.stat_file_path)
+      if not isinstance(stats_dict, dict) or \
+          not isinstance(stats_dict.get('data'), list):
+        stats_dict = {"date": now, "data": []}
+      stats_dict["data"].extend(stats_list)
+      writeJson(self.stat_file_path, stats_dict)
+    self.checkpoint['stats-offset'] = os.path.getsize(self.stat_file_path)
+
+  def build(self, now):
+    entry_list = self.readNewEntryList()
+    if not entry_list:
+      return
+    touched_day_set = self.processEntryList(entry_list)
+    last_date = entry_list[-1].get("date")
+    stats_list = [self.getDayStatistic(day, now, last_date)
+                  for day in sorted(touched_day_set)]
+    self.appendStatistic(stats_list, now)
+    self.pruneDayDict()
+    writeJson(self.checkpoint_path, self.checkpoint)
 
-    with open(stat_file_path, "w+") as f:
-      f.write(json.dumps(stats_dict))
-      f.truncate()
-      f.close()
+
+def buildStatistic(history_folder, checkpoint_folder):
+  now = time.time()
+  if not os.path.isdir(checkpoint_folder):
+    raise Exception("Invalid checkpoint folder: %s" % checkpoint_folder)
+  for p in glob.glob("%s/*.history.json" % history_folder):
+    promise_name = p.split("/")[-1].replace(".history.json", "")
+    stat_file_path = p.replace(".history.json", ".stats.json")
+    checkpoint_path = os.path.join(
+      checkpoint_folder, "%s.stats.checkpoint" % promise_name)
+    try:
+      PromiseStatistic(p, stat_file_path, checkpoint_path).build(now)
+    except ValueError as e:
+      print("ERROR: Bad json file at: %s\n%s" % (p, e))
 
 def main():
   arg_parser = parseArguments()
   config = arg_parser.parse_args()
-  buildStatistic(config.history_folder)
+  buildStatistic(config.history_folder, config.checkpoint_folder)
   sys.exit(0)
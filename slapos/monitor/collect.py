@@ -31,18 +31,22 @@ from __future__ import division
 
 import sqlite3
 import os
-import errno
 import pwd
-import time
 import json
 import argparse
 import psutil
 from time import strftime
 from datetime import datetime, timedelta
+from six.moves.urllib.request import pathname2url
 
 from slapos.collect.db import Database
 from slapos.collect.reporter import ConsumptionReportBase
-from slapos.monitor.monitor_state import quickAppendToJsonFile, safeWriteJsonFile
+from slapos.monitor.monitor_state import safeWriteJsonFile
+from slapos.monitor.resource_data import ResourceDataFile
+
+PROCESS_DATA_HEADER = "date, total process, CPU percent, CPU time, CPU threads"
+MEMORY_DATA_HEADER = "date, memory used percent, memory used"
+IO_DATA_HEADER = "date, io rw counter, io cycles counter, disk used"
 
 def parseArguments():
   """
@@ -57,6 +61,9 @@ def parseArguments():
                       help='ID of the computer partition to collect data from.')
   parser.add_argument('--collector_db',
                       help='The path of slapos collect database.')
+  parser.add_argument('--state_folder', required=True,
+                      help='Path of the private folder where the rollup '
+                           'state of data files is stored.')
 
   return parser.parse_args()
 
@@ -68,6 +75,24 @@ def parseArguments():
 
 class ResourceCollect:
 
+  # Queries are constant strings with bound parameters, so the sqlite3
+  # statement cache only prepares each of them once per connection.
+  PROCESS_CONSUMPTION_QUERY = """SELECT count(pid), SUM(cpu_percent) as cpu_result,
+      SUM(cpu_time), MAX(cpu_num_threads), SUM(memory_percent), SUM(memory_rss),
+      pid, SUM(io_rw_counter), SUM(io_cycles_counter)
+    FROM user
+    WHERE date = ? AND partition = ? AND (time BETWEEN ? AND ?) %s
+    GROUP BY pid ORDER BY cpu_result DESC"""
+
+  PARTITION_STATUS_QUERY = """SELECT count(pid), SUM(cpu_percent), SUM(cpu_time),
+      SUM(cpu_num_threads), SUM(memory_percent), SUM(memory_rss),
+      SUM(io_rw_counter), SUM(io_cycles_counter)%s
+    FROM user
+    WHERE date = ? AND partition = ? AND (time BETWEEN ? AND ?) %s"""
+
+  FOLDER_STATUS_SUBQUERY = """, (SELECT SUM(disk_used) FROM folder
+      WHERE date = ? AND partition = ? AND (time BETWEEN ? AND ?) %s)"""
+
   def __init__(self, db_path = None):
     # XXX this code is duplicated with slapos.collect.db.Database.__init__
     assert os.path.exists(db_path)
@@ -77,15 +102,48 @@ class ResourceCollect:
     # Do not try to created or update tables, access will be refused
     self.db = Database(db_path, create=False, timeout=15)
     self.consumption_utils = ConsumptionReportBase(self.db)
+    self.connection = None
+    self._table_dict = {}
+
+  def getConnection(self):
+    """
+      Return the read only connection used by all queries of this collector.
+    """
+    if self.connection is None:
+      self.connection = sqlite3.connect(
+        'file:%s?mode=ro' % pathname2url(self.db.uri),
+        uri=True,
+        timeout=self.db.timeout)
+    return self.connection
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
 
   def has_table(self, name):
-    self.db.connect()
-    check_result_cursor = self.db.select(
-      table="sqlite_master",
-      columns='name',
-      where="type='table' AND name='%s'" % name)
-    r = check_result_cursor.fetchone()
-    return r and r[0] is not None
+    if name not in self._table_dict:
+      r = self.getConnection().execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+        (name,)).fetchone()
+      self._table_dict[name] = bool(r and r[0] is not None)
+    return self._table_dict[name]
+
+  def getProcessInfo(self, pid):
+    """
+      Return name, command, user and start date of the process.
+    """
+    try:
+      pprocess = psutil.Process(pid)
+      with pprocess.oneshot():
+        return {
+          'name': pprocess.name(),
+          'command': pprocess.cmdline(),
+          'user': pprocess.username(),
+          'date': datetime.fromtimestamp(pprocess.create_time()).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    except psutil.NoSuchProcess:
+      return None
 
   def getPartitionCPULoadAverage(self, partition_id, date_scope):
     return self.consumption_utils.getPartitionCPULoadAverage(partition_id, date_scope)
@@ -96,28 +154,28 @@ class ResourceCollect:
   def getPartitionDiskUsedAverage(self, partition_id, date_scope):
     return self.consumption_utils.getPartitionDiskUsedAverage(partition_id, date_scope)/1024
 
+  def _getQueryScope(self, date_scope, min_time, max_time):
+    if not date_scope:
+      date_scope = datetime.now().strftime('%Y-%m-%d')
+    if not min_time:
+      min_time = (datetime.now() - timedelta(minutes=1)).strftime('%H:%M:00')
+    if not max_time:
+      max_time = (datetime.now() - timedelta(minutes=1)).strftime('%H:%M:59')
+    return date_scope, min_time, max_time
+
   def getPartitionConsumption(self, partition_id, where="", date_scope=None, min_time=None, max_time=None):
     """
       Query collector db to get consumed resource for last minute
     """
-    self.db.connect()
     comsumption_list = []
     if where != "":
       where = "and %s" % where
-    if not date_scope:
-      date_scope = datetime.now().strftime('%Y-%m-%d')
-    if not min_time:
-      min_time = (datetime.now() - timedelta(minutes=1)).strftime('%H:%M:00')
-    if not max_time:
-      max_time = (datetime.now() - timedelta(minutes=1)).strftime('%H:%M:59')
+    date_scope, min_time, max_time = self._getQueryScope(
+      date_scope, min_time, max_time)
 
-    columns = """count(pid), SUM(cpu_percent) as cpu_result, SUM(cpu_time),
-                MAX(cpu_num_threads), SUM(memory_percent), SUM(memory_rss), pid, SUM(io_rw_counter),
-                SUM(io_cycles_counter)"""
-    query_result = self.db.select("user", date_scope, columns,
-                   where="partition = '%s'  and (time between '%s' and '%s') %s" % 
-                   (partition_id, min_time, max_time, where),
-                   group="pid", order="cpu_result desc")
+    query_result = self.getConnection().execute(
+      self.PROCESS_CONSUMPTION_QUERY % where,
+      (date_scope, partition_id, min_time, max_time))
     for result in query_result:
       count = int(result[0])
       if not count > 0:
@@ -132,36 +190,27 @@ class ResourceCollect:
         'io_rw_counter': round(result[7]/count, 2),
         'io_cycles_counter': round(result[8]/count, 2)
       }
-      try:
-        pprocess = psutil.Process(int(result[6]))
-      except psutil.NoSuchProcess:
-        pass
-      else:
-        resource_dict['name'] = pprocess.name()
-        resource_dict['command'] = pprocess.cmdline()
-        resource_dict['user'] = pprocess.username()
-        resource_dict['date'] = datetime.fromtimestamp(pprocess.create_time()).strftime("%Y-%m-%d %H:%M:%S")
+      process_info = self.getProcessInfo(int(result[6]))
+      if process_info is not None:
+        resource_dict.update(process_info)
       comsumption_list.append(resource_dict)
-    self.db.close()
     return comsumption_list
 
   def getPartitionComsumptionStatus(self, partition_id, where="", date_scope=None, min_time=None, max_time=None):
-    self.db.connect()
     if where != "":
       where = " and %s" % where
-    if not date_scope:
-      date_scope = datetime.now().strftime('%Y-%m-%d')
-    if not min_time:
-      min_time = (datetime.now() - timedelta(minutes=1)).strftime('%H:%M:00')
-    if not max_time:
-      max_time = (datetime.now() - timedelta(minutes=1)).strftime('%H:%M:59') 
+    date_scope, min_time, max_time = self._getQueryScope(
+      date_scope, min_time, max_time)
 
-    colums = """count(pid), SUM(cpu_percent), SUM(cpu_time), SUM(cpu_num_threads), SUM(memory_percent), 
-                SUM(memory_rss), SUM(io_rw_counter), SUM(io_cycles_counter)"""  
-    query_result = self.db.select('user', date_scope, colums, 
-                                  where="partition='%s' and (time between '%s' and '%s') %s" % 
-                                  (partition_id, min_time, max_time, where))
-    result = query_result.fetchone()
+    parameter_tuple = (date_scope, partition_id, min_time, max_time)
+    if self.has_table('folder'):
+      # disk usage is read by the same statement
+      query = self.PARTITION_STATUS_QUERY % (
+        self.FOLDER_STATUS_SUBQUERY % where, where)
+      parameter_tuple = parameter_tuple * 2
+    else:
+      query = self.PARTITION_STATUS_QUERY % ('', where)
+    result = self.getConnection().execute(query, parameter_tuple).fetchone()
 
     process_dict = {'total_process': result[0],
       'cpu_percent': round((result[1] or 0), 2),
@@ -178,43 +227,10 @@ class ResourceCollect:
       'disk_used': 0,
       'date': '%s %s' % (date_scope, min_time)
     }
-    if self.has_table('folder'):
-      disk_result_cursor = self.db.select(
-        "folder", date_scope,
-        columns="SUM(disk_used)",
-        where="partition='%s' and (time between '%s' and '%s') %s" % (
-          partition_id, min_time, max_time, where
-        )
-      )
-
-      disk_used_sum, = disk_result_cursor.fetchone()
-      if disk_used_sum is not None:
-        io_dict['disk_used'] = round(disk_used_sum/1024, 2)
-    self.db.close()
+    if len(result) > 8 and result[8] is not None:
+      io_dict['disk_used'] = round(result[8]/1024, 2)
     return (process_dict, memory_dict, io_dict)
 
-def appendJsonToFile(file_path, content, init_dict):
-  create = False
-  data_dict = init_dict
-  try:
-    with open(file_path) as f:
-      _ = json.load(f)
-  except (IOError, OSError) as e:
-    if e.errno != errno.ENOENT:
-      raise
-    create = True
-  except ValueError:
-    # Broken json, we use default
-    create = True
-  if create:
-    tmp_dir = os.path.dirname(file_path)
-    if content:
-      data_dict["data"].append(content)
-    safeWriteJsonFile(tmp_dir, file_path, data_dict)
-  else:
-    # append content to existing json file
-    quickAppendToJsonFile(file_path, content)
-
 def main():
   parser = parseArguments()
   if not os.path.exists(parser.output_folder) and \
@@ -257,12 +273,18 @@ def main():
     'monitor_resource.status.json'
   )
   tmp_dir = parser.output_folder
+  state_folder = parser.state_folder
+  if not os.path.isdir(state_folder):
+    raise Exception("Invalid state folder: %s" % state_folder)
+  process_data = ResourceDataFile(
+    process_file, PROCESS_DATA_HEADER, state_folder)
+  memory_data = ResourceDataFile(mem_file, MEMORY_DATA_HEADER, state_folder)
+  io_data = ResourceDataFile(io_file, IO_DATA_HEADER, state_folder)
 
   if not os.path.exists(parser.collector_db):
     print("Collector database not found...")
-    initProcessDataFile(process_file)
-    initMemoryDataFile(mem_file)
-    initIODataFile(io_file)
+    for resource_data in (process_data, memory_data, io_data):
+      resource_data.save()
     with open(status_file, "w") as status_file:
       status_file.write(json.dumps({
         "cpu_time": 0,
@@ -293,47 +315,22 @@ def main():
                   'disk_used']
   resource_status_dict = {}
 
-  init_process_dict = {
-    "date": time.time(),
-    "data": ["date, total process, CPU percent, CPU time, CPU threads"]
-  }
-  init_mem_dict = {
-    "date": time.time(),
-    "data": ["date, memory used percent, memory used"]
-  }
-  init_io_dict = {
-    "date": time.time(),
-    "data": ["date, io rw counter, io cycles counter, disk used"]
-  }
-
   if process_result and process_result['total_process'] > 0:
-    appendJsonToFile(
-      process_file,
-      ", ".join(
-        str(process_result[key]) for key in label_list if key in process_result
-      ),
-      init_process_dict
-    )
+    process_data.append(", ".join(
+      str(process_result[key]) for key in label_list if key in process_result
+    ))
     resource_status_dict.update(process_result)
 
   if memory_result and memory_result['memory_rss'] > 0:
-    appendJsonToFile(
-      mem_file,
-      ", ".join(
-        str(memory_result[key]) for key in label_list if key in memory_result
-      ),
-      init_mem_dict
-    )
+    memory_data.append(", ".join(
+      str(memory_result[key]) for key in label_list if key in memory_result
+    ))
     resource_status_dict.update(memory_result)
 
   if io_result and io_result['io_rw_counter'] > 0:
-    appendJsonToFile(
-      io_file,
-      ", ".join(
-        str(io_result[key]) for key in label_list if key in io_result
-      ),
-      init_io_dict
-    )
+    io_data.append(", ".join(
+      str(io_result[key]) for key in label_list if key in io_result
+    ))
     resource_status_dict.update(io_result)
 
   safeWriteJsonFile(tmp_dir, status_file, resource_status_dict)
@@ -342,6 +339,7 @@ def main():
   resource_process_status_list = collector.getPartitionConsumption(partition_user)
   if resource_process_status_list:
     safeWriteJsonFile(tmp_dir, resource_file, resource_process_status_list)
+  collector.close()
 
   if os.path.exists(parser.pid_file):
     os.unlink(parser.pid_file)
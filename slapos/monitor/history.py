@@ -0,0 +1,171 @@
+import os
+import errno
+import json
+import time
+import hashlib
+
+from slapos.util import str2bytes
+
+INDEX_VERSION = 1
+
+
+def getStateHash(state_dict):
+  """
+    Return the hash identifying a promise state in the history: the same
+    change date with the same message is not saved twice.
+  """
+  return hashlib.md5(str2bytes('%s\n%s' % (
+    state_dict.get('change-date', ''),
+    state_dict.get('message', '')))).hexdigest()
+
+
+class PromiseHistoryStore(object):
+  """
+    Append-only store of promise history.
+
+    The history of each promise is `<name>.history.json` in the public
+    folder, kept in the `{"date": ..., "data": [...]}` format read by the web
+    UI and by monitor.statistic. Entries are only ever appended to it, never
+    parsed again: a small sidecar index in `index_folder` remembers the entry
+    count, the offset at which the file ends after the last append and the
+    hash of the last saved state. As long as the history file still ends at
+    the recorded offset it is trusted, otherwise (file restored, touched or
+    rewritten by someone else, or crash before the index was saved) it is
+    parsed again to rebuild the index. A new history file is only created
+    if it was removed or is not valid JSON.
+  """
+
+  def __init__(self, public_folder, index_folder, tmp_dir):
+    self.public_folder = public_folder
+    self.index_folder = index_folder
+    self.tmp_dir = tmp_dir
+    if not os.path.isdir(self.index_folder):
+      os.makedirs(self.index_folder)
+
+  def getHistoryPath(self, name):
+    return os.path.join(self.public_folder, '%s.history.json' % name)
+
+  def getIndexPath(self, name):
+    return os.path.join(self.index_folder, '%s.index.json' % name)
+
+  def _writeJson(self, file_path, content):
+    tmp_file_path = os.path.join(
+      self.tmp_dir,
+      '%s.tmp' % os.path.basename(file_path)
+    )
+    with open(tmp_file_path, 'w') as f:
+      json.dump(content, f)
+    os.rename(tmp_file_path, file_path)
+
+  def loadIndex(self, name):
+    try:
+      with open(self.getIndexPath(name)) as f:
+        index_dict = json.load(f)
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return None
+    except ValueError:
+      return None
+    if index_dict.get('version') != INDEX_VERSION:
+      return None
+    return index_dict
+
+  def _saveIndex(self, name, index_dict, history_path):
+    stat_result = os.stat(history_path)
+    index_dict['offset'] = stat_result.st_size
+    index_dict['mtime'] = stat_result.st_mtime_ns
+    index_dict['version'] = INDEX_VERSION
+    self._writeJson(self.getIndexPath(name), index_dict)
+
+  def _isHistoryValid(self, history_path, index_dict):
+    if index_dict is None:
+      return False
+    try:
+      stat_result = os.stat(history_path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return False
+    return stat_result.st_size == index_dict['offset'] and \
+      stat_result.st_mtime_ns == index_dict['mtime']
+
+  def _adoptHistory(self, name, history_path):
+    """
+      Build the index of a history file written before the store existed,
+      or which does not match its index anymore. This is the only place
+      where a history file is parsed.
+    """
+    try:
+      with open(history_path) as f:
+        history_dict = json.load(f)
+      data_list = history_dict['data']
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return None
+    except (ValueError, KeyError, TypeError):
+      # Broken json, the history file will be recreated
+      return None
+    if not data_list:
+      return None
+    with open(history_path, 'rb') as f:
+      f.seek(-2, os.SEEK_END)
+      if f.read() != b']}':
+        # entries are appended before the final "]}", write it again so
+        # that it ends with the list of entries
+        history_dict['data'] = history_dict.pop('data')
+        self._writeJson(history_path, history_dict)
+    index_dict = {
+      'count': len(data_list),
+      'hash': getStateHash(data_list[-1]),
+    }
+    self._saveIndex(name, index_dict, history_path)
+    return index_dict
+
+  def append(self, name, state_dict):
+    """
+      Append state_dict to the history of the promise `name`, unless it is
+      the same state as the last saved one. Return True if it was saved.
+    """
+    history_path = self.getHistoryPath(name)
+    index_dict = self.loadIndex(name)
+    if not self._isHistoryValid(history_path, index_dict):
+      index_dict = self._adoptHistory(name, history_path)
+    state_hash = getStateHash(state_dict)
+
+    if self._isHistoryValid(history_path, index_dict):
+      if index_dict['hash'] == state_hash:
+        # Only save the changes and not the same info
+        return False
+      entry = state_dict.copy()
+      entry.pop('title', '')
+      entry.pop('name', '')
+      with open(history_path, 'rb+') as f:
+        f.seek(index_dict['offset'] - 2)
+        f.write(str2bytes(',{}]}}'.format(json.dumps(entry))))
+      index_dict['count'] += 1
+      index_dict['hash'] = state_hash
+      self._saveIndex(name, index_dict, history_path)
+      return True
+
+    self._writeJson(history_path, {
+      "date": time.time(),
+      "data": [state_dict]
+    })
+    self._saveIndex(name, {
+      'count': 1,
+      'hash': state_hash,
+    }, history_path)
+    return True
+
+  def remove(self, name):
+    """
+      Drop the history of the promise `name`.
+    """
+    for path in self.getHistoryPath(name), self.getIndexPath(name):
+      try:
+        os.unlink(path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
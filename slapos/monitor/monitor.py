@@ -14,13 +14,16 @@ import json
 from six.moves import configparser
 import traceback
 import argparse
-from six.moves.urllib.request import urlopen
-from six.moves.urllib.error import HTTPError
-import ssl
 import glob
-import socket
 import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from xml.sax.saxutils import escape
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InsecureRequestWarning
+import warnings
 
 OPML_START = """<?xml version="1.0" encoding="UTF-8"?>
 <!-- OPML generated by SlapOS -->
@@ -36,6 +39,11 @@ OPML_END = """	  </outline>
   </body>
 </opml>"""
 
+# Titles of related monitors are fetched again after one hour
+MONITOR_TITLE_CACHE_TTL = 3600
+# Maximum number of related monitors queried at the same time
+MONITOR_TITLE_JOBS = 8
+
 OPML_OUTLINE_FEED = '<outline text="%(title)s" title="%(title)s" type="rss" version="RSS" htmlUrl="%(html_url)s" xmlUrl="%(xml_url)s" url="%(global_url)s" />'
 
 
@@ -106,6 +114,12 @@ class Monitoring(object):
     self.config_folder = os.path.join(self.private_folder, 'config')
     self.data_folder = config.get("monitor", "document-folder")
     self.bootstrap_is_ok = True
+    self.monitor_title_cache_file = os.path.join(self.private_folder,
+                                                 '_monitor_title_cache')
+    self.monitor_title_cache_ttl = int(softConfigGet(config, "monitor",
+      "monitor-title-cache-ttl") or MONITOR_TITLE_CACHE_TTL)
+    self._title_refresh_thread = None
+    self._title_refresh_error = None
 
   def loadConfig(self, pathes, config=None):
     if config is None:
@@ -207,40 +221,104 @@ class Monitoring(object):
             if e.errno != errno.EEXIST:
               raise
 
-  def getMonitorTitleFromUrl(self, monitor_url):
+  def _fetchMonitorTitle(self, monitor_url, session=None):
+    """
+      Return (title, success) of the monitor at monitor_url. success is None
+      if the url can not be queried.
+    """
     # This file should be generated
     if not monitor_url.startswith('https://') and not monitor_url.startswith('http://'):
-      return 'Unknown Instance'
+      return 'Unknown Instance', None
     if not monitor_url.endswith('/'):
       monitor_url = monitor_url + '/'
 
     url  = monitor_url + '/monitor.global.json'
-    success = False
-    monitor_title = 'Unknown Instance'
+    if session is None:
+      session = requests
     try:
-      # Timeout after 20 seconds
-      timeout = 20
-      # XXX - working here with public url
-      if hasattr(ssl, '_create_unverified_context'):
-        context = ssl._create_unverified_context()
-        response = urlopen(url, context=context, timeout=timeout)
-      else:
-        response = urlopen(url, timeout=timeout)
-    except HTTPError:
+      with warnings.catch_warnings():
+        # XXX - working here with public url
+        warnings.simplefilter('ignore', InsecureRequestWarning)
+        # Timeout after 20 seconds
+        response = session.get(url, verify=False, timeout=20)
+      response.raise_for_status()
+    except requests.exceptions.HTTPError:
       print("ERROR: Failed to get Monitor configuration file at %s " % url)
-    except (socket.timeout, ssl.SSLError) as e:
+    except requests.exceptions.Timeout as e:
       print("ERROR: Timeout with %r while downloading monitor config at %s " % (e, url))
+    except requests.exceptions.RequestException as e:
+      print("ERROR: %r while downloading monitor config at %s " % (e, url))
     else:
       try:
-        monitor_dict = json.loads(response.read())
-        monitor_title = monitor_dict.get('title', 'Unknown Instance')
-        success = True
-      except ValueError as e:
+        monitor_dict = response.json()
+        return monitor_dict.get('title', 'Unknown Instance'), True
+      except (ValueError, AttributeError) as e:
         print("ERROR: Json file at %s is not valid" % url)
+    return 'Unknown Instance', False
 
-    self.bootstrap_is_ok = success
+  def getMonitorTitleFromUrl(self, monitor_url):
+    monitor_title, success = self._fetchMonitorTitle(monitor_url)
+    if success is not None:
+      self.bootstrap_is_ok = success
     return monitor_title
 
+  def loadMonitorTitleCache(self):
+    try:
+      with open(self.monitor_title_cache_file) as f:
+        return json.load(f)
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+    except ValueError:
+      pass
+    return {}
+
+  def saveMonitorTitleCache(self, title_cache):
+    tmp_file = '%s.tmp' % self.monitor_title_cache_file
+    with open(tmp_file, 'w') as f:
+      json.dump(title_cache, f)
+    os.rename(tmp_file, self.monitor_title_cache_file)
+
+  def refreshMonitorTitleCache(self, feed_url_list, title_cache):
+    """
+      Fetch titles of monitors in feed_url_list concurrently, with a bounded
+      pool sharing keep-alive connections, and update title_cache. The
+      previous title is kept if a monitor can not be reached.
+    """
+    with requests.Session() as session:
+      adapter = HTTPAdapter(pool_connections=MONITOR_TITLE_JOBS,
+                            pool_maxsize=MONITOR_TITLE_JOBS)
+      session.mount('http://', adapter)
+      session.mount('https://', adapter)
+      with ThreadPoolExecutor(max_workers=MONITOR_TITLE_JOBS) as executor:
+        result_list = list(executor.map(
+          lambda url: self._fetchMonitorTitle(url + "/public", session),
+          feed_url_list))
+
+    now = time.time()
+    for feed_url, (title, success) in zip(feed_url_list, result_list):
+      if success is False:
+        self.bootstrap_is_ok = False
+        if feed_url in title_cache:
+          continue
+      title_cache[feed_url] = {'title': title, 'date': now,
+                               'success': success}
+    return title_cache
+
+  def waitMonitorTitleRefresh(self):
+    """
+      Wait for the titles fetched by generateOpmlFile, and fail the
+      bootstrap if they could not be refreshed.
+    """
+    if self._title_refresh_thread is not None:
+      self._title_refresh_thread.join()
+      self._title_refresh_thread = None
+    if self._title_refresh_error is not None:
+      print("ERROR: %r while refreshing titles of monitors" %
+            self._title_refresh_error)
+      self._title_refresh_error = None
+      self.bootstrap_is_ok = False
+
   def configureFolders(self):
     # create symlinks from monitor.conf
     self.createSymlinksFromConfig(self.public_folder, self.public_path_list)
@@ -283,7 +361,7 @@ class Monitoring(object):
       pass
 
 
-  def generateOpmlFile(self, feed_url_list, output_file):
+  def writeOpmlFile(self, feed_url_list, output_file, title_cache):
 
     if os.path.exists(output_file):
       creation_date = datetime.datetime.utcfromtimestamp(os.path.getctime(output_file))\
@@ -304,7 +382,8 @@ class Monitoring(object):
         'global_url': "%s/private/" % self.webdav_url}
     for feed_url in feed_url_list:
       opml_content += OPML_OUTLINE_FEED % {
-        'title': self.getMonitorTitleFromUrl(feed_url + "/public"),
+        'title': escape(
+          title_cache.get(feed_url, {}).get('title', 'Unknown Instance')),
         'html_url': feed_url + '/public/feed',
         'xml_url': feed_url + '/public/feed',
         'global_url': "%s/share/private/" % feed_url}
@@ -314,6 +393,46 @@ class Monitoring(object):
     with open(output_file, 'w') as wfile:
       wfile.write(opml_content)
 
+  def generateOpmlFile(self, feed_url_list, output_file, background=False):
+    """
+      Write the OPML file from cached monitor titles, then fetch titles which
+      are missing or older than the cache TTL and write it again if needed.
+      If background is True, titles are fetched in a thread, see
+      waitMonitorTitleRefresh.
+    """
+    title_cache = self.loadMonitorTitleCache()
+    now = time.time()
+    stale_url_list = [url for url in feed_url_list
+      if now - title_cache.get(url, {}).get('date', 0) > \
+        self.monitor_title_cache_ttl]
+    for url in feed_url_list:
+      if url not in stale_url_list and title_cache[url].get('success') is False:
+        self.bootstrap_is_ok = False
+    self.writeOpmlFile(feed_url_list, output_file, title_cache)
+    if not stale_url_list:
+      return
+
+    def refresh():
+      previous_title_dict = dict((url, title_cache.get(url, {}).get('title'))
+                                 for url in stale_url_list)
+      try:
+        self.refreshMonitorTitleCache(stale_url_list, title_cache)
+        self.saveMonitorTitleCache(title_cache)
+        if any(title_cache[url]['title'] != previous_title_dict[url]
+               for url in stale_url_list):
+          self.writeOpmlFile(feed_url_list, output_file, title_cache)
+      except Exception as e:
+        # reported by waitMonitorTitleRefresh, exceptions of a thread are
+        # lost otherwise
+        self._title_refresh_error = e
+
+    if background:
+      self._title_refresh_thread = threading.Thread(target=refresh)
+      self._title_refresh_thread.start()
+    else:
+      refresh()
+      self.waitMonitorTitleRefresh()
+
   def cleanupMonitorDeprecated(self):
     # Monitor report feature is removed
     cleanup_file_list = glob.glob("%s/*.history.json" % self.private_folder)
@@ -363,9 +482,10 @@ class Monitoring(object):
 
     self.configureFolders()
 
-    # Generate OPML file
+    # Generate OPML file, titles of related monitors are refreshed while
+    # the bootstrap continues
     self.generateOpmlFile(self.monitor_url_list,
-      os.path.join(self.public_folder, 'feeds'))
+      os.path.join(self.public_folder, 'feeds'), background=True)
 
     # cleanup deprecated entries
     self.cleanupMonitorDeprecated()
@@ -373,6 +493,8 @@ class Monitoring(object):
     # Generate parameters files and scripts
     self.makeConfigurationFiles()
 
+    self.waitMonitorTitleRefresh()
+
     # Write an empty file when monitor bootstrap went until the end
     if self.bootstrap_is_ok:
       with open(self.promise_output_file, 'w') as promise_file:
@@ -3,16 +3,18 @@
 import sys
 import os
 import errno
-import glob
 import json
 import configparser
 import time
 import datetime
 import base64
 import hashlib
+import io
 import PyRSS2Gen
+from xml.sax.saxutils import XMLGenerator
 
 from slapos.util import bytes2str, str2bytes
+from slapos.monitor.history import PromiseHistoryStore
 
 def getKey(item):
   return item.source.name
@@ -38,10 +40,27 @@ def quickAppendToJsonFile(file_path, content, step_back=2):
     f.seek(position)
     f.write(',{}]}}'.format(json.dumps(content)))
 
+class CachedRSSItem(object):
+  """
+    RSS item already rendered as XML, published as is.
+  """
+
+  def __init__(self, xml):
+    self.xml = xml
+
+  def publish(self, handler):
+    # ignorableWhitespace writes its content without escaping
+    handler.ignorableWhitespace(self.xml)
+
+def renderRSSItem(rss_item, encoding="iso-8859-1"):
+  output = io.StringIO()
+  rss_item.publish(XMLGenerator(output, encoding))
+  return output.getvalue()
+
 class MonitorFeed(object):
 
   def __init__(self, instance_name, hosting_name,
-      public_url, private_url, feed_url):
+      public_url, private_url, feed_url, cache_file=None):
     self.rss_item_list = []
     self.report_date = datetime.datetime.now(datetime.UTC)
     self.instance_name = instance_name
@@ -49,6 +68,8 @@ class MonitorFeed(object):
     self.public_url = public_url
     self.private_url = private_url
     self.feed_url = feed_url
+    # XML of items rendered on previous runs, by item key
+    self.cache_file = cache_file
 
   def appendItem(self, item_dict, has_string=""):
     event_date = item_dict['result']['change-date']
@@ -67,20 +88,68 @@ class MonitorFeed(object):
     )
     self.rss_item_list.append(rss_item)
 
+  def getItemKey(self, rss_item):
+    return '%s %s' % (rss_item.guid.guid, hashlib.md5(str2bytes('\n'.join([
+      rss_item.title,
+      rss_item.description,
+      rss_item.link,
+      rss_item.source.url]))).hexdigest())
+
+  def loadCache(self):
+    if self.cache_file is None:
+      return {}
+    try:
+      with open(self.cache_file) as f:
+        return json.load(f)
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+    except ValueError:
+      pass
+    return {}
+
   def generateRSS(self, output_file):
     ### Build the rss feed
     # try to keep the list in the same order
-    sorted(self.rss_item_list, key=getKey)
+    self.rss_item_list.sort(key=getKey)
+    cache_dict = self.loadCache()
+    fragment_dict = cache_dict.get('fragment', {})
+    new_fragment_dict = {}
+    item_list = []
+    for rss_item in self.rss_item_list:
+      key = self.getItemKey(rss_item)
+      if key not in fragment_dict:
+        # only new or modified items are rendered
+        fragment_dict[key] = renderRSSItem(rss_item)
+      new_fragment_dict[key] = fragment_dict[key]
+      item_list.append(CachedRSSItem(fragment_dict[key]))
+
+    signature = hashlib.md5(str2bytes('\n'.join(
+      [self.instance_name, self.feed_url, self.hosting_name] +
+      list(new_fragment_dict)))).hexdigest()
+    if signature == cache_dict.get('signature') and \
+        os.path.exists(output_file):
+      # Nothing changed, keep the file and its modification date
+      return False
+
     rss_feed = PyRSS2Gen.RSS2 (
       title = self.instance_name,
       link = self.feed_url,
       description = self.hosting_name,
       lastBuildDate = self.report_date,
-      items = self.rss_item_list
+      items = item_list
     )
 
-    with open(output_file, 'w') as frss:
-      frss.write(rss_feed.to_xml())
+    tmp_file = '%s.tmp' % output_file
+    with open(tmp_file, 'w') as frss:
+      rss_feed.write_xml(frss)
+    os.rename(tmp_file, output_file)
+
+    if self.cache_file is not None:
+      with open('%s.tmp' % self.cache_file, 'w') as f:
+        json.dump({'signature': signature, 'fragment': new_fragment_dict}, f)
+      os.rename('%s.tmp' % self.cache_file, self.cache_file)
+    return True
 
 class MonitorStateBuilder(object):
 
@@ -127,6 +196,19 @@ class MonitorStateBuilder(object):
     if not os.path.isdir(self.tmp_dir):
       os.mkdir(self.tmp_dir)
 
+    self.status_cache_file = os.path.join(
+      self.private_folder,
+      '_promise_status_cache'
+    )
+    # number of status files read and skipped by loadPromiseStatusList
+    self.ingestion_counter_dict = {'parsed': 0, 'skipped': 0}
+
+    self.history_store = PromiseHistoryStore(
+      self.public_folder,
+      os.path.join(self.private_folder, 'history-index'),
+      self.tmp_dir
+    )
+
   def writeDocumentList(self, folder_path):
     # Save document list in a file called _document_list
     document_list = [os.path.splitext(file)[0]
@@ -135,51 +217,14 @@ class MonitorStateBuilder(object):
     with open(os.path.join(folder_path, '_document_list'), 'w') as f:
       f.write('\n'.join(document_list))
 
-  def savePromiseHistory(self, promise_name, state_dict, previous_state_list):
-
-    history_file = os.path.join(
-      self.public_folder,
-      '%s.history.json' % promise_name
-    )
-    create = False
-
+  def savePromiseHistory(self, promise_name, state_dict):
     # Remove useless informations
     result = state_dict.pop('result')
     state_dict.update(result)
     state_dict.pop('path', '')
     state_dict.pop('type', '')
 
-    try:
-      with open(history_file) as f:
-        _ = json.load(f)
-    except (IOError, OSError) as e:
-      if e.errno != errno.ENOENT:
-        raise
-      # create history file
-      create = True
-    except ValueError:
-      # Broken json, use default history_dict
-      create = True
-    else:
-      if previous_state_list is not None:
-        _, change_date, checksum = previous_state_list
-        current_sum = hashlib.md5(str2bytes(state_dict.get('message', ''))).hexdigest()
-        if state_dict['change-date'] == change_date and \
-            current_sum == checksum:
-          # Only save the changes and not the same info
-          return
-
-      state_dict.pop('title', '')
-      state_dict.pop('name', '')
-
-    if create:
-      history_dict = {
-        "date": time.time(),
-        "data": [state_dict]
-      }
-      safeWriteJsonFile(self.tmp_dir, history_file, history_dict)
-    else:
-      quickAppendToJsonFile(history_file, state_dict)
+    self.history_store.append(promise_name, state_dict)
 
   def saveStatisticsData(self, stat_file_path, content):
     create = False
@@ -214,13 +259,86 @@ class MonitorStateBuilder(object):
     else:
       quickAppendToJsonFile(stat_file_path, current_state)
 
+  def loadPromiseStatusList(self):
+    """
+      Return the list of (path, status_dict) of all promise status files,
+      status_dict being None if the file is not valid JSON.
+
+      The fields of the status files used by generateMonitoringData are
+      cached by path, modification time and size, so a status file which
+      did not change since the previous run is not read again. The cache is
+      only written when a status file changed. The number of status files
+      parsed and skipped is kept in ingestion_counter_dict and printed.
+    """
+    status_folder = os.path.join(self.public_folder, 'promise')
+    try:
+      with open(self.status_cache_file) as f:
+        cache_dict = json.load(f)
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+      cache_dict = {}
+    except ValueError:
+      cache_dict = {}
+    if not isinstance(cache_dict, dict):
+      cache_dict = {}
+
+    entry_list = []
+    try:
+      for entry in os.scandir(status_folder):
+        if entry.name.endswith('.status.json') and entry.is_file():
+          entry_list.append(entry)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+    entry_list.sort(key=lambda entry: entry.name)
+
+    parsed = skipped = 0
+    new_cache_dict = {}
+    status_list = []
+    for entry in entry_list:
+      stat_result = entry.stat()
+      key = [stat_result.st_mtime_ns, stat_result.st_size]
+      cached = cache_dict.get(entry.path)
+      if cached is not None and cached[:2] == key:
+        status_dict = cached[2]
+        skipped += 1
+      else:
+        try:
+          with open(entry.path) as f:
+            status_dict = json.load(f)
+          result = status_dict['result']
+          status_dict = {
+            'title': status_dict['title'],
+            'name': status_dict['name'],
+            'execution-time': status_dict.get('execution-time'),
+            'result': {
+              'failed': result['failed'],
+              'date': result['date'],
+              'message': result.get('message', ''),
+            },
+          }
+        except (ValueError, KeyError, TypeError) as e:
+          # bad json file
+          print("ERROR: Bad json file at: %s\n%s" % (entry.path, e))
+          status_list.append((entry.path, None))
+          continue
+        parsed += 1
+      new_cache_dict[entry.path] = key + [status_dict]
+      status_list.append((entry.path, status_dict))
+
+    self.ingestion_counter_dict = {'parsed': parsed, 'skipped': skipped}
+    print('OK: Parsed %s status files, skipped %s unchanged'
+          % (parsed, skipped))
+    if parsed or len(new_cache_dict) != len(cache_dict):
+      # status dicts are modified by generateMonitoringData once written
+      safeWriteJsonFile(self.tmp_dir, self.status_cache_file, new_cache_dict)
+    return status_list
+
   def generateMonitoringData(self):
     feed_output = os.path.join(self.public_folder, 'feed')
     # search for all status files
-    file_list = list(filter(
-      os.path.isfile,
-      glob.glob("%s/promise/*.status.json" % self.public_folder)
-    ))
+    status_list = self.loadPromiseStatusList()
 
     promises_status_file = os.path.join(self.private_folder, '_promise_status')
     previous_state_dict = {}
@@ -231,7 +349,8 @@ class MonitorStateBuilder(object):
       self.monitor_root_title,
       self.public_url,
       self.private_url,
-      self.feed_url)
+      self.feed_url,
+      cache_file=os.path.join(self.private_folder, '_feed_cache'))
 
     try:
       with open(promises_status_file) as f:
@@ -245,7 +364,8 @@ class MonitorStateBuilder(object):
 
     # clean up stale history files
     expected_history_json_name_list = [
-      os.path.basename(q).replace('status.json', 'history.json') for q in file_list]
+      os.path.basename(q).replace('status.json', 'history.json')
+      for q, _ in status_list]
     cleanup_history_json_path_list = []
     for history_json_name in [q for q in os.listdir(self.public_folder)
                               if q.endswith('history.json')]:
@@ -255,17 +375,17 @@ class MonitorStateBuilder(object):
         )
     for cleanup_path in cleanup_history_json_path_list:
       try:
-        os.unlink(cleanup_path)
+        self.history_store.remove(
+          os.path.basename(cleanup_path)[:-len('.history.json')])
       except Exception:
         print('ERROR: Failed to remove stale %s' % (cleanup_path,))
       else:
         print('OK: Removed stale %s' % (cleanup_path,))
 
-    for file in file_list:
+    for file, tmp_json in status_list:
+      if tmp_json is None:
+        continue
       try:
-        with open(file, 'r') as temp_file:
-          tmp_json = json.load(temp_file)
-
         if tmp_json['result']['failed']:
           promise_status = "ERROR"
           error += 1
@@ -287,11 +407,7 @@ class MonitorStateBuilder(object):
           message_hash
         ]
         monitor_feed.appendItem(tmp_json, message_hash)
-        self.savePromiseHistory(
-          tmp_json['title'],
-          tmp_json,
-          previous_state_dict.get(tmp_json['name'])
-        )
+        self.savePromiseHistory(tmp_json['title'], tmp_json)
       except ValueError as e:
         # bad json file
         print("ERROR: Bad json file at: %s\n%s" % (file, e))
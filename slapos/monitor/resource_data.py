@@ -0,0 +1,211 @@
+import os
+import errno
+import json
+import time
+from datetime import datetime, timedelta
+
+from slapos.monitor.monitor_state import safeWriteJsonFile
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+RESOLUTION_MINUTE = 'minute'
+RESOLUTION_HOUR = 'hour'
+RESOLUTION_DAY = 'day'
+
+# How long samples are kept at each resolution
+MINUTE_RETENTION = timedelta(days=1)
+HOUR_RETENTION = timedelta(days=31)
+DAY_RETENTION = timedelta(days=731)
+
+STATE_VERSION = 1
+
+
+def parseRow(row):
+  """
+    Convert "2026-01-01 10:00:00, 1.0, 2" to ["2026-01-01 10:00:00", 1.0, 2.0]
+  """
+  value_list = [q.strip() for q in row.split(',')]
+  return [value_list[0]] + [float(q) for q in value_list[1:]]
+
+
+def formatValue(value):
+  value = round(value, 2)
+  if value.is_integer():
+    return str(int(value))
+  return str(value)
+
+
+def formatRow(row):
+  return ", ".join([row[0]] + [formatValue(q) for q in row[1:]])
+
+
+class ResourceDataFile(object):
+  """
+    Resource data file (monitor_resource_*.data.json) with tiered retention.
+
+    Samples are kept with their original (minute) resolution for one day,
+    then as hourly averages for a month and as daily averages after that,
+    so the file read by the monitor UI stays bounded. The data file keeps
+    its format: a header line followed by "date, value, ..." lines, oldest
+    first, each period being given at the best available resolution.
+
+    Hourly and daily averages are computed incrementally when samples are
+    appended, from running sums stored with the tiers in `<file>.rollup` in
+    state_folder, which must be private: the data file is usually in the
+    public folder of the monitor.
+  """
+
+  def __init__(self, file_path, header, state_folder):
+    self.file_path = file_path
+    self.state_folder = state_folder
+    self.state_path = os.path.join(
+      state_folder, os.path.basename(file_path) + '.rollup')
+    self.header = header
+    self.state = None
+
+  def _newState(self):
+    return {
+      'version': STATE_VERSION,
+      RESOLUTION_MINUTE: [],
+      RESOLUTION_HOUR: [],
+      RESOLUTION_DAY: [],
+      'accumulator': {RESOLUTION_HOUR: None, RESOLUTION_DAY: None},
+    }
+
+  def loadState(self):
+    if self.state is not None:
+      return self.state
+    try:
+      with open(self.state_path) as f:
+        state = json.load(f)
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+      state = None
+    except ValueError:
+      state = None
+    if state is None or state.get('version') != STATE_VERSION:
+      # Rebuild tiers from the samples of the current data file, this only
+      # happens once when the data file was written by a previous version.
+      self.state = self._newState()
+      for row in self._readLegacyRowList():
+        self._addRow(row)
+    else:
+      self.state = state
+    return self.state
+
+  def _readLegacyRowList(self):
+    try:
+      with open(self.file_path) as f:
+        data_list = json.load(f)['data']
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return []
+    except (ValueError, KeyError, TypeError):
+      # Broken json, start from scratch
+      return []
+    row_list = []
+    for row in data_list[1:]:
+      try:
+        row_list.append(parseRow(row))
+      except (ValueError, AttributeError):
+        continue
+    return row_list
+
+  def _getPeriodStart(self, date, resolution):
+    if resolution == RESOLUTION_HOUR:
+      return date[:13] + ':00:00'
+    return date[:10] + ' 00:00:00'
+
+  def _accumulate(self, row, resolution):
+    accumulator_dict = self.state['accumulator']
+    start = self._getPeriodStart(row[0], resolution)
+    accumulator = accumulator_dict[resolution]
+    if accumulator is not None and accumulator['start'] != start:
+      count = accumulator['count']
+      self.state[resolution].append(
+        [accumulator['start']] + [q / count for q in accumulator['sum']])
+      accumulator = None
+    if accumulator is None or len(accumulator['sum']) != len(row) - 1:
+      accumulator = {'start': start, 'count': 0, 'sum': [0.] * (len(row) - 1)}
+    accumulator['count'] += 1
+    accumulator['sum'] = [a + b for a, b in zip(accumulator['sum'], row[1:])]
+    accumulator_dict[resolution] = accumulator
+
+  def _addRow(self, row):
+    minute_list = self.state[RESOLUTION_MINUTE]
+    if minute_list and row[0] <= minute_list[-1][0]:
+      # samples are only appended in chronological order
+      return
+    minute_list.append(row)
+    self._accumulate(row, RESOLUTION_HOUR)
+    self._accumulate(row, RESOLUTION_DAY)
+
+    last_date = datetime.strptime(row[0], DATE_FORMAT)
+    for resolution, retention in ((RESOLUTION_MINUTE, MINUTE_RETENTION),
+                                  (RESOLUTION_HOUR, HOUR_RETENTION),
+                                  (RESOLUTION_DAY, DAY_RETENTION)):
+      limit = (last_date - retention).strftime(DATE_FORMAT)
+      row_list = self.state[resolution]
+      index = 0
+      while index < len(row_list) and row_list[index][0] < limit:
+        index += 1
+      if index:
+        del row_list[:index]
+
+  def getRowList(self):
+    """
+      Return rows of the data file: each period at the best resolution.
+    """
+    state = self.loadState()
+    minute_list = state[RESOLUTION_MINUTE]
+    hour_list = state[RESOLUTION_HOUR]
+    day_list = state[RESOLUTION_DAY]
+    if minute_list:
+      # the hour of the oldest minute sample can be partial
+      limit = self._getPeriodStart(minute_list[0][0], RESOLUTION_HOUR)
+      hour_list = [q for q in hour_list if q[0] < limit]
+    if hour_list or minute_list:
+      limit = (hour_list or minute_list)[0][0][:10] + ' 00:00:00'
+      day_list = [q for q in day_list if q[0] < limit]
+    return day_list + hour_list + minute_list
+
+  def append(self, row):
+    """
+      Add the sample row ("date, value, ...") and update the data file.
+    """
+    self.loadState()
+    if row:
+      self._addRow(parseRow(row))
+    self.save()
+
+  def save(self):
+    state = self.loadState()
+    folder = os.path.dirname(self.file_path)
+    safeWriteJsonFile(folder, self.file_path, {
+      "date": time.time(),
+      "data": [self.header] + [formatRow(q) for q in self.getRowList()],
+    })
+    safeWriteJsonFile(self.state_folder, self.state_path, state)
+
+  def getRange(self, start=None, end=None, resolution=RESOLUTION_MINUTE):
+    """
+      Return the rows between start and end (datetime or date string),
+      included, at the given resolution. Averages of the current hour and
+      day are included.
+    """
+    if isinstance(start, datetime):
+      start = start.strftime(DATE_FORMAT)
+    if isinstance(end, datetime):
+      end = end.strftime(DATE_FORMAT)
+    state = self.loadState()
+    row_list = list(state[resolution])
+    if resolution != RESOLUTION_MINUTE:
+      accumulator = state['accumulator'][resolution]
+      if accumulator is not None:
+        count = accumulator['count']
+        row_list.append(
+          [accumulator['start']] + [q / count for q in accumulator['sum']])
+    return [q for q in row_list
+            if (start is None or q[0] >= start) and (end is None or q[0] <= end)]
@@ -7,16 +7,19 @@ import subprocess
 import json
 import psutil
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 from shutil import copyfile
 import glob
 import argparse
 import traceback
 import logging
+import multiprocessing
 from six.moves import configparser
 from slapos.grid.promise import PromiseLauncher, PromiseQueueResult, PromiseError
-from slapos.grid.promise.generic import PROMISE_LOG_FOLDER_NAME
-from slapos.util import mkdir_p
+from slapos.grid.promise.generic import (PROMISE_LOG_FOLDER_NAME,
+                                         PROMISE_RESULT_FOLDER_NAME,
+                                         PROMISE_STATE_FOLDER_NAME)
+from slapos.util import mkdir_p, listifdir
 
 # Promise timeout after 20 seconds by default
 promise_timeout = 20
@@ -64,6 +67,9 @@ def getArgumentParser():
                       default=False, action='store_true')
   parser.add_argument('--promise-timeout', default=20, type=int,
                       help='Maximum promise execution time.')
+  parser.add_argument('-j', '--jobs', type=int,
+                      help='Number of promises to run at the same time. '
+                           'Default: 1, run promises one by one.')
 
   return parser
 
@@ -96,7 +102,8 @@ class MonitorPromiseLauncher(object):
     config.read([config_file])
     known_key_list = ['partition-cert', 'partition-key', 'partition-id',
                       'pid-path', 'computer-id', 'check-anomaly',
-                      'master-url', 'partition-folder', 'promise-timeout']
+                      'master-url', 'partition-folder', 'promise-timeout',
+                      'jobs']
  
     if config.has_section('promises'):
       for key, value in config.items('promises'):
@@ -149,24 +156,196 @@ class MonitorPromiseLauncher(object):
                                                   PROMISE_LOG_FOLDER_NAME)
       mkdir_p(parameter_dict['log-folder'])
 
+    jobs = int(self.config.jobs or 1)
+
+    self.logger.info("Checking promises...")
+    exit_code = 0
+    if jobs > 1:
+      exit_code = self.runConcurrently(parameter_dict, jobs)
+    else:
+      exit_code = self.runLauncher(parameter_dict)
+    if self.config.pid_path:
+      os.remove(self.config.pid_path)
+    self.logger.info("Finished promises.")
+    return exit_code
+
+  def getPromiseList(self, parameter_dict):
+    """
+      Return the list of (promise_name, promise_path, is_legacy) to run,
+      the same way PromiseLauncher.run selects them.
+    """
+    promise_list = []
+    run_only_promise_list = parameter_dict['run-only-promise-list']
+    promise_folder = parameter_dict['promise-folder']
+    for promise_name in listifdir(promise_folder):
+      if promise_name.startswith('__init__') or \
+          not promise_name.endswith('.py'):
+        continue
+      if run_only_promise_list and \
+          promise_name not in run_only_promise_list:
+        continue
+      promise_list.append(
+        (promise_name, os.path.join(promise_folder, promise_name), False))
+
+    if not run_only_promise_list:
+      legacy_promise_folder = parameter_dict['legacy-promise-folder']
+      for promise_name in listifdir(legacy_promise_folder):
+        promise_path = os.path.join(legacy_promise_folder, promise_name)
+        if not os.path.isfile(promise_path) or \
+            not os.access(promise_path, os.X_OK):
+          self.logger.warning("Bad promise file at %r." % promise_path)
+          continue
+        promise_list.append((promise_name, promise_path, True))
+    return promise_list
+
+  def getStatusFile(self, promise_name):
+    return os.path.join(
+      self.config.partition_folder,
+      PROMISE_RESULT_FOLDER_NAME,
+      '%s.status.json' % os.path.splitext(promise_name)[0])
+
+  def getRecordedExecutionTime(self, promise_name):
+    """
+      Return the execution time of the previous run of the promise, or 0 if
+      it never ran.
+    """
+    try:
+      with open(self.getStatusFile(promise_name)) as f:
+        return float(json.load(f).get('execution-time') or 0)
+    except (IOError, OSError, ValueError, TypeError, AttributeError):
+      return 0
+
+  def getPromiseGroupList(self, execution_time_dict, jobs):
+    """
+      Split the promises in at most `jobs` groups of about the same
+      execution time on previous run (execution_time_dict): the slowest
+      promises are put first, each in the group with the smallest total
+      time (or the fewest promises). Each group is then sorted by
+      increasing execution time, so that cheap promises finish first.
+    """
+    group_list = [[0, []] for _ in range(min(jobs, len(execution_time_dict)))]
+    for promise_name in sorted(execution_time_dict,
+        key=execution_time_dict.get, reverse=True):
+      group = min(group_list, key=lambda group: (group[0], len(group[1])))
+      group[0] += execution_time_dict[promise_name]
+      group[1].append(promise_name)
+    return [sorted(name_list, key=execution_time_dict.get)
+            for _, name_list in group_list]
+
+  def runLauncher(self, parameter_dict):
+    """
+      Run the promises of parameter_dict with PromiseLauncher.run and
+      return the exit code.
+    """
     promise_launcher = PromiseLauncher(
       config=parameter_dict,
       logger=self.logger,
       dry_run=self.config.dry_run
     )
-
-    self.logger.info("Checking promises...")
-    exit_code = 0
     try:
       promise_launcher.run()
     except PromiseError as e:
       # error was already logged
-      exit_code = 1
-    if self.config.pid_path:
-      os.remove(self.config.pid_path)
-    self.logger.info("Finished promises.")
+      return 1
+    return 0
+
+  def runGroup(self, parameter_dict, name_list, legacy_parameter_dict):
+    """
+      Run the promises of name_list one after the other, in this order,
+      each with PromiseLauncher.run, and return the exit code. None stands
+      for all legacy promises, run with legacy_parameter_dict.
+    """
+    exit_code = 0
+    for promise_name in name_list:
+      if promise_name is None:
+        exit_code |= self.runLauncher(legacy_parameter_dict)
+      else:
+        exit_code |= self.runLauncher(dict(parameter_dict,
+          **{'run-only-promise-list': [promise_name]}))
     return exit_code
 
+  def runConcurrently(self, parameter_dict, jobs):
+    """
+      Run promises in at most `jobs` processes, each running a group of
+      promises (see getPromiseGroupList) with PromiseLauncher, so that
+      promise timeout and result handling are the ones of
+      PromiseLauncher.run. Legacy promises are run together, as one
+      promise of a group.
+    """
+    promise_list = self.getPromiseList(parameter_dict)
+    execution_time_dict = dict(
+      (name, self.getRecordedExecutionTime(name))
+      for name, _, is_legacy in promise_list if not is_legacy)
+    legacy_name_list = [name for name, _, is_legacy in promise_list
+                        if is_legacy]
+    legacy_parameter_dict = None
+    if legacy_name_list:
+      # PromiseLauncher.run only runs legacy promises when it runs all
+      # promises of the plugin folder: give it an empty one
+      empty_promise_folder = os.path.join(
+        self.config.partition_folder, PROMISE_STATE_FOLDER_NAME,
+        'legacy-promise-run')
+      mkdir_p(empty_promise_folder)
+      legacy_parameter_dict = dict(parameter_dict, **{
+        'promise-folder': empty_promise_folder,
+        'run-only-promise-list': None,
+      })
+      execution_time_dict[None] = sum(
+        self.getRecordedExecutionTime(name) for name in legacy_name_list)
+    group_list = self.getPromiseGroupList(execution_time_dict, jobs)
+
+    start_time = time.time()
+    context = multiprocessing.get_context('fork')
+    process_list = []
+    for name_list in group_list:
+      process = context.Process(
+        target=lambda name_list: sys.exit(self.runGroup(
+          parameter_dict, name_list, legacy_parameter_dict)),
+        args=(name_list,))
+      process.start()
+      process_list.append(process)
+    for process in process_list:
+      process.join()
+    wall_time = time.time() - start_time
+
+    timing_list = []
+    for worker_id, name_list in enumerate(group_list):
+      if None in name_list:
+        index = name_list.index(None)
+        name_list = name_list[:index] + legacy_name_list + name_list[index+1:]
+      for promise_name in name_list:
+        timing_list.append({
+          'name': promise_name,
+          'worker': worker_id,
+          'execution-time': self.getRecordedExecutionTime(promise_name),
+          'skipped': not self.hasResultSince(promise_name, start_time),
+        })
+    self.writeTimingReport(jobs, wall_time, timing_list)
+    return 1 if any(process.exitcode for process in process_list) else 0
+
+  def hasResultSince(self, promise_name, date):
+    try:
+      return os.stat(self.getStatusFile(promise_name)).st_mtime >= date
+    except OSError:
+      return False
+
+  def writeTimingReport(self, jobs, wall_time, timing_list):
+    report_path = os.path.join(self.config.partition_folder,
+                               PROMISE_STATE_FOLDER_NAME,
+                               'promise_timing.json')
+    with open(report_path + '.tmp', 'w') as f:
+      json.dump({
+        'date': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+0000'),
+        'jobs': jobs,
+        'wall-time': round(wall_time, 3),
+        'execution-time': round(
+          sum(timing['execution-time'] for timing in timing_list), 3),
+        'promise-list': timing_list,
+      }, f)
+    os.rename(report_path + '.tmp', report_path)
+    self.logger.info("Ran %s promises in %.2f second(s) with %s jobs." % (
+      len(timing_list), wall_time, jobs))
+
 def main():
   arg_parser = getArgumentParser()
   promise_runner = MonitorPromiseLauncher(arg_parser.parse_args())
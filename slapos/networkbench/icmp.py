@@ -0,0 +1,279 @@
+"""
+Native ICMP echo prober.
+
+ICMPProbe pings many hosts concurrently from one asyncio event loop,
+without spawning ping processes: each round sends one echo request to
+every host, then replies are read from one ICMP socket per address family.
+
+Unprivileged ICMP sockets (SOCK_DGRAM, allowed by the
+net.ipv4.ping_group_range sysctl) are used when possible, raw sockets
+otherwise (root or CAP_NET_RAW). ICMPError is raised if neither can be
+opened.
+"""
+
+import asyncio
+import errno
+import math
+import os
+import random
+import socket
+import struct
+import time
+
+PING_COUNT = 10
+# seconds between 2 echo requests to the same host, as ping
+PING_INTERVAL = 1
+# maximum duration of the probe, in seconds (ping -w)
+PING_TIMEOUT = 10
+PING_PAYLOAD_SIZE = 56
+PERCENTILE_LIST = (50, 90, 99)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+ICMP_HEADER = struct.Struct('!BBHHH')
+
+ECHO_TYPE_DICT = {
+  socket.AF_INET: (ICMP_ECHO_REQUEST, ICMP_ECHO_REPLY, socket.IPPROTO_ICMP),
+  socket.AF_INET6: (ICMPV6_ECHO_REQUEST, ICMPV6_ECHO_REPLY,
+                    socket.IPPROTO_ICMPV6),
+}
+
+
+class ICMPError(Exception):
+  pass
+
+
+def getChecksum(data):
+  if len(data) % 2:
+    data += b'\0'
+  checksum = sum(struct.unpack('!%sH' % (len(data) // 2), data))
+  checksum = (checksum >> 16) + (checksum & 0xffff)
+  checksum += checksum >> 16
+  return ~checksum & 0xffff
+
+
+def getPercentile(sorted_list, percentile):
+  """
+    Return the percentile of the sorted values, with a linear interpolation
+    between the closest ranks.
+  """
+  position = (len(sorted_list) - 1) * percentile / 100.
+  lower = int(position)
+  upper = min(lower + 1, len(sorted_list) - 1)
+  return sorted_list[lower] + \
+    (sorted_list[upper] - sorted_list[lower]) * (position - lower)
+
+
+def getStatistics(sent, rtt_list):
+  """
+    Return the packet loss (in percent) and the round trip times statistics
+    (in milliseconds) of a host, as printed by ping.
+  """
+  received = len(rtt_list)
+  result = {
+    'sent': sent,
+    'received': received,
+    'loss': 100. * (sent - received) / sent if sent else 100.,
+  }
+  if rtt_list:
+    rtt_list = sorted(rtt_list)
+    avg = sum(rtt_list) / received
+    result.update(
+      min=rtt_list[0],
+      avg=avg,
+      max=rtt_list[-1],
+      # as ping: sqrt(mean(rtt^2) - mean(rtt)^2)
+      mdev=math.sqrt(max(sum(q * q for q in rtt_list) / received - avg * avg,
+                         0)),
+      percentile=dict((str(q), getPercentile(rtt_list, q))
+                      for q in PERCENTILE_LIST),
+    )
+  return result
+
+
+class ICMPSocket(object):
+  """
+    ICMP socket of an address family, shared by all hosts of the probe.
+  """
+
+  def __init__(self, family):
+    self.family = family
+    self.request_type, self.reply_type, protocol = ECHO_TYPE_DICT[family]
+    try:
+      self.socket = socket.socket(family, socket.SOCK_DGRAM, protocol)
+      self.raw = False
+    except (socket.error, OSError) as e:
+      if e.errno not in (errno.EACCES, errno.EPERM, errno.EPROTONOSUPPORT):
+        # e.g. EAFNOSUPPORT if the family is disabled
+        raise ICMPError("Can not open an ICMP socket: %s" % e)
+      try:
+        self.socket = socket.socket(family, socket.SOCK_RAW, protocol)
+      except (socket.error, OSError) as e:
+        raise ICMPError("Can not open an ICMP socket: %s" % e)
+      self.raw = True
+    self.socket.setblocking(False)
+    # the kernel replaces the identifier by the port of SOCK_DGRAM sockets
+    # and only gives them their replies, raw sockets receive all replies
+    self.identifier = (os.getpid() ^ random.getrandbits(16)) & 0xffff
+    self.sequence = random.getrandbits(16)
+
+  def send(self, address, payload):
+    """
+      Send an echo request to address and return its sequence number.
+    """
+    self.sequence = sequence = (self.sequence + 1) & 0xffff
+    header = ICMP_HEADER.pack(self.request_type, 0, 0, self.identifier,
+                              sequence)
+    if self.family == socket.AF_INET:
+      # the kernel computes the checksum of ICMPv6 packets
+      header = ICMP_HEADER.pack(self.request_type, 0,
+        getChecksum(header + payload), self.identifier, sequence)
+    self.socket.sendto(header + payload, address)
+    return sequence
+
+  def receive(self):
+    """
+      Yield the (source address, sequence number) of the received echo
+      replies.
+    """
+    while True:
+      try:
+        data, address = self.socket.recvfrom(65536)
+      except (BlockingIOError, InterruptedError):
+        return
+      except (socket.error, OSError):
+        # ICMP errors (e.g. host unreachable) are reported on the socket
+        continue
+      if self.raw and self.family == socket.AF_INET:
+        # raw IPv4 sockets receive the IP header
+        data = data[(data[0] & 0x0f) * 4:]
+      if len(data) < ICMP_HEADER.size:
+        continue
+      message_type, _, _, identifier, sequence = ICMP_HEADER.unpack_from(data)
+      if message_type != self.reply_type or (
+          self.raw and identifier != self.identifier):
+        continue
+      yield address[0].split('%')[0], sequence
+
+  def close(self):
+    self.socket.close()
+
+
+class ICMPProbe(object):
+  """
+    Ping many hosts concurrently.
+  """
+
+  def __init__(self, count=PING_COUNT, interval=PING_INTERVAL,
+               timeout=PING_TIMEOUT, payload_size=PING_PAYLOAD_SIZE):
+    self.count = count
+    self.interval = interval
+    self.timeout = timeout
+    self.payload = b'\0' * payload_size
+
+  def resolve(self, host, family=None):
+    """
+      Return the address family and socket address of host, of family if
+      the host has an address of this family (a literal address is always
+      pinged in its own family, as ping and ping6 do).
+    """
+    info_list = socket.getaddrinfo(host, None, 0, socket.SOCK_RAW)
+    info_list = [q for q in info_list if q[0] in ECHO_TYPE_DICT]
+    info_list.sort(key=lambda q: q[0] != family)
+    if not info_list:
+      raise socket.gaierror("No IP address for %s" % host)
+    return info_list[0][0], info_list[0][4]
+
+  async def probeAsync(self, target_list, family=None):
+    loop = asyncio.get_running_loop()
+    socket_dict = {}
+    target_dict = {}
+    result_dict = {}
+    # (family, sequence) -> (target, address, sending time)
+    pending_dict = {}
+    done = loop.create_future()
+    sending_done = False
+
+    def receive(icmp_socket):
+      now = time.time()
+      for address, sequence in icmp_socket.receive():
+        pending = pending_dict.get((icmp_socket.family, sequence))
+        if pending is not None and pending[1] == address:
+          del pending_dict[icmp_socket.family, sequence]
+          target_dict[pending[0]]['rtt_list'].append(
+            1000 * (now - pending[2]))
+      if not pending_dict and not done.done() and sending_done:
+        done.set_result(None)
+
+    try:
+      for target in target_list:
+        if target in target_dict or target in result_dict:
+          continue
+        host, host_family = target if isinstance(target, tuple) else \
+          (target, family)
+        try:
+          host_family, address = self.resolve(host, host_family)
+        except (socket.error, UnicodeError) as e:
+          result_dict[target] = dict(getStatistics(0, []), error=str(e))
+          continue
+        icmp_socket = socket_dict.get(host_family)
+        if icmp_socket is None:
+          icmp_socket = socket_dict[host_family] = ICMPSocket(host_family)
+          loop.add_reader(icmp_socket.socket.fileno(), receive, icmp_socket)
+        target_dict[target] = {
+          'socket': icmp_socket,
+          'address': address,
+          'sent': 0,
+          'rtt_list': [],
+          'error': None,
+        }
+
+      deadline = loop.time() + self.timeout
+      for i in range(self.count):
+        for key, target in target_dict.items():
+          if target['error']:
+            continue
+          try:
+            sequence = target['socket'].send(target['address'], self.payload)
+          except (socket.error, OSError) as e:
+            target['error'] = e.strerror or str(e)
+            continue
+          target['sent'] += 1
+          pending_dict[target['socket'].family, sequence] = (
+            key, target['address'][0].split('%')[0], time.time())
+        if i < self.count - 1:
+          delay = min(self.interval, deadline - loop.time())
+          if delay <= 0:
+            break
+          await asyncio.sleep(delay)
+      sending_done = True
+      if pending_dict:
+        try:
+          await asyncio.wait_for(done, max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+          pass
+    finally:
+      for icmp_socket in socket_dict.values():
+        loop.remove_reader(icmp_socket.socket.fileno())
+        icmp_socket.close()
+
+    for key, target in target_dict.items():
+      result = result_dict[key] = getStatistics(target['sent'],
+                                                 target['rtt_list'])
+      result['address'] = target['address'][0]
+      result['error'] = target['error']
+    return result_dict
+
+  def probe(self, target_list, family=None):
+    """
+      Ping the targets and return for each target a dict of the packet loss
+      (in percent), the round trip times min, avg, max, mdev and percentiles
+      (in milliseconds) and the error preventing to ping it, if any.
+
+      A target is a host or a (host, family) tuple: addresses of family
+      (default: family) are used for the hosts which have some.
+    """
+    return asyncio.run(self.probeAsync(target_list, family))
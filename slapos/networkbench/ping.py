@@ -1,5 +1,8 @@
 import subprocess
 import re
+import socket
+
+from slapos.networkbench.icmp import ICMPError, ICMPProbe
 
 # rtt min/avg/max/mdev = 1.102/1.493/2.203/0.438 ms
 ping_re = re.compile(
@@ -13,13 +16,55 @@ ping_re = re.compile(
 date_reg_exp = re.compile('\d{4}[-/]\d{2}[-/]\d{2}')
 
 
+PROTOCOL_DICT = {
+  '4': ('ping', 'PING', socket.AF_INET),
+  '6': ('ping6', 'PING6', socket.AF_INET6),
+}
+
+
+def getPingInfo(host, protocol, result):
+  """
+    Return the ping information of a result of ICMPProbe, as ping does.
+  """
+  test_title = PROTOCOL_DICT[protocol][1]
+  if result['error'] and not result['sent']:
+    if 'unreachable' in result['error']:
+      return (test_title, host, 600, 'failed', 100, "Network is unreachable")
+    # unknown host
+    return (test_title, host, 600, 'failed', -1, "Fail to parser ping output")
+  packet_lost_ratio = str(int(result['loss']))
+  if not result['received']:
+    return (test_title, host, 600, 'failed', packet_lost_ratio,
+            "Cannot ping host")
+  return (test_title, host, 200, '%.3f' % result['avg'], packet_lost_ratio,
+          'min %.3f max %.3f avg %.3f' % (
+            result['min'], result['max'], result['avg']))
+
+
+def pingMany(host_list, timeout=10, count=10):
+  """
+    Ping concurrently the (host, protocol) of host_list and return their
+    ping information, in the same order.
+
+    The ping command is run for each host if ICMP sockets can not be used.
+  """
+  target_list = [(host, PROTOCOL_DICT[protocol][2])
+                 for host, protocol in host_list]
+  try:
+    result_dict = ICMPProbe(count=count, timeout=timeout).probe(target_list)
+  except ICMPError:
+    return [pingCommand(host, timeout=timeout, protocol=protocol, count=count)
+            for host, protocol in host_list]
+  return [getPingInfo(host, protocol, result_dict[target])
+          for (host, protocol), target in zip(host_list, target_list)]
+
+
 def ping(host, timeout=10, protocol="4", count=10):
-  if protocol == '4':
-    ping_bin = 'ping'
-    test_title = 'PING'
-  elif protocol == '6':
-    ping_bin = 'ping6'
-    test_title = 'PING6'
+  return pingMany([(host, protocol)], timeout=timeout, count=count)[0]
+
+
+def pingCommand(host, timeout=10, protocol="4", count=10):
+  ping_bin, test_title, _ = PROTOCOL_DICT[protocol]
 
   proc = subprocess.Popen((ping_bin, '-c', str(count), '-w', str(timeout), host),
                           universal_newlines=True, stdout=subprocess.PIPE,
@@ -14,12 +14,12 @@ import sqlite3
 import argparse
 import datetime
 
-from slapos.collect.db import Database
+from slapos.promise.collectordb import CollectorDatabase
 
 def getMemoryInfo(database, time, date):
 
   memory_info = {}
-  database = Database(database, create=False, timeout=5)
+  database = CollectorDatabase(database, timeout=5)
   try:
     database.connect()
     query_result = database.select("computer", date, "memory_size", limit=1) 
@@ -11,7 +11,7 @@ import os
 import argparse
 from datetime import datetime, timedelta
 
-from slapos.collect.db import Database
+from slapos.promise.collectordb import CollectorDatabase
 
 def escapeSqlStringValue(string):
   return string.replace("'", "\\'")
@@ -32,7 +32,7 @@ def getMemoryInfo(database_path, moment, user):
     time_from_str = "00:00:00"
   escaped_user = escapeSqlStringValue(user)
   memory_info = {}
-  database = Database(database_path, create=False, timeout=5)
+  database = CollectorDatabase(database_path, timeout=5)
   try:
     database.connect()
     result = list(database.select(
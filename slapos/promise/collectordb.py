@@ -0,0 +1,320 @@
+"""
+Read only access to the collector database (collector.db) for promises.
+
+Promises only read the database written every minute by slapos collect.
+CollectorDatabase is a slapos.collect.db.Database which:
+
+- reuses one read only connection per database in the process,
+- optionally reads from a snapshot of the database, so that queries of
+  promises neither wait for the collector nor make it wait,
+- selects time ranges with conditions on the date and time columns, which
+  can use the indexes of the tables (see selectTimeRange), instead of
+  conditions on datetime(date || ' ' || time), which scan the whole table.
+  Indexes on (partition, date, time) are added to the snapshot.
+
+The snapshot is copied with the SQLite backup API. It is preferably made
+once for the computer, by running collectordb-snapshot (see main) after
+each run of the collector, in the folder of collector.db: promises then
+read it as long as it is a copy of the current collector.db. A caller can
+also make its own snapshot, in a snapshot_folder it owns
+(collectordb-snapshot-folder for promises), copied at most every
+snapshot_max_age seconds (1 hour by default).
+
+Queries of the last minutes (recent) only read a snapshot which is a copy
+of the current collector.db: an older snapshot does not have their rows,
+so collector.db is read directly. Other queries, e.g. of the history of a
+partition, accept a snapshot younger than snapshot_max_age.
+
+The collector database uses a rollback journal, so the writer and readers
+of collector.db itself still lock each other: this is why a snapshot is
+used rather than WAL, which can not be enabled by a read only connection.
+Without snapshot, or when the snapshot can not be made (folder not
+writable, copy too long), collector.db is read directly. A failed copy is
+not attempted again before snapshot_max_age seconds.
+"""
+
+import argparse
+import errno
+import fcntl
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from six.moves.urllib.request import pathname2url
+from slapos.collect.db import Database
+
+SNAPSHOT_FILE_NAME = 'collector.snapshot.db'
+# touched when a copy fails
+SNAPSHOT_FAILURE_FILE_NAME = 'collector.snapshot.failed'
+# minimum number of seconds between 2 copies of the database
+SNAPSHOT_MAX_AGE = 3600
+# maximum number of seconds to copy the database and build its indexes
+SNAPSHOT_COPY_TIMEOUT = 5
+# number of SQLite virtual machine instructions between 2 checks of the
+# copy timeout while building the indexes
+SNAPSHOT_INDEX_PROGRESS_STEP = 10000
+# number of pages copied at each backup step
+SNAPSHOT_COPY_PAGE_COUNT = 1024
+
+# indexes added to the snapshot for the queries of promises
+SNAPSHOT_INDEX_DICT = {
+  'disk': "CREATE INDEX IF NOT EXISTS disk_partition_date_time ON"
+          " disk (partition, date, time)",
+  'folder': "CREATE INDEX IF NOT EXISTS folder_partition_date_time ON"
+            " folder (partition, date, time)",
+}
+
+ORDER_ASC = "date ASC, time ASC"
+ORDER_DESC = "date DESC, time DESC"
+
+# connections shared by all CollectorDatabase of the process:
+# path of the read file -> (inode of the read file, connection)
+_connection_dict = {}
+
+
+def connectReadOnly(path, timeout=None):
+  connection = sqlite3.connect(
+    'file:%s?mode=ro' % pathname2url(path),
+    uri=True,
+    timeout=5 if timeout is None else timeout)
+  connection.execute("PRAGMA query_only=1")
+  return connection
+
+
+def getTimeRangeWhere(start=None, end=None, start_included=True):
+  """
+    Return (condition, parameter list) selecting the rows from start to end
+    (datetime or "YYYY-MM-DD HH:MM:SS" string) on the date and time
+    columns. Values are bound to the ? placeholders of the condition.
+
+    The condition on the date alone can use an index on date, the one on
+    the time only filters the rows of the first and last days.
+  """
+  condition_list = []
+  parameter_list = []
+  for value, operator, included in ((start, '>', start_included),
+                                    (end, '<', True)):
+    if value is None:
+      continue
+    if isinstance(value, datetime):
+      value = value.strftime("%Y-%m-%d %H:%M:%S")
+    date_value, time_value = value.split(' ', 1)
+    condition_list.append(
+      "date %s= ? AND (date %s ? OR time %s ?)" % (
+        operator, operator, operator + '=' if included else operator))
+    parameter_list += date_value, date_value, time_value
+  return ' AND '.join(condition_list) or '1 = 1', parameter_list
+
+
+def closeConnections():
+  for _, connection in _connection_dict.values():
+    connection.close()
+  _connection_dict.clear()
+
+
+class CollectorDatabase(Database):
+  """
+    Read only, pooled access to the collector database.
+
+    The snapshot is written in snapshot_folder, which must be owned by the
+    caller. Without snapshot_folder, the snapshot of the computer in the
+    folder of the database is read if it exists, and never copied.
+
+    With recent, queries need the rows of the last minutes: the snapshot is
+    only read if it is a copy of the current database, and never copied.
+  """
+
+  def __init__(self, directory, timeout=None, snapshot_folder=None,
+               snapshot_max_age=SNAPSHOT_MAX_AGE, recent=False):
+    Database.__init__(self, directory, create=False, timeout=timeout)
+    self.copy_snapshot = bool(snapshot_folder)
+    if not snapshot_folder:
+      snapshot_folder = os.path.dirname(self.uri)
+    self.snapshot_path = os.path.join(snapshot_folder, SNAPSHOT_FILE_NAME)
+    self.failure_path = os.path.join(
+      snapshot_folder, SNAPSHOT_FAILURE_FILE_NAME)
+    self.snapshot_max_age = snapshot_max_age
+    self.recent = recent
+
+  @classmethod
+  def fromPromise(cls, promise, directory, timeout=None, recent=False):
+    """
+      Return the CollectorDatabase configured by the promise options
+      collectordb-snapshot-folder and collectordb-snapshot-max-age (only
+      the snapshot of the computer by default).
+    """
+    return cls(directory, timeout=timeout,
+      snapshot_folder=promise.getConfig('collectordb-snapshot-folder'),
+      snapshot_max_age=float(promise.getConfig(
+        'collectordb-snapshot-max-age', SNAPSHOT_MAX_AGE)),
+      recent=recent)
+
+  def _copySnapshot(self, source_stat):
+    deadline = time.time() + SNAPSHOT_COPY_TIMEOUT
+    def progress(status, remaining, total):
+      if time.time() > deadline:
+        raise sqlite3.OperationalError("copy of the database is too long")
+    def indexProgress():
+      # interrupts the statement when true
+      return time.time() > deadline
+    tmp_path = '%s.%s.tmp' % (self.snapshot_path, os.getpid())
+    try:
+      source = connectReadOnly(self.uri, self.timeout)
+      try:
+        target = sqlite3.connect(tmp_path)
+        try:
+          source.backup(target, pages=SNAPSHOT_COPY_PAGE_COUNT,
+                        progress=progress)
+          target.set_progress_handler(indexProgress,
+                                      SNAPSHOT_INDEX_PROGRESS_STEP)
+          table_set = set(q[0] for q in target.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"))
+          for table, query in sorted(SNAPSHOT_INDEX_DICT.items()):
+            if table in table_set:
+              target.execute(query)
+          target.commit()
+        finally:
+          target.close()
+      finally:
+        source.close()
+      os.chmod(tmp_path, 0o644)
+      # the date of the snapshot is the date of the copied database
+      os.utime(tmp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+      os.rename(tmp_path, self.snapshot_path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+  def getReadPath(self):
+    """
+      Return the path of the database to read: the snapshot, copied again
+      if needed, or the database itself.
+    """
+    try:
+      source_stat = os.stat(self.uri)
+      try:
+        snapshot_stat = os.stat(self.snapshot_path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+        snapshot_stat = None
+      if snapshot_stat is not None:
+        if snapshot_stat.st_mtime_ns == source_stat.st_mtime_ns:
+          return self.snapshot_path
+        if self.recent:
+          # the rows of the last minutes are not in the snapshot
+          return self.uri
+        if time.time() - snapshot_stat.st_ctime < self.snapshot_max_age:
+          return self.snapshot_path
+      if self.recent or not self.copy_snapshot:
+        return self.uri
+      try:
+        failure_mtime = os.stat(self.failure_path).st_mtime
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+      else:
+        if time.time() - failure_mtime < self.snapshot_max_age:
+          # the last copy failed, do not try again yet
+          return self.uri
+      fd = os.open(self.snapshot_path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+      try:
+        try:
+          fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+          if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+          # another promise is copying the database, do not wait for it
+          return self.snapshot_path if snapshot_stat is not None else self.uri
+        try:
+          self._copySnapshot(source_stat)
+        except (IOError, OSError, sqlite3.Error):
+          os.close(os.open(self.failure_path, os.O_WRONLY | os.O_CREAT, 0o644))
+          os.utime(self.failure_path)
+          raise
+        if os.path.exists(self.failure_path):
+          os.remove(self.failure_path)
+      finally:
+        os.close(fd)
+    except (IOError, OSError, sqlite3.Error):
+      # the database is read directly
+      return self.uri
+    return self.snapshot_path
+
+  def connect(self):
+    path = self.getReadPath()
+    try:
+      inode = os.stat(path).st_ino
+    except OSError:
+      inode = None
+    pooled = _connection_dict.get(path)
+    if pooled is None or pooled[0] != inode:
+      if pooled is not None:
+        # the snapshot was copied again
+        pooled[1].close()
+      pooled = _connection_dict[path] = (
+        inode, connectReadOnly(path, self.timeout))
+    self.connection = pooled[1]
+    self.cursor = self.connection.cursor()
+
+  def selectTimeRange(self, table, start=None, end=None, columns="*",
+                      where=None, order=ORDER_ASC, group=None, limit=0,
+                      start_included=True):
+    """
+      Select the rows of the table from start to end, ordered by time.
+    """
+    time_where, parameter_list = getTimeRangeWhere(
+      start, end, start_included)
+    if where is not None:
+      time_where = "%s AND %s" % (where, time_where)
+    # same query as Database.select, with the bound time range
+    select_sql = "SELECT %s FROM %s WHERE %s" % (columns, table, time_where)
+    if group is not None:
+      select_sql += " GROUP BY %s" % group
+    if order is not None:
+      select_sql += " ORDER BY %s" % order
+    if limit:
+      select_sql += " LIMIT %s" % limit
+    assert self.connection is not None
+    return self.cursor.execute(select_sql, parameter_list)
+
+  def commit(self):
+    raise sqlite3.OperationalError("collector database is read only")
+
+  def close(self):
+    # the connection is kept for the next queries of the process
+    if self.cursor is not None:
+      self.cursor.close()
+    self.cursor = None
+    self.connection = None
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Copy the collector database to the snapshot read by"
+                " promises, if it was modified since the last copy. Run it"
+                " after each run of the collector.")
+  parser.add_argument("--collectordb", required=True,
+                      help="the directory path of the 'collector.db' file.")
+  parser.add_argument("--snapshot-folder",
+                      help="folder of the snapshot (default: the folder of"
+                           " 'collector.db').")
+  args = parser.parse_args()
+
+  database_path = args.collectordb
+  # --collectordb : can also be the path of 'collector.db' itself
+  if os.path.basename(database_path) == "collector.db":
+    database_path = os.path.dirname(database_path)
+
+  database = CollectorDatabase(database_path,
+    snapshot_folder=args.snapshot_folder or database_path,
+    snapshot_max_age=0)
+  if database.getReadPath() != database.snapshot_path:
+    print("Snapshot of %s not made" % database.uri)
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
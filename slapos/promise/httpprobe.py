@@ -0,0 +1,509 @@
+"""
+Batched HTTP probing for promises checking URLs.
+
+HTTPProbe sends the GET requests of many URLs concurrently with asyncio,
+with a bounded number of requests in flight, and reuses kept alive
+connections to the same host (scheme, host, port and TLS options). For
+each URL, it returns the status code or the error, with the duration of
+the DNS resolution, TCP connection, TLS handshake and time to first byte.
+
+SharedProbeFolder shares the probe results between the promises of a
+partition: each promise registers its request in the folder, and the
+first promise finding its result too old probes all registered requests
+at once and writes them in result.json for the others. Credentials are
+never written in the folder: requests with credentials are probed by the
+promise itself.
+"""
+
+import asyncio
+import base64
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import ssl
+import time
+
+from six.moves.urllib.parse import unquote, urljoin, urlsplit
+
+# maximum number of requests in flight
+PROBE_CONCURRENCY = 32
+# maximum number of idle connections kept for each host
+PROBE_POOL_SIZE = 4
+PROBE_TIMEOUT = 5
+PROBE_MAX_REDIRECTS = 30
+# results older than this are probed again, in seconds
+PROBE_MAX_AGE = 60
+# requests not registered again for this time are forgotten, in seconds
+PROBE_REQUEST_MAX_AGE = 24 * 3600
+# delay between 2 attempts to take the lock of a SharedProbeFolder
+PROBE_LOCK_RETRY_DELAY = 0.1
+
+REDIRECT_STATUS_CODE_LIST = (301, 302, 303, 307, 308)
+
+ERROR_SSL = 'ssl'
+ERROR_CONNECTION = 'connection'
+ERROR_OTHER = 'other'
+
+# keys of a request which are not written in a SharedProbeFolder, as well
+# as requests whose url contains credentials
+SECRET_KEY_LIST = ('username', 'password')
+
+
+class ProbeError(Exception):
+
+  def __init__(self, error_type, message):
+    Exception.__init__(self, message)
+    self.error_type = error_type
+
+
+def getPublicRequest(request):
+  """
+    Return the request without its secret keys (see SECRET_KEY_LIST).
+  """
+  return dict((key, value) for key, value in request.items()
+              if key not in SECRET_KEY_LIST)
+
+
+def hasSecret(request):
+  if any(request.get(key) for key in SECRET_KEY_LIST):
+    return True
+  parsed_url = urlsplit(request.get('url') or '')
+  return parsed_url.username is not None or parsed_url.password is not None
+
+
+def getProbeKey(request):
+  """
+    Return the key of the request (a dict of the url and its options),
+    computed from the keys which are not secret.
+  """
+  return hashlib.sha1(json.dumps(
+    dict(getPublicRequest(request), secret=hasSecret(request)),
+    sort_keys=True).encode()).hexdigest()
+
+
+def writeJSON(path, value):
+  """
+    Write value in path atomically, readable by the owner only.
+  """
+  tmp_file = '%s.%s.tmp' % (path, os.getpid())
+  with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600), 'w') as f:
+    json.dump(value, f, sort_keys=True)
+  os.rename(tmp_file, path)
+
+
+def getDefaultCAFile():
+  # the same CA bundle as requests
+  ca_file = os.environ.get('REQUESTS_CA_BUNDLE') or \
+    os.environ.get('CURL_CA_BUNDLE')
+  if not ca_file:
+    import requests.certs
+    ca_file = requests.certs.where()
+  return ca_file
+
+
+class HTTPConnection(object):
+
+  def __init__(self, reader, writer):
+    self.reader = reader
+    self.writer = writer
+    self.reusable = True
+
+  def close(self):
+    self.reusable = False
+    self.writer.close()
+
+
+class HTTPProbe(object):
+  """
+    Probe URLs concurrently. A request is a dict with the keys:
+
+      url, timeout, verify (bool or CA file), cert-file, key-file,
+      username, password, allow-redirects
+  """
+
+  def __init__(self, concurrency=PROBE_CONCURRENCY, pool_size=PROBE_POOL_SIZE):
+    self.concurrency = concurrency
+    self.pool_size = pool_size
+    self.pool_dict = {}
+    self.ssl_context_dict = {}
+
+  def getSSLContext(self, request):
+    verify = request.get('verify', False)
+    cert_file = request.get('cert-file')
+    key_file = request.get('key-file')
+    context_key = (verify, cert_file, key_file)
+    context = self.ssl_context_dict.get(context_key)
+    if context is None:
+      if verify:
+        context = ssl.create_default_context(cafile=getDefaultCAFile()
+          if verify is True else verify)
+      else:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+      if cert_file and key_file:
+        context.load_cert_chain(cert_file, key_file)
+      self.ssl_context_dict[context_key] = context
+    return context
+
+  async def connect(self, scheme, host, port, request, timing_dict):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+      address_list = await loop.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+      raise ProbeError(ERROR_CONNECTION, str(e))
+    timing_dict['dns'] = loop.time() - start
+    start = loop.time()
+    error = None
+    for family, type_, proto, _, address in address_list:
+      sock = socket.socket(family, type_, proto)
+      sock.setblocking(False)
+      try:
+        await loop.sock_connect(sock, address)
+        break
+      except OSError as e:
+        sock.close()
+        error = e
+    else:
+      raise ProbeError(ERROR_CONNECTION, str(error))
+    timing_dict['connect'] = loop.time() - start
+    start = loop.time()
+    try:
+      if scheme == 'https':
+        reader, writer = await asyncio.open_connection(
+          sock=sock, ssl=self.getSSLContext(request), server_hostname=host)
+      else:
+        reader, writer = await asyncio.open_connection(sock=sock)
+    except (ssl.SSLError, ssl.CertificateError) as e:
+      sock.close()
+      raise ProbeError(ERROR_SSL, str(e))
+    except OSError as e:
+      sock.close()
+      raise ProbeError(ERROR_CONNECTION, str(e))
+    timing_dict['tls'] = loop.time() - start if scheme == 'https' else 0.
+    return HTTPConnection(reader, writer)
+
+  async def readResponse(self, connection, start, timing_dict):
+    reader = connection.reader
+    status_line = await reader.readline()
+    if not status_line:
+      raise EOFError('connection closed')
+    timing_dict['ttfb'] = asyncio.get_running_loop().time() - start
+    try:
+      version, status_code = status_line.split(None, 2)[:2]
+      status_code = int(status_code)
+    except ValueError:
+      raise ProbeError(ERROR_OTHER, 'bad status line %r' % status_line)
+    header_dict = {}
+    while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        break
+      name, _, value = line.decode('latin-1').partition(':')
+      header_dict[name.strip().lower()] = value.strip()
+    if version != b'HTTP/1.1' or \
+        header_dict.get('connection', '').lower() == 'close':
+      connection.reusable = False
+    # read the body, so that the connection can be reused
+    if 100 <= status_code < 200 or status_code in (204, 304):
+      pass
+    elif header_dict.get('transfer-encoding', '').lower() == 'chunked':
+      while True:
+        try:
+          size = int((await reader.readline()).split(b';')[0], 16)
+        except ValueError:
+          # the end of the body is unknown
+          connection.reusable = False
+          break
+        if not size:
+          # trailer fields, up to the blank line
+          while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+          break
+        await reader.readexactly(size + 2)
+    elif 'content-length' in header_dict:
+      await reader.readexactly(int(header_dict['content-length']))
+    else:
+      await reader.read()
+      connection.reusable = False
+    return status_code, header_dict
+
+  async def sendRequest(self, url, request, timing_dict):
+    """
+      Send one GET request, on a pooled connection if possible, and return
+      the status code and headers of the response.
+    """
+    loop = asyncio.get_running_loop()
+    parsed_url = urlsplit(url)
+    scheme = parsed_url.scheme
+    if scheme not in ('http', 'https'):
+      raise ProbeError(ERROR_OTHER, 'Invalid URL %r: No scheme supplied' % url)
+    host = parsed_url.hostname
+    if not host:
+      raise ProbeError(ERROR_OTHER, 'Invalid URL %r: No host supplied' % url)
+    port = parsed_url.port or (443 if scheme == 'https' else 80)
+    timeout = request.get('timeout', PROBE_TIMEOUT)
+    path = parsed_url.path or '/'
+    if parsed_url.query:
+      path += '?' + parsed_url.query
+    header_list = [
+      'GET %s HTTP/1.1' % path,
+      'Host: %s' % parsed_url.netloc.rsplit('@', 1)[-1],
+      'User-Agent: slapos-httpprobe',
+      'Accept: */*',
+      'Accept-Encoding: identity',
+      'Connection: keep-alive',
+    ]
+    username = request.get('username')
+    password = request.get('password')
+    if username and password:
+      credentials = '%s:%s' % (username, password)
+    elif parsed_url.username is not None or parsed_url.password is not None:
+      # like requests, credentials of the url are sent
+      credentials = '%s:%s' % (unquote(parsed_url.username or ''),
+                               unquote(parsed_url.password or ''))
+    else:
+      credentials = None
+    if credentials is not None:
+      header_list.append('Authorization: Basic %s' % base64.b64encode(
+        credentials.encode()).decode())
+    data = ('\r\n'.join(header_list) + '\r\n\r\n').encode('latin-1')
+
+    pool_key = (scheme, host, port, request.get('verify', False),
+                request.get('cert-file'), request.get('key-file'))
+    idle_list = self.pool_dict.setdefault(pool_key, [])
+    while True:
+      if idle_list:
+        connection = idle_list.pop()
+        reused = True
+        for phase in ('dns', 'connect', 'tls'):
+          timing_dict[phase] = 0.
+      else:
+        try:
+          connection = await asyncio.wait_for(
+            self.connect(scheme, host, port, request, timing_dict), timeout)
+        except asyncio.TimeoutError:
+          raise ProbeError(ERROR_CONNECTION,
+            'connection to %s:%s timed out' % (host, port))
+        reused = False
+      start = loop.time()
+      try:
+        connection.writer.write(data)
+        await connection.writer.drain()
+        status_code, header_dict = await asyncio.wait_for(
+          self.readResponse(connection, start, timing_dict), timeout)
+      except asyncio.TimeoutError:
+        connection.close()
+        raise ProbeError(ERROR_OTHER,
+          '%s:%s read timed out (timeout=%s)' % (host, port, timeout))
+      except (EOFError, OSError, asyncio.IncompleteReadError) as e:
+        connection.close()
+        if reused:
+          # the server closed the kept alive connection, use a new one
+          continue
+        if isinstance(e, ssl.SSLError):
+          raise ProbeError(ERROR_SSL, str(e))
+        raise ProbeError(ERROR_CONNECTION, str(e))
+      except Exception:
+        connection.close()
+        raise
+      break
+    timing_dict['reused'] = reused
+    if connection.reusable and len(idle_list) < self.pool_size:
+      idle_list.append(connection)
+    else:
+      connection.close()
+    return status_code, header_dict
+
+  async def probeRequest(self, request, semaphore):
+    """
+      Return the result of the request, following redirects.
+    """
+    loop = asyncio.get_running_loop()
+    url = request['url']
+    result = {'url': url}
+    async with semaphore:
+      start = loop.time()
+      try:
+        for _ in range(PROBE_MAX_REDIRECTS + 1):
+          timing_dict = {}
+          status_code, header_dict = await self.sendRequest(
+            url, request, timing_dict)
+          location = header_dict.get('location')
+          if not (request.get('allow-redirects', True) and location and
+                  status_code in REDIRECT_STATUS_CODE_LIST):
+            break
+          next_url = urljoin(url, location)
+          if urlsplit(next_url).netloc != urlsplit(url).netloc:
+            # like requests, do not send credentials to another host
+            request = dict(request, username=None, password=None)
+          url = next_url
+        else:
+          raise ProbeError(ERROR_OTHER,
+            'Exceeded %s redirects.' % PROBE_MAX_REDIRECTS)
+      except ProbeError as e:
+        result['error-type'] = e.error_type
+        result['error'] = str(e)
+      except Exception as e:
+        result['error-type'] = ERROR_OTHER
+        result['error'] = str(e)
+      else:
+        result['status-code'] = status_code
+        result['reused'] = timing_dict.pop('reused')
+        result['timing'] = timing_dict
+      result.setdefault('timing', {})['total'] = loop.time() - start
+    result['date'] = time.time()
+    return result
+
+  async def probeAsync(self, request_dict, timeout=None):
+    semaphore = asyncio.Semaphore(self.concurrency)
+    task_dict = dict(
+      (key, asyncio.ensure_future(self.probeRequest(request, semaphore)))
+      for key, request in request_dict.items())
+    try:
+      if task_dict:
+        await asyncio.wait(list(task_dict.values()), timeout=timeout)
+      return dict((key, task.result()) for key, task in task_dict.items()
+                  if task.done())
+    finally:
+      for task in task_dict.values():
+        task.cancel()
+      for idle_list in self.pool_dict.values():
+        for connection in idle_list:
+          connection.close()
+      self.pool_dict.clear()
+
+  def probe(self, request_dict, timeout=None):
+    """
+      Probe the requests of request_dict (key -> request) and return the
+      results (key -> result) of the ones done before timeout.
+    """
+    return asyncio.run(self.probeAsync(request_dict, timeout))
+
+
+class SharedProbeFolder(object):
+  """
+    Folder where promises register their requests and read the results.
+
+      <folder>/request/<key>.json   the registered requests
+      <folder>/result.json          the results, by key
+
+    Files are only readable by their owner, and requests are written
+    without their credentials.
+  """
+
+  def __init__(self, folder, max_age=PROBE_MAX_AGE,
+               concurrency=PROBE_CONCURRENCY):
+    self.folder = folder
+    self.request_folder = os.path.join(folder, 'request')
+    self.result_file = os.path.join(folder, 'result.json')
+    self.max_age = max_age
+    self.concurrency = concurrency
+
+  def register(self, request):
+    if hasSecret(request):
+      raise ValueError("requests with credentials can not be registered")
+    key = getProbeKey(request)
+    request_file = os.path.join(self.request_folder, key + '.json')
+    try:
+      # mark the request as still used
+      os.utime(request_file)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      if not os.path.isdir(self.request_folder):
+        os.makedirs(self.request_folder, 0o700)
+      writeJSON(request_file, request)
+    return key
+
+  def loadResultDict(self):
+    try:
+      with open(self.result_file) as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return {}
+
+  def isFresh(self, result):
+    return result is not None and \
+      time.time() - result['date'] < self.max_age
+
+  def loadRequestDict(self):
+    request_dict = {}
+    now = time.time()
+    for name in os.listdir(self.request_folder):
+      if not name.endswith('.json'):
+        continue
+      path = os.path.join(self.request_folder, name)
+      try:
+        if now - os.stat(path).st_mtime > PROBE_REQUEST_MAX_AGE:
+          os.remove(path)
+          continue
+        with open(path) as f:
+          request_dict[name[:-len('.json')]] = json.load(f)
+      except (IOError, OSError, ValueError):
+        continue
+    return request_dict
+
+  def probe(self, timeout=None):
+    """
+      Probe the registered requests whose results are too old, and write
+      the results.
+    """
+    result_dict = self.loadResultDict()
+    request_dict = self.loadRequestDict()
+    stale_dict = dict((key, request) for key, request in request_dict.items()
+                      if not self.isFresh(result_dict.get(key)))
+    result_dict = dict((key, result) for key, result in result_dict.items()
+                       if key in request_dict)
+    result_dict.update(
+      HTTPProbe(self.concurrency).probe(stale_dict, timeout=timeout))
+    writeJSON(self.result_file, result_dict)
+    return result_dict
+
+  def getResult(self, request, timeout=None):
+    """
+      Return the result of the request, probed with the other registered
+      requests if it is too old, or None if it could not be probed before
+      timeout.
+
+      Requests with credentials are probed alone, and neither they nor
+      their results are written in the folder.
+    """
+    if hasSecret(request):
+      key = getProbeKey(request)
+      return HTTPProbe(self.concurrency).probe(
+        {key: request}, timeout=timeout).get(key)
+    deadline = None if timeout is None else time.time() + timeout
+    key = self.register(request)
+    result = self.loadResultDict().get(key)
+    if self.isFresh(result):
+      return result
+    with open(self.result_file + '.lock', 'a') as lock:
+      while True:
+        try:
+          fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+          break
+        except (IOError, OSError) as e:
+          if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        # another promise is probing, its results are likely fresh
+        result = self.loadResultDict().get(key)
+        if self.isFresh(result):
+          return result
+        if deadline is not None and time.time() >= deadline:
+          return None
+        time.sleep(PROBE_LOCK_RETRY_DELAY)
+      result = self.loadResultDict().get(key)
+      if self.isFresh(result):
+        return result
+      if deadline is not None:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          return None
+      return self.probe(timeout).get(key)
@@ -5,31 +5,26 @@ Check if a specific ip address and port is listening.
 
 No connection establishment is done during the check.
 
-Uses:
-- /proc/net/tcp
-- /proc/net/tcp6
+Uses (see slapos.promise.sockdiag):
+- netlink sock_diag
+- /proc/net/tcp and /proc/net/tcp6 if sock_diag is not available
 """
 
 import sys
-import socket
-import struct
-assert struct.calcsize('I') == 4
 
-def isLocalTcpPortOpened(ip_address, port):
-  family = socket.getaddrinfo(ip_address, 0)[0][0]
-  conf = {
-    socket.AF_INET6: (4, "/proc/net/tcp6"),
-    socket.AF_INET: (1, "/proc/net/tcp"),
-  }
-
-  int_count = conf[family][0]
-  tcp_path = conf[family][1]
+from slapos.promise.sockdiag import getListeningAddressList
 
-  ip_addr_hex = ('%08X' * int_count) % struct.unpack('I' * int_count, socket.inet_pton(family, ip_address))
-  full_addr_hex = ip_addr_hex + ":%04X" % port
+def areLocalTcpPortsOpened(address_list):
+  """
+    Return the list of (ip address, port) of address_list which are
+    listening, with one lookup for all the ports of an address family.
+  """
+  address_list = [(ip_address, int(port)) for ip_address, port in address_list
+                  if 0 < int(port) < 65536]
+  return getListeningAddressList(address_list)
 
-  with open(tcp_path) as f:
-    return any(full_addr_hex == line.split()[1] for line in f.readlines())
+def isLocalTcpPortOpened(ip_address, port):
+  return bool(areLocalTcpPortsOpened([(ip_address, port)]))
 
 def main():
   if isLocalTcpPortOpened(sys.argv[1], int(sys.argv[2])):
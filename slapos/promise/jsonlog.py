@@ -0,0 +1,240 @@
+"""
+Reading of the JSON logs written by promises (see JSONPromise).
+
+Each line of a JSON log is a JSON object whose "time" is the date the line
+was logged, so lines are in chronological order. The lines of the last
+seconds are read backwards from the end of the log and of its rotated logs
+(see slapos.promise.logrotate), or from a time index of the log
+(see JSONLogTimeIndex), which avoids reading the whole current log when it
+is large.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+
+from dateutil import parser as dateparser
+from datetime import datetime
+from slapos.promise.logrotate import iter_logrotate_file_handle
+
+
+REVERSE_READ_BLOCK_SIZE = 64 * 1024
+
+# Distance in bytes between 2 entries of a JSON log time index
+JSON_LOG_INDEX_STEP = 256 * 1024
+JSON_LOG_INDEX_VERSION = 1
+
+JSON_LOG_TIME_PREFIX = b'{"time": "'
+
+
+def iter_reverse_lines(f, block_size=REVERSE_READ_BLOCK_SIZE):
+  """
+    Read lines from the end of the file
+
+    Lines are returned like readline does, with their newline
+    character. The file is read backwards by blocks of block_size bytes.
+  """
+  position = f.seek(0, os.SEEK_END)
+  buffer = b''
+  # buffer[:line_end] is the part of the file which was not yet returned
+  line_end = 0
+  while True:
+    # the last character of the current line is its newline
+    newline = buffer.rfind(b'\n', 0, line_end - 1)
+    if newline != -1:
+      yield buffer[newline + 1:line_end]
+      line_end = newline + 1
+    elif position:
+      read_size = min(block_size, position)
+      position -= read_size
+      f.seek(position)
+      buffer = f.read(read_size) + buffer[:line_end]
+      line_end = len(buffer)
+    else:
+      if line_end:
+        yield buffer[:line_end]
+      return
+
+
+def parse_log_time(time_string):
+  """
+    Parse a log date, as written by logging ("2026-01-01 10:00:00,123")
+
+    Other formats are handled by dateutil.
+  """
+  s = time_string
+  if len(s) >= 19 and s[4] == s[7] == '-' and s[10] in ' T' \
+      and s[13] == s[16] == ':':
+    fraction = s[20:]
+    if len(s) == 19 or (s[19] in ',.' and fraction.isdigit()):
+      try:
+        return datetime(int(s[:4]), int(s[5:7]), int(s[8:10]),
+                        int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                        int(fraction[:6].ljust(6, '0')) if fraction else 0)
+      except ValueError:
+        pass
+  return dateparser.parse(time_string)
+
+
+def get_json_log_line_time(line):
+  """
+    Return the date of a JSON log line, without decoding the whole line
+    when it was written by JSONPromise.
+  """
+  if line.startswith(JSON_LOG_TIME_PREFIX):
+    start = len(JSON_LOG_TIME_PREFIX)
+    end = line.find(b'"', start)
+    if end != -1:
+      return parse_log_time(line[start:end].decode())
+  return parse_log_time(json.loads(line)['time'])
+
+
+class JSONLogTimeIndex(object):
+  """
+    Index of a JSON log giving the date of the line found every
+    JSON_LOG_INDEX_STEP bytes, so lines after a date can be found by
+    bisection instead of reading the file backwards.
+
+    The index is stored in index_folder, never next to the log whose
+    folder may not be writable. It is updated incrementally when the log
+    grows, and rebuilt when the log is rotated or truncated.
+  """
+
+  def __init__(self, json_log_file, index_folder, step=JSON_LOG_INDEX_STEP):
+    self.index_file = os.path.join(index_folder, hashlib.md5(
+      json_log_file.encode('utf-8')).hexdigest() + '.index')
+    self.step = step
+    self.index = None
+
+  def _newIndex(self, inode):
+    return {
+      'version': JSON_LOG_INDEX_VERSION,
+      'inode': inode,
+      'step': self.step,
+      'size': 0,
+      'next-offset': 0,
+      'entry-list': [],
+    }
+
+  def load(self, inode):
+    try:
+      with open(self.index_file) as f:
+        index = json.load(f)
+    except (OSError, ValueError):
+      index = None
+    if not isinstance(index, dict) \
+        or index.get('version') != JSON_LOG_INDEX_VERSION \
+        or index.get('inode') != inode or index.get('step') != self.step:
+      index = self._newIndex(inode)
+    return index
+
+  def save(self):
+    tmp_file = '%s.%s.tmp' % (self.index_file, os.getpid())
+    try:
+      folder = os.path.dirname(self.index_file)
+      if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+      with open(tmp_file, 'w') as f:
+        json.dump(self.index, f)
+      os.rename(tmp_file, self.index_file)
+    except OSError:
+      # the index is only an optimisation
+      pass
+
+  def update(self, f):
+    """
+      Index the lines added to the opened log f since the last update.
+    """
+    stat = os.fstat(f.fileno())
+    index = self.load(stat.st_ino)
+    if stat.st_size < index['size']:
+      index = self._newIndex(stat.st_ino)
+    self.index = index
+    if stat.st_size == index['size']:
+      return
+    offset = index['next-offset']
+    while offset < stat.st_size:
+      f.seek(offset)
+      if offset:
+        # skip the end of the previous line
+        f.readline()
+      line_offset = f.tell()
+      line = f.readline()
+      if not line.endswith(b'\n'):
+        # last line, which may not be fully written
+        break
+      index['entry-list'].append(
+        [get_json_log_line_time(line).timestamp(), line_offset])
+      offset = line_offset + self.step
+    index['next-offset'] = offset
+    index['size'] = stat.st_size
+    self.save()
+
+  def getStartOffset(self, timestamp):
+    """
+      Return the offset of a line older than timestamp, from which all
+      newer lines are found, or None if all indexed lines are newer.
+    """
+    entry_list = self.index['entry-list']
+    i = bisect.bisect_left(entry_list, [timestamp])
+    if i == 0:
+      return None
+    return entry_list[i - 1][1]
+
+
+def _get_json_log_entry_interval_indexed(json_log_file, interval,
+                                         current_time, index_folder):
+  entry_list = []
+  with open(json_log_file, 'rb') as f:
+    time_index = JSONLogTimeIndex(json_log_file, index_folder=index_folder)
+    time_index.update(f)
+    # one second of margin, lines are filtered on their date anyway
+    start_offset = time_index.getStartOffset(
+      current_time.timestamp() - interval - 1)
+    if start_offset is not None:
+      f.seek(start_offset)
+      for line in f:
+        timestamp = get_json_log_line_time(line)
+        if (current_time - timestamp).total_seconds() <= interval:
+          entry_list.append((timestamp.timestamp(), json.loads(line)['data']))
+      entry_list.reverse()
+      return entry_list
+  # the whole current log is in the interval, rotated logs are needed
+  return None
+
+
+def _get_json_log_entry_interval(json_log_file, interval, use_index,
+                                 current_time, index_folder=None):
+  """
+    Return (timestamp, data) of the lines of the last "interval" seconds,
+    newest first. The time index is only used with an index_folder, where
+    the index of compressed rotated logs is kept too.
+  """
+  if use_index and index_folder:
+    try:
+      entry_list = _get_json_log_entry_interval_indexed(
+        json_log_file, interval, current_time, index_folder)
+    except (OSError, ValueError, KeyError):
+      entry_list = None
+    if entry_list is not None:
+      return entry_list
+  entry_list = []
+  for f in iter_logrotate_file_handle(json_log_file, 'rb', index_folder):
+    for line in iter_reverse_lines(f):
+      timestamp = get_json_log_line_time(line)
+      if (current_time - timestamp).total_seconds() > interval:
+        return entry_list
+      entry_list.append((timestamp.timestamp(), json.loads(line)['data']))
+  return entry_list
+
+
+def get_json_log_latest_timestamp(json_log_file):
+  """
+    Get latest timestamp from JSON log
+    Reads rotated logs too (XX.log, XX.log.1, XX.log.2, ...)
+  """
+  for f in iter_logrotate_file_handle(json_log_file, 'rb'):
+    for line in iter_reverse_lines(f):
+      return get_json_log_line_time(line).timestamp()
+  return 0
@@ -0,0 +1,219 @@
+"""
+Running aggregates of the values logged in JSON logs.
+
+A promise checking the average, minimum or maximum of a value over a long
+period would read all the lines of this period at each run. Instead,
+JSONLogAggregate keeps the statistics of the logged values per time
+bucket, updated by JSONLogAggregateHandler when each value is logged (see
+JSONPromise.aggregate_json_log).
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+
+from datetime import datetime
+from slapos.promise.jsonlog import parse_log_time
+
+
+JSON_LOG_AGGREGATE_FOLDER_NAME = '.slapgrid/promise/json-log-aggregate'
+# Number of buckets covering the period of a JSON log aggregate
+JSON_LOG_AGGREGATE_BUCKET_COUNT = 60
+JSON_LOG_AGGREGATE_VERSION = 1
+
+
+def get_value_statistics(entry_list):
+  """
+    Return the count, sum, average, minimum, maximum, first (oldest) and
+    last (newest) value of the (timestamp, value) of entry_list.
+  """
+  entry_list = sorted(entry_list, key=lambda q: q[0])
+  statistics = {'count': len(entry_list)}
+  if entry_list:
+    value_list = [value for _, value in entry_list]
+    # fsum does not depend on the order of the values
+    statistics['sum'] = math.fsum(value_list)
+    statistics.update(
+      avg=statistics['sum'] / len(value_list),
+      min=min(value_list),
+      max=max(value_list),
+      first=value_list[0],
+      last=value_list[-1],
+    )
+  return statistics
+
+
+class JSONLogAggregate(object):
+  """
+    Running aggregate of a value of a JSON log, stored in aggregate_folder
+    (not next to the log), so that statistics over the last "period"
+    seconds do not need to read the log.
+
+    The aggregate is a ring buffer of bucket_count buckets of
+    period / (bucket_count - 1) seconds (the buckets of the start and end of
+    the period are partly covered), each with the count, sum, min, max and
+    first and last values (with their dates) of the values logged during
+    this time. A bucket is [index, count, sum, min, max, first date,
+    first value, last date, last value], the bucket of index i is in the
+    slot i % bucket_count.
+
+    Statistics are only given when they are the same as the ones of the
+    log lines of the interval: the aggregate must have been updated for
+    all these lines, and the start of the interval must not be between 2
+    values of the same bucket. Otherwise, they are computed from the log
+    (see JSONPromise.get_json_log_statistics).
+  """
+
+  def __init__(self, json_log_file, key, period, aggregate_folder,
+               bucket_count=JSON_LOG_AGGREGATE_BUCKET_COUNT):
+    self.json_log_file = json_log_file
+    self.aggregate_file = os.path.join(aggregate_folder, hashlib.md5(
+      ('%s\0%s' % (json_log_file, key)).encode('utf-8')).hexdigest() +
+      '.aggregate')
+    self.key = key
+    self.bucket_count = bucket_count
+    self.bucket_duration = float(period) / (bucket_count - 1)
+
+  def _newAggregate(self, start):
+    return {
+      'version': JSON_LOG_AGGREGATE_VERSION,
+      'bucket-duration': self.bucket_duration,
+      # date from which all logged values are aggregated
+      'start': start,
+      'inode': None,
+      'size': 0,
+      'bucket-list': [None] * self.bucket_count,
+    }
+
+  def load(self):
+    """
+      Return the saved aggregate, or None if it is not valid anymore
+      because the log was rotated or truncated.
+    """
+    try:
+      with open(self.aggregate_file) as f:
+        aggregate = json.load(f)
+      stat = os.stat(self.json_log_file)
+    except (OSError, ValueError):
+      return None
+    if not isinstance(aggregate, dict) \
+        or aggregate.get('version') != JSON_LOG_AGGREGATE_VERSION \
+        or aggregate.get('bucket-duration') != self.bucket_duration \
+        or len(aggregate.get('bucket-list', ())) != self.bucket_count \
+        or aggregate.get('inode') != stat.st_ino \
+        or aggregate.get('size') > stat.st_size:
+      return None
+    return aggregate
+
+  def save(self, aggregate):
+    try:
+      stat = os.stat(self.json_log_file)
+      aggregate['inode'] = stat.st_ino
+      aggregate['size'] = stat.st_size
+      tmp_file = '%s.%s.tmp' % (self.aggregate_file, os.getpid())
+      folder = os.path.dirname(self.aggregate_file)
+      if not os.path.isdir(folder):
+        os.makedirs(folder)
+      with open(tmp_file, 'w') as f:
+        json.dump(aggregate, f)
+      os.rename(tmp_file, self.aggregate_file)
+    except OSError:
+      # the aggregate is only an optimisation
+      pass
+
+  def _add(self, aggregate, timestamp, value):
+    index = int(timestamp // self.bucket_duration)
+    slot = index % self.bucket_count
+    bucket = aggregate['bucket-list'][slot]
+    if bucket is None or bucket[0] != index:
+      aggregate['bucket-list'][slot] = [
+        index, 1, value, value, value, timestamp, value, timestamp, value]
+    else:
+      bucket[1] += 1
+      bucket[2] += value
+      bucket[3] = min(bucket[3], value)
+      bucket[4] = max(bucket[4], value)
+      if timestamp < bucket[5]:
+        bucket[5:7] = timestamp, value
+      if timestamp >= bucket[7]:
+        bucket[7:9] = timestamp, value
+
+  def add(self, timestamp, value):
+    """
+      Add the value logged at timestamp, just after it was logged.
+    """
+    aggregate = self.load()
+    if aggregate is None:
+      aggregate = self._newAggregate(timestamp)
+    self._add(aggregate, timestamp, value)
+    self.save(aggregate)
+
+  def reset(self, entry_list, start):
+    """
+      Replace the aggregate by the (timestamp, value) of entry_list, which
+      are all the values logged since start.
+    """
+    aggregate = self._newAggregate(start)
+    for timestamp, value in sorted(entry_list, key=lambda q: q[0]):
+      self._add(aggregate, timestamp, value)
+    self.save(aggregate)
+
+  def getStatistics(self, interval, current_time=None):
+    """
+      Return the statistics (see get_value_statistics) of the values
+      logged in the last "interval" seconds, or None if the aggregate can
+      not give the same result as the log.
+    """
+    if current_time is None:
+      current_time = datetime.now().timestamp()
+    start = current_time - interval
+    aggregate = self.load()
+    if aggregate is None or aggregate['start'] > start or \
+        interval > self.bucket_duration * (self.bucket_count - 1):
+      return None
+    start_index = int(start // self.bucket_duration)
+    bucket_list = []
+    for bucket in aggregate['bucket-list']:
+      if bucket is None or bucket[0] < start_index or bucket[7] < start:
+        continue
+      if bucket[5] < start:
+        # some values of the bucket are out of the interval
+        return None
+      bucket_list.append(bucket)
+    statistics = {'count': sum(bucket[1] for bucket in bucket_list)}
+    if bucket_list:
+      bucket_list.sort()
+      statistics['sum'] = math.fsum(bucket[2] for bucket in bucket_list)
+      statistics.update(
+        avg=statistics['sum'] / statistics['count'],
+        min=min(bucket[3] for bucket in bucket_list),
+        max=max(bucket[4] for bucket in bucket_list),
+        first=bucket_list[0][6],
+        last=bucket_list[-1][8],
+      )
+    return statistics
+
+
+class JSONLogAggregateHandler(logging.Handler):
+  """
+    Update a JSONLogAggregate with the values logged in a JSON log, with
+    the date written in the log.
+  """
+
+  def __init__(self, aggregate):
+    logging.Handler.__init__(self)
+    self.aggregate = aggregate
+    self.setFormatter(logging.Formatter())
+
+  def emit(self, record):
+    try:
+      value = json.loads(record.data)[self.aggregate.key]
+    except (AttributeError, TypeError, ValueError, KeyError):
+      return
+    try:
+      timestamp = parse_log_time(self.formatter.formatTime(record)).timestamp()
+      self.aggregate.add(timestamp, value)
+    except Exception:
+      self.handleError(record)
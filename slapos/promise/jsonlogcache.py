@@ -0,0 +1,119 @@
+"""
+Sharing of the lines read from JSON logs between promises.
+
+Many promises of a partition read the last minutes of the same JSON log
+in each promise run. JSONLogWindowCache keeps the parsed lines of the
+windows read, in memory and in a cache folder of the partition, so that
+the log is parsed once for all of them (see
+slapos.promise.plugin.util.get_json_log_data_interval).
+"""
+
+import hashlib
+import marshal
+import os
+
+from datetime import datetime
+from slapos.promise.jsonlog import _get_json_log_entry_interval
+
+
+JSON_LOG_CACHE_FOLDER_NAME = '.slapgrid/promise/json-log-cache'
+JSON_LOG_CACHE_VERSION = 1
+
+
+class JSONLogWindowCache(object):
+  """
+    Memoized reader of the last "interval" seconds of JSON logs, so that
+    promises reading the same log during a promise run parse it once.
+
+    Windows are keyed by (path, inode, size, mtime, interval). While the
+    log is not modified, a window read earlier contains all the lines of the same
+    window read now, which is obtained by filtering lines on their date.
+    A window of a larger interval is used the same way.
+
+    Windows are kept in memory, and in cache_folder if given, because
+    promises are run in separate processes. Cache files use marshal, which
+    is much faster than json for these data and can not run code. With
+    use_index, the time index of the log (see JSONLogTimeIndex) is kept in
+    cache_folder too.
+  """
+
+  def __init__(self, cache_folder=None):
+    self.cache_folder = cache_folder
+    self.cache_dict = {}
+    self.hit_count = 0
+    self.miss_count = 0
+
+  def _getCacheFile(self, json_log_file):
+    return os.path.join(
+      self.cache_folder,
+      hashlib.md5(json_log_file.encode('utf-8')).hexdigest() + '.cache')
+
+  def _load(self, json_log_file, stat):
+    cache = self.cache_dict.get(json_log_file)
+    if cache is None and self.cache_folder:
+      try:
+        with open(self._getCacheFile(json_log_file), 'rb') as f:
+          cache = marshal.loads(f.read())
+      except (OSError, EOFError, ValueError, TypeError):
+        pass
+    key = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+    if not isinstance(cache, dict) or cache.get('version') != \
+        JSON_LOG_CACHE_VERSION or cache.get('key') != key:
+      cache = {
+        'version': JSON_LOG_CACHE_VERSION,
+        'key': key,
+        'window-list': [],
+      }
+    self.cache_dict[json_log_file] = cache
+    return cache
+
+  def _save(self, json_log_file, cache):
+    if not self.cache_folder:
+      return
+    cache_file = self._getCacheFile(json_log_file)
+    tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+    try:
+      if not os.path.isdir(self.cache_folder):
+        os.makedirs(self.cache_folder)
+      with open(tmp_file, 'wb') as f:
+        f.write(marshal.dumps(cache))
+      os.rename(tmp_file, cache_file)
+    except OSError:
+      # the cache is only an optimisation
+      pass
+
+  def getEntryList(self, json_log_file, interval, use_index=False):
+    current_time = datetime.now()
+    try:
+      stat = os.stat(json_log_file)
+    except OSError:
+      return _get_json_log_entry_interval(
+        json_log_file, interval, use_index, current_time, self.cache_folder)
+    cache = self._load(json_log_file, stat)
+    start = current_time.timestamp() - interval
+    for window in cache['window-list']:
+      if window['date'] - window['interval'] <= start:
+        self.hit_count += 1
+        return [q for q in window['entry-list'] if q[0] >= start]
+    self.miss_count += 1
+    entry_list = _get_json_log_entry_interval(
+      json_log_file, interval, use_index, current_time, self.cache_folder)
+    cache['window-list'].append({
+      'interval': interval,
+      'date': current_time.timestamp(),
+      'entry-list': entry_list,
+    })
+    self._save(json_log_file, cache)
+    return entry_list
+
+
+# Cache shared by all promises run in this process, per cache folder
+_json_log_window_cache_dict = {}
+
+def get_json_log_window_cache(cache_folder=None):
+  try:
+    return _json_log_window_cache_dict[cache_folder]
+  except KeyError:
+    cache = _json_log_window_cache_dict[cache_folder] = \
+      JSONLogWindowCache(cache_folder)
+    return cache
@@ -0,0 +1,321 @@
+"""
+Incremental reading of logs by promises.
+
+A promise counting the errors of a log in the last minutes would read
+the whole log at each run. LogCheckpoint only reads the lines added since
+its previous run, from a checkpoint kept in a state file of the partition,
+following the log when it is rotated (see slapos.promise.logrotate).
+LogMinuteCounter keeps per-minute counters of the lines read.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from slapos.gzipindex import GzipIndexError, openLog
+from slapos.promise.logrotate import iter_logrotate_file_handle
+
+
+# Number of bytes at the beginning of a log identifying it in a checkpoint
+LOG_CHECKPOINT_IDENTITY_SIZE = 4096
+
+LOG_COUNTER_FOLDER_NAME = '.slapgrid/promise/log-counter'
+LOG_COUNTER_VERSION = 1
+# Number of bytes read at the end of a log which was never scanned
+LOG_COUNTER_INITIAL_SIZE = 1024 * 1024
+# Per-minute counters are kept for this number of seconds
+LOG_COUNTER_RETENTION = 7 * 24 * 3600
+
+
+class LogCheckpoint(object):
+  """
+    Incremental reader of a log.
+
+    The state file is a checkpoint of the log (offset of the end of the
+    last complete line read, and identity of the log) and of what
+    subclasses keep from the lines (see readLine), so each update only
+    reads the lines added since the previous one, including the end of the
+    log if it was rotated (see iter_logrotate_file_handle). A log which was
+    never read is only read from its last initial_size bytes, or with all
+    its rotated logs if initial_size is None.
+
+    The log is identified by a hash of its first bytes (at most
+    LOG_CHECKPOINT_IDENTITY_SIZE, all read before the checkpoint), so it is
+    still found once rotated and compressed, when it has another inode.
+    Compressed rotated logs are only found with a gzip_index_folder, where
+    their index is kept.
+  """
+
+  version = None
+  initial_size = None
+
+  def __init__(self, log_file, state_file, gzip_index_folder=None):
+    self.log_file = log_file
+    self.state_file = state_file
+    self.gzip_index_folder = gzip_index_folder
+    self.state = None
+    # offset of the line given to readLine in the current log, or None if
+    # it is read from a rotated log
+    self.line_offset = None
+
+  def _newState(self):
+    return {
+      'version': self.version,
+      'inode': None,
+      'identity': None,
+      'identity-size': 0,
+      'offset': 0,
+    }
+
+  def load(self):
+    try:
+      with open(self.state_file) as f:
+        state = json.load(f)
+    except (OSError, ValueError):
+      state = None
+    if not isinstance(state, dict) \
+        or state.get('version') != self.version:
+      state = self._newState()
+    return state
+
+  def save(self):
+    tmp_file = '%s.%s.tmp' % (self.state_file, os.getpid())
+    try:
+      folder = os.path.dirname(self.state_file)
+      if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+      with open(tmp_file, 'w') as f:
+        json.dump(self.state, f)
+      os.rename(tmp_file, self.state_file)
+    except OSError:
+      # lines will be read again next time
+      pass
+
+  def readLine(self, line):
+    raise NotImplementedError
+
+  def resetLog(self):
+    """
+      Called before reading the current log from another position than the
+      checkpoint: first read, or new, rotated or truncated log.
+    """
+
+  def isCompleteLine(self, line):
+    """
+      Tell if the last line of the log, without newline, is complete.
+    """
+    return False
+
+  def expire(self):
+    """
+      Called after reading the new lines, before saving the state.
+    """
+
+  def _read(self, f, current=False):
+    """
+      Read the lines of f from its current position, and return the
+      offset following the last complete line. current tells if f is the
+      current log, whose line offsets are given in line_offset.
+    """
+    offset = f.tell()
+    for line in f:
+      if not (line.endswith(b'\n') or self.isCompleteLine(line)):
+        # line being written, read it next time
+        break
+      self.line_offset = offset if current else None
+      offset += len(line)
+      self.readLine(line)
+    self.line_offset = None
+    return offset
+
+  def _getIdentity(self, f, size):
+    f.seek(0)
+    return hashlib.md5(f.read(size)).hexdigest()
+
+  def _isCheckpointLog(self, f):
+    state = self.state
+    size = state['identity-size']
+    if not size:
+      # nothing was read, only the inode is known
+      return os.fstat(f.fileno()).st_ino == state['inode']
+    return self._getIdentity(f, size) == state['identity']
+
+  def _setCheckpoint(self, f, offset):
+    state = self.state
+    state['offset'] = offset
+    state['inode'] = os.fstat(f.fileno()).st_ino
+    state['identity-size'] = size = min(offset, LOG_CHECKPOINT_IDENTITY_SIZE)
+    state['identity'] = self._getIdentity(f, size)
+
+  def update(self):
+    self.state = state = self.load()
+    # logs to read from their beginning, newest first
+    new_log_list = []
+    checkpoint_log = None
+    if state['inode'] is None and self.initial_size is not None:
+      # never read, only read the end of the current log: rotated logs are
+      # not even opened, which would decompress them
+      new_log_list.append(self.log_file)
+      state['offset'] = -self.initial_size
+    else:
+      for f in iter_logrotate_file_handle(self.log_file, 'rb',
+                                          self.gzip_index_folder):
+        if self._isCheckpointLog(f):
+          if f.name != self.log_file \
+              or os.fstat(f.fileno()).st_size >= state['offset']:
+            checkpoint_log = f.name
+          else:
+            # truncated
+            new_log_list.append(f.name)
+          break
+        new_log_list.append(f.name)
+      else:
+        if self.initial_size is not None:
+          # the checkpointed log was not found, only read the end of the
+          # current one
+          new_log_list = new_log_list[:1]
+          state['offset'] = -self.initial_size
+
+    if checkpoint_log is not None:
+      with openLog(checkpoint_log, 'rb', self.gzip_index_folder) as f:
+        f.seek(state['offset'])
+        if checkpoint_log == self.log_file:
+          self._setCheckpoint(f, self._read(f, True))
+        else:
+          self._read(f)
+    for path in reversed(new_log_list):
+      try:
+        f = openLog(path, 'rb', self.gzip_index_folder)
+      except (OSError, GzipIndexError):
+        continue
+      with f:
+        if path == self.log_file:
+          if state['offset'] < 0:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size + state['offset'], 0))
+            if f.tell():
+              # skip the first partial line
+              f.readline()
+          self.resetLog()
+          self._setCheckpoint(f, self._read(f, True))
+        else:
+          self._read(f)
+
+    self.expire()
+    self.save()
+
+
+class LogMinuteCounter(LogCheckpoint):
+  """
+    Per-minute counters of the lines of a log, updated incrementally
+    (see LogCheckpoint), kept during "retention" seconds. A log which was
+    never read is only read from its last initial_size bytes
+    (LOG_COUNTER_INITIAL_SIZE by default).
+
+    If tail_size is given, the counters of the lines in the last tail_size
+    bytes of the current log are also kept (see getTailCount).
+
+    parse_line(line) returns the minute of the line (timestamp // 60) and
+    the list of the counters it increments, or None to ignore the line.
+  """
+
+  version = LOG_COUNTER_VERSION
+  initial_size = LOG_COUNTER_INITIAL_SIZE
+
+  def __init__(self, log_file, state_file, parse_line,
+               retention=LOG_COUNTER_RETENTION,
+               initial_size=LOG_COUNTER_INITIAL_SIZE, tail_size=None,
+               gzip_index_folder=None):
+    super(LogMinuteCounter, self).__init__(log_file, state_file,
+                                           gzip_index_folder)
+    self.parse_line = parse_line
+    self.retention = retention
+    self.initial_size = initial_size
+    self.tail_size = tail_size
+
+  def _newState(self):
+    state = super(LogMinuteCounter, self)._newState()
+    # minute -> {counter name: count}
+    state['counter-dict'] = {}
+    # [offset, counter name list] of the counted lines at the end of the
+    # current log
+    state['tail-list'] = []
+    return state
+
+  def readLine(self, line):
+    result = self.parse_line(line)
+    if result is None:
+      return
+    minute, name_list = result
+    minute_dict = self.state['counter-dict'].setdefault(str(minute), {})
+    for name in name_list:
+      minute_dict[name] = minute_dict.get(name, 0) + 1
+    if self.tail_size is not None and self.line_offset is not None:
+      self.state['tail-list'].append([self.line_offset, name_list])
+
+  def resetLog(self):
+    del self.state['tail-list'][:]
+
+  def _getTailList(self):
+    if self.tail_size is None:
+      return []
+    first_offset = self.state['offset'] - self.tail_size
+    return [q for q in self.state['tail-list'] if q[0] >= first_offset]
+
+  def expire(self):
+    self.state['tail-list'] = self._getTailList()
+    counter_dict = self.state['counter-dict']
+    oldest_minute = (time.time() - self.retention) // 60
+    for minute in list(counter_dict):
+      if int(minute) < oldest_minute:
+        del counter_dict[minute]
+
+  def getCount(self, name, maximum_delay=0):
+    """
+      Return the number of lines counted in name, in the minutes of the
+      last maximum_delay seconds (or during the retention if 0).
+    """
+    if maximum_delay:
+      first_minute = (time.time() - maximum_delay) // 60
+    else:
+      first_minute = float('-inf')
+    return sum(minute_dict.get(name, 0)
+               for minute, minute_dict in self.state['counter-dict'].items()
+               if int(minute) >= first_minute)
+
+  def getTailCount(self, name):
+    """
+      Return the number of lines counted in name in the last tail_size
+      bytes of the current log, whatever their date.
+    """
+    return sum(name in name_list for _, name_list in self._getTailList())
+
+
+def get_log_counter_state_file(promise, log_file):
+  """
+    Return the state file of the LogMinuteCounter of log_file for promise.
+  """
+  return os.path.join(
+    promise.getPartitionFolder(), LOG_COUNTER_FOLDER_NAME,
+    hashlib.md5(('%s\0%s' % (promise.getName(), log_file)).encode('utf-8')
+                ).hexdigest() + '.json')
+
+
+class LogMinuteParser(object):
+  """
+    Convert the date of log lines to minutes, calling strptime only once
+    per minute of the log.
+  """
+
+  def __init__(self, minute_format):
+    self.minute_format = minute_format
+    self.minute_dict = {}
+
+  def getMinute(self, minute_string):
+    try:
+      return self.minute_dict[minute_string]
+    except KeyError:
+      minute = self.minute_dict[minute_string] = int(time.mktime(
+        time.strptime(minute_string, self.minute_format)) // 60)
+      return minute
@@ -0,0 +1,60 @@
+"""
+Discovery of the rotated logs of a log, as written by logrotate.
+
+The rotated logs of XX.log are XX.log.1 (or XX.log1), XX.log.2, ... and are
+compressed by logrotate from some rank (XX.log.2.gz). Compressed rotated
+logs are read with slapos.gzipindex, their index being kept in a folder
+private to the partition of the reader (see get_gzip_index_folder).
+"""
+
+import itertools
+import os
+
+from slapos.gzipindex import GzipIndexError, openGzip
+
+
+# Index of the compressed rotated logs (see slapos.gzipindex)
+GZIP_INDEX_FOLDER_NAME = '.slapgrid/promise/gzip-index'
+
+
+def iter_logrotate_file_handle(path, mode='r', gzip_index_folder=None):
+  """
+    Yield successive file handles for rotated logs
+    (XX.log, XX.log.1, XX.log.2, ...)
+
+    Rotated logs compressed by logrotate (XX.log.2.gz) are read with their
+    index kept in gzip_index_folder (see slapos.gzipindex), so seeking in
+    them (e.g. to read them backwards) only decompresses the parts which
+    are read. They are skipped without gzip_index_folder, or if their index
+    can not be stored there.
+  """
+  for i in itertools.count():
+    f = None
+    if i:
+      path_list = path + str(i), '%s.%s' % (path, i)
+    else:
+      path_list = path,
+    for path_i in path_list:
+      try:
+        f = open(path_i, mode)
+      except OSError:
+        try:
+          if gzip_index_folder is None:
+            continue
+          f = openGzip(path_i + '.gz', mode, index_folder=gzip_index_folder,
+                       fallback=False)
+        except (OSError, GzipIndexError):
+          continue
+      break
+    if f is None:
+      break
+    with f:
+      yield f
+
+
+def get_gzip_index_folder(promise):
+  """
+    Return the folder of the index of the compressed rotated logs read by
+    promise, private to its partition.
+  """
+  return os.path.join(promise.getPartitionFolder(), GZIP_INDEX_FOLDER_NAME)
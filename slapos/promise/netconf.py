@@ -0,0 +1,87 @@
+"""
+Index of the alarms notified in netconf JSON logs.
+
+The promises checking the alarms of a radio unit read its netconf log,
+where alarms are raised and cleared. NetconfAlarmIndex keeps the latest
+notification of each alarm, updated incrementally (see
+slapos.promise.logcounter.LogCheckpoint) in a state file shared by the
+promises of the partition.
+"""
+
+import hashlib
+import json
+import os
+
+from slapos.promise.logcounter import LogCheckpoint
+from slapos.promise.logrotate import get_gzip_index_folder
+
+
+NETCONF_ALARM_FOLDER_NAME = '.slapgrid/promise/netconf-alarm'
+NETCONF_ALARM_INDEX_VERSION = 1
+
+
+class NetconfAlarmIndex(LogCheckpoint):
+  """
+    Latest alarm notification (raise or clear) of each fault id and fault
+    source of a netconf JSON log, updated incrementally (see LogCheckpoint),
+    so that the promises checking the alarms of a log share one small state
+    file instead of reading the log backwards.
+  """
+
+  version = NETCONF_ALARM_INDEX_VERSION
+
+  def _newState(self):
+    state = super(NetconfAlarmIndex, self)._newState()
+    # order of the notifications in the log
+    state['sequence'] = 0
+    # fault id -> {fault source: [sequence, alarm notification]}
+    state['alarm-dict'] = {}
+    return state
+
+  def readLine(self, line):
+    if b'"alarm-notif"' not in line:
+      return
+    try:
+      alarm_notif = json.loads(line)['data']['notification']['alarm-notif']
+      fault_id = alarm_notif['fault-id']
+    except (ValueError, KeyError, TypeError):
+      return
+    self.state['sequence'] += 1
+    self.state['alarm-dict'].setdefault(fault_id, {})[
+      alarm_notif.get('fault-source', '')] = [self.state['sequence'],
+                                              alarm_notif]
+
+  def isCompleteLine(self, line):
+    try:
+      json.loads(line)
+    except ValueError:
+      return False
+    return True
+
+  def getAlarmDict(self, fault_id):
+    """
+      Return the latest alarm notification of each source of fault_id.
+    """
+    return dict((source, alarm_notif) for source, (_, alarm_notif)
+                in self.state['alarm-dict'].get(fault_id, {}).items())
+
+  def getLatestAlarm(self, fault_id):
+    """
+      Return the latest alarm notification of fault_id, or None.
+    """
+    source_dict = self.state['alarm-dict'].get(fault_id)
+    if source_dict:
+      return max(source_dict.values(), key=lambda q: q[0])[1]
+
+
+def get_netconf_alarm_index(promise, netconf_log):
+  """
+    Return the updated NetconfAlarmIndex of netconf_log, shared by all
+    promises of the partition.
+  """
+  index = NetconfAlarmIndex(netconf_log, os.path.join(
+    promise.getPartitionFolder(), NETCONF_ALARM_FOLDER_NAME,
+    hashlib.md5(netconf_log.encode('utf-8')).hexdigest() + '.json'),
+    get_gzip_index_folder(promise))
+  index.update()
+  return index
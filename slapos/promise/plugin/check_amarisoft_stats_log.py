@@ -1,6 +1,7 @@
-import time
+import os
 
-from .util import get_json_log_latest_timestamp
+from .util import (JSON_LOG_CACHE_FOLDER_NAME, get_json_log_entry_interval,
+  get_json_log_field_statistics)
 
 from zope.interface import implementer
 from slapos.grid.promise import interface
@@ -18,9 +19,15 @@ class RunPromise(GenericPromise):
 
   def sense(self):
 
-    latest_timestamp = get_json_log_latest_timestamp(self.amarisoft_stats_log)
-    delta = time.time() - latest_timestamp
-    if delta > self.stats_period * 2:
+    # the window read by the other Amarisoft promises, shared with them
+    statistics = get_json_log_field_statistics(
+      get_json_log_entry_interval(
+        self.amarisoft_stats_log, self.stats_period * 2, use_index=True,
+        cache_folder=os.path.join(self.getPartitionFolder(),
+                                  JSON_LOG_CACHE_FOLDER_NAME),
+        shared=True),
+      {'time': None})['time']
+    if not statistics['count']:
         self.logger.error("Latest entry from amarisoft statistics log is more"\
                           "than %s seconds old" % (self.stats_period * 2,))
     else:
@@ -1,4 +1,3 @@
-from .util import get_json_log_data_interval
 from .util import JSONPromise
 
 from zope.interface import implementer
@@ -23,21 +22,20 @@ class RunPromise(JSONPromise):
         self.logger.info("skipping promise")
         return
 
-    data_list = get_json_log_data_interval(self.amarisoft_stats_log, self.stats_period * 5)
-
-    min_rxtx_delay_it = map(lambda x: float(x['rf']['rxtx_delay_min']), data_list)
-    max_rxtx_delay_it = map(lambda x: float(x['rf']['rxtx_delay_min']), data_list)
-    if not min_rxtx_delay_it:
+    statistics = self.get_shared_json_log_field_statistics(
+      self.amarisoft_stats_log, self.stats_period * 5,
+      {'rxtx_delay_min': ('rf', 'rxtx_delay_min')})['rxtx_delay_min']
+    if not statistics['count']:
         self.logger.error("No TX/RX diff data available")
+        return
+    min_rxtx_delay = statistics['min']
+    max_rxtx_delay = statistics['max']
+    if min_rxtx_delay < self.min_rxtx_delay_threshold:
+      self.logger.error("The minimum available time for radio front end processing is lower than the minimum threshold (%s ms)." % (self.min_rxtx_delay_threshold,))
+    elif max_rxtx_delay > self.max_rxtx_delay_threshold:
+      self.logger.error("The minimum available time for radio front end processing is higher than the maximum threshold (%s ms)." % (self.max_rxtx_delay_threshold,))
     else:
-      min_rxtx_delay = min(min_rxtx_delay_it)
-      max_rxtx_delay = max(max_rxtx_delay_it)
-      if min_rxtx_delay < self.min_rxtx_delay_threshold:
-        self.logger.error("The minimum available time for radio front end processing is lower than the minimum threshold (%s ms)." % (self.min_rxtx_delay_threshold,))
-      elif max_rxtx_delay > self.max_rxtx_delay_threshold:
-        self.logger.error("The minimum available time for radio front end processing is higher than the maximum threshold (%s ms)." % (self.max_rxtx_delay_threshold,))
-      else:
-        self.logger.info("The minimum available time for radio front end processing is within range (%s ms - %s ms)." % (self.min_rxtx_delay_threshold,self.max_rxtx_delay_threshold,))
+      self.logger.info("The minimum available time for radio front end processing is within range (%s ms - %s ms)." % (self.min_rxtx_delay_threshold,self.max_rxtx_delay_threshold,))
 
     self.json_logger.info("Min RX TX Delay (ms)",
       extra={'data': {'min_rxtx_delay': min_rxtx_delay}})
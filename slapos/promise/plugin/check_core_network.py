@@ -1,4 +1,3 @@
-from .util import get_json_log_data_interval
 from .util import JSONPromise
 
 import json
@@ -22,7 +21,7 @@ class RunPromise(JSONPromise):
   def sense(self):
 
     interval = self.stats_period * 2
-    data_list = get_json_log_data_interval(self.amarisoft_stats_log, interval)
+    data_list = self.get_shared_json_log_data_interval(self.amarisoft_stats_log, interval)
 
     def check_core(addr, port, proto):
       if '.' in addr:
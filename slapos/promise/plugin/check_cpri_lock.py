@@ -1,5 +1,5 @@
 import re
-from .util import JSONPromise, get_json_log_data_interval
+from .util import JSONPromise
 
 from zope.interface import implementer
 from slapos.grid.promise import interface
@@ -22,7 +22,7 @@ class RunPromise(JSONPromise):
       def error(msg): self.logger.error("%s: %s", self.sdr_devchan, msg)
       def info(msg):  self.logger.info ("%s: %s", self.sdr_devchan, msg)
 
-      data_list = get_json_log_data_interval(self.amarisoft_stats_log, self.stats_period * 2)
+      data_list = self.get_shared_json_log_data_interval(self.amarisoft_stats_log, self.stats_period * 2)
       if len(data_list) < 1:
         error("rf_info: stale data")
         return
@@ -18,6 +18,7 @@ class RunPromise(JSONPromise):
     self.max_spot_temp = float(self.getConfig('max-spot-temp', 90)) # °C
     self.max_avg_temp = float(self.getConfig('max-avg-temp', 80)) # °C
     self.avg_temp_duration = int(self.getConfig('avg-temp-duration', 600)) # secondes
+    self.aggregate_json_log('cpu_temperature', self.avg_temp_duration)
 
   def sense(self):
     success = True
@@ -51,9 +52,10 @@ class RunPromise(JSONPromise):
       t = 0
     if (time.time() - t) > avg_computation_period:
       open(self.avg_flag_file, 'w').close()
-      temp_list = self.get_json_log_data_interval(self.avg_temp_duration)
-      if temp_list:
-        avg_temp = sum(x['cpu_temperature'] for x in temp_list) / len(temp_list)
+      statistics = self.get_json_log_statistics('cpu_temperature',
+                                                self.avg_temp_duration)
+      if statistics['count']:
+        avg_temp = statistics['avg']
         if avg_temp > self.max_avg_temp:
           success = False
           self.logger.error(
@@ -2,9 +2,17 @@ from zope.interface import implementer
 from slapos.grid.promise import interface
 from slapos.grid.promise.generic import GenericPromise, TestResult
 import re
-import time
 import os
 
+from .util import (
+  LogMinuteCounter,
+  LogMinuteParser,
+  get_gzip_index_folder,
+  get_log_counter_state_file,
+)
+
+line_regex = re.compile(br"^(\[[^\]]+\]) (\[[^\]]+\]) (.*)$")
+
 @implementer(interface.IPromise)
 class RunPromise(GenericPromise):
   def __init__(self, config):
@@ -14,6 +22,33 @@ class RunPromise(GenericPromise):
     self.setPeriodicity(self.custom_frequency)
     # Skip test check on this promise
     self.setTestLess()
+    self.minute_parser = LogMinuteParser("%a %b %d %H:%M %Y")
+
+  def parseLine(self, line):
+    m = line_regex.match(line)
+    if m is None:
+      return
+    dt, level, msg = m.groups()
+    if level != b"[error]":
+      return
+    # "Sun Oct 18 17:03:07 2026" or "Sun Oct 18 17:03:07.123456 2026"
+    dt = dt[1:-1].decode('utf-8', 'replace')
+    if dt[16:17] != ':':
+      return
+    try:
+      minute = self.minute_parser.getMinute(dt[:16] + dt[-5:])
+    except ValueError:
+      # Probably a line cut on the middle
+      return
+    # Classify the types of errors
+    name_list = ['error']
+    if b"(113)No route to host" in msg:
+      name_list.append('noroute')
+    elif b"(101)Network is unreachable" in msg:
+      name_list.append('unreachable')
+    elif b"(110)Connection timed out" in msg:
+      name_list.append('timeout')
+    return minute, name_list
 
   def sense(self):
     """
@@ -24,55 +59,25 @@ class RunPromise(GenericPromise):
     if not log_file:
       raise ValueError("log file was not set in promise parameters.")
 
-    regex = re.compile(br"^(\[[^\]]+\]) (\[[^\]]+\]) (.*)$")
-    error_amount = 0
-    no_route_error = 0
-    network_is_unreachable = 0
-    timeout = 0
-    parsing_failure = 0
-
     if not os.path.exists(log_file):
       # file don't exist, nothing to check
       self.logger.info("OK")
       return
 
-    with open(log_file, "rb") as f:
-      f.seek(0, 2)
-      block_end_byte = f.tell()
-      f.seek(-min(block_end_byte, 4096), 1)
-      data = f.read()
-      for line in reversed(data.splitlines()):
-        m = regex.match(line)
-        if m is None:
-          continue
-        dt, level, msg = m.groups()
-        try:
-          try:
-            t = time.strptime(dt[1:-1].decode('utf-8'), "%a %b %d %H:%M:%S %Y")
-          except ValueError:
-            # Fail to parser for the first time, try a different output.
-            t = time.strptime(dt[1:-1].decode('utf-8'), "%a %b %d %H:%M:%S.%f %Y")
-        except ValueError:
-            # Probably it fail to parse
-            if parsing_failure < 3:
-              # Accept failure 2 times, as the line can be actually
-              # cut on the middle.
-              parsing_failure += 1
-              continue
-            raise
-        if maximum_delay and (time.time()-time.mktime(t)) > maximum_delay:
-          # no result in the latest hour
-          break
-        if level != b"[error]":
-          continue
-        # Classify the types of errors
-        if b"(113)No route to host" in msg:
-          no_route_error += 1
-        elif b"(101)Network is unreachable" in msg:
-          network_is_unreachable += 1
-        elif b"(110)Connection timed out" in msg:
-          timeout += 1
-        error_amount += 1
+    # only the lines added since the previous run are read
+    counter = LogMinuteCounter(
+      log_file, get_log_counter_state_file(self, log_file), self.parseLine,
+      tail_size=4096, gzip_index_folder=get_gzip_index_folder(self))
+    counter.update()
+    if maximum_delay:
+      getCount = lambda name: counter.getCount(name, maximum_delay)
+    else:
+      # errors in the last 4096 bytes of the log
+      getCount = counter.getTailCount
+    error_amount = getCount('error')
+    no_route_error = getCount('noroute')
+    network_is_unreachable = getCount('unreachable')
+    timeout = getCount('timeout')
     if error_amount:
       self.logger.error("ERROR=%s (NOROUTE=%s, UNREACHABLENET=%s, TIMEOUT=%s)" % (
         error_amount, no_route_error, network_is_unreachable, timeout))
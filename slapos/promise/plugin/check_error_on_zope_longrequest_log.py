@@ -1,12 +1,17 @@
 from zope.interface import implementer
 from slapos.grid.promise import interface
 from slapos.grid.promise.generic import GenericPromise
-import time
-
 import os
 import sys
 import re
 
+from .util import (
+  LogMinuteCounter,
+  LogMinuteParser,
+  get_gzip_index_folder,
+  get_log_counter_state_file,
+)
+
 r = re.compile(br"^([0-9]+\-[0-9]+\-[0-9]+ [0-9]+\:[0-9]+\:[0-9]+)(\,[0-9]+) - ([A-z]+) (.*)$")
 
 @implementer(interface.IPromise)
@@ -14,35 +19,38 @@ class RunPromise(GenericPromise):
   def __init__(self, config):
     super(RunPromise, self).__init__(config)
     self.setPeriodicity(float(self.getConfig('frequency', 10)))
+    self.minute_parser = LogMinuteParser("%Y-%m-%d %H:%M")
+
+  def parseLine(self, line):
+    m = r.match(line)
+    if m is None:
+      return
+    # "2026-10-18 17:03:07"
+    dt = m.group(1).decode('utf-8')
+    try:
+      return self.minute_parser.getMinute(dt[:-3]), ['longrequest']
+    except ValueError:
+      return
 
   def sense(self):
     log_file = self.getConfig('log-file')
     error_threshold = self.getConfig('error-threshold')
     maximum_delay = self.getConfig('maximum-delay')
-    error_amount = 0
     if not os.path.exists(log_file):
       # file don't exist, nothing to check
       self.logger.info("log file does not exist: log check skipped")
       return 0
-    
-    with open(log_file, "rb") as f:
-      f.seek(0, 2)
-      block_end_byte = f.tell()
-      f.seek(-min(block_end_byte, 4096*10), 1)
-      data = f.read()
-      for line in reversed(data.splitlines()):
-        m = r.match(line)
-        if m is None:
-          continue
-        dt, _, level, msg = m.groups()
-        try:
-          t = time.strptime(dt.decode('utf-8'), "%Y-%m-%d %H:%M:%S")
-        except ValueError:
-          continue
-        if maximum_delay and (time.time()-time.mktime(t)) > maximum_delay:
-          # no result in the latest hour
-          break
-        error_amount += 1
+
+    # only the lines added since the previous run are read
+    counter = LogMinuteCounter(
+      log_file, get_log_counter_state_file(self, log_file), self.parseLine,
+      tail_size=4096*10, gzip_index_folder=get_gzip_index_folder(self))
+    counter.update()
+    if maximum_delay:
+      error_amount = counter.getCount('longrequest', maximum_delay)
+    else:
+      # long requests in the last 40KB of the log
+      error_amount = counter.getTailCount('longrequest')
     if error_amount > error_threshold:
       self.logger.error('ERROR: Site has %s long request' % error_amount)
     else:
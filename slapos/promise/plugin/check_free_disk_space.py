@@ -11,21 +11,265 @@ import sqlite3
 import argparse
 import datetime
 import psutil
-import itertools
-import warnings
+import errno
+import fcntl
+import json
 import pkgutil
+import stat
+import tempfile
 
-from slapos.collect.db import Database
-from contextlib import closing
+from slapos.promise.collectordb import CollectorDatabase, ORDER_ASC, ORDER_DESC
+from contextlib import closing, contextmanager
 
-# install pandas, numpy and statsmodels for ARIMA prediction
+# install pandas and numpy for prediction
 try:
   import pandas as pd
   import numpy as np
-  from statsmodels.tsa.arima.model import ARIMA
 except ImportError:
   pass
 
+FORECAST_STATE_FILE_NAME = '.slapgrid/promise/disk-space-forecast.json'
+FORECAST_STATE_VERSION = 1
+# states of a disk not updated since this number of days are removed
+FORECAST_STATE_RETENTION = 7
+# maximum number of disks whose state is kept, the most recently updated
+FORECAST_STATE_MAX_COUNT = 16
+# minimum number of days of data to predict
+FORECAST_MIN_DAY_COUNT = 14
+# maximum order of the autoregressive model of the daily differences
+FORECAST_MAX_ORDER = 3
+# forecasts of the shared cache computed by another model are not used
+FORECAST_MODEL_VERSION = 1
+# forecast cache of each user (see SharedForecastCache), by uid
+FORECAST_CACHE_FILE_NAME = 'disk-space-forecast.%s.cache.json'
+# folder of the forecast caches shared by the partitions of the computer,
+# in the folder of the collector database, provisioned by its owner
+FORECAST_CACHE_FOLDER_NAME = 'disk-space-forecast'
+
+
+class DiskSpaceForecaster(object):
+  """
+    ARIMA(p, 1, 0) model with drift of the free disk space, one value per
+    day, fitted by conditional least squares.
+
+    The fit only needs the sums of the products of the last daily
+    differences, which are updated with each new value: the state saved
+    between runs has a fixed size and new days are added without reading
+    the history again. The order p (up to FORECAST_MAX_ORDER) with the best
+    AIC is selected when predicting, which only solves small linear systems.
+  """
+
+  def __init__(self, state=None):
+    if state is None:
+      size = FORECAST_MAX_ORDER + 2
+      state = {
+        'value-list': [],
+        'product-list': [[0.] * size for _ in range(size)],
+        'count': 0,
+      }
+    self.state = state
+
+  def update(self, value_list):
+    product = np.array(self.state['product-list'])
+    last_value_list = self.state['value-list']
+    for value in value_list:
+      last_value_list = (last_value_list + [float(value)])[
+        -(FORECAST_MAX_ORDER + 2):]
+      if len(last_value_list) == FORECAST_MAX_ORDER + 2:
+        diff = np.diff(last_value_list)
+        # 1, d(t-1), ..., d(t-FORECAST_MAX_ORDER), d(t)
+        vector = np.concatenate([[1.], diff[-2::-1], diff[-1:]])
+        product += np.outer(vector, vector)
+      self.state['count'] += 1
+    self.state['value-list'] = last_value_list
+    self.state['product-list'] = product.tolist()
+
+  def fit(self):
+    """
+      Return (coefficient array, variance of the errors) of the model with
+      the best AIC: coefficients are the drift and the autoregressive
+      coefficients of the differences.
+    """
+    product = np.array(self.state['product-list'])
+    count = product[0, 0]
+    best = None
+    for order in range(FORECAST_MAX_ORDER + 1):
+      if count <= order + 1:
+        break
+      xx = product[:order + 1, :order + 1]
+      xy = product[:order + 1, -1]
+      coefficient = np.linalg.lstsq(xx, xy, rcond=None)[0]
+      residual = max(product[-1, -1] - coefficient.dot(xy), 0.)
+      # AIC of a gaussian model, up to a constant
+      aic = count * np.log(residual / count or np.finfo(float).tiny) + \
+        2 * (order + 1)
+      if best is None or aic < best[0]:
+        best = aic, coefficient, residual / (count - order - 1)
+    if best is None:
+      raise ValueError("Not enough data")
+    return best[1:]
+
+  def forecast(self, steps):
+    """
+      Return the forecast of the next steps values and its 95% confidence
+      interval, as numpy arrays.
+    """
+    coefficient, variance = self.fit()
+    drift, ar = coefficient[0], coefficient[1:]
+    value_list = self.state['value-list']
+    # last differences, most recent first
+    diff_list = list(np.diff(value_list)[::-1])
+    mean = np.empty(steps)
+    value = value_list[-1]
+    for i in range(steps):
+      diff = drift + ar.dot(diff_list[:len(ar)])
+      diff_list.insert(0, diff)
+      value += diff
+      mean[i] = value
+    # psi weights of the integrated process, for the forecast variance
+    weight_list = [1.]
+    for j in range(1, steps):
+      weight_list.append(sum(ar[i] * weight_list[j - i - 1]
+                             for i in range(min(j, len(ar)))))
+    psi = np.cumsum(weight_list)
+    margin = 1.959964 * np.sqrt(variance * np.cumsum(psi * psi))
+    return mean, mean - margin, mean + margin
+
+
+class SharedForecastCache(object):
+  """
+    Forecasts of the free space of the disks of the computer, shared by the
+    promises using the same cache folder: the first promise of the day
+    computes the forecast of a disk and the others reuse it.
+
+    Each user only writes its own cache file (readable by all, writable by
+    its owner), under a lock so that a forecast is computed only once per
+    user, and reads the cache files of the other users of the folder. The
+    folder is provisioned by the administrator of the computer for the
+    users trusting each other: the files of other users are not read if
+    it is writable by all users.
+  """
+
+  def __init__(self, folder):
+    self.folder = folder
+    self.uid = os.getuid()
+    self.cache_file = os.path.join(folder, FORECAST_CACHE_FILE_NAME % self.uid)
+
+  @staticmethod
+  def isSharedFolder(folder, owner_uid):
+    """
+      Tell if folder can be used to share forecasts: a folder (not a
+      symbolic link) owned by root or owner_uid, which this user can write
+      but not all users.
+    """
+    try:
+      folder_stat = os.lstat(folder)
+    except OSError:
+      return False
+    return stat.S_ISDIR(folder_stat.st_mode) and \
+      folder_stat.st_uid in (0, owner_uid) and \
+      not folder_stat.st_mode & stat.S_IWOTH and \
+      os.access(folder, os.W_OK)
+
+  @contextmanager
+  def lock(self):
+    if not os.path.isdir(self.folder):
+      os.makedirs(self.folder)
+    fd = os.open(self.cache_file + '.lock',
+                 os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      yield
+    finally:
+      os.close(fd)
+
+  def iterOtherForecastDict(self):
+    """
+      Iterate over the forecasts of the cache files of the other users.
+    """
+    if os.stat(self.folder).st_mode & stat.S_IWOTH:
+      # anybody could plant forecasts
+      return
+    prefix, suffix = FORECAST_CACHE_FILE_NAME.split('%s')
+    for name in os.listdir(self.folder):
+      if not (name.startswith(prefix) and name.endswith(suffix)):
+        continue
+      uid = name[len(prefix):-len(suffix)]
+      path = os.path.join(self.folder, name)
+      try:
+        # only trust files owned by the user of their name
+        if uid == str(self.uid) or os.stat(path).st_uid != int(uid):
+          continue
+        with open(path) as f:
+          cache = json.load(f)
+        if cache.get('version') == FORECAST_STATE_VERSION:
+          yield cache['forecast-dict']
+      except (IOError, OSError, ValueError, KeyError):
+        continue
+
+  def load(self):
+    try:
+      with open(self.cache_file) as f:
+        cache = json.load(f)
+      if cache.get('version') == FORECAST_STATE_VERSION:
+        return cache
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise
+    except ValueError:
+      pass
+    return {
+      'version': FORECAST_STATE_VERSION,
+      'forecast-dict': {},
+      'hit-count': 0,
+      'fit-count': 0,
+    }
+
+  def save(self, cache):
+    # the folder may be shared: the temporary file must be new
+    fd, tmp_file = tempfile.mkstemp(
+      prefix=os.path.basename(self.cache_file) + '.', dir=self.folder)
+    try:
+      with os.fdopen(fd, 'w') as f:
+        os.fchmod(f.fileno(), 0o644)
+        json.dump(cache, f)
+      os.rename(tmp_file, self.cache_file)
+    except BaseException:
+      os.remove(tmp_file)
+      raise
+
+  def getForecast(self, device, date, steps, compute):
+    """
+      Return (forecast dict, cache) for the device and the day, from the
+      cache or computed by compute(steps), which returns a forecast dict
+      or None.
+    """
+    key = '%s %s %s' % (device, date, FORECAST_MODEL_VERSION)
+    with self.lock():
+      cache = self.load()
+      forecast = cache['forecast-dict'].get(key)
+      if forecast is None or len(forecast['mean']) < steps:
+        for forecast_dict in self.iterOtherForecastDict():
+          forecast = forecast_dict.get(key)
+          if forecast is not None and len(forecast['mean']) >= steps:
+            break
+      if forecast is not None and len(forecast['mean']) >= steps:
+        cache['hit-count'] += 1
+      else:
+        forecast = compute(steps)
+        if forecast is None:
+          return None, cache
+        cache['fit-count'] += 1
+        forecast['date'] = date
+        # forecasts of the previous days are not used anymore
+        cache['forecast-dict'] = dict(
+          (k, v) for k, v in cache['forecast-dict'].items()
+          if v['date'] == date)
+        cache['forecast-dict'][key] = forecast
+      self.save(cache)
+    return forecast, cache
+
+
 @implementer(interface.IPromise)
 class RunPromise(GenericPromise):
 
@@ -34,16 +278,21 @@ class RunPromise(GenericPromise):
     # check disk space at least every hours (heavy in computation)
     self.setPeriodicity(float(self.getConfig('frequency', 60)))
 
+  def getDatabase(self, database):
+    # queries are on the last minute (or day): the snapshot of the
+    # collector database is only read if it has their rows
+    return CollectorDatabase.fromPromise(self, database, timeout=10,
+                                         recent=True)
+
   def getDiskSize(self, disk_partition, database):
-    database = Database(database, create=False, timeout=10)
+    database = self.getDatabase(database)
     # by using contextlib.closing, we don't need to close the database explicitly
     with closing(database):
       try:
         # fetch disk size
         database.connect()
         where_query = "partition='%s'" % (disk_partition)
-        order = "datetime(date || ' ' || time) DESC"
-        query_result = database.select("disk", columns="free+used", where=where_query, order=order, limit=1)
+        query_result = database.select("disk", columns="free+used", where=where_query, order=ORDER_DESC, limit=1)
         result = query_result.fetchone()
         if not result or not result[0]:
           return None
@@ -59,7 +308,7 @@ class RunPromise(GenericPromise):
     return disk_size
 
   def getFreeSpace(self, disk_partition, database, date, time):
-    database = Database(database, create=False, timeout=10)
+    database = self.getDatabase(database)
     with closing(database):
       try:
         # fetch free disk space
@@ -84,18 +333,18 @@ class RunPromise(GenericPromise):
   def getBiggestPartitions(self, database, date, time):
     # displays the 3 biggest partitions thanks to disk usage
     limit = 3
-    database = Database(database, create=False, timeout=10)
+    database = self.getDatabase(database)
     with closing(database):
       try:
         database.connect()
-        date_time = date + ' ' + time
+        date_time = datetime.datetime.strptime(date + ' ' + time, "%Y-%m-%d %H:%M")
         # gets the data recorded between the current date (date_time) and 24 hours earlier
-        where_query = "datetime(date || ' ' || time) >= datetime('%s', '-1 days') AND datetime(date || ' ' || time) <= datetime('%s')"
         # gets only the most recent data for each partition
-        result = database.select(
+        result = database.selectTimeRange(
           "folder",
-          columns = "partition, disk_used*1024, max(datetime(date || ' ' || time))",
-          where =  where_query % (date_time, date_time),
+          start = date_time - datetime.timedelta(days=1),
+          end = date_time,
+          columns = "partition, disk_used*1024, max(date || ' ' || time)",
           group = "partition",
           order = "disk_used DESC",
           limit = limit).fetchall()
@@ -112,67 +361,153 @@ class RunPromise(GenericPromise):
         raise
     return result
 
+  def loadForecastState(self):
+    try:
+      with open(os.path.join(self.getPartitionFolder(),
+                             FORECAST_STATE_FILE_NAME)) as f:
+        forecast_dict = json.load(f)
+      if forecast_dict.get('version') == FORECAST_STATE_VERSION:
+        return forecast_dict
+    except (IOError, OSError, ValueError):
+      pass
+    return {'version': FORECAST_STATE_VERSION, 'state': {}}
+
+  def saveForecastState(self, forecast_dict):
+    state_dict = forecast_dict['state']
+    if state_dict:
+      last_date = max(q['last-date'] for q in state_dict.values())
+      min_date = str(datetime.date(*map(int, last_date[:10].split('-'))) -
+        datetime.timedelta(FORECAST_STATE_RETENTION))
+      key_list = sorted(state_dict, key=lambda q: state_dict[q]['last-date'],
+                        reverse=True)
+      for i, key in enumerate(key_list):
+        if i >= FORECAST_STATE_MAX_COUNT or \
+            state_dict[key]['last-date'] < min_date:
+          del state_dict[key]
+    state_file = os.path.join(self.getPartitionFolder(),
+                              FORECAST_STATE_FILE_NAME)
+    try:
+      if not os.path.isdir(os.path.dirname(state_file)):
+        os.makedirs(os.path.dirname(state_file))
+      with open(state_file + '.tmp', 'w') as f:
+        json.dump(forecast_dict, f)
+      os.rename(state_file + '.tmp', state_file)
+    except (IOError, OSError) as e:
+      # the model is fitted again from the whole history next time
+      self.logger.debug("Forecast state is not saved: %s", e)
+
   def diskSpacePrediction(self, disk_partition, database, date, time, day_range):
     """
     Returns an estimation of free disk space left depending on
     the day_range parameter.
 
-    It uses Arima in order to predict data thanks to the 15 days before.
+    The forecast is computed once a day and kept in a cache (see
+    SharedForecastCache and getForecastCacheFolder). The cache is not used
+    if its folder is not writable. Its number of hits (forecasts reused) and
+    fits (forecasts computed) are reported in the promise result.
+    """
+    # set the days to be predicted
+    max_date_predicted = day_range+1
+    compute = lambda steps: self.computeDiskSpacePrediction(
+      disk_partition, database, time, steps)
+    cache_folder = self.getForecastCacheFolder(database)
+    try:
+      forecast, cache = SharedForecastCache(cache_folder).getForecast(
+        disk_partition, date, max_date_predicted, compute)
+    except (IOError, OSError) as e:
+      self.logger.debug("Forecast cache is not available: %s", e)
+      forecast = compute(max_date_predicted)
+    else:
+      self.logger.info("Forecast cache: %s hits, %s fits.",
+        cache['hit-count'], cache['fit-count'])
+    if forecast is None:
+      return None
+    fcast = pd.Series(forecast['mean'][:max_date_predicted],
+      index=pd.period_range(forecast['first-day'],
+        periods=max_date_predicted, freq='D'))
+    # get results with 95% confidence
+    return (fcast, np.array(forecast['lower'][:max_date_predicted]),
+            np.array(forecast['upper'][:max_date_predicted]))
+
+  def getForecastCacheFolder(self, database):
+    """
+    Returns the folder of the forecast cache:
+
+    - the forecast-cache-folder option, if set,
+    - otherwise the disk-space-forecast folder of the collector database
+      folder, shared by the partitions of the computer, if it was
+      provisioned by the owner of the collector database folder (or root),
+      e.g. with the group of the partition users and the mode 1770,
+    - otherwise a folder of the partition, so that forecasts are not shared.
+    """
+    cache_folder = self.getConfig('forecast-cache-folder')
+    if cache_folder:
+      return cache_folder
+    if database.endswith("collector.db"):
+      database = os.path.dirname(database)
+    cache_folder = os.path.join(database, FORECAST_CACHE_FOLDER_NAME)
+    try:
+      owner_uid = os.stat(database).st_uid
+    except OSError:
+      owner_uid = None
+    if owner_uid is not None and \
+        SharedForecastCache.isSharedFolder(cache_folder, owner_uid):
+      return cache_folder
+    return os.path.dirname(os.path.join(self.getPartitionFolder(),
+                                        FORECAST_STATE_FILE_NAME))
+
+  def computeDiskSpacePrediction(self, disk_partition, database, time, steps):
+    """
+    Returns the forecast of the free disk space for the next steps days.
+
+    It uses an ARIMA model on one data per day, at the same time (see
+    DiskSpaceForecaster). The state of the model of each disk is kept
+    between runs, with the time of the day of its data (the time of the
+    run which created it), and only updated with the days added since.
     """
-    database = Database(database, create=False, timeout=10)
+    database = self.getDatabase(database)
     with closing(database):
       try:
         database.connect()
+        forecast_dict = self.loadForecastState()
+        state = forecast_dict['state'].get(disk_partition)
+        if state is not None:
+          time = state['time']
         # get one data per day, where each data is at the same time
         where_query = "time between '%s:00' and '%s:30' and partition='%s'" % (
           time, time, disk_partition)
-        result = database.select(
+        result = database.selectTimeRange(
           "disk",
+          start = None if state is None else state['last-date'],
+          start_included = False,
           columns = "free, datetime(date || ' ' || time)",
           where = where_query,
-          order = "datetime(date || ' ' || time) ASC").fetchall()
+          order = ORDER_ASC).fetchall()
+        forecaster = DiskSpaceForecaster(state)
         # checks that there are at least 14 days of data
-        if (not result) or (len(result) < 14):
+        if forecaster.state['count'] + len(result) < FORECAST_MIN_DAY_COUNT:
           self.logger.info("No or not enough results from collector database in table disk: no prediction")
           return None
-        # put the list in pandas dataframe format and set the right types
-        data = np.array(result,
-                dtype=[('free', 'float'), ('date', 'datetime64[s]')])
-        df = pd.DataFrame.from_records(data)
-        df.loc[:,'date'] = pd.to_datetime(df.date)
-        df = df.set_index('date')
-        df.index = pd.DatetimeIndex(df.index).to_period('D')
-        # find the best configuration by trying different combinations
-        p_values = d_values = q_values = range(0, 3)
-        # We were using a function called evaluateModels() to select the
-        # best ARIMA (p, d, q) order, but it evaluates 27 combinations,
-        # each taking about 1–2 seconds, which exceeds the 20s limit for a promise.
-        # And also in statsmodels 0.11.1, _check_estimable would skip combinations
-        # with insufficient degrees of freedom.
-        # but in 0.14.4, all 27 combinations are evaluated, resulting in excessive runtime.
-        # To save time, we simply use the order (1, 1, 0).
-        # XXX: Now we are using the hardcoded order, need to find a better way in future.
-        best_cfg = (1, 1, 0)
-        # set the days to be predicted
-        max_date_predicted = day_range+1
+        if result:
+          forecaster.update([q[0] for q in result])
+          forecaster.state['last-date'] = result[-1][1]
+          forecaster.state['time'] = time
+          forecast_dict['state'][disk_partition] = forecaster.state
+          self.saveForecastState(forecast_dict)
         try:
-          # disabling warnings during the ARIMA calculation
-          model_arima = ARIMA(df, order=best_cfg, trend="t")
-          model_arima_fit = model_arima.fit()
-          # save ARIMA predictions
-          fcast_result  = model_arima_fit.get_forecast(steps=max_date_predicted)
-          fcast = fcast_result.predicted_mean
-          conf = fcast_result.conf_int(alpha=0.05).to_numpy()
-          if fcast.empty:
-            self.logger.info("Arima prediction: none. Skipped prediction")
-            return None
+          mean, lower_series, upper_series = forecaster.forecast(steps)
+          if not np.isfinite(mean).all():
+            raise ValueError("Invalid prediction")
         except Exception:
           self.logger.info("Arima prediction error: skipped prediction")
           return None
-        # get results with 95% confidence
-        lower_series = conf[:, 0]
-        upper_series = conf[:, 1]
-        return fcast, lower_series, upper_series
+        return {
+          'first-day': str(
+            pd.Period(forecaster.state['last-date'][:10], freq='D') + 1),
+          'mean': mean.tolist(),
+          'lower': lower_series.tolist(),
+          'upper': upper_series.tolist(),
+        }
       except sqlite3.OperationalError as e:
         # if database is still locked after timeout expiration (another process is using it)
         # we print warning message and try the promise at next run until max warn count
@@ -297,9 +632,8 @@ class RunPromise(GenericPromise):
         # check that the libraries are installed from the slapos.toolbox extra requires
         pandas_found = pkgutil.find_loader("pandas")
         numpy_found = pkgutil.find_loader("numpy")
-        statsmodels_found = pkgutil.find_loader("statsmodels")
-        if pandas_found is None or numpy_found is None or statsmodels_found is None:
-          self.logger.warning("Trying to use statsmodels and pandas " \
+        if pandas_found is None or numpy_found is None:
+          self.logger.warning("Trying to use numpy and pandas " \
             "but at least one module is not installed. Prediction skipped.")
           return
         nb_days_predicted = int(self.getConfig('nb-days-predicted', 10) or 10)
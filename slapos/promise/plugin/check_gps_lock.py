@@ -1,4 +1,4 @@
-from .util import JSONPromise, get_json_log_data_interval
+from .util import JSONPromise
 
 from zope.interface import implementer
 from slapos.grid.promise import interface
@@ -14,7 +14,7 @@ class RunPromise(JSONPromise):
 
   def sense(self):
 
-      data_list = get_json_log_data_interval(self.amarisoft_stats_log, self.stats_period * 2)
+      data_list = self.get_shared_json_log_data_interval(self.amarisoft_stats_log, self.stats_period * 2)
       if len(data_list) < 1:
         self.logger.error("rf_info: stale data")
         return
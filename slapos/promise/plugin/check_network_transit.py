@@ -20,6 +20,7 @@ class RunPromise(JSONPromise):
     self.max_data_amount = float(self.getConfig('max-data-amount', 10e3))*1048576 #  MB converted into bytes
     self.min_data_amount = float(self.getConfig('min-data-amount', 0.1))*1048576 #  MB converted into bytes
     self.transit_period = int(self.getConfig('transit-period', 600)) # secondes
+    self.aggregate_json_log('network_data_amount', self.transit_period)
 
   def sense(self):
     promise_success = True    
@@ -39,13 +40,14 @@ class RunPromise(JSONPromise):
     # can be heavy in computation
     if (time.time() - t) > self.transit_period / 4:
       open(self.last_transit_file, 'w').close()
-      temp_list = self.get_json_log_data_interval(self.transit_period)
-      if temp_list:
+      statistics = self.get_json_log_statistics('network_data_amount',
+                                                self.transit_period)
+      if statistics['count']:
         # If no previous data in log
-        if len(temp_list) == 1:
+        if statistics['count'] == 1:
           pass
         else:
-          data_diff = temp_list[0]['network_data_amount'] - temp_list[-1]['network_data_amount']
+          data_diff = statistics['last'] - statistics['first']
           if data_diff <= self.min_data_amount:
             self.logger.error("Network congested, data amount over the last %s seconds "\
               "reached minimum threshold: %7s (threshold is %7s)" 
@@ -1,11 +1,4 @@
-import errno
-import json
-import logging
-import os
-
-from dateutil import parser
-from .util import iter_logrotate_file_handle
-from .util import iter_reverse_lines
+from .util import get_netconf_alarm_index
 from .util import JSONPromise
 
 from zope.interface import implementer
@@ -27,18 +20,16 @@ class RunPromise(JSONPromise):
         self.logger.info("skipping promise")
         return
 
-    for f in iter_logrotate_file_handle(self.netconf_log, 'rb'):
-      for line in iter_reverse_lines(f):
-        l = json.loads(line)
-        alarm_notif = l.get('data', {}).get('notification', {}).get('alarm-notif', None)
-        if alarm_notif and alarm_notif['fault-id'] == '27':
-          if alarm_notif['is-cleared'] == 'false':
-            affected_objects = alarm_notif.get('affected-objects', {})
-            self.logger.error('PA Over Output Power Alarm is on, affected objects are: %s', affected_objects)
-            self.json_logger.info("Affected objects", extra={'data': affected_objects})
-        else:
-            self.logger.info('PA Over Output Power Alarm is off')
-        return
+    alarm_notif = get_netconf_alarm_index(
+      self, self.netconf_log).getLatestAlarm('27')
+    if alarm_notif:
+      if alarm_notif['is-cleared'] == 'false':
+        affected_objects = alarm_notif.get('affected-objects', {})
+        self.logger.error('PA Over Output Power Alarm is on, affected objects are: %s', affected_objects)
+        self.json_logger.info("Affected objects", extra={'data': affected_objects})
+      else:
+        self.logger.info('PA Over Output Power Alarm is off')
+      return
     self.logger.info('No PA Over Output Power Alarm received')
 
   def test(self):
@@ -20,6 +20,7 @@ class RunPromise(JSONPromise):
     self.min_threshold_ram = float(self.getConfig('min-threshold-ram', 500))*1048576 #  MB converted into bytes
     self.min_avg_ram = float(self.getConfig('min-avg-ram', 1e3))*1048576 #  MB converted into bytes
     self.avg_ram_period =  int(self.getConfig('avg-ram-period', 600)) # secondes
+    self.aggregate_json_log('available_ram', self.avg_ram_period)
 
   def sense(self):
     promise_success = True
@@ -43,9 +44,10 @@ class RunPromise(JSONPromise):
     # Get last available RAM from log file since avg_ram_period / 4
     if (time.time() - t) > self.avg_ram_period / 4:
       open(self.last_avg_ram_file, 'w').close()
-      temp_list = self.get_json_log_data_interval(self.avg_ram_period)
-      if temp_list:
-        avg_ram = sum(map(lambda x: x['available_ram'], temp_list)) / len(temp_list)
+      statistics = self.get_json_log_statistics('available_ram',
+                                                self.avg_ram_period)
+      if statistics['count']:
+        avg_ram = statistics['avg']
         if avg_ram < self.min_avg_ram:
           self.logger.error("Average RAM usage over the last %s seconds "\
             "reached threshold: %7s (threshold is %7s)" 
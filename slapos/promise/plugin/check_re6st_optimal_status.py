@@ -3,7 +3,7 @@ from slapos.grid.promise import interface
 from slapos.grid.promise.generic import GenericPromise, TestResult
 import re
 import time
-from slapos.networkbench.ping import ping, ping6
+from slapos.networkbench.ping import pingMany
 
 @implementer(interface.IPromise)
 class RunPromise(GenericPromise):
@@ -28,8 +28,8 @@ class RunPromise(GenericPromise):
     if not ipv6:
       raise ValueError("'ipv6' was not set in promise parameters.")
 
-    result_ipv4 = ping(ipv4, count=count)
-    result_ipv6 = ping6(ipv6, count=count)
+    # both gateways are pinged at the same time
+    result_ipv4, result_ipv6 = pingMany([(ipv4, '4'), (ipv6, '6')], count=count)
     # push into to the log file
     self.logger.info("%s host=%s code=%s, result=%s, packet_lost_ratio=%s msg=%s" % result_ipv4)
     self.logger.info("%s host=%s code=%s, result=%s, packet_lost_ratio=%s msg=%s" % result_ipv6)
@@ -1,4 +1,3 @@
-from .util import get_json_log_data_interval
 from .util import JSONPromise
 
 import json
@@ -20,19 +19,14 @@ class RunPromise(JSONPromise):
 
   def sense(self):
 
-    data_list = get_json_log_data_interval(self.amarisoft_stats_log, self.stats_period * 2)
+    statistics_dict = self.get_shared_json_log_field_statistics(
+      self.amarisoft_stats_log, self.stats_period * 2,
+      dict((i, ('samples', 'rx', i, 'max')) for i in self.rx_chan_list))
 
     max_rx_list = []
-    saturated = False
-
-    for rx_antenna_list in map(lambda x: x['samples']['rx'], data_list):
-        rx_list = map(lambda x: float(x['max']), [rx_antenna_list[i] for i in self.rx_chan_list])
-        if not max_rx_list:
-          max_rx_list = list(rx_list)
-        for i, rx in enumerate(rx_list):
-            max_rx_list[i] = max(max_rx_list[i], rx)
-            if rx >= self.max_rx_sample_db:
-                saturated = True
+    if all(statistics['count'] for statistics in statistics_dict.values()):
+        max_rx_list = [statistics_dict[i]['max'] for i in self.rx_chan_list]
+    saturated = any(rx >= self.max_rx_sample_db for rx in max_rx_list)
 
     self.json_logger.info("RX maximum sample values (dB)", extra={'data': max_rx_list})
 
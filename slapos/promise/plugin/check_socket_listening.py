@@ -4,6 +4,8 @@ from slapos.grid.promise.generic import GenericPromise
 
 import socket
 
+from slapos.promise.sockdiag import getListeningAddressList
+
 ADDRESS_USAGE = (
   "Address must be specified in 1 of the following 3 forms:"
   " (host, port), path or abstract")
@@ -39,6 +41,18 @@ class RunPromise(GenericPromise):
       family = socket.AF_UNIX
       addr = path or '\0' + abstract
 
+    if family != socket.AF_UNIX:
+      # look up the listening socket without connecting to it, the
+      # connection is only tried if no socket listens on this exact address
+      # (e.g. for a socket listening on all addresses)
+      try:
+        listening = getListeningAddressList([addr[:2]])
+      except (socket.error, ValueError):
+        listening = None
+      if listening:
+        self.logger.info("socket listening OK %r", addr)
+        return
+
     s = socket.socket(family, socket.SOCK_STREAM)
     try:
       s.connect(addr)
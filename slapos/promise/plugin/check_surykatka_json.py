@@ -4,12 +4,159 @@ from slapos.grid.promise.generic import GenericPromise
 
 import datetime
 import email.utils
+import fcntl
+import hashlib
 import json
 import os
+import sqlite3
 import time
 from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import pathname2url
 import operator
 
+SURYKATKA_INDEX_FOLDER_NAME = '.slapgrid/promise/surykatka-index'
+SURYKATKA_INDEX_VERSION = 1
+
+# values by which the entries of each list of the surykatka JSON are found
+SURYKATKA_KEY_DICT = {
+  'bot_status': lambda entry: [''],
+  'http_query': lambda entry: [entry['url']],
+  'ssl_certificate': lambda entry: [entry['hostname']],
+  'dns_query': lambda entry: [entry['domain']],
+  'tcp_server': lambda entry: [q.strip() for q in entry['domain'].split(',')],
+  'whois': lambda entry: [entry['domain']],
+}
+
+
+class SurykatkaJSON(object):
+  """
+    Entries of the loaded surykatka JSON, found by scanning the lists.
+  """
+
+  def __init__(self, surykatka_json):
+    self.surykatka_json = surykatka_json
+
+  def __contains__(self, key):
+    return key in self.surykatka_json
+
+  def getEntryList(self, key, value_list):
+    get_value_list = SURYKATKA_KEY_DICT[key]
+    return [q for q in self.surykatka_json[key]
+            if not set(get_value_list(q)).isdisjoint(value_list)]
+
+  def close(self):
+    pass
+
+
+class SurykatkaIndex(object):
+  """
+    SQLite index of the entries of the surykatka JSON, by the values of
+    SURYKATKA_KEY_DICT (URL, hostname and domain).
+
+    A frontend runs hundreds of promises on the same JSON: the index is
+    built by the first promise run after each update of the JSON, the
+    others only read the entries they check instead of loading the whole
+    file.
+  """
+
+  def __init__(self, index_file, json_file):
+    self.index_file = index_file
+    self.json_file = json_file
+    self.connection = None
+
+  @staticmethod
+  def getFileKey(stat):
+    return '%s %s %s %s' % (SURYKATKA_INDEX_VERSION,
+      stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+  def open(self):
+    """
+      Connect to the index and return whether it is up to date.
+    """
+    try:
+      connection = sqlite3.connect(
+        'file:%s?mode=ro' % pathname2url(self.index_file), uri=True)
+    except sqlite3.OperationalError:
+      # not built yet
+      return False
+    try:
+      key, = connection.execute(
+        "SELECT value FROM meta WHERE name = 'key'").fetchone()
+      if key == self.getFileKey(os.stat(self.json_file)):
+        self.connection = connection
+        return True
+    except (sqlite3.Error, TypeError):
+      # broken index, it is built again
+      pass
+    connection.close()
+    return False
+
+  def build(self):
+    with open(self.json_file) as fh:
+      surykatka_json = json.load(fh)
+      # stat after reading, so that a JSON updated meanwhile is indexed again
+      key = self.getFileKey(os.fstat(fh.fileno()))
+    tmp_file = '%s.%s.tmp' % (self.index_file, os.getpid())
+    connection = sqlite3.connect(tmp_file)
+    try:
+      connection.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+      connection.execute("CREATE TABLE section (name TEXT PRIMARY KEY)")
+      connection.execute("CREATE TABLE entry (section TEXT, value TEXT,"
+                         " position INTEGER, data TEXT)")
+      connection.executemany("INSERT INTO section VALUES (?)",
+                             [(q,) for q in surykatka_json])
+      for section, get_value_list in SURYKATKA_KEY_DICT.items():
+        for position, entry in enumerate(surykatka_json.get(section, ())):
+          data = json.dumps(entry)
+          connection.executemany(
+            "INSERT INTO entry VALUES (?, ?, ?, ?)",
+            [(section, q, position, data) for q in set(get_value_list(entry))])
+      connection.execute(
+        "CREATE INDEX entry_section_value ON entry (section, value)")
+      connection.execute("INSERT INTO meta VALUES ('key', ?)", (key,))
+      connection.commit()
+    finally:
+      connection.close()
+    try:
+      os.rename(tmp_file, self.index_file)
+    except OSError:
+      os.remove(tmp_file)
+      raise
+
+  def load(self):
+    """
+      Open the index, built again if the JSON was updated, and return
+      whether it can be used.
+    """
+    if self.open():
+      return True
+    folder = os.path.dirname(self.index_file)
+    if not os.path.isdir(folder):
+      os.makedirs(folder)
+    with open(self.index_file + '.lock', 'a') as lock:
+      # wait for the promise building the index instead of loading the JSON
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      if self.open():
+        return True
+      self.build()
+    return self.open()
+
+  def __contains__(self, key):
+    return self.connection.execute(
+      "SELECT 1 FROM section WHERE name = ?", (key,)).fetchone() is not None
+
+  def getEntryList(self, key, value_list):
+    value_list = list(value_list)
+    return [json.loads(q[1]) for q in self.connection.execute(
+      "SELECT DISTINCT position, data FROM entry"
+      " WHERE section = ? AND value IN (%s) ORDER BY position" % (
+        ', '.join('?' * len(value_list))), [key] + value_list)]
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
+
 
 @implementer(interface.IPromise)
 class RunPromise(GenericPromise):
@@ -65,7 +212,7 @@ class RunPromise(GenericPromise):
     if key not in self.surykatka_json:
       self.appendError("%r not in %r" % (key, self.json_file))
       return
-    bot_status_list = self.surykatka_json[key]
+    bot_status_list = self.surykatka_json.getEntryList(key, [''])
     if len(bot_status_list) == 0:
       self.appendError("%r empty in %r" % (key, self.json_file))
       return
@@ -117,8 +264,7 @@ class RunPromise(GenericPromise):
       self.appendError("%r not in %r" % (key, self.json_file))
       return
 
-    entry_list = [
-      q for q in self.surykatka_json[key] if q['hostname'] == hostname]
+    entry_list = self.surykatka_json.getEntryList(key, [hostname])
     if len(entry_list) == 0:
       self.appendError('No data')
       for check_name, check_method in [
@@ -160,7 +306,7 @@ class RunPromise(GenericPromise):
     status_code = self.getConfig('status-code')
     http_header_dict = json.loads(self.getConfig('http-header-dict', '{}'))
 
-    entry_list = [q for q in self.surykatka_json[key] if q['url'] == url]
+    entry_list = self.surykatka_json.getEntryList(key, [url])
     if len(entry_list) == 0:
       self.appendError('No data')
       for check_name, check_method in [
@@ -213,8 +359,8 @@ class RunPromise(GenericPromise):
     ip_set = set(self.getConfig('ip-list', '').split())
 
     entry_dict = {}
-    for q in self.surykatka_json[key]:
-      if q['domain'] == hostname and q['rdtype'] in ('A', 'AAAA'):
+    for q in self.surykatka_json.getEntryList(key, [hostname]):
+      if q['rdtype'] in ('A', 'AAAA'):
         if not q['resolver_ip'] in entry_dict:
           entry_dict[q['resolver_ip']] = {
             'domain': q['domain'],
@@ -270,9 +416,8 @@ class RunPromise(GenericPromise):
       return
 
     entry_list = [
-      q for q in self.surykatka_json[key]
-      if hostname in [
-        r.strip() for r in q['domain'].split(',')] and q['port'] == port]
+      q for q in self.surykatka_json.getEntryList(key, [hostname])
+      if q['port'] == port]
     if len(entry_list) == 0:
       self.appendError('No data')
       for check_name, check_method in [
@@ -321,16 +466,10 @@ class RunPromise(GenericPromise):
       self.appendError("%r not in %r" % (key, self.json_file))
       return
 
-    def checkHostnameDomain(hostname, domain):
-      if hostname == domain:
-        return True
-      elif hostname.endswith('.' + domain):
-        return True
-      return False
-
-    entry_list = [
-      q for q in self.surykatka_json[key]
-      if checkHostnameDomain(hostname, q['domain'])]
+    # the domain is the hostname or one of its parent domains
+    domain_list = [hostname] + [
+      hostname[i + 1:] for i, c in enumerate(hostname) if c == '.']
+    entry_list = self.surykatka_json.getEntryList(key, domain_list)
     if len(entry_list) == 0:
       self.appendError('No data')
       return
@@ -368,8 +507,7 @@ class RunPromise(GenericPromise):
     url = self.getConfig('url')
     maximum_elapsed_time = self.getConfig('maximum-elapsed-time')
 
-    entry_list = [
-      q for q in self.surykatka_json[surykatka_key] if q['url'] == url]
+    entry_list = self.surykatka_json.getEntryList(surykatka_key, [url])
     if len(entry_list) == 0:
       self.appendError('No data')
       for check_name, check_method in [
@@ -403,6 +541,23 @@ class RunPromise(GenericPromise):
     else:
       self.appendOk("No check configured")
 
+  def loadSurykatkaJSON(self):
+    """
+      Return the entries of the JSON file, from its index if it can be used.
+    """
+    index_file = os.path.join(
+      self.getPartitionFolder(), SURYKATKA_INDEX_FOLDER_NAME, '%s.db' % (
+        hashlib.md5(os.path.abspath(self.json_file).encode()).hexdigest(),))
+    index = SurykatkaIndex(index_file, self.json_file)
+    try:
+      if index.load():
+        return index
+    except Exception:
+      # the JSON is loaded and checked below
+      index.close()
+    with open(self.json_file) as fh:
+      return SurykatkaJSON(json.load(fh))
+
   def sense(self):
     """
       Sense various information about the given url
@@ -413,13 +568,13 @@ class RunPromise(GenericPromise):
     if not os.path.exists(self.json_file):
       self.appendError('File %r does not exists' % self.json_file)
     else:
-      with open(self.json_file) as fh:
+      try:
+        self.surykatka_json = self.loadSurykatkaJSON()
+      except Exception:
+        self.appendError(
+          "loading JSON from %r" % self.json_file)
+      else:
         try:
-          self.surykatka_json = json.load(fh)
-        except Exception:
-          self.appendError(
-            "loading JSON from %r" % self.json_file)
-        else:
           report = self.getConfig('report')
           if report == 'bot_status':
             self.senseBotStatus()
@@ -437,6 +592,8 @@ class RunPromise(GenericPromise):
           else:
             self.appendError(
               "Report %r is not supported" % report)
+        finally:
+          self.surykatka_json.close()
     self.emitLog()
 
   def anomaly(self):
@@ -22,9 +22,37 @@ try:
 except ImportError:
   pass
 
-from slapos.collect.db import Database
+from slapos.promise.collectordb import CollectorDatabase, ORDER_ASC, ORDER_DESC
 from contextlib import closing
 
+SERIES_CACHE_FOLDER_NAME = '.slapgrid/promise/partition-space'
+SERIES_CACHE_VERSION = 1
+
+def getRollingMedianMAD(values, window, start=0, chunk_size=1024):
+  """
+    Return the rolling median and median absolute deviation of values on
+    window samples, for the windows ending at start and after. Windows
+    which are incomplete or contain NaN give NaN, like pandas
+    rolling(window).median() and rolling(window).apply(mad).
+  """
+  values = np.asarray(values, dtype=float)
+  median = np.full(len(values) - start, np.nan)
+  mad = np.full(len(values) - start, np.nan)
+  offset = max(start, window - 1)
+  if offset >= len(values):
+    return median, mad
+  window_array = np.lib.stride_tricks.sliding_window_view(
+    values[offset - window + 1:], window)
+  # windows are processed by chunks to bound memory usage
+  for i in range(0, len(window_array), chunk_size):
+    chunk = window_array[i:i + chunk_size]
+    chunk_median = np.median(chunk, axis=1)
+    position = offset - start + i
+    median[position:position + len(chunk)] = chunk_median
+    mad[position:position + len(chunk)] = np.median(
+      np.fabs(chunk - chunk_median[:, None]), axis=1)
+  return median, mad
+
 @implementer(interface.IPromise)
 class RunPromise(GenericPromise):
 
@@ -34,18 +62,17 @@ class RunPromise(GenericPromise):
     self.setPeriodicity(float(self.getConfig('frequency', 60)))
 
   def getDiskSize(self, disk_partition, db_path):
-    database = Database(db_path, create=False, timeout=10)
+    database = CollectorDatabase.fromPromise(self, db_path, timeout=10)
     # by using contextlib.closing, we don't need to close the database explicitly
     with closing(database):
       try:
         database.connect()
         where_query = "partition='%s'" % (disk_partition)
-        order = "datetime(date || ' ' || time) DESC"
         result = database.select(
           "disk",
           columns="free+used",
           where=where_query,
-          order=order,
+          order=ORDER_DESC,
           limit=1).fetchone()
         if not result or not result[0]:
           return None
@@ -61,17 +88,16 @@ class RunPromise(GenericPromise):
     return disk_size
 
   def getPartitionSize(self, disk_partition, db_path):
-    database = Database(db_path, create=False, timeout=10)
+    database = CollectorDatabase.fromPromise(self, db_path, timeout=10)
     with closing(database):
       try:
         database.connect()
         where_query = "partition='%s'" % (disk_partition)
-        order = "datetime(date || ' ' || time) DESC"
         result = database.select(
           "folder",
           columns="disk_used*1024",
           where=where_query,
-          order=order,
+          order=ORDER_DESC,
           limit=1).fetchone()
         if not result or not result[0]:
           return None
@@ -86,23 +112,84 @@ class RunPromise(GenericPromise):
         raise
     return partition_size
 
+  def getSeriesCacheFile(self, user):
+    return os.path.join(self.getPartitionFolder(), SERIES_CACHE_FOLDER_NAME,
+                        '%s.npz' % user)
+
+  def loadSeriesCache(self, cache_file, cache_key):
+    """
+      Return the resampled series computed by the previous run, if it was
+      computed with the same parameters and data.
+    """
+    try:
+      with np.load(cache_file, allow_pickle=False) as f:
+        cache = dict(f)
+    except Exception:
+      # missing or broken cache, everything is computed again
+      return None
+    if cache.get('version') != SERIES_CACHE_VERSION or \
+        cache['key'].tolist() != cache_key or not len(cache['date']):
+      return None
+    return cache
+
+  def saveSeriesCache(self, cache_file, cache):
+    cache_folder = os.path.dirname(cache_file)
+    if not os.path.isdir(cache_folder):
+      os.makedirs(cache_folder)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+      np.savez(f, **cache)
+    os.rename(tmp_file, cache_file)
+
   def getAnomaly(self, disk_partition, db_path, user, date, time):
-    database = Database(db_path, create=False, timeout=10)
+    database = CollectorDatabase.fromPromise(self, db_path, timeout=10)
     with closing(database):
       try:
         disk_size = self.getDiskSize(disk_partition, db_path)
         if disk_size is None:
           return None
         database.connect()
-        result = database.select(
+        where = "partition='%s'" % (user)
+        first = database.select(
           "folder",
-          columns = "%s-disk_used*1024, disk_used*1024, datetime(date || ' ' || time)" % disk_size,
-          where =  "partition='%s'" % (user),
-          order = "date ASC, time ASC"
-        ).fetchall()
-        if not result or not result[0]:
+          columns="datetime(date || ' ' || time)",
+          where=where,
+          order=ORDER_ASC,
+          limit=1).fetchone()
+        if not first or not first[0]:
           self.logger.info("No result from collector database for the user %s: skipped", user)
           return None
+        # keep a sample every 5 minutes, set NaN when there is no information
+        freq = 5
+        # use a 1-day window
+        minutes_per_day = 60*24/freq
+        rolling_window = int(minutes_per_day*1)
+
+        # Samples are resampled and the rolling median and MAD computed
+        # only for the new data, the series of the previous runs are cached.
+        # The cache is dropped when old data is removed from the database.
+        cache_file = self.getSeriesCacheFile(user)
+        cache_key = [str(disk_size), first[0], str(freq), str(rolling_window)]
+        cache = self.loadSeriesCache(cache_file, cache_key)
+        result = None
+        if cache is not None:
+          # the last cached interval may be incomplete, it is computed again
+          since = pd.Timestamp(cache['date'][-1]).strftime("%Y-%m-%d %H:%M:%S")
+          result = database.selectTimeRange(
+            "folder",
+            start = since,
+            columns = "%s-disk_used*1024, disk_used*1024, datetime(date || ' ' || time)" % disk_size,
+            where = where,
+            order = ORDER_ASC
+          ).fetchall()
+        if not result:
+          cache = None
+          result = database.select(
+            "folder",
+            columns = "%s-disk_used*1024, disk_used*1024, datetime(date || ' ' || time)" % disk_size,
+            where = where,
+            order = ORDER_ASC
+          ).fetchall()
         datetime_now = datetime.datetime.strptime(date + ' ' + time, "%Y-%m-%d %H:%M:%S")
         # check that the last data is less than 24 hours old
         last_date = datetime.datetime.strptime(result[-1][2], "%Y-%m-%d %H:%M:%S")
@@ -110,33 +197,63 @@ class RunPromise(GenericPromise):
           self.logger.info("Not enough recent data to detect anomalies: skipped")
           return None
         # check that the first data is at least 13 days old
-        first_date = datetime.datetime.strptime(result[0][2], "%Y-%m-%d %H:%M:%S")
+        first_date = datetime.datetime.strptime(first[0], "%Y-%m-%d %H:%M:%S")
         if (datetime_now - first_date) < datetime.timedelta(days=13):
           self.logger.info("Not enough data to detect anomalies: skipped")
           return None
 
         df = pd.DataFrame(result, columns=["free", "used", "date"])
-        df.loc[:,'date'] = pd.to_datetime(df.date)
-        # keep a sample every 5 minutes, set NaN when there is no information
-        freq = 5
+        df['date'] = pd.to_datetime(df.date)
         df = df.resample(str(freq)+"min", on='date').mean()
+        df['free'] = df.free.astype(float)
+        df['used'] = df.used.astype(float)
+        start = 0
+        if cache is not None:
+          # prepend the cached intervals and fill the missing ones with NaN
+          cached_df = pd.DataFrame(
+            {'free': cache['raw_free'], 'used': cache['raw_used']},
+            index=pd.DatetimeIndex(cache['date'], name='date'))
+          cached_df = cached_df[cached_df.index < df.index[0]]
+          df = pd.concat([cached_df, df]).asfreq(str(freq)+"min")
+        raw_free = df.free.values
+        raw_used = df.used.values
         # estimate the missing information
-        df['free'] = df.free.astype(float).interpolate(method='linear')
-        df['used'] = df.used.astype(float).interpolate(method='linear')
+        df['free'] = df.free.interpolate(method='linear')
+        df['used'] = df.used.interpolate(method='linear')
+        free = df.free.values
+        median = np.full(len(free), np.nan)
+        mad = np.full(len(free), np.nan)
+        if cache is not None:
+          # keep the rolling values of the windows which did not change
+          cached_free = cache['free']
+          length = min(len(cached_free), len(free))
+          changed = ~((cached_free[:length] == free[:length]) |
+            (np.isnan(cached_free[:length]) & np.isnan(free[:length])))
+          start = int(np.argmax(changed)) if changed.any() else length
+          median[:start] = cache['median'][:start]
+          mad[:start] = cache['mad'][:start]
         # calculate the median for the element-wise absolute value
         # of the difference between each x and the median of x
+        median[start:], mad[start:] = getRollingMedianMAD(
+          free, rolling_window, start)
+        self.saveSeriesCache(cache_file, {
+          'version': SERIES_CACHE_VERSION,
+          'key': np.array(cache_key),
+          'date': df.index.values,
+          'raw_free': raw_free,
+          'raw_used': raw_used,
+          'free': free,
+          'median': median,
+          'mad': mad,
+        })
+
         df = df.reset_index()
         x = df['date']
         y = df['free']
-        mad = lambda x: np.median(np.fabs(x - np.median(x)))
         # threshold is set at 8% of the disk size by default
         threshold_ratio = float(self.getConfig('threshold-ratio', 0.08) or 0.08)
         threshold = threshold_ratio*disk_size
-        # use a 1-day window
-        minutes_per_day = 60*24/freq
-        rolling_window = int(minutes_per_day*1)
-        rolling_mad = y.rolling(window=rolling_window, center=False).median() + \
-          y.rolling(window=rolling_window, center=False).apply(mad)
+        rolling_mad = pd.Series(median + mad)
         rolling_mad_upper = rolling_mad + threshold
         rolling_mad_lower = rolling_mad - threshold
         # create Pandas DataFrame and rename columns
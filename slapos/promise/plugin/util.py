@@ -1,69 +1,141 @@
-import itertools
 import json
 import logging
 import os
 import textwrap
 
-from dateutil import parser as dateparser
 from datetime import datetime
 from slapos.grid.promise.generic import GenericPromise
+from slapos.promise.logrotate import (GZIP_INDEX_FOLDER_NAME,
+  get_gzip_index_folder, iter_logrotate_file_handle)
+from slapos.promise.jsonlog import (JSON_LOG_INDEX_STEP,
+  JSON_LOG_INDEX_VERSION, JSON_LOG_TIME_PREFIX, REVERSE_READ_BLOCK_SIZE,
+  JSONLogTimeIndex, _get_json_log_entry_interval,
+  _get_json_log_entry_interval_indexed, get_json_log_latest_timestamp,
+  get_json_log_line_time, iter_reverse_lines, parse_log_time)
+from slapos.promise.jsonlogcache import (JSON_LOG_CACHE_FOLDER_NAME,
+  JSON_LOG_CACHE_VERSION, JSONLogWindowCache, _json_log_window_cache_dict,
+  get_json_log_window_cache)
+from slapos.promise.jsonlogaggregate import (
+  JSON_LOG_AGGREGATE_BUCKET_COUNT, JSON_LOG_AGGREGATE_FOLDER_NAME,
+  JSON_LOG_AGGREGATE_VERSION, JSONLogAggregate, JSONLogAggregateHandler,
+  get_value_statistics)
+from slapos.promise.logcounter import (LOG_CHECKPOINT_IDENTITY_SIZE,
+  LOG_COUNTER_FOLDER_NAME, LOG_COUNTER_INITIAL_SIZE, LOG_COUNTER_RETENTION,
+  LOG_COUNTER_VERSION, LogCheckpoint, LogMinuteCounter, LogMinuteParser,
+  get_log_counter_state_file)
+from slapos.promise.netconf import (NETCONF_ALARM_FOLDER_NAME,
+  NETCONF_ALARM_INDEX_VERSION, NetconfAlarmIndex, get_netconf_alarm_index)
 
 
-def iter_reverse_lines(f):
+def get_json_log_entry_interval(json_log_file, interval, use_index=False,
+                                cache_folder=None, shared=False):
   """
-    Read lines from the end of the file
-  """
-  f.seek(0, os.SEEK_END)
-  while True:
-    try:
-      while f.seek(-2, os.SEEK_CUR) and f.read(1) != b'\n':
-        pass
-    except OSError:
-      return
-    pos = f.tell()
-    yield f.readline()
-    f.seek(pos, os.SEEK_SET)
+    Get (timestamp, data) of all lines in the last "interval" seconds from
+    JSON log, newest first
+    Reads rotated logs too (XX.log, XX.log.1, XX.log.2, ...)
 
+    With use_index, the start of the interval in the current log is found
+    with a time index stored in cache_folder (see JSONLogTimeIndex), if
+    given.
 
-def iter_logrotate_file_handle(path, mode='r'):
+    With shared, parsed lines are reused from (and shared with) other
+    readers of the same log in this process and in cache_folder
+    (see JSONLogWindowCache).
   """
-    Yield successive file handles for rotated logs
-    (XX.log, XX.log.1, XX.log.2, ...)
-  """
-  for i in itertools.count():
-    path_i = path + str(i or '')
-    try:
-      with open(path_i, mode) as f:
-        yield f
-    except OSError:
-      break
+  if shared:
+    return get_json_log_window_cache(cache_folder).getEntryList(
+      json_log_file, interval, use_index)
+  return _get_json_log_entry_interval(
+    json_log_file, interval, use_index, datetime.now(), cache_folder)
 
-def get_json_log_data_interval(json_log_file, interval):
+def get_json_log_data_interval(json_log_file, interval, use_index=False,
+                               cache_folder=None, shared=False):
   """
     Get all data in the last "interval" seconds from JSON log
-    Reads rotated logs too (XX.log, XX.log.1, XX.log.2, ...)
+    (see get_json_log_entry_interval)
   """
-  current_time = datetime.now()
-  data_list = []
-  for f in iter_logrotate_file_handle(json_log_file, 'rb'):
-    for line in iter_reverse_lines(f):
-      l = json.loads(line)
-      timestamp = dateparser.parse(l['time'])
-      if (current_time - timestamp).total_seconds() > interval:
-        return data_list
-      data_list.append(l['data'])
-  return data_list
-
-def get_json_log_latest_timestamp(json_log_file):
+  return [data for _, data in get_json_log_entry_interval(
+    json_log_file, interval, use_index, cache_folder, shared)]
+
+
+def _get_json_log_field_column(column_dict, path):
+  try:
+    return column_dict[path]
+  except KeyError:
+    pass
+  parent = _get_json_log_field_column(column_dict, path[:-1])
+  key = path[-1]
+  try:
+    column = [value[key] for value in parent]
+  except (KeyError, IndexError, TypeError):
+    column = []
+    for value in parent:
+      try:
+        column.append(value[key])
+      except (KeyError, IndexError, TypeError):
+        # missing field
+        column.append(None)
+  column_dict[path] = column
+  return column
+
+def get_json_log_field_array_dict(entry_list, field_dict):
   """
-    Get latest timestamp from JSON log
-    Reads rotated logs too (XX.log, XX.log.1, XX.log.2, ...)
+    Extract numeric fields of the (timestamp, data) of entry_list
+    (see get_json_log_entry_interval) into NumPy arrays of float.
+
+    field_dict maps a key to the path of a field in data, a sequence of
+    dict keys and list indexes (e.g. ('samples', 'rx', 1, 'max')), or to
+    None for the date of the lines. The array of a key has one value per
+    line, NaN where the field is missing or not a number. Lines are read
+    once per path prefix, shared by the paths of all keys.
   """
-  for f in iter_logrotate_file_handle(json_log_file, 'rb'):
-    for line in iter_reverse_lines(f):
-      l = json.loads(line)
-      return dateparser.parse(l['time']).timestamp()
-  return 0
+  # imported here so that promises not using it do not pay for the import
+  import numpy as np
+  column_dict = {(): [data for _, data in entry_list]}
+  array_dict = {}
+  for key, path in field_dict.items():
+    if path is None:
+      array_dict[key] = np.array([timestamp for timestamp, _ in entry_list],
+                                 dtype=float)
+      continue
+    column = _get_json_log_field_column(column_dict, tuple(path))
+    try:
+      array = np.array(column, dtype=float)
+    except (TypeError, ValueError):
+      array = np.empty(len(column))
+      for i, value in enumerate(column):
+        try:
+          array[i] = value
+        except (TypeError, ValueError):
+          array[i] = np.nan
+    array_dict[key] = array
+  return array_dict
+
+def get_json_log_field_statistics(entry_list, field_dict, percentile_list=()):
+  """
+    Return the statistics of the numeric fields of the (timestamp, data) of
+    entry_list (see get_json_log_field_array_dict): for each key, the
+    count, minimum, maximum and average of its values and their
+    percentiles of percentile_list ('p95' for 95), without the missing
+    values. Only the count is given for a key without value.
+  """
+  import numpy as np
+  statistics_dict = {}
+  for key, array in get_json_log_field_array_dict(
+      entry_list, field_dict).items():
+    array = array[~np.isnan(array)]
+    statistics = statistics_dict[key] = {'count': len(array)}
+    if len(array):
+      statistics.update(
+        min=float(array.min()),
+        max=float(array.max()),
+        avg=float(array.mean()),
+      )
+      if percentile_list:
+        for percentile, value in zip(
+            percentile_list, np.percentile(array, percentile_list)):
+          statistics['p%g' % percentile] = float(value)
+  return statistics_dict
 
 
 class JSONPromise(GenericPromise):
@@ -75,6 +147,7 @@ class JSONPromise(GenericPromise):
     json_log_name = os.path.splitext(self.__name)[0] + '.json.log'
     self.__json_log_file = os.path.join(self.__log_folder, json_log_name)
     self.json_logger = self.__make_json_logger(self.__json_log_file)
+    self.__json_log_aggregate_dict = {}
 
   def __make_json_logger(self, json_log_file):
     logger = logging.getLogger('json-logger')
@@ -88,8 +161,82 @@ class JSONPromise(GenericPromise):
     logger.addHandler(handler)
     return logger
 
-  def get_json_log_data_interval(self, interval):
-    return get_json_log_data_interval(self.__json_log_file, interval)
+  def get_json_log_data_interval(self, interval, use_index=False):
+    return get_json_log_data_interval(
+      self.__json_log_file, interval, use_index=use_index,
+      cache_folder=os.path.join(self.getPartitionFolder(),
+                                JSON_LOG_CACHE_FOLDER_NAME))
+
+  def aggregate_json_log(self, key, period):
+    """
+      Keep a running aggregate of the "key" values logged by json_logger,
+      to get their statistics over the last "period" seconds (or less)
+      with get_json_log_statistics without reading the log.
+    """
+    aggregate = JSONLogAggregate(
+      self.__json_log_file, key, period, os.path.join(
+        self.getPartitionFolder(), JSON_LOG_AGGREGATE_FOLDER_NAME))
+    self.__json_log_aggregate_dict[key] = aggregate
+    for handler in self.json_logger.handlers[:]:
+      if isinstance(handler, JSONLogAggregateHandler) and \
+          handler.aggregate.aggregate_file == aggregate.aggregate_file:
+        self.json_logger.removeHandler(handler)
+    self.json_logger.addHandler(JSONLogAggregateHandler(aggregate))
+
+  def get_json_log_statistics(self, key, interval):
+    """
+      Get the statistics (see get_value_statistics) of the "key" values
+      of the last "interval" seconds of the JSON log.
+
+      They come from the aggregate of the key (see aggregate_json_log) if
+      it covers the interval, and from the log otherwise.
+    """
+    aggregate = self.__json_log_aggregate_dict.get(key)
+    current_time = datetime.now()
+    if aggregate is not None:
+      statistics = aggregate.getStatistics(interval, current_time.timestamp())
+      if statistics is not None:
+        return statistics
+    entry_list = [(timestamp, data[key]) for timestamp, data in
+                  _get_json_log_entry_interval(
+                    self.__json_log_file, interval, False, current_time,
+                    os.path.join(self.getPartitionFolder(),
+                                 JSON_LOG_CACHE_FOLDER_NAME))
+                  if key in data]
+    if aggregate is not None:
+      aggregate.reset(entry_list, current_time.timestamp() - interval)
+    return get_value_statistics(entry_list)
+
+  def get_shared_json_log_entry_interval(self, json_log_file, interval):
+    """
+      Get (timestamp, data) of the last "interval" seconds of json_log_file,
+      sharing parsed lines with the other promises of the partition reading
+      it. The start of the interval is found with a time index of the log,
+      kept with the shared lines in the partition.
+    """
+    return get_json_log_entry_interval(
+      json_log_file, interval, use_index=True, shared=True,
+      cache_folder=os.path.join(self.getPartitionFolder(),
+                                JSON_LOG_CACHE_FOLDER_NAME))
+
+  def get_shared_json_log_data_interval(self, json_log_file, interval):
+    """
+      Get data of the last "interval" seconds of json_log_file
+      (see get_shared_json_log_entry_interval)
+    """
+    return [data for _, data in self.get_shared_json_log_entry_interval(
+      json_log_file, interval)]
+
+  def get_shared_json_log_field_statistics(self, json_log_file, interval,
+                                           field_dict, percentile_list=()):
+    """
+      Get the statistics (see get_json_log_field_statistics) of fields of
+      the last "interval" seconds of json_log_file
+      (see get_shared_json_log_entry_interval)
+    """
+    return get_json_log_field_statistics(
+      self.get_shared_json_log_entry_interval(json_log_file, interval),
+      field_dict, percentile_list)
 
 def tail_file(file_path, line_count=10):
   """
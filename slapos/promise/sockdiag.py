@@ -0,0 +1,197 @@
+"""
+Lookup of listening TCP sockets with netlink sock_diag.
+
+The kernel only returns the sockets in LISTEN state on the requested
+ports (the ports are filtered with an inet_diag bytecode), so the cost does
+not depend on the number of connections of the host, unlike reading
+/proc/net/tcp. /proc/net/tcp and /proc/net/tcp6 are read when sock_diag
+can not be used (no netlink, inet_diag module not loaded).
+"""
+
+import errno
+import os
+import socket
+import struct
+import sys
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_JMP = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+TCP_LISTEN = 10
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+NLMSG_ERROR_CODE = struct.Struct('=i')
+NLATTR_HEADER = struct.Struct('=HH')
+BC_OP = struct.Struct('=BBH')
+# struct inet_diag_req_v2, without the socket id which is not used
+INET_DIAG_REQ = struct.Struct('=BBBxI48x')
+# struct inet_diag_msg up to the source address of the socket id
+INET_DIAG_MSG = struct.Struct('=BBxx2s2x16s')
+PORT = struct.Struct('!H')
+
+# above this number of ports, all listening sockets are requested
+MAX_FILTERED_PORT_COUNT = 1024
+
+PROC_NET_TCP_DICT = {
+  socket.AF_INET: '/proc/net/tcp',
+  socket.AF_INET6: '/proc/net/tcp6',
+}
+ADDRESS_LENGTH_DICT = {
+  socket.AF_INET: 4,
+  socket.AF_INET6: 16,
+}
+
+
+class NetlinkError(Exception):
+  pass
+
+
+def getPortBytecode(port_list):
+  """
+    Return the inet_diag bytecode accepting the sockets whose source port
+    is in port_list. For each port, "sport >= port and sport <= port"
+    accepts, otherwise the next port is tried and the last one rejects:
+
+      S_GE port ; S_LE port ; JMP accept ; S_GE port ; S_LE port ; ...
+  """
+  block_list = []
+  length = 20 * len(port_list) - 4
+  for i, port in enumerate(port_list):
+    block = [
+      # jump to the next port (or reject after the last one) if false
+      BC_OP.pack(INET_DIAG_BC_S_GE, 8, 20),
+      BC_OP.pack(0, 0, port),
+      BC_OP.pack(INET_DIAG_BC_S_LE, 8, 12),
+      BC_OP.pack(0, 0, port),
+    ]
+    if i < len(port_list) - 1:
+      # JMP always takes the "no" branch: to the end, which accepts
+      block.append(BC_OP.pack(INET_DIAG_BC_JMP, 4, length - 20 * i - 16))
+    block_list.extend(block)
+  return b''.join(block_list)
+
+
+def queryNetlink(family, port_list=None):
+  """
+    Return the set of (packed address, port) of the TCP sockets of family
+    listening on a port of port_list (or any port if None).
+  """
+  request = INET_DIAG_REQ.pack(
+    family, socket.IPPROTO_TCP, 0, 1 << TCP_LISTEN)
+  if port_list:
+    bytecode = getPortBytecode(sorted(set(port_list)))
+    request += NLATTR_HEADER.pack(
+      NLATTR_HEADER.size + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+  request = NLMSG_HEADER.pack(
+    NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+    NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request
+
+  address_length = ADDRESS_LENGTH_DICT[family]
+  result_set = set()
+  s = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+  try:
+    s.sendall(request)
+    while True:
+      data = s.recv(65536)
+      offset = 0
+      while offset + NLMSG_HEADER.size <= len(data):
+        length, message_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if message_type == NLMSG_DONE:
+          return result_set
+        if message_type == NLMSG_ERROR:
+          error, = NLMSG_ERROR_CODE.unpack_from(
+            data, offset + NLMSG_HEADER.size)
+          raise NetlinkError(os.strerror(-error))
+        if message_type == SOCK_DIAG_BY_FAMILY:
+          message_family, state, port, address = INET_DIAG_MSG.unpack_from(
+            data, offset + NLMSG_HEADER.size)
+          if message_family == family and state == TCP_LISTEN:
+            result_set.add((address[:address_length], PORT.unpack(port)[0]))
+        if not length:
+          raise NetlinkError('bad netlink message')
+        # messages are aligned on 4 bytes
+        offset += (length + 3) & ~3
+  finally:
+    s.close()
+
+
+def readProcNet(family, port_list=None):
+  """
+    Same as queryNetlink, from /proc/net/tcp or /proc/net/tcp6.
+  """
+  port_set = None if port_list is None else set(port_list)
+  result_set = set()
+  with open(PROC_NET_TCP_DICT[family]) as f:
+    next(f)
+    for line in f:
+      # sl local_address rem_address st ...
+      _, local_address, _, state = line.split(None, 4)[:4]
+      if state != '0A':
+        continue
+      address, port = local_address.split(':')
+      port = int(port, 16)
+      if port_set is not None and port not in port_set:
+        continue
+      # addresses are written as 32 bits words in host byte order
+      address = bytes.fromhex(address)
+      if sys.byteorder == 'little':
+        address = b''.join(address[i:i + 4][::-1]
+                           for i in range(0, len(address), 4))
+      result_set.add((address, port))
+  return result_set
+
+
+def getListeningSocketSet(family, port_list=None):
+  """
+    Return the set of (packed address, port) of the TCP sockets of family
+    listening on a port of port_list (or any port if None).
+  """
+  if port_list is not None and len(port_list) > MAX_FILTERED_PORT_COUNT:
+    listening_set = getListeningSocketSet(family)
+    port_set = set(port_list)
+    return set(q for q in listening_set if q[1] in port_set)
+  try:
+    return queryNetlink(family, port_list)
+  except (NetlinkError, OSError) as e:
+    if isinstance(e, OSError) and e.errno not in (
+        errno.EPROTONOSUPPORT, errno.EAFNOSUPPORT, errno.EACCES,
+        errno.EPERM, errno.ENOENT, errno.EINVAL):
+      raise
+    return readProcNet(family, port_list)
+
+
+def getAddressFamily(ip_address):
+  for family in (socket.AF_INET, socket.AF_INET6):
+    try:
+      socket.inet_pton(family, ip_address)
+    except (socket.error, ValueError):
+      continue
+    return family
+  raise ValueError("%r is not an IP address" % (ip_address,))
+
+
+def getListeningAddressList(address_list):
+  """
+    Return the (ip address, port) of address_list on which a TCP socket
+    is listening, with one lookup per address family.
+  """
+  port_dict = {}
+  for ip_address, port in address_list:
+    family = getAddressFamily(ip_address)
+    port_dict.setdefault(family, []).append(
+      (ip_address, port, socket.inet_pton(family, ip_address)))
+  listening_list = []
+  for family, item_list in port_dict.items():
+    listening_set = getListeningSocketSet(
+      family, [q[1] for q in item_list])
+    listening_list.extend((ip_address, port)
+      for ip_address, port, address in item_list
+      if (address, port) in listening_set)
+  return listening_list
@@ -0,0 +1,179 @@
+"""
+Benchmark of the parallel chunked scanning of logs (slapos.logscan).
+
+Generates a synthetic Apache access log and a synthetic slapos node log,
+then compares the throughput of line by line loops with ChunkScanner,
+in one process and in a pool of processes:
+
+  python -m slapos.test.bench_logscan [size in MB] [process count]
+"""
+import contextlib
+import datetime
+import io
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from slapos import loganalyze
+from slapos.logscan import ChunkScanner, countMatches
+
+ACCESS_LOG_LINE = (
+  '%(ip)s - - [%(date)s +0000] "GET /erp5/%(path)s HTTP/1.1" %(status)s'
+  ' %(size)s "-" "Mozilla/5.0 (X11; Linux x86_64)" %(duration)s\n')
+# starting with a literal, so that the regular expression engine looks for
+# it before trying to match
+SERVER_ERROR_PATTERN = br'HTTP/1\.[01]" 5\d\d '
+SERVER_ERROR_REGEX = re.compile(SERVER_ERROR_PATTERN.decode())
+
+
+def writeAccessLog(path, size):
+  """
+    Write an Apache access log of size bytes, with 1% of 5xx responses.
+  """
+  rng = random.Random(0)
+  date = datetime.datetime(2026, 10, 18)
+  with open(path, 'w') as f:
+    while f.tell() < size:
+      line_list = []
+      for _ in range(1000):
+        date += datetime.timedelta(milliseconds=rng.randrange(100))
+        line_list.append(ACCESS_LOG_LINE % {
+          'ip': '10.0.%d.%d' % (rng.randrange(256), rng.randrange(256)),
+          'date': date.strftime('%d/%b/%Y:%H:%M:%S'),
+          'path': 'web_site_module/%08x' % rng.getrandbits(32),
+          'status': 503 if rng.random() < 0.01 else 200,
+          'size': rng.randrange(100000),
+          'duration': rng.randrange(1000000),
+        })
+      f.write(''.join(line_list))
+
+
+def writeNodeLog(path, size):
+  """
+    Write a slapos node log of size bytes, processing partitions in turn.
+  """
+  rng = random.Random(0)
+  date = datetime.datetime(2026, 10, 18)
+  with open(path, 'w') as f:
+    while f.tell() < size:
+      line_list = []
+      for partition in range(100):
+        def log(level, message):
+          line_list.append('[%s,%03d] %-8s %s\n' % (
+            date.strftime('%Y-%m-%d %H:%M:%S'), rng.randrange(1000),
+            level, message))
+        log('INFO', 'Processing Computer Partition slappart%d.' % partition)
+        log('INFO', '  Software URL: https://lab.nexedi.com/nexedi/slapos'
+            '/raw/1.0.%d/software/erp5/software.cfg' % rng.randrange(400))
+        for _ in range(rng.randrange(50)):
+          date += datetime.timedelta(seconds=rng.randrange(3))
+          log('INFO', 'Installing part %08x.' % rng.getrandbits(32))
+        if rng.random() < 0.1:
+          log('ERROR', "Failed to run buildout profile in directory "
+              "'/srv/slapgrid/slappart%d'" % partition)
+        line_list.append('While:\n  Installing.\n')
+      f.write(''.join(line_list))
+
+
+def countServerErrorLineByLine(path):
+  count = 0
+  with open(path) as f:
+    for line in f:
+      if SERVER_ERROR_REGEX.search(line):
+        count += 1
+  return count
+
+
+def analyzeLineByLine(path):
+  """
+    Reference implementation of loganalyze, processing the log line by line.
+  """
+  output = io.StringIO()
+  state = {}
+  with open(path) as f:
+    for line in f.readlines():
+      line = line.strip()[:500]
+      if not line.startswith('['):
+        continue
+      processing = loganalyze.PROCESSING_DETECT.fullmatch(line)
+      if processing:
+        event = ('processing',
+                 processing.groupdict()['timestamp'].split(',')[0],
+                 processing.groupdict()['partition'])
+        with contextlib.redirect_stdout(output):
+          loganalyze.processEvent(state, event)
+        continue
+      state['previous_timestamp'] = loganalyze.TIMESTAMP_DETECT.fullmatch(
+        line).groupdict()['timestamp'].split(',')[0]
+      if loganalyze.ERROR_DETECT.fullmatch(line):
+        state['status'] = 'ERR'
+      software = loganalyze.SOFTWARE_DETECT.fullmatch(line)
+      if software:
+        loganalyze.processEvent(
+          state, ('software', software.groupdict()['software_release']))
+  return output.getvalue()
+
+
+def analyzeChunked(path, scanner):
+  output = io.StringIO()
+  state = {}
+  with contextlib.redirect_stdout(output):
+    for event_list in scanner.scan(path, loganalyze.scanChunk):
+      for event in event_list:
+        loganalyze.processEvent(state, event)
+  return output.getvalue()
+
+
+def timeRun(name, size, run):
+  start = time.time()
+  result = run()
+  duration = time.time() - start
+  print("%-40s %8.2f s %8.1f MB/s" % (name, duration, size / 1e6 / duration))
+  return result
+
+
+def main():
+  size = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 200 * 10**6
+  process_count = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+  folder = tempfile.mkdtemp()
+  try:
+    access_log = os.path.join(folder, 'access.log')
+    node_log = os.path.join(folder, 'slapos-node.log')
+    writeAccessLog(access_log, size)
+    writeNodeLog(node_log, size)
+    one = ChunkScanner(1, chunk_size=16 * 1024 * 1024)
+    pool = ChunkScanner(process_count, chunk_size=16 * 1024 * 1024)
+    print("%.0f MB logs, %s processes" % (size / 1e6, process_count))
+
+    size = os.path.getsize(access_log)
+    result_list = [
+      timeRun("5xx count, line by line", size,
+              lambda: countServerErrorLineByLine(access_log)),
+      timeRun("5xx count, chunks, 1 process", size,
+              lambda: countMatches(access_log, SERVER_ERROR_PATTERN, scanner=one)),
+      timeRun("5xx count, chunks, %s processes" % process_count, size,
+              lambda: countMatches(access_log, SERVER_ERROR_PATTERN,
+                                   scanner=pool)),
+    ]
+    assert len(set(result_list)) == 1, result_list
+
+    size = os.path.getsize(node_log)
+    result_list = [
+      timeRun("loganalyze, line by line", size,
+              lambda: analyzeLineByLine(node_log)),
+      timeRun("loganalyze, chunks, 1 process", size,
+              lambda: analyzeChunked(node_log, one)),
+      timeRun("loganalyze, chunks, %s processes" % process_count, size,
+              lambda: analyzeChunked(node_log, pool)),
+    ]
+    assert len(set(result_list)) == 1
+  finally:
+    shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+  main()
@@ -29,6 +29,7 @@ import unittest
 import os
 import sqlite3
 import time
+import psutil
 
 from ..promise import data
 from slapos.monitor.collect import ResourceCollect
@@ -74,7 +75,27 @@ class TestMonitorCollect(unittest.TestCase):
     self.assertAlmostEqual(7.3, data[0]['cpu_percent'])
     self.assertAlmostEqual(2822535483392.0, data[2]['io_rw_counter'])
 
+  def test_getPartitionComsumptionStatusDiskUsed(self):
+    data = self.collector.getPartitionComsumptionStatus('slapuser15', date_scope='2017-04-18',
+                                         min_time='12:00:00', max_time='12:10:00')
+    self.assertAlmostEqual(35.52, data[2]['disk_used'])
+
+  def test_has_table(self):
+    self.assertTrue(self.collector.has_table('folder'))
+    self.assertFalse(self.collector.has_table('not_a_table'))
+    # table existence is cached
+    self.collector.close()
+    os.remove("/tmp/collector.db")
+    sqlite3.connect('/tmp/collector.db').close()
+    self.assertTrue(self.collector.has_table('folder'))
+
+  def test_getProcessInfo(self):
+    info = self.collector.getProcessInfo(os.getpid())
+    self.assertEqual(info['command'], psutil.Process().cmdline())
+    self.assertEqual(info['user'], psutil.Process().username())
+
   def tearDown(self):
+    self.collector.close()
     os.remove("/tmp/collector.db") 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,124 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from slapos.monitor.history import PromiseHistoryStore
+
+
+class TestPromiseHistoryStore(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.public_dir = os.path.join(self.base_dir, 'public')
+    self.index_dir = os.path.join(self.base_dir, 'private', 'history-index')
+    self.tmp_dir = os.path.join(self.base_dir, 'tmp')
+    os.mkdir(self.public_dir)
+    os.mkdir(self.tmp_dir)
+    self.store = PromiseHistoryStore(
+      self.public_dir, self.index_dir, self.tmp_dir)
+    self.history_file = os.path.join(self.public_dir, 'promise.history.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def getState(self, date, message='OK', status='OK'):
+    return {
+      'title': 'promise',
+      'name': 'promise.py',
+      'status': status,
+      'date': date,
+      'change-date': date,
+      'message': message,
+    }
+
+  def loadHistory(self):
+    with open(self.history_file) as f:
+      return json.load(f)
+
+  def test_append(self):
+    self.assertTrue(self.store.append('promise', self.getState('2026-01-01')))
+    self.assertTrue(self.store.append('promise', self.getState('2026-01-02')))
+    data_list = self.loadHistory()['data']
+    self.assertEqual(len(data_list), 2)
+    self.assertEqual(data_list[0]['title'], 'promise')
+    self.assertNotIn('title', data_list[1])
+    self.assertEqual(data_list[1]['change-date'], '2026-01-02')
+    index_dict = self.store.loadIndex('promise')
+    self.assertEqual(index_dict['count'], 2)
+    self.assertEqual(index_dict['offset'], os.path.getsize(self.history_file))
+
+  def test_append_same_state(self):
+    self.store.append('promise', self.getState('2026-01-01'))
+    self.assertFalse(self.store.append('promise', self.getState('2026-01-01')))
+    self.assertTrue(
+      self.store.append('promise', self.getState('2026-01-01', 'changed')))
+    self.assertEqual(len(self.loadHistory()['data']), 2)
+
+  def test_append_does_not_parse_history(self):
+    self.store.append('promise', self.getState('2026-01-01'))
+    original_load = json.load
+    def load(f, *args, **kw):
+      if f.name == self.history_file:
+        raise AssertionError('history file must not be parsed')
+      return original_load(f, *args, **kw)
+    json.load = load
+    try:
+      self.store.append('promise', self.getState('2026-01-02'))
+    finally:
+      json.load = original_load
+    self.assertEqual(len(self.loadHistory()['data']), 2)
+
+  def test_modified_history_is_recreated(self):
+    self.store.append('promise', self.getState('2026-01-01'))
+    with open(self.history_file, 'w') as f:
+      f.write('{"date": 1232424, "data": [{"ddfdf}]}')
+    self.store.append('promise', self.getState('2026-01-02'))
+    data_list = self.loadHistory()['data']
+    self.assertEqual(len(data_list), 1)
+    self.assertEqual(data_list[0]['change-date'], '2026-01-02')
+
+  def test_legacy_history_is_adopted(self):
+    with open(self.history_file, 'w') as f:
+      json.dump({'date': 1, 'data': [self.getState('2026-01-01')]}, f)
+    self.assertFalse(self.store.append('promise', self.getState('2026-01-01')))
+    self.assertTrue(self.store.append('promise', self.getState('2026-01-02')))
+    self.assertEqual(len(self.loadHistory()['data']), 2)
+
+  def test_touched_history_is_kept(self):
+    for day in range(1, 6):
+      self.store.append('promise', self.getState('2026-01-%02d' % day))
+    # e.g. restored from a backup, or crash before the index was saved
+    os.utime(self.history_file, (1, 1))
+    self.assertTrue(self.store.append('promise', self.getState('2026-01-06')))
+    self.assertEqual(
+      [q['change-date'] for q in self.loadHistory()['data']],
+      ['2026-01-%02d' % day for day in range(1, 7)])
+    self.assertEqual(self.store.loadIndex('promise')['count'], 6)
+
+    # the last state is still recognized
+    os.utime(self.history_file, (2, 2))
+    self.assertFalse(self.store.append('promise', self.getState('2026-01-06')))
+
+    # a history file not ending with its entries is written again
+    with open(self.history_file, 'w') as f:
+      json.dump({'data': [self.getState('2026-01-01')], 'date': 1}, f)
+    self.store.append('promise', self.getState('2026-01-02'))
+    self.assertEqual(len(self.loadHistory()['data']), 2)
+
+  def test_history_is_kept(self):
+    for day in range(1, 8):
+      self.store.append('promise', self.getState('2026-01-%02d' % day))
+    # the whole history stays in the public folder
+    self.assertEqual(
+      [q['change-date'] for q in self.loadHistory()['data']],
+      ['2026-01-%02d' % day for day in range(1, 8)])
+
+    self.store.remove('promise')
+    self.assertFalse(os.path.exists(self.history_file))
+    self.assertEqual(os.listdir(self.index_dir), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
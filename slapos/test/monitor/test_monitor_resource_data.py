@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from slapos.monitor.resource_data import ResourceDataFile, DATE_FORMAT
+
+HEADER = "date, memory used percent, memory used"
+
+
+class TestResourceDataFile(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.data_file = os.path.join(self.base_dir,
+                                  'monitor_resource_memory.data.json')
+    self.state_dir = os.path.join(self.base_dir, 'private')
+    os.mkdir(self.state_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def loadData(self):
+    with open(self.data_file) as f:
+      return json.load(f)['data']
+
+  def appendSamples(self, start, minute_count):
+    resource_data = ResourceDataFile(self.data_file, HEADER, self.state_dir)
+    for i in range(minute_count):
+      date = start + timedelta(minutes=i)
+      resource_data.append('%s, %s, %s' % (
+        date.strftime(DATE_FORMAT), date.hour, 10))
+    return resource_data
+
+  def test_empty(self):
+    ResourceDataFile(self.data_file, HEADER, self.state_dir).save()
+    self.assertEqual(self.loadData(), [HEADER])
+
+  def test_minute_resolution(self):
+    self.appendSamples(datetime(2026, 1, 1, 10), 3)
+    self.assertEqual(self.loadData(), [
+      HEADER,
+      "2026-01-01 10:00:00, 10, 10",
+      "2026-01-01 10:01:00, 10, 10",
+      "2026-01-01 10:02:00, 10, 10",
+    ])
+
+  def test_rollup(self):
+    start = datetime(2026, 1, 1, 0, 30)
+    # 3 days of samples, one every 30 minutes
+    resource_data = ResourceDataFile(self.data_file, HEADER, self.state_dir)
+    for i in range(3 * 48):
+      date = start + timedelta(minutes=30 * i)
+      resource_data.append('%s, %s, %s' % (
+        date.strftime(DATE_FORMAT), date.hour, i))
+    last_date = '2026-01-04 00:00:00'
+
+    data_list = self.loadData()[1:]
+    date_list = [q.split(',')[0] for q in data_list]
+    self.assertEqual(date_list, sorted(date_list))
+    # last day at original resolution
+    self.assertEqual(date_list[-49:][0], '2026-01-03 00:00:00')
+    self.assertEqual(date_list[-1], last_date)
+    # previous hours are averaged
+    self.assertEqual(date_list[0], '2026-01-01 00:00:00')
+    self.assertEqual(data_list[0], '2026-01-01 00:00:00, 0, 0')
+    self.assertEqual(data_list[1], '2026-01-01 01:00:00, 1, 1.5')
+    self.assertEqual(len(data_list), 48 + 49)
+
+    # ranges at all resolutions, reloaded from the rollup state
+    resource_data = ResourceDataFile(self.data_file, HEADER, self.state_dir)
+    self.assertEqual(
+      resource_data.getRange('2026-01-02 00:00:00', '2026-01-03 23:59:59',
+                             resolution='day'),
+      [['2026-01-02 00:00:00', 11.5, 70.5],
+       ['2026-01-03 00:00:00', 11.5, 118.5]])
+    hour_list = resource_data.getRange(
+      datetime(2026, 1, 2, 5), datetime(2026, 1, 2, 6), resolution='hour')
+    self.assertEqual(hour_list, [['2026-01-02 05:00:00', 5, 57.5],
+                                 ['2026-01-02 06:00:00', 6, 59.5]])
+    self.assertEqual(len(resource_data.getRange(resolution='minute')), 49)
+
+  def test_retention(self):
+    resource_data = self.appendSamples(datetime(2026, 1, 1), 1)
+    resource_data.append('2026-03-01 00:00:00, 1, 1')
+    resource_data.append('2026-03-01 00:01:00, 1, 1')
+    self.assertEqual(resource_data.getRange(resolution='hour'), [
+      ['2026-03-01 00:00:00', 1, 1]])
+    self.assertEqual(self.loadData(), [
+      HEADER,
+      "2026-01-01 00:00:00, 0, 10",
+      "2026-03-01 00:00:00, 1, 1",
+      "2026-03-01 00:01:00, 1, 1",
+    ])
+
+  def test_legacy_data_file(self):
+    with open(self.data_file, 'w') as f:
+      json.dump({'date': 1, 'data': [
+        HEADER,
+        "2026-01-01 10:00:00, 10, 10",
+        "2026-01-01 10:01:00, 10, 20",
+      ]}, f)
+    resource_data = ResourceDataFile(self.data_file, HEADER, self.state_dir)
+    resource_data.append("2026-01-01 10:02:00, 10, 30")
+    self.assertEqual(resource_data.getRange(resolution='hour'),
+                     [['2026-01-01 10:00:00', 10, 20]])
+    self.assertEqual(len(self.loadData()), 4)
+
+  def test_private_state(self):
+    # the rollup state is not written next to the data file
+    self.appendSamples(datetime(2026, 1, 1, 10), 1)
+    self.assertEqual(sorted(os.listdir(self.base_dir)),
+                     ['monitor_resource_memory.data.json', 'private'])
+    self.assertEqual(os.listdir(self.state_dir),
+                     ['monitor_resource_memory.data.json.rollup'])
+
+
+if __name__ == '__main__':
+  unittest.main()
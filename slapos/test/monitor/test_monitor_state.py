@@ -9,7 +9,7 @@ import pkg_resources
 
 from slapos.monitor.runpromise import MonitorPromiseLauncher, getArgumentParser
 from slapos.monitor.monitor import Monitoring
-from slapos.monitor.monitor_state import MonitorStateBuilder
+from slapos.monitor.monitor_state import MonitorStateBuilder, MonitorFeed
 from jsonschema import validate
 
 class MonitorGlobalTest(unittest.TestCase):
@@ -419,6 +419,61 @@ exit %(code)s
       data_dict = json.load(f)
       self.assertEqual(data_dict['data'][0]['title'], 'promise_1')
 
+  def test_monitor_status_ingestion_cache(self):
+    config_content = self.monitor_conf % self.monitor_config_dict
+    self.writeContent(self.monitor_config_file, config_content)
+
+    instance = Monitoring(self.monitor_config_file)
+    instance.bootstrapMonitor()
+
+    self.writePromise('promise_1')
+    self.writePromise('promise_2', success=False)
+
+    os.symlink(self.output_dir, '%s/public/promise' % self.base_dir)
+    parser = self.getPromiseParser()
+    promise_runner = MonitorPromiseLauncher(parser)
+    promise_runner.config.force = True
+    promise_runner.start()
+    builder = MonitorStateBuilder(self.monitor_config_file)
+    builder.buildMonitorState()
+    self.assertEqual(builder.ingestion_counter_dict,
+                     {'parsed': 2, 'skipped': 0})
+    cache_file = os.path.join(self.private_dir, '_promise_status_cache')
+    with open(cache_file) as f:
+      cache_dict = json.load(f)
+    # only the fields used to build the state are cached
+    self.assertEqual(sorted(cache_dict[os.path.join(
+        self.base_dir, 'public', 'promise', 'promise_1.status.json')][2]),
+      ['execution-time', 'name', 'result', 'title'])
+    cache_mtime = os.stat(cache_file).st_mtime_ns
+
+    # status files did not change, nor the cache: they are not read again,
+    # even if their content is replaced without changing their date and size
+    status_file = os.path.join(self.output_dir, 'promise_2.status.json')
+    status_stat = os.stat(status_file)
+    with open(status_file, 'w') as f:
+      f.write(' ' * status_stat.st_size)
+    os.utime(status_file, ns=(status_stat.st_atime_ns,
+                              status_stat.st_mtime_ns))
+    builder = MonitorStateBuilder(self.monitor_config_file)
+    builder.buildMonitorState()
+    self.assertEqual(builder.ingestion_counter_dict,
+                     {'parsed': 0, 'skipped': 2})
+    self.assertEqual(os.stat(cache_file).st_mtime_ns, cache_mtime)
+    with open(os.path.join(self.private_dir, 'monitor.global.json')) as f:
+      self.assertEqual(json.load(f)['state'], {'error': 1, 'success': 1})
+
+    # promises are run again, status files are parsed
+    self.writePromise('promise_2')
+    promise_runner.start()
+    builder.buildMonitorState()
+    self.assertEqual(builder.ingestion_counter_dict,
+                     {'parsed': 2, 'skipped': 0})
+    with open(os.path.join(self.private_dir, 'monitor.global.json')) as f:
+      self.assertEqual(json.load(f)['state'], {'error': 0, 'success': 2})
+    with open(os.path.join(self.public_dir, 'promise_2.history.json')) as f:
+      self.assertEqual(len(json.load(f)['data']), 2)
+
 
 class MonitorGlobalTestWithoutLegacyPromiseFolder(MonitorGlobalTest):
   monitor_conf = """[monitor]
@@ -467,3 +522,57 @@ master-url = http://10.0.151.118:50000
 software-type = default
 ipv4 = 10.0.151.118
 """
+
+
+class TestMonitorFeed(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.feed_file = os.path.join(self.base_dir, 'feed')
+    self.cache_file = os.path.join(self.base_dir, '_feed_cache')
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def generateFeed(self, status_dict):
+    feed = MonitorFeed('Monitor', 'Monitor ROOT', 'https://monitor/public',
+      'https://monitor/private', 'https://monitor/feed',
+      cache_file=self.cache_file)
+    for title, status in sorted(status_dict.items()):
+      feed.appendItem({
+        'title': title,
+        'status': status,
+        'result': {
+          'change-date': '2026-01-01T00:00:00+0000',
+          'date': '2026-01-01T00:00:00+0000',
+          'message': '%s is %s' % (title, status),
+        }
+      }, status)
+    return feed.generateRSS(self.feed_file)
+
+  def test_feed_not_rewritten_if_unchanged(self):
+    self.assertTrue(self.generateFeed({'promise_1': 'OK', 'promise_2': 'OK'}))
+    with open(self.feed_file) as f:
+      content = f.read()
+    self.assertIn('<title>[OK] promise_1</title>', content)
+    self.assertIn('<description>\npromise_2 is OK</description>', content)
+    mtime = os.stat(self.feed_file).st_mtime_ns
+
+    self.assertFalse(self.generateFeed({'promise_1': 'OK', 'promise_2': 'OK'}))
+    self.assertEqual(mtime, os.stat(self.feed_file).st_mtime_ns)
+
+    self.assertTrue(
+      self.generateFeed({'promise_1': 'OK', 'promise_2': 'ERROR'}))
+    with open(self.feed_file) as f:
+      content = f.read()
+    self.assertIn('<title>[OK] promise_1</title>', content)
+    self.assertIn('<title>[ERROR] promise_2</title>', content)
+    self.assertNotIn('<title>[OK] promise_2</title>', content)
+    with open(self.cache_file) as f:
+      self.assertEqual(len(json.load(f)['fragment']), 2)
+
+  def test_feed_recreated_if_removed(self):
+    self.generateFeed({'promise_1': 'OK'})
+    os.remove(self.feed_file)
+    self.assertTrue(self.generateFeed({'promise_1': 'OK'}))
+    self.assertTrue(os.path.exists(self.feed_file))
@@ -0,0 +1,203 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from slapos.monitor.build_statistic import buildStatistic
+from slapos.monitor.history import PromiseHistoryStore
+
+
+class TestBuildStatistic(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.public_dir = os.path.join(self.base_dir, 'public')
+    self.tmp_dir = os.path.join(self.base_dir, 'tmp')
+    self.checkpoint_dir = os.path.join(self.base_dir, 'private',
+                                       'statistic-checkpoint')
+    os.mkdir(self.public_dir)
+    os.mkdir(self.tmp_dir)
+    os.makedirs(self.checkpoint_dir)
+    self.store = PromiseHistoryStore(
+      self.public_dir, os.path.join(self.base_dir, 'index'), self.tmp_dir)
+    self.stats_file = os.path.join(self.public_dir, 'promise.stats.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def addHistory(self, date, status):
+    self.store.append('promise', {
+      'title': 'promise',
+      'status': status,
+      'date': date,
+      'change-date': date,
+      'message': status,
+    })
+
+  def loadStats(self):
+    with open(self.stats_file) as f:
+      return json.load(f)['data']
+
+  def test_statistic(self):
+    self.addHistory('2026-01-01T10:00:00+0000', 'OK')
+    self.addHistory('2026-01-01T12:00:00+0000', 'ERROR')
+    self.addHistory('2026-01-01T13:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+
+    stats_list = self.loadStats()
+    self.assertEqual(len(stats_list), 1)
+    stat = stats_list[0]
+    self.assertEqual(stat['day'], '2026-01-01')
+    self.assertEqual(stat['status'], 'ERROR')
+    self.assertEqual(stat['date'], '2026-01-01T13:00:00+0000')
+    self.assertEqual(stat['message'], {'ERROR': 1, 'OK': 2})
+    self.assertEqual(stat['flap-count'], 2)
+    self.assertEqual(stat['time-to-recover'], 3600)
+    # 2 hours OK, 1 hour ERROR
+    self.assertEqual(stat['availability'], 66.67)
+
+    # nothing new, nothing is added
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    self.assertEqual(len(self.loadStats()), 1)
+    # the checkpoint is private
+    self.assertEqual(sorted(os.listdir(self.public_dir)),
+                     ['promise.history.json', 'promise.stats.json'])
+    self.assertEqual(
+      os.listdir(self.checkpoint_dir),
+      ['promise.stats.checkpoint'])
+
+    # only new entries are processed, counters are kept between runs and
+    # the days modified by the new entries are written again
+    self.addHistory('2026-01-02T01:00:00+0000', 'ERROR')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual([q['day'] for q in stats_list],
+                     ['2026-01-01', '2026-01-01', '2026-01-02'])
+    self.assertEqual([q['date'] for q in stats_list[1:]],
+                     ['2026-01-02T01:00:00+0000'] * 2)
+    stat = stats_list[1]
+    self.assertEqual(stat['message'], {'ERROR': 1, 'OK': 2})
+    # OK from 13:00 to midnight is now known
+    self.assertEqual(stat['availability'], round(100. * 13 / 14, 2))
+    stat = stats_list[2]
+    self.assertEqual(stat['message'], {'ERROR': 1, 'OK': 0})
+    self.assertEqual(stat['flap-count'], 1)
+    self.assertEqual(stat['availability'], 100.)
+
+    self.addHistory('2026-01-02T02:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual([q['day'] for q in stats_list[3:]], ['2026-01-02'])
+    self.assertEqual(stats_list[3]['message'], {'ERROR': 1, 'OK': 1})
+
+  def test_statistic_prune_day(self):
+    for day in range(1, 11):
+      self.addHistory('2026-01-%02dT10:00:00+0000' % day, 'OK')
+      buildStatistic(self.public_dir, self.checkpoint_dir)
+    checkpoint_path = os.path.join(self.checkpoint_dir,
+      'promise.stats.checkpoint')
+    with open(checkpoint_path) as f:
+      checkpoint = json.load(f)
+    # only the last days are kept
+    self.assertEqual(sorted(checkpoint['day-dict']),
+      ['2026-01-07', '2026-01-08', '2026-01-09', '2026-01-10'])
+    # each run only wrote the days of its entries
+    stats_list = self.loadStats()
+    self.assertEqual(len(stats_list), 19)
+    final_dict = {}
+    for stat in stats_list:
+      final_dict[stat['day']] = stat
+    self.assertEqual(len(final_dict), 10)
+    self.assertEqual(final_dict['2026-01-01']['availability'], 100.)
+    self.assertEqual(final_dict['2026-01-01']['message'], {'ERROR': 0, 'OK': 1})
+
+  def test_statistic_no_valid_entry(self):
+    self.addHistory('not a date', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    self.assertFalse(os.path.exists(self.stats_file))
+    self.addHistory('2026-01-01T10:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    self.assertEqual([q['day'] for q in self.loadStats()], ['2026-01-01'])
+
+  def test_statistic_append_to_empty_list(self):
+    self.addHistory('2026-01-01T10:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    checkpoint_path = os.path.join(self.checkpoint_dir,
+      'promise.stats.checkpoint')
+    with open(self.stats_file, 'w') as f:
+      json.dump({'date': 1, 'data': []}, f)
+    with open(checkpoint_path) as f:
+      checkpoint = json.load(f)
+    checkpoint['stats-offset'] = os.path.getsize(self.stats_file)
+    with open(checkpoint_path, 'w') as f:
+      json.dump(checkpoint, f)
+    self.addHistory('2026-01-01T11:00:00+0000', 'ERROR')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual(len(stats_list), 1)
+    self.assertEqual(stats_list[0]['message'], {'ERROR': 1, 'OK': 1})
+
+  def test_statistic_empty_day(self):
+    self.addHistory('2026-01-01T12:00:00+0000', 'ERROR')
+    self.addHistory('2026-01-03T12:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual([(q['day'], q['status']) for q in stats_list], [
+      ('2026-01-01', 'ERROR'),
+      ('2026-01-02', 'ERROR'),
+      ('2026-01-03', 'OK'),
+    ])
+    self.assertEqual(stats_list[1]['message'], {'ERROR': 0, 'OK': 0})
+    self.assertEqual(stats_list[1]['availability'], 0.)
+
+  def test_statistic_timezone(self):
+    self.addHistory('2026-01-01T22:00:00+0000', 'OK')
+    # 2026-01-01T23:30:00+0000
+    self.addHistory('2026-01-02T01:30:00+0200', 'ERROR')
+    # 2026-01-01T23:45:00+0000
+    self.addHistory('2026-01-01T18:45:00-0500', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual(len(stats_list), 1)
+    self.assertEqual(stats_list[0]['day'], '2026-01-01')
+    self.assertEqual(stats_list[0]['message'], {'ERROR': 1, 'OK': 2})
+    # 90 minutes OK, 15 minutes ERROR
+    self.assertEqual(stats_list[0]['availability'], round(100. * 90 / 105, 2))
+
+  def test_history_recreated(self):
+    self.addHistory('2026-01-01T10:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    history_file = os.path.join(self.public_dir, 'promise.history.json')
+    with open(history_file, 'w') as f:
+      json.dump({'date': 1, 'data': [{
+        'status': 'ERROR', 'date': '2026-01-01T11:00:00+0000'}]}, f)
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual(len(stats_list), 2)
+    # counters are computed again from the new history
+    self.assertEqual(stats_list[1]['message'], {'ERROR': 1, 'OK': 0})
+
+  def test_broken_stats_file(self):
+    self.addHistory('2026-01-01T10:00:00+0000', 'OK')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    with open(self.stats_file, 'w') as f:
+      f.write('{"date": 1, "data": [{')
+    self.addHistory('2026-01-01T11:00:00+0000', 'ERROR')
+    buildStatistic(self.public_dir, self.checkpoint_dir)
+    stats_list = self.loadStats()
+    self.assertEqual(len(stats_list), 1)
+    self.assertEqual(stats_list[0]['message'], {'ERROR': 1, 'OK': 1})
+
+  def test_missing_checkpoint_folder(self):
+    self.addHistory('2026-01-01T10:00:00+0000', 'OK')
+    shutil.rmtree(self.checkpoint_dir)
+    with self.assertRaises(Exception):
+      buildStatistic(self.public_dir, self.checkpoint_dir)
+    # the checkpoint folder is not guessed nor created
+    self.assertFalse(os.path.exists(self.checkpoint_dir))
+    self.assertFalse(os.path.exists(self.stats_file))
+
+
+if __name__ == '__main__':
+  unittest.main()
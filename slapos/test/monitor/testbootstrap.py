@@ -5,9 +5,31 @@ import shutil
 import tempfile
 import unittest
 import json
+import threading
+import mock
+from six.moves import BaseHTTPServer
 
 from slapos.monitor.monitor import Monitoring
 
+
+class MonitorTitleHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    if self.path.startswith('/public/') and \
+        self.path.endswith('monitor.global.json'):
+      body = json.dumps({'title': 'Related Monitor'}).encode()
+      self.send_response(200)
+    else:
+      body = b''
+      self.send_response(404)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
 class MonitorBootstrapTest(unittest.TestCase):
 
   monitor_conf = """[monitor]
@@ -279,6 +301,75 @@ partition-folder = %(base_dir)s
 
     self.assertEqual(key_list, [])
 
+  def test_monitor_bootstrap_related_monitor_title(self):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), MonitorTitleHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    related_url = 'http://127.0.0.1:%s' % server.server_port
+    try:
+      self.monitor_config_dict['url_list'] = related_url
+      config_content = self.monitor_conf % self.monitor_config_dict
+      self.writeContent(self.monitor_config_file, config_content)
+      instance = Monitoring(self.monitor_config_file)
+      instance.bootstrapMonitor()
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+
+    promise_file = os.path.join(self.base_dir, 'monitor-bootstrap-status')
+    self.assertTrue(os.path.exists(promise_file))
+    opml_file = os.path.join(self.base_dir, 'public/feeds')
+    with open(opml_file) as f:
+      self.assertIn('title="Related Monitor"', f.read())
+    with open(os.path.join(self.base_dir, 'private',
+                           '_monitor_title_cache')) as f:
+      self.assertEqual(json.load(f)[related_url]['title'], 'Related Monitor')
+
+    # server is down, but title is still in cache
+    os.unlink(opml_file)
+    instance = Monitoring(self.monitor_config_file)
+    instance.bootstrapMonitor()
+    self.assertTrue(os.path.exists(promise_file))
+    with open(opml_file) as f:
+      self.assertIn('title="Related Monitor"', f.read())
+
+    # cache expired, previous title is kept but bootstrap fails
+    instance = Monitoring(self.monitor_config_file)
+    instance.monitor_title_cache_ttl = -1
+    instance.bootstrapMonitor()
+    self.assertFalse(os.path.exists(promise_file))
+    with open(opml_file) as f:
+      self.assertIn('title="Related Monitor"', f.read())
+
+
+  def test_monitor_bootstrap_related_monitor_title_error(self):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), MonitorTitleHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    related_url = 'http://127.0.0.1:%s' % server.server_port
+    try:
+      self.monitor_config_dict['url_list'] = related_url
+      config_content = self.monitor_conf % self.monitor_config_dict
+      self.writeContent(self.monitor_config_file, config_content)
+      instance = Monitoring(self.monitor_config_file)
+      # errors of the thread refreshing titles fail the bootstrap
+      with mock.patch.object(instance, 'saveMonitorTitleCache',
+                             side_effect=OSError("disk full")), \
+          mock.patch('sys.stdout') as stdout:
+        instance.bootstrapMonitor()
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+
+    self.assertFalse(instance.bootstrap_is_ok)
+    promise_file = os.path.join(self.base_dir, 'monitor-bootstrap-status')
+    self.assertFalse(os.path.exists(promise_file))
+    self.assertIn(
+      mock.call("ERROR: OSError('disk full') while refreshing titles of "
+                "monitors"),
+      stdout.write.mock_calls)
 
 class MonitorBootstrapTestWithoutLegacyPromiseFolder(MonitorBootstrapTest):
   monitor_conf = """[monitor]
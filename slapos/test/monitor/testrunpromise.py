@@ -120,7 +120,8 @@ class RunPromise(GenericPromise):
     with open(file_path, 'w') as cfg:
       cfg.write(config)
 
-  def getPromiseParser(self, use_config=True, check_anomaly=False, force=False):
+  def getPromiseParser(self, use_config=True, check_anomaly=False, force=False,
+      jobs=None):
 
     arg_parser = getArgumentParser()
     base_list = ['-c', self.monitor_config_file]
@@ -129,6 +130,8 @@ class RunPromise(GenericPromise):
         base_list.append('-a')
       if force:
         base_list.append('--force')
+      if jobs:
+        base_list.extend(['--jobs', str(jobs)])
       return arg_parser.parse_args(base_list)
 
     pid_path = os.path.join(self.run_dir, 'monitor-promise.pid')
@@ -419,3 +422,60 @@ class RunPromise(GenericPromise):
     self.assertTrue(result2.pop('execution-time'))
     self.assertEqual(expected_result, result2)
 
+
+  def test_promise_jobs(self):
+    self.generatePromiseScript('my_promise.py', success=True,
+                               content="import time; time.sleep(1)")
+    self.generatePromiseScript('my_second_promise.py', success=True,
+                               content="import time; time.sleep(1)")
+    self.generatePromiseScript('my_failed_promise.py', success=False)
+    self.writePromiseOK('promise_1')
+    parser = self.getPromiseParser(jobs=4)
+    promise_runner = MonitorPromiseLauncher(parser)
+    self.assertEqual(promise_runner.start(), 1)
+
+    for title, failed in (('my_promise', False),
+                          ('my_second_promise', False),
+                          ('my_failed_promise', True),
+                          ('promise_1', False)):
+      with open(os.path.join(self.output_dir, '%s.status.json' % title)) as f:
+        result = json.load(f)
+      self.assertEqual(result['result']['failed'], failed)
+
+    with open(os.path.join(self.base_dir, '.slapgrid', 'promise',
+                           'promise_timing.json')) as f:
+      report = json.load(f)
+    self.assertEqual(report['jobs'], 4)
+    self.assertEqual(sorted(q['name'] for q in report['promise-list']),
+      ['my_failed_promise.py', 'my_promise.py', 'my_second_promise.py',
+       'promise_1'])
+    # sleeping promises ran at the same time
+    self.assertLess(report['wall-time'], report['execution-time'])
+
+    # slowest promises are run by different processes on next run
+    parser = self.getPromiseParser(force=True, jobs=2)
+    promise_runner = MonitorPromiseLauncher(parser)
+    promise_runner.start()
+    with open(os.path.join(self.base_dir, '.slapgrid', 'promise',
+                           'promise_timing.json')) as f:
+      report = json.load(f)
+    worker_dict = dict((q['name'], q['worker'])
+                       for q in report['promise-list'])
+    self.assertNotEqual(worker_dict['my_promise.py'],
+                        worker_dict['my_second_promise.py'])
+    self.assertLess(report['wall-time'], report['execution-time'])
+    # legacy promises are run by one of the processes
+    self.assertEqual(sorted(set(worker_dict.values())), [0, 1])
+    # and cheap promises first in each process
+    for worker in 0, 1:
+      execution_time_list = [q['execution-time']
+        for q in report['promise-list'] if q['worker'] == worker]
+      self.assertEqual(execution_time_list, sorted(execution_time_list))
+
+  def test_promise_group_list(self):
+    promise_runner = MonitorPromiseLauncher(self.getPromiseParser())
+    self.assertEqual(promise_runner.getPromiseGroupList(
+      {'a.py': 1, 'b.py': 5, 'c.py': 4, None: 2, 'd.py': 0}, 2),
+      [['d.py', 'a.py', 'b.py'], [None, 'c.py']])
+    self.assertEqual(promise_runner.getPromiseGroupList({'a.py': 1}, 4),
+                     [['a.py']])
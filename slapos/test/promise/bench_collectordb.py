@@ -0,0 +1,147 @@
+"""
+Benchmark of the time range queries of disk promises on collector.db.
+
+Builds a synthetic database (one disk sample per minute, one folder sample
+per partition every 10 minutes) and runs the queries of
+check_free_disk_space and monitor_partition_space with conditions on
+datetime(date || ' ' || time) on collector.db, then with the conditions of
+CollectorDatabase.selectTimeRange on collector.db and on its snapshot:
+
+  python -m slapos.test.promise.bench_collectordb [day count] [partition count]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from slapos.collect.db import Database
+from slapos.promise.collectordb import (
+  CollectorDatabase,
+  ORDER_ASC,
+  ORDER_DESC,
+  closeConnections,
+)
+
+DISK_PARTITION = '/dev/sda1'
+FOLDER_PERIOD = 10
+
+
+def writeDatabase(folder, day_count, partition_count):
+  database = Database(folder, create=True)
+  database.connect()
+  end = datetime(2026, 10, 18)
+  date = end - timedelta(days=day_count)
+  disk_list = []
+  folder_list = []
+  minute = 0
+  while date < end:
+    day, hour = date.strftime('%Y-%m-%d %H:%M:%S').split()
+    disk_list.append((DISK_PARTITION, minute, 10 ** 9 - minute, day, hour))
+    if not minute % FOLDER_PERIOD:
+      folder_list.extend(('slappuser%s' % i, i * 1000 + minute, day, hour)
+                         for i in range(partition_count))
+    date += timedelta(minutes=1)
+    minute += 1
+  # the connection is in autocommit mode, insert all rows in one transaction
+  database.connection.execute("BEGIN")
+  database.connection.executemany(
+    "INSERT INTO disk (partition, used, free, mountpoint, date, time)"
+    " VALUES (?, ?, ?, '/', ?, ?)", disk_list)
+  database.connection.executemany(
+    "INSERT INTO folder (partition, disk_used, date, time)"
+    " VALUES (?, ?, ?, ?)", folder_list)
+  database.commit()
+  database.close()
+  return end, len(disk_list), len(folder_list)
+
+
+def getLegacyQueryList(end):
+  since = (end - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+  end = end.strftime('%Y-%m-%d %H:%M:%S')
+  return [
+    ("disk size", "SELECT free+used FROM disk WHERE partition='%s'"
+     " ORDER BY datetime(date || ' ' || time) DESC LIMIT 1" % DISK_PARTITION),
+    ("partition size", "SELECT disk_used*1024 FROM folder"
+     " WHERE partition='slappuser1'"
+     " ORDER BY datetime(date || ' ' || time) DESC LIMIT 1"),
+    ("biggest partitions", "SELECT partition, disk_used*1024,"
+     " max(datetime(date || ' ' || time)) FROM folder"
+     " WHERE datetime(date || ' ' || time) >= datetime('%s', '-1 days')"
+     " AND datetime(date || ' ' || time) <= datetime('%s')"
+     " GROUP BY partition ORDER BY disk_used DESC LIMIT 3" % (end, end)),
+    ("new partition samples", "SELECT disk_used FROM folder"
+     " WHERE partition='slappuser1'"
+     " AND datetime(date || ' ' || time) >= '%s'"
+     " ORDER BY date ASC, time ASC" % since),
+  ]
+
+
+def getQueryList(end):
+  since = end - timedelta(days=1)
+  return [
+    ("disk size", lambda db: db.select("disk", columns="free+used",
+      where="partition='%s'" % DISK_PARTITION, order=ORDER_DESC, limit=1)),
+    ("partition size", lambda db: db.select("folder",
+      columns="disk_used*1024", where="partition='slappuser1'",
+      order=ORDER_DESC, limit=1)),
+    ("biggest partitions", lambda db: db.selectTimeRange("folder",
+      start=since, end=end,
+      columns="partition, disk_used*1024, max(date || ' ' || time)",
+      group="partition", order="disk_used DESC", limit=3)),
+    ("new partition samples", lambda db: db.selectTimeRange("folder",
+      start=since, columns="disk_used", where="partition='slappuser1'",
+      order=ORDER_ASC)),
+  ]
+
+
+def timeQuery(run, repeat=5):
+  duration = float('inf')
+  for _ in range(repeat):
+    start = time.time()
+    result = run().fetchall()
+    duration = min(duration, time.time() - start)
+  return duration, result
+
+
+def main():
+  day_count = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+  partition_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+  folder = tempfile.mkdtemp()
+  try:
+    end, disk_count, folder_count = writeDatabase(
+      folder, day_count, partition_count)
+    print("%s days, %s partitions: %s disk rows, %s folder rows, %.1f MB" % (
+      day_count, partition_count, disk_count, folder_count,
+      os.path.getsize(os.path.join(folder, 'collector.db')) / 1e6))
+
+    legacy = Database(folder)
+    legacy.connect()
+    direct = CollectorDatabase(folder)
+    direct.connect()
+    database = CollectorDatabase(folder, snapshot_folder=folder)
+    start = time.time()
+    database.connect()
+    print("snapshot copy and indexes: %.0f ms" % (1000 * (time.time() - start)))
+    for (name, query), (_, run) in zip(getLegacyQueryList(end),
+                                       getQueryList(end)):
+      legacy_duration, legacy_result = timeQuery(
+        lambda: legacy.connection.execute(query))
+      direct_duration, direct_result = timeQuery(lambda: run(direct))
+      duration, result = timeQuery(lambda: run(database))
+      assert len(result) == len(direct_result) == len(legacy_result), name
+      print("%-22s datetime(): %8.2f ms   date/time: %8.2f ms"
+            "   date/time on snapshot: %8.2f ms" % (
+        name, 1000 * legacy_duration, 1000 * direct_duration,
+        1000 * duration))
+    legacy.close()
+    direct.close()
+    database.close()
+  finally:
+    closeConnections()
+    shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+  main()
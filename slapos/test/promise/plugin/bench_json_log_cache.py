@@ -0,0 +1,111 @@
+"""
+Benchmark of the shared JSON log window cache of Amarisoft promises.
+
+Runs sense() of the promises reading amarisoft-stats.json.log, as one
+promise run would, with and without sharing parsed lines:
+
+  python -m slapos.test.promise.plugin.bench_json_log_cache [line count]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Queue
+
+from slapos.promise.plugin import util
+from slapos.promise.plugin import (
+  check_baseband_latency,
+  check_core_network,
+  check_cpri_lock,
+  check_gps_lock,
+  check_rx_saturated,
+)
+
+STATS_PERIOD = 60
+
+RF_INFO = """TRX SDR driver 2023-09-07, API v15/18
+PCIe CPRI /dev/sdr0@1:
+  Sync: gps (locked)
+  CPRI: HW SW
+"""
+
+PROMISE_LIST = [
+  (check_baseband_latency, {}),
+  (check_core_network, {'mme-list': ['127.0.1.100'], 'amf-list': []}),
+  (check_cpri_lock, {'sdr_dev': '0', 'sfp_port': '1'}),
+  (check_gps_lock, {}),
+  (check_rx_saturated, {'max-rx-sample-db': 0.0, 'rf-rx-chan-list': '[0]'}),
+]
+
+
+def writeLog(path, line_count):
+  data = json.dumps({
+    'rf': {'rxtx_delay_min': 2.5},
+    'rf_info': RF_INFO,
+    'samples': {'rx': [{'max': -10.0}, {'max': -12.0}]},
+    's1_list': [{'address': '127.0.1.100:36412', 'state': 'setup_done'}],
+    'ng_list': [],
+    'cells': dict(('%s' % i, {'dl_bitrate': i * 1000., 'ul_bitrate': i * 10.})
+                  for i in range(20)),
+  })
+  now = datetime.now()
+  with open(path, 'w') as f:
+    for i in range(line_count, 0, -1):
+      date = now - timedelta(seconds=i)
+      f.write('{"time": "%s", "log_level": "INFO", "message": "Samples stats"'
+              ', "data": %s}\n' % (
+                date.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3], data))
+
+
+def runPromiseList(partition_folder, stats_log, shared):
+  cache_folder = os.path.join(partition_folder,
+                              util.JSON_LOG_CACHE_FOLDER_NAME)
+  shutil.rmtree(cache_folder, ignore_errors=True)
+  total = 0
+  for module, config in PROMISE_LIST:
+    # each promise runs in a new process
+    util._json_log_window_cache_dict.clear()
+    config = dict(config, **{
+      'name': module.__name__.rsplit('.', 1)[-1] + '.py',
+      'path': module.__file__,
+      'queue': Queue(),
+      'partition-folder': partition_folder,
+      'log-folder': os.path.join(partition_folder, 'log'),
+      'amarisoft-stats-log': stats_log,
+      'stats-period': STATS_PERIOD,
+    })
+    promise = module.RunPromise(config)
+    if not shared:
+      promise.get_shared_json_log_entry_interval = \
+        util.get_json_log_entry_interval
+    start = time.time()
+    promise.sense()
+    total += time.time() - start
+  return total
+
+
+def main():
+  line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  partition_folder = tempfile.mkdtemp()
+  try:
+    os.mkdir(os.path.join(partition_folder, 'log'))
+    stats_log = os.path.join(partition_folder, 'amarisoft-stats.json.log')
+    writeLog(stats_log, line_count)
+    print("%s lines, %.1f MB, stats-period %ss" % (
+      line_count, os.path.getsize(stats_log) / 1e6, STATS_PERIOD))
+    result_dict = {}
+    for shared in (False, True, False, True):
+      result_dict.setdefault(shared, []).append(
+        runPromiseList(partition_folder, stats_log, shared))
+    for shared, label in ((False, 'not shared'), (True, 'shared')):
+      print("%-12s total sense() time: %.1f ms" % (
+        label, 1000 * min(result_dict[shared])))
+  finally:
+    shutil.rmtree(partition_folder)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,133 @@
+"""
+Benchmark of the field statistics of JSON log windows (see
+get_json_log_field_statistics) used by the Amarisoft promises.
+
+Generates 24 hours of amarisoft-stats.json.log, then compares, on windows
+of increasing size, the loops over the parsed lines which the promises
+used with get_json_log_field_statistics:
+
+  python -m slapos.test.promise.plugin.bench_json_log_statistics \
+    [stats-period] [cell count] [rx channel count]
+"""
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from slapos.promise.plugin.util import (
+  get_json_log_entry_interval,
+  get_json_log_field_statistics,
+)
+
+DURATION = 24 * 3600
+
+
+def writeLog(path, stats_period, cell_count, rx_chan_count):
+  rng = random.Random(0)
+  now = datetime.now()
+  with open(path, 'w') as f:
+    for age in range(DURATION, 0, -stats_period):
+      data = {
+        'rf': {'rxtx_delay_min': rng.uniform(1, 3)},
+        'samples': {
+          'rx': [{'max': rng.uniform(-30, 0), 'rms': rng.uniform(-50, -20)}
+                 for _ in range(rx_chan_count)],
+          'tx': [{'max': rng.uniform(-30, 0), 'rms': rng.uniform(-50, -20)}
+                 for _ in range(rx_chan_count)],
+        },
+        'cells': dict(('%s' % i, {
+          'dl_bitrate': rng.uniform(0, 1e8),
+          'ul_bitrate': rng.uniform(0, 1e7),
+          'dl_use_min': rng.random(),
+          'ul_use_max': rng.random(),
+        }) for i in range(cell_count)),
+      }
+      f.write('{"time": "%s", "log_level": "INFO", "message": "Samples stats"'
+              ', "data": %s}\n' % (
+                (now - timedelta(seconds=age)).strftime(
+                  "%Y-%m-%d %H:%M:%S,%f")[:-3], json.dumps(data)))
+
+
+def computeWithLoops(entry_list, rx_chan_list, cell_list):
+  """
+    Reference implementation, with the loops of the promises.
+  """
+  max_rx_list = []
+  for _, data in entry_list:
+    rx_antenna_list = data['samples']['rx']
+    rx_list = [float(rx_antenna_list[i]['max']) for i in rx_chan_list]
+    if not max_rx_list:
+      max_rx_list = list(rx_list)
+    for i, rx in enumerate(rx_list):
+      max_rx_list[i] = max(max_rx_list[i], rx)
+  rxtx_delay_list = [float(data['rf']['rxtx_delay_min'])
+                     for _, data in entry_list]
+  dl_bitrate_list = [max(float(data['cells'][cell]['dl_bitrate'])
+                         for _, data in entry_list) for cell in cell_list]
+  return (max_rx_list, min(rxtx_delay_list), max(rxtx_delay_list),
+          dl_bitrate_list, max(timestamp for timestamp, _ in entry_list))
+
+
+def computeWithStatistics(entry_list, rx_chan_list, cell_list):
+  field_dict = dict((('rx', i), ('samples', 'rx', i, 'max'))
+                    for i in rx_chan_list)
+  field_dict['rxtx_delay_min'] = ('rf', 'rxtx_delay_min')
+  for cell in cell_list:
+    field_dict['dl_bitrate', cell] = ('cells', cell, 'dl_bitrate')
+  field_dict['time'] = None
+  statistics_dict = get_json_log_field_statistics(entry_list, field_dict)
+  return ([statistics_dict['rx', i]['max'] for i in rx_chan_list],
+          statistics_dict['rxtx_delay_min']['min'],
+          statistics_dict['rxtx_delay_min']['max'],
+          [statistics_dict['dl_bitrate', cell]['max'] for cell in cell_list],
+          statistics_dict['time']['max'])
+
+
+def timeRun(run, repeat=5):
+  duration_list = []
+  for _ in range(repeat):
+    start = time.time()
+    result = run()
+    duration_list.append(time.time() - start)
+  return result, 1000 * min(duration_list)
+
+
+def main():
+  stats_period = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  cell_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+  rx_chan_count = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+  folder = tempfile.mkdtemp()
+  try:
+    stats_log = os.path.join(folder, 'amarisoft-stats.json.log')
+    writeLog(stats_log, stats_period, cell_count, rx_chan_count)
+    print("24h log, %s lines, %.1f MB, %s cells, %s rx channels" % (
+      DURATION // stats_period, os.path.getsize(stats_log) / 1e6,
+      cell_count, rx_chan_count))
+    start = time.time()
+    import numpy
+    print("numpy import: %.1f ms" % (1000 * (time.time() - start)))
+
+    rx_chan_list = list(range(rx_chan_count))
+    cell_list = ['%s' % i for i in range(cell_count)]
+    print("%-10s %8s %10s %10s %10s" % (
+      'window', 'lines', 'read', 'loops', 'numpy'))
+    for interval in (stats_period * 2, stats_period * 5, 3600, DURATION):
+      entry_list, read = timeRun(lambda: get_json_log_entry_interval(
+        stats_log, interval), repeat=1)
+      expected, loops = timeRun(lambda: computeWithLoops(
+        entry_list, rx_chan_list, cell_list))
+      result, statistics = timeRun(lambda: computeWithStatistics(
+        entry_list, rx_chan_list, cell_list))
+      assert result == expected, (result, expected)
+      print("%-10s %8s %7.1f ms %7.1f ms %7.1f ms" % (
+        '%ss' % interval, len(entry_list), read, loops, statistics))
+  finally:
+    shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+  main()
@@ -39,7 +39,7 @@ class TestCheckAmarisoftStatsLog(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckAmarisoftStatsLog, self).setUp()
-    self.amarisoft_stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'amarisoft_stats.json.log')
+    self.amarisoft_stats_log = os.path.join(self.partition_dir, 'amarisoft_stats.json.log')
     with open(self.amarisoft_stats_log, 'w+') as f:
       f.write("""{"time": "%s", "log_level": "INFO", "message": "Amarisoft Stats", "data": {}}
 {"time": "%s", "log_level": "INFO", "message": "Amarisoft Stats", "data": {}}
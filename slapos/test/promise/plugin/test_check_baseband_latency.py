@@ -39,7 +39,7 @@ class TestCheckBasebandLatency(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckBasebandLatency, self).setUp()
-    self.amarisoft_stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'amarisoft_stats.json.log')
+    self.amarisoft_stats_log = os.path.join(self.partition_dir, 'amarisoft_stats.json.log')
     with open(self.amarisoft_stats_log, 'w+') as f:
       f.write("""{"time": "%s", "log_level": "INFO", "message": "Amarisoft Stats", "data": {"rf": {"rxtx_delay_min": %f}}}
 {"time": "%s", "log_level": "INFO", "message": "Amarisoft Stats", "data": {"rf": {"rxtx_delay_min": %f}}}
@@ -89,5 +89,17 @@ class TestCheckBasebandLatency(TestPromisePluginMixin):
     with self.assertRaises(PromiseError):
       self.launcher.run()
 
+  def test_promise_no_data(self):
+    self.writePromise(**{
+        'amarisoft-stats-log': self.amarisoft_stats_log,
+        'stats-period': 0,
+    })
+    self.configureLauncher(force=True)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    self.assertEqual(
+      self.getPromiseResult(self.promise_name)['result']['message'],
+      "No TX/RX diff data available")
+
 if __name__ == '__main__':
   unittest.main()
@@ -39,7 +39,7 @@ class TestCheckCoreNetwork(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckCoreNetwork, self).setUp()
-    self.amarisoft_stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'amarisoft_stats.json.log')
+    self.amarisoft_stats_log = os.path.join(self.partition_dir, 'amarisoft_stats.json.log')
 
   def writePromise(self, **kw):
     super(TestCheckCoreNetwork, self).writePromise(self.promise_name,
@@ -51,7 +51,7 @@ class TestCheckErrorOnHttpLog(TestPromisePluginMixin):
           old += line.replace("DATETIME", self.get_time(i+3600))
           i -= 1
 
-      with open(self.base_path + "/SOFTINST-0_" + log_file, "w") as f:
+      with open(self.partition_dir + "/SOFTINST-0_" + log_file, "w") as f:
         f.write(old)
         f.write(new)
 
@@ -78,7 +78,7 @@ extra_config_dict = {
 
   def test_no_error(self):
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_infoonly_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_infoonly_error_log",
       'maximum_delay': 0
     }
     self.writePromise(self.promise_name, content)
@@ -92,7 +92,7 @@ extra_config_dict = {
     self.assertEqual(result['result']['message'], "OK")
 
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_infoonly_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_infoonly_error_log",
       'maximum_delay': 3600
     }
     self.writePromise(self.promise_name, content)
@@ -108,7 +108,7 @@ extra_config_dict = {
 
   def test_error(self):
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_apache_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_apache_error_log",
       'maximum_delay': 0
     }
     self.writePromise(self.promise_name, content)
@@ -122,7 +122,7 @@ extra_config_dict = {
     self.assertEqual(result['result']['message'], "ERROR=2 (NOROUTE=2, UNREACHABLENET=0, TIMEOUT=0)")
 
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_apache_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_apache_error_log",
       'maximum_delay': 3600
     }
     self.writePromise(self.promise_name, content)
@@ -139,7 +139,7 @@ extra_config_dict = {
 
   def test_error_timeout(self):
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_timeout_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_timeout_error_log",
       'maximum_delay': 0
     }
     self.writePromise(self.promise_name, content)
@@ -153,7 +153,7 @@ extra_config_dict = {
     self.assertEqual(result['result']['message'], "ERROR=4 (NOROUTE=0, UNREACHABLENET=0, TIMEOUT=4)")
 
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_timeout_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_timeout_error_log",
       'maximum_delay': 3600
     }
     self.writePromise(self.promise_name, content)
@@ -170,7 +170,7 @@ extra_config_dict = {
 
   def test_error_unreacheabler(self):
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_unreachable_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_unreachable_error_log",
       'maximum_delay': 0
     }
     self.writePromise(self.promise_name, content)
@@ -184,7 +184,7 @@ extra_config_dict = {
     self.assertEqual(result['result']['message'], "ERROR=11 (NOROUTE=0, UNREACHABLENET=11, TIMEOUT=0)")
 
     content = self.base_content % {
-      'log_file': self.base_path + "/SOFTINST-0_unreachable_error_log",
+      'log_file': self.partition_dir + "/SOFTINST-0_unreachable_error_log",
       'maximum_delay': 3600
     }
     self.writePromise(self.promise_name, content)
@@ -199,5 +199,24 @@ extra_config_dict = {
     self.assertEqual(result['result']['failed'], True)
     self.assertEqual(result['result']['message'], "ERROR=11 (NOROUTE=0, UNREACHABLENET=11, TIMEOUT=0)")
 
+  def test_error_followed_by_notice(self):
+    log_file = self.partition_dir + "/SOFTINST-0_apache_error_log"
+    content = self.base_content % {
+      'log_file': log_file,
+      'maximum_delay': 0
+    }
+    self.writePromise(self.promise_name, content)
+
+    self.configureLauncher(force=True, enable_anomaly=True)
+    self.launcher.run()
+    # errors are still in the last 4096 bytes of the log
+    with open(log_file, "a") as f:
+      f.write("[%s] [notice] caught SIGTERM, shutting down\n" % self.get_time(0))
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    self.assertEqual(result['result']['failed'], True)
+    self.assertEqual(result['result']['message'], "ERROR=2 (NOROUTE=2, UNREACHABLENET=0, TIMEOUT=0)")
+
 if __name__ == '__main__':
   unittest.main()
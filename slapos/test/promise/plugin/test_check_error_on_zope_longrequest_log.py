@@ -37,7 +37,7 @@ class TestCheckErrorOnZopeLongrequestLog(TestPromisePluginMixin):
     TestPromisePluginMixin.setUp(self)
     self.promise_name = "check-error-on-zope_longrequest-log.py"
     self.log_file = self.base_path + "/longrequest_logger_zope.log"
-    self.test_log_file = self.base_path + "/SOFTINST-0_longrequest_logger_zope.log"
+    self.test_log_file = self.partition_dir + "/SOFTINST-0_longrequest_logger_zope.log"
     self._update_logs()
 
   def get_time(self, sec):
@@ -28,7 +28,19 @@
 from slapos.test.promise.plugin import TestPromisePluginMixin
 from slapos.grid.promise import PromiseError
 import os
+import json
+import mock
 import sqlite3
+import unittest
+import warnings
+import numpy as np
+import pandas as pd
+from six.moves import queue
+from slapos.promise.collectordb import CollectorDatabase, \
+  SNAPSHOT_FILE_NAME, closeConnections
+from slapos.promise.plugin.check_free_disk_space import RunPromise, \
+  DiskSpaceForecaster, SharedForecastCache, FORECAST_CACHE_FILE_NAME, \
+  FORECAST_CACHE_FOLDER_NAME
 from slapos.grid.promise import PromiseError
 
 class TestCheckFreeDiskSpace(TestPromisePluginMixin):
@@ -60,6 +72,7 @@ extra_config_dict = {
 
   def tearDown(self):
     TestPromisePluginMixin.tearDown(self)
+    closeConnections()
     if os.path.exists(self.db_file):
       os.remove(self.db_file)
 
@@ -130,6 +143,46 @@ The partition slappart1 uses 20.87 G (date checked: 2017-10-02 09:17:00).
 Free disk space low: remaining 269.10 G (disk size: 417 G, threshold: 278 G)."""
     self.assertIn(message, result['result']['message'])
 
+  def test_snapshot_older_than_checked_minute(self):
+    snapshot_folder = os.path.join(self.partition_dir, 'snapshot')
+    os.mkdir(snapshot_folder)
+    # the snapshot is copied before the collector writes the checked minute
+    conn = sqlite3.connect(self.db_file)
+    row_list = conn.execute("SELECT * FROM disk WHERE date='2017-10-02'"
+                            " AND time LIKE '09:17:%'").fetchall()
+    self.assertTrue(row_list)
+    conn.execute("DELETE FROM disk WHERE date='2017-10-02'"
+                 " AND time LIKE '09:17:%'")
+    conn.commit()
+    CollectorDatabase(os.path.dirname(self.db_file),
+                      snapshot_folder=snapshot_folder).getReadPath()
+    snapshot_file = os.path.join(snapshot_folder, SNAPSHOT_FILE_NAME)
+    snapshot_mtime = os.stat(snapshot_file).st_mtime_ns
+    conn.executemany("INSERT INTO disk VALUES (%s)" % ', '.join(
+      '?' * len(row_list[0])), row_list)
+    conn.commit()
+    conn.close()
+
+    content = """from slapos.promise.plugin.check_free_disk_space import RunPromise
+
+extra_config_dict = {
+  'collectordb': '%(collectordb)s',
+  'collectordb-snapshot-folder': '%(snapshot_folder)s',
+  'test-check-date': '2017-10-02',
+  'threshold': '278',
+}
+""" % {'collectordb': self.db_file, 'snapshot_folder': snapshot_folder}
+    self.writePromise(self.promise_name, content)
+    self.configureLauncher(timeout=20)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    # the disk is checked, not skipped
+    self.assertEqual(result['result']['failed'], True)
+    self.assertIn("Free disk space low: remaining 269.10 G",
+                  result['result']['message'])
+    self.assertEqual(os.stat(snapshot_file).st_mtime_ns, snapshot_mtime)
+
   def test_display_prediction(self):
     content = """from slapos.promise.plugin.check_free_disk_space import RunPromise
 
@@ -146,6 +199,9 @@ extra_config_dict = {
     result = self.getPromiseResult(self.promise_name)
     self.assertEqual(result['result']['failed'], False)
     self.assertIn("Prediction:", result['result']['message'])
+    # the forecast was computed, not taken from the cache
+    self.assertIn("Forecast cache: 0 hits, 1 fits.",
+                  result['result']['message'])
 
   def test_check_free_disk_with_unicode_string_path(self):
     # set path unicode
@@ -155,6 +211,258 @@ extra_config_dict = {
     result = self.getPromiseResult(self.promise_name)
     self.assertEqual(result['result']['failed'], False)
     self.assertIn("Current disk usage: OK", result['result']['message'])
+  def getPromise(self, partition_folder=None, **kw):
+    return RunPromise(dict(kw,
+      queue=queue.Queue(),
+      name=self.promise_name,
+      path=os.path.join(self.plugin_dir, self.promise_name),
+      **{'partition-folder': partition_folder or self.partition_dir,
+         'log-folder': self.log_dir}))
+
+  def test_prediction_state(self):
+    promise = self.getPromise()
+    fcast, lower, upper = promise.diskSpacePrediction(
+      '/dev/sda1', self.db_file, '2017-10-02', '09:17', 10)
+    self.assertEqual(str(fcast.index[0]), '2017-10-03')
+    self.assertEqual(len(fcast), 11)
+    state = promise.loadForecastState()['state']['/dev/sda1']
+    self.assertEqual(state['count'], 15)
+    self.assertEqual(state['last-date'], '2017-10-02 09:17:01')
+
+    # only the new day is read from the database
+    conn = sqlite3.connect(self.db_file)
+    conn.execute("INSERT INTO disk VALUES('/dev/sda1', '159220666368', "
+                 "'278948396032', '/', '2017-10-03', '09:17:01', 1)")
+    conn.commit()
+    conn.close()
+    fcast, lower, upper = promise.diskSpacePrediction(
+      '/dev/sda1', self.db_file, '2017-10-03', '09:17', 10)
+    state = promise.loadForecastState()['state']['/dev/sda1']
+    self.assertEqual(state['count'], 16)
+    self.assertEqual(str(fcast.index[0]), '2017-10-04')
+    self.assertTrue((fcast < 278948396032).all())
+
+    # a run at another time of the day updates the same state with the
+    # data of the time of the state
+    conn = sqlite3.connect(self.db_file)
+    conn.execute("INSERT INTO disk VALUES('/dev/sda1', '159220666368', "
+                 "'278948396032', '/', '2017-10-04', '09:17:01', 1)")
+    conn.execute("INSERT INTO disk VALUES('/dev/sda1', '159220666368', "
+                 "'1', '/', '2017-10-04', '10:42:01', 1)")
+    conn.commit()
+    conn.close()
+    fcast, lower, upper = promise.diskSpacePrediction(
+      '/dev/sda1', self.db_file, '2017-10-04', '10:42', 10)
+    state_dict = promise.loadForecastState()['state']
+    self.assertEqual(list(state_dict), ['/dev/sda1'])
+    self.assertEqual(state_dict['/dev/sda1']['count'], 17)
+    self.assertEqual(state_dict['/dev/sda1']['time'], '09:17')
+    self.assertEqual(state_dict['/dev/sda1']['last-date'],
+                     '2017-10-04 09:17:01')
+    self.assertEqual(str(fcast.index[0]), '2017-10-05')
+
+  def test_prediction_state_save(self):
+    promise = self.getPromise()
+    state_dict = {
+      '/dev/sdb1': {'last-date': '2017-10-02 09:17:01'},
+      '/dev/sdc1': {'last-date': '2017-09-25 08:00:01'},
+      '/dev/sdd1': {'last-date': '2017-09-24 07:00:01'},
+    }
+    promise.saveForecastState({'version': 1, 'state': state_dict})
+    # states not updated for a week are removed
+    self.assertEqual(sorted(promise.loadForecastState()['state']),
+                     ['/dev/sdb1', '/dev/sdc1'])
+    # only the most recently updated states are kept
+    state_dict = dict(('/dev/sd%s' % i, {'last-date': '2017-10-02 09:%02d' % i})
+                      for i in range(20))
+    with mock.patch('slapos.promise.plugin.check_free_disk_space.'
+                    'FORECAST_STATE_MAX_COUNT', 3):
+      promise.saveForecastState({'version': 1, 'state': state_dict})
+    self.assertEqual(sorted(promise.loadForecastState()['state']),
+                     ['/dev/sd17', '/dev/sd18', '/dev/sd19'])
+
+    # the state is not saved if it cannot be written
+    state_file = os.path.join(self.partition_dir,
+      '.slapgrid/promise/disk-space-forecast.json')
+    os.mkdir(state_file + '.tmp')
+    promise.saveForecastState({'version': 1, 'state': {}})
+    self.assertEqual(len(promise.loadForecastState()['state']), 3)
+    fcast, lower, upper = promise.diskSpacePrediction(
+      '/dev/sda1', self.db_file, '2017-10-02', '09:17', 10)
+    self.assertEqual(len(fcast), 11)
+
+  def test_shared_forecast_cache(self):
+    cache_folder = os.path.join(self.partition_dir, 'forecast-cache')
+    cache_file = os.path.join(cache_folder,
+                              FORECAST_CACHE_FILE_NAME % os.getuid())
+    def predict(promise, date, day_range=10):
+      result = promise.diskSpacePrediction(
+        '/dev/sda1', self.db_file, date, '09:17', day_range)
+      with open(cache_file) as f:
+        cache = json.load(f)
+      return result, (cache['hit-count'], cache['fit-count'])
+
+    # the cache is in the partition by default
+    self.getPromise().diskSpacePrediction(
+      '/dev/sda1', self.db_file, '2017-10-02', '09:17', 10)
+    default_cache_file = os.path.join(
+      self.partition_dir, '.slapgrid', 'promise',
+      FORECAST_CACHE_FILE_NAME % os.getuid())
+    # only writable by its owner
+    self.assertFalse(os.stat(default_cache_file).st_mode & 0o022)
+
+    promise = self.getPromise(**{'forecast-cache-folder': cache_folder})
+    (fcast, lower, upper), metrics = predict(promise, '2017-10-02')
+    self.assertEqual(metrics, (0, 1))
+    self.assertFalse(os.stat(cache_file).st_mode & 0o022)
+
+    # promise of another partition reuses the forecast
+    other_partition = os.path.join(self.partition_dir, 'other')
+    os.mkdir(other_partition)
+    other_promise = self.getPromise(other_partition,
+      **{'forecast-cache-folder': cache_folder})
+    (other_fcast, other_lower, other_upper), metrics = predict(
+      other_promise, '2017-10-02')
+    self.assertEqual(metrics, (1, 1))
+    pd.testing.assert_series_equal(fcast, other_fcast)
+    np.testing.assert_array_equal(upper, other_upper)
+    self.assertFalse(os.path.exists(os.path.join(
+      other_partition, '.slapgrid')))
+    (short_fcast, _, _), metrics = predict(other_promise, '2017-10-02', 5)
+    self.assertEqual(metrics, (2, 1))
+    pd.testing.assert_series_equal(fcast[:6], short_fcast)
+
+    # forecast for more days, or for a new day, is computed again
+    _, metrics = predict(other_promise, '2017-10-02', 20)
+    self.assertEqual(metrics, (2, 2))
+    _, metrics = predict(promise, '2017-10-03')
+    self.assertEqual(metrics, (2, 3))
+    with open(cache_file) as f:
+      cache = json.load(f)
+    self.assertEqual(len(cache['forecast-dict']), 1)
+
+    # files of other users are only used if they own them
+    forecast, = cache['forecast-dict'].values()
+    forecast['mean'] = [0] * len(forecast['mean'])
+    with open(os.path.join(cache_folder,
+        FORECAST_CACHE_FILE_NAME % (os.getuid() + 1)), 'w') as f:
+      json.dump(cache, f)
+    os.remove(cache_file)
+    (fcast, _, _), metrics = predict(promise, '2017-10-03')
+    self.assertEqual(metrics, (0, 1))
+    self.assertTrue((fcast > 0).all())
+
+  def test_shared_forecast_cache_default_folder(self):
+    database_folder = os.path.join(self.partition_dir, 'collector')
+    os.mkdir(database_folder)
+    database = os.path.join(database_folder, 'collector.db')
+    shared_folder = os.path.join(database_folder, FORECAST_CACHE_FOLDER_NAME)
+    default_folder = os.path.join(self.partition_dir, '.slapgrid', 'promise')
+    promise = self.getPromise()
+    # not provisioned: forecasts are not shared
+    self.assertEqual(promise.getForecastCacheFolder(database), default_folder)
+    # provisioned by the owner of the collector database folder
+    os.mkdir(shared_folder)
+    os.chmod(shared_folder, 0o1770)
+    self.assertEqual(promise.getForecastCacheFolder(database), shared_folder)
+    self.assertEqual(promise.getForecastCacheFolder(database_folder + '/'),
+                     shared_folder)
+    # the option is used first
+    self.assertEqual(self.getPromise(**{
+      'forecast-cache-folder': self.partition_dir,
+    }).getForecastCacheFolder(database), self.partition_dir)
+    # writable by all users
+    os.chmod(shared_folder, 0o1777)
+    self.assertEqual(promise.getForecastCacheFolder(database), default_folder)
+    os.chmod(shared_folder, 0o1770)
+    # owned by another user
+    with mock.patch('os.lstat', return_value=mock.Mock(
+        st_mode=0o41770, st_uid=os.getuid() + 1)):
+      self.assertFalse(SharedForecastCache.isSharedFolder(
+        shared_folder, os.getuid()))
+    self.assertTrue(SharedForecastCache.isSharedFolder(
+      shared_folder, os.getuid()))
+    # symbolic link
+    os.rename(shared_folder, shared_folder + '.target')
+    os.symlink(shared_folder + '.target', shared_folder)
+    self.assertEqual(promise.getForecastCacheFolder(database), default_folder)
+
+  def test_shared_forecast_cache_permission(self):
+    cache_folder = os.path.join(self.partition_dir, 'forecast-cache')
+    os.mkdir(cache_folder)
+    promise = self.getPromise(**{'forecast-cache-folder': cache_folder})
+    cache = SharedForecastCache(cache_folder)
+    with open(os.path.join(cache_folder,
+        FORECAST_CACHE_FILE_NAME % (os.getuid() + 1)), 'w') as f:
+      json.dump(cache.load(), f)
+    with mock.patch('os.stat', side_effect=lambda path: mock.Mock(
+        st_mode=0o40755, st_uid=os.getuid() + 1)):
+      self.assertEqual(len(list(cache.iterOtherForecastDict())), 1)
+    # files of other users are not trusted if anybody can write them
+    os.chmod(cache_folder, 0o1777)
+    self.assertEqual(list(cache.iterOtherForecastDict()), [])
+
+    # the lock does not follow symbolic links
+    target = os.path.join(self.partition_dir, 'target')
+    os.symlink(target, cache.cache_file + '.lock')
+    fcast, _, _ = promise.diskSpacePrediction(
+      '/dev/sda1', self.db_file, '2017-10-02', '09:17', 10)
+    self.assertEqual(len(fcast), 11)
+    self.assertFalse(os.path.exists(target))
+    self.assertFalse(os.path.exists(cache.cache_file))
+
+
+class TestDiskSpaceForecaster(unittest.TestCase):
+
+  def getSeries(self):
+    random = np.random.RandomState(0)
+    return {
+      'linear': 300e9 - 2e9 * np.arange(70) + random.normal(0, 1e9, 70),
+      'step': 300e9 - 1e9 * np.arange(70) - 20e9 * (np.arange(70) > 40) +
+        random.normal(0, 5e8, 70),
+      'random walk': 300e9 + np.cumsum(random.normal(-1e9, 2e9, 70)),
+    }
+
+  def test_incremental_update(self):
+    value_list = self.getSeries()['random walk']
+    forecaster = DiskSpaceForecaster()
+    forecaster.update(value_list)
+    incremental_forecaster = DiskSpaceForecaster()
+    for value in value_list:
+      incremental_forecaster = DiskSpaceForecaster(incremental_forecaster.state)
+      incremental_forecaster.update([value])
+    np.testing.assert_allclose(forecaster.forecast(10),
+                               incremental_forecaster.forecast(10))
+
+  def test_constant(self):
+    forecaster = DiskSpaceForecaster()
+    forecaster.update([288948396032.] * 14)
+    mean, lower, upper = forecaster.forecast(11)
+    np.testing.assert_allclose(mean, [288948396032.] * 11)
+    np.testing.assert_allclose(lower, mean)
+    np.testing.assert_allclose(upper, mean)
+
+  def test_accuracy(self):
+    try:
+      from statsmodels.tsa.arima.model import ARIMA
+    except ImportError:
+      self.skipTest("statsmodels is not installed")
+    for name, value_list in self.getSeries().items():
+      train, test = value_list[:60], value_list[60:]
+      forecaster = DiskSpaceForecaster()
+      forecaster.update(train)
+      mean, lower, upper = forecaster.forecast(10)
+      df = pd.DataFrame({'free': train}, index=pd.period_range(
+        '2026-01-01', periods=60, freq='D'))
+      with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        arima_mean = ARIMA(df, order=(1, 1, 0), trend='t').fit(
+          ).get_forecast(10).predicted_mean.values
+      error = np.abs(mean - test).mean()
+      arima_error = np.abs(arima_mean - test).mean()
+      self.assertLess(error, arima_error * 1.1, name)
+      self.assertTrue(((lower <= test) & (test <= upper)).all(), name)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -42,7 +42,7 @@ class TestCheckGPSLock(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckGPSLock, self).setUp()
-    self.amarisoft_stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'amarisoft_stats.json.log')
+    self.amarisoft_stats_log = os.path.join(self.partition_dir, 'amarisoft_stats.json.log')
 
     rf_info = \
 """
@@ -21,9 +21,7 @@ class TestCheckOruConfigLog(TestPromisePluginMixin):
             % (RunPromise.__module__, RunPromise.__name__, kw))
 
     def test_promise_success(self):
-        self.config_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.log')
-        if os.path.exists(self.config_log):
-            os.remove(self.config_log)
+        self.config_log = os.path.join(self.partition_dir, 'config.log')
         with open(self.config_log, 'w+') as f:
             f.write("""2023-05-23 04:32:48,867 [INFO] Sending edit-config RPC request...
 2023-05-23 04:32:49,111 [INFO] Edit-config RPC request sent successfully
@@ -36,9 +34,7 @@ class TestCheckOruConfigLog(TestPromisePluginMixin):
         self.launcher.run()
 
     def test_promise_fail(self):
-        self.config_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.log')
-        if os.path.exists(self.config_log):
-            os.remove(self.config_log)
+        self.config_log = os.path.join(self.partition_dir, 'config.log')
         with open(self.config_log, 'w') as f:
             f.write("""2023-05-23 04:32:20,110 [INFO] Connecting to ('2a11:9ac1:6:800a::1', 830), user oranuser...
 2023-05-23 04:32:48,863 [INFO] Connection to ('2a11:9ac1:6:800a::1', 830) successful
@@ -40,7 +40,7 @@ class TestCheckOruLOFSuccess(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckOruLOFSuccess, self).setUp()
-    self.netconf_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'netconf.json.log')
+    self.netconf_log = os.path.join(self.partition_dir, 'netconf.json.log')
 
   def writePromise(self, **kw):
     super(TestCheckOruLOFSuccess, self).writePromise(self.promise_name,
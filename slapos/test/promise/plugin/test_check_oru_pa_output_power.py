@@ -40,7 +40,7 @@ class TestCheckOruPAOutputPowerSuccess(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckOruPAOutputPowerSuccess, self).setUp()
-    self.netconf_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'netconf.json.log')
+    self.netconf_log = os.path.join(self.partition_dir, 'netconf.json.log')
 
   def writePromise(self, **kw):
     super(TestCheckOruPAOutputPowerSuccess, self).writePromise(self.promise_name,
@@ -21,9 +21,7 @@ class TestCheckOruConfigLog(TestPromisePluginMixin):
             % (RunPromise.__module__, RunPromise.__name__, kw))
 
     def test_promise_success(self):
-        self.stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stats.log')
-        if os.path.exists(self.stats_log):
-            os.remove(self.stats_log)
+        self.stats_log = os.path.join(self.partition_dir, 'stats.log')
         with open(self.stats_log, 'w+') as f:
             f.write("""2023-05-23 04:32:46,350 [INFO] Connecting to ('2a11:9ac1:6:800a::1', 830), user oranuser...
 2023-05-23 04:32:48,830 [INFO] Connection to ('2a11:9ac1:6:800a::1', 830) successful
@@ -42,9 +40,7 @@ class TestCheckOruConfigLog(TestPromisePluginMixin):
         self.launcher.run()
 
     def test_promise_fail(self):
-        self.stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stats.log')
-        if os.path.exists(self.stats_log):
-            os.remove(self.stats_log)
+        self.stats_log = os.path.join(self.partition_dir, 'stats.log')
         with open(self.stats_log, 'w') as f:
             f.write("""
 2023-05-23 04:32:33,230 [INFO] Connecting to ('2a11:9ac1:6:800a::1', 830), user oranuser...
@@ -39,7 +39,7 @@ class TestCheckRXSaturated(TestPromisePluginMixin):
 
   def setUp(self):
     super(TestCheckRXSaturated, self).setUp()
-    self.amarisoft_stats_log = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'amarisoft_stats.json.log')
+    self.amarisoft_stats_log = os.path.join(self.partition_dir, 'amarisoft_stats.json.log')
     with open(self.amarisoft_stats_log, 'w+') as f:
       f.write("""{"time": "%s", "log_level": "INFO", "message": "Amarisoft Stats", "data": {"samples": {"rx": [{"max": %f}, {"max": %f}]}}}
 {"time": "%s", "log_level": "INFO", "message": "Amarisoft Stats", "data": {"samples": {"rx": [{"max": %f}, {"max": %f}]}}}
@@ -78,5 +78,17 @@ class TestCheckRXSaturated(TestPromisePluginMixin):
     with self.assertRaises(PromiseError):
       self.launcher.run()
 
+  def test_promise_fail_newest(self):
+    # only the newest line is in the window
+    self.writePromise(**{
+        'amarisoft-stats-log': self.amarisoft_stats_log,
+        'stats-period': 4,
+        'max-rx-sample-db': -7.0,
+        'rf-rx-chan-list': '[1]',
+    })
+    self.configureLauncher(force=True)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,10 +1,13 @@
 from slapos.grid.promise import PromiseError
 from slapos.test.promise.plugin import TestPromisePluginMixin
+from slapos.promise.plugin.check_surykatka_json import \
+  SURYKATKA_INDEX_FOLDER_NAME, SurykatkaIndex
 
 import email
 import json
 import os
 import shutil
+import sqlite3
 import tempfile
 import time
 
@@ -1126,6 +1129,62 @@ class TestCheckSurykatkaJSONHttpQueryWhois(CheckSurykatkaJSONMixin):
       "whois: OK whois3.com expires in > 2 days"
     )
 
+  def test_index(self):
+    self.writeSurykatkaPromise(
+      {
+        'url': 'https://www.whois3.com/',
+        'domain-expiration-days': '2',
+      }
+    )
+    self.runAndAssertPassedMessage(
+      "https://www.whois3.com/ : "
+      "whois: OK whois3.com expires in > 2 days"
+    )
+    index_folder = os.path.join(
+      self.partition_dir, SURYKATKA_INDEX_FOLDER_NAME)
+    index_file, = [q for q in os.listdir(index_folder) if q.endswith('.db')]
+
+    # the index is built again when the JSON is updated
+    self.writeSurykatkaJson({
+      "whois": [
+        {
+            "domain": "whois3.com",
+            "expiration_date": self.time_past29d,
+        },
+      ]
+    })
+    self.configureLauncher(enable_anomaly=True, force=True)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    self.assertFailedMessage(
+      self.getPromiseResult(self.promise_name),
+      "https://www.whois3.com/ : "
+      "whois: ERROR whois3.com expires in < 2 days")
+
+    # and when it is broken
+    with open(os.path.join(index_folder, index_file), 'w') as f:
+      f.write('broken')
+    self.configureLauncher(enable_anomaly=True, force=True)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    self.assertFailedMessage(
+      self.getPromiseResult(self.promise_name),
+      "https://www.whois3.com/ : "
+      "whois: ERROR whois3.com expires in < 2 days")
+
+  def test_index_close(self):
+    self.writeSurykatkaJson({"whois": [{"domain": "whois3.com"}]})
+    index = SurykatkaIndex(
+      os.path.join(self.partition_dir, 'index.db'), self.json_file)
+    self.assertTrue(index.load())
+    self.assertEqual(index.getEntryList('whois', ['whois3.com']),
+                     [{"domain": "whois3.com"}])
+    connection = index.connection
+    index.close()
+    self.assertIsNone(index.connection)
+    self.assertRaises(sqlite3.ProgrammingError, connection.execute,
+                      "SELECT 1")
+
   def test_expired_expires_2_day(self):
     self.writeSurykatkaPromise(
       {
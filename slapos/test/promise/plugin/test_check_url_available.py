@@ -627,6 +627,116 @@ class TestCheckUrlAvailable(CheckUrlAvailableMixin):
       self.authenticated_ignored_success_template % (url,)
     )
 
+class TestCheckUrlAvailableProbeFolder(CheckUrlAvailableMixin):
+
+  def setUp(self):
+    CheckUrlAvailableMixin.setUp(self)
+    self.probe_folder = os.path.join(self.partition_dir, 'probe')
+
+  def writeProbePromise(self, promise_name, option_dict):
+    option_dict = dict(option_dict, **{
+      'probe-folder': self.probe_folder,
+      'timeout': 10,
+    })
+    self.writePromise(promise_name, self.make_content(option_dict))
+
+  def test_check_shared(self):
+    url_dict = {
+      'check-200.py': HTTPS_ENDPOINT + '200',
+      'check-401.py': HTTPS_ENDPOINT + '401',
+    }
+    for promise_name, url in url_dict.items():
+      self.writeProbePromise(promise_name, {'url': url})
+    self.configureLauncher(timeout=5)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    result = self.getPromiseResult('check-200.py')
+    self.assertEqual(result['result']['failed'], False)
+    self.assertEqual(
+      result['result']['message'],
+      self.success_template % (url_dict['check-200.py'], 200))
+    result = self.getPromiseResult('check-401.py')
+    self.assertEqual(result['result']['failed'], True)
+    self.assertEqual(
+      result['result']['message'],
+      ("non-authenticated request to %r failed "
+       "(returned 401, expected 200)") % (url_dict['check-401.py'],))
+
+    # both URLs were probed at once by the first promise
+    with open(os.path.join(self.probe_folder, 'result.json')) as f:
+      probe_result_dict = json.load(f)
+    self.assertEqual(
+      sorted(q['url'] for q in probe_result_dict.values()),
+      sorted(url_dict.values()))
+    for probe_result in probe_result_dict.values():
+      self.assertEqual(
+        sorted(probe_result['timing']),
+        ['connect', 'dns', 'tls', 'total', 'ttfb'])
+
+  def test_check_shared_authenticate(self):
+    url = HTTPS_ENDPOINT + '!200'
+    self.writeProbePromise(self.promise_name, {
+      'url': url,
+      'username': TEST_GOOD_USERNAME,
+      'password': TEST_GOOD_PASSWORD,
+      'ca-cert-file': self.test_server_ca_certificate_file.name,
+    })
+    self.configureLauncher(timeout=5)
+    self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    self.assertEqual(result['result']['failed'], False)
+    self.assertEqual(
+      result['result']['message'],
+      self.authenticated_success_template % (url, 200))
+
+  def test_check_shared_url_credentials(self):
+    # like requests, credentials of the url are sent, and they are not
+    # written in the probe folder
+    url = HTTPS_ENDPOINT.replace('https://', 'https://%s:%s@' % (
+      TEST_GOOD_USERNAME.replace(' ', '%20'),
+      TEST_GOOD_PASSWORD.replace(' ', '%20'))) + '!200'
+    self.writeProbePromise(self.promise_name, {
+      'url': url,
+      'ca-cert-file': self.test_server_ca_certificate_file.name,
+    })
+    self.configureLauncher(timeout=5)
+    self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    self.assertEqual(result['result']['failed'], False)
+    self.assertEqual(
+      result['result']['message'], self.success_template % (url, 200))
+    for root, _, name_list in os.walk(self.probe_folder):
+      for name in name_list:
+        with open(os.path.join(root, name)) as f:
+          self.assertNotIn('password', f.read())
+
+  def test_check_shared_verify_fail(self):
+    url = HTTPS_ENDPOINT + '200'
+    self.writeProbePromise(self.promise_name, {'url': url, 'verify': 1})
+    self.configureLauncher(timeout=5)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    self.assertEqual(result['result']['failed'], True)
+    self.assertIn('ERROR SSL error while accessing %r' % (url, ),
+                  result['result']['message'])
+    self.assertIn('CERTIFICATE_VERIFY_FAILED', result['result']['message'])
+
+  def test_check_shared_site_off(self):
+    self.writeProbePromise(self.promise_name, {
+      'url': 'https://localhost:56789/site'})
+    self.configureLauncher(timeout=5)
+    with self.assertRaises(PromiseError):
+      self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    self.assertEqual(result['result']['failed'], True)
+    self.assertEqual(
+      result['result']['message'],
+      "ERROR connection not possible while accessing "
+      "'https://localhost:56789/site'"
+    )
+
+
 class TestCheckUrlAvailableTimeout(CheckUrlAvailableMixin):
   def test_check_200_timeout(self):
     url = HTTPS_ENDPOINT + '200_5'
@@ -697,6 +807,23 @@ class TestCheckUrlAvailableRedirect(CheckUrlAvailableMixin):
       self.success_template % (url, 302)
     )
 
+  def test_check_redirected_follow_redirect_shared(self):
+    url = HTTPS_ENDPOINT
+    content = self.make_content({
+      'url': url,
+      'http-code': '200',
+      'probe-folder': os.path.join(self.partition_dir, 'probe'),
+    })
+    self.writePromise(self.promise_name, content)
+    self.configureLauncher(timeout=5)
+    self.launcher.run()
+    result = self.getPromiseResult(self.promise_name)
+    self.assertEqual(result['result']['failed'], False)
+    self.assertEqual(
+      result['result']['message'],
+      self.success_template % (url, 200)
+    )
+
 
 if __name__ == '__main__':
   unittest.main()
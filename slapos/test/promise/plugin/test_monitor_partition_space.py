@@ -30,7 +30,13 @@ from slapos.grid.promise import PromiseError
 import os
 import sqlite3
 import psutil
+import numpy as np
+import pandas as pd
+from six.moves import queue
+from slapos.promise.collectordb import closeConnections
 from slapos.grid.promise import PromiseError
+from slapos.promise.plugin.monitor_partition_space import RunPromise, \
+  getRollingMedianMAD
 
 class TestMonitorPartitionSpace(TestPromisePluginMixin):
 
@@ -53,6 +59,7 @@ class TestMonitorPartitionSpace(TestPromisePluginMixin):
           disk_partition = p.device
           break
 
+    self.disk_partition = disk_partition
     self.db_file = '/tmp/collector.db'
 
     # populate db
@@ -77,6 +84,7 @@ extra_config_dict = {
 
   def tearDown(self):
     TestPromisePluginMixin.tearDown(self)
+    closeConnections()
     if os.path.exists(self.db_file):
       os.remove(self.db_file)
 
@@ -162,6 +170,50 @@ extra_config_dict = {
     msg = "Anomaly detected on 2017-10-02 09:30:00. Space used by slapuser0: %.2f G."
     self.assertIn(msg % (87533020.0/(1024*1024)), result['result']['message'])
 
+  def test_rolling_median_mad(self):
+    values = np.random.RandomState(0).normal(size=1000).round(2)
+    values[100:110] = np.nan
+    series = pd.Series(values)
+    mad = lambda x: np.median(np.fabs(x - np.median(x)))
+    expected_median = series.rolling(window=288).median().values
+    expected_mad = series.rolling(window=288).apply(mad).values
+    median, mad = getRollingMedianMAD(values, 288)
+    np.testing.assert_array_equal(median, expected_median)
+    np.testing.assert_array_equal(mad, expected_mad)
+    median, mad = getRollingMedianMAD(values, 288, start=500)
+    np.testing.assert_array_equal(median, expected_median[500:])
+    np.testing.assert_array_equal(mad, expected_mad[500:])
+
+  def test_anomaly_cache(self):
+    promise = RunPromise({
+      'queue': queue.Queue(),
+      'name': self.promise_name,
+      'path': os.path.join(self.plugin_dir, self.promise_name),
+      'partition-folder': self.partition_dir,
+      'log-folder': self.log_dir,
+    })
+    def getAnomaly(time):
+      return promise.getAnomaly(self.disk_partition, self.db_file,
+                                'slapuser0', '2017-10-02', time)
+    getAnomaly('09:30:30')
+    cache_file = promise.getSeriesCacheFile('slapuser0')
+    self.assertTrue(os.path.exists(cache_file))
+
+    # new samples, in the last cached interval and after
+    conn = sqlite3.connect(self.db_file)
+    conn.executemany("INSERT INTO folder VALUES('slapuser0', ?, ?, ?, 1)", [
+      (87633020.0, '2017-10-02', '09:33:00'),
+      (87733020.0, '2017-10-02', '10:12:00'),
+      (87833020.0, '2017-10-02', '11:01:00'),
+    ])
+    conn.commit()
+    conn.close()
+    data = getAnomaly('11:01:30')
+    self.assertEqual(str(data.index[-1]), '2017-10-02 11:00:00')
+
+    os.remove(cache_file)
+    pd.testing.assert_frame_equal(data, getAnomaly('11:01:30'))
+
 
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,578 @@
+import gzip
+import io
+import os
+import json
+import logging
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import mock
+
+from slapos import gzipindex
+
+from slapos.promise.plugin.util import (
+  JSONLogAggregate,
+  JSONLogAggregateHandler,
+  JSONLogTimeIndex,
+  JSONLogWindowCache,
+  LogMinuteCounter,
+  NetconfAlarmIndex,
+  _get_json_log_entry_interval,
+  get_json_log_data_interval,
+  get_json_log_entry_interval,
+  get_json_log_field_array_dict,
+  get_json_log_field_statistics,
+  get_value_statistics,
+  get_json_log_latest_timestamp,
+  iter_reverse_lines,
+  parse_log_time,
+)
+
+
+class TestIterReverseLines(unittest.TestCase):
+
+  def assertReverseLines(self, content):
+    expected = io.BytesIO(content).readlines()[::-1]
+    for block_size in (1, 2, 3, 7, 1024):
+      self.assertEqual(
+        list(iter_reverse_lines(io.BytesIO(content), block_size)), expected)
+
+  def test_iter_reverse_lines(self):
+    self.assertReverseLines(b'')
+    self.assertReverseLines(b'\n')
+    self.assertReverseLines(b'a')
+    self.assertReverseLines(b'a\nbc\n')
+    self.assertReverseLines(b'a\nbc\ndef')
+    self.assertReverseLines(b'\n\nab\n\ncd\n')
+    self.assertReverseLines(b''.join(b'line %d\n' % i for i in range(100)))
+
+
+class TestParseLogTime(unittest.TestCase):
+
+  def test_parse_log_time(self):
+    self.assertEqual(parse_log_time('2026-10-18 18:13:04,205'),
+                     datetime(2026, 10, 18, 18, 13, 4, 205000))
+    self.assertEqual(parse_log_time('2026-10-18T18:13:04.123456'),
+                     datetime(2026, 10, 18, 18, 13, 4, 123456))
+    self.assertEqual(parse_log_time('2026-10-18 18:13:04'),
+                     datetime(2026, 10, 18, 18, 13, 4))
+    # other formats are still supported
+    self.assertEqual(parse_log_time('18 Oct 2026 18:13:04'),
+                     datetime(2026, 10, 18, 18, 13, 4))
+
+
+class JSONLogMixin(object):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.log_file = os.path.join(self.base_dir, 'stats.json.log')
+    self.now = datetime.now()
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
+  def writeLog(self, path, first_age, last_age, mode='w'):
+    # one line every second, from oldest to newest
+    with open(path, mode) as f:
+      for age in range(first_age, last_age - 1, -1):
+        date = self.now - timedelta(seconds=age)
+        f.write('{"time": "%s", "log_level": "INFO", "message": "", '
+                '"data": {"age": %d}}\n' % (
+                  date.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3], age))
+
+
+class TestJSONLogInterval(JSONLogMixin, unittest.TestCase):
+
+  def setUp(self):
+    super(TestJSONLogInterval, self).setUp()
+    self.index_folder = os.path.join(self.base_dir, 'index')
+
+  def getAgeList(self, interval, **kw):
+    if kw.get('use_index'):
+      kw['cache_folder'] = self.index_folder
+    return [q['age'] for q in
+            get_json_log_data_interval(self.log_file, interval, **kw)]
+
+  def test_interval(self):
+    self.writeLog(self.log_file, 1000, 10)
+    expected = list(range(10, 101))
+    self.assertEqual(self.getAgeList(100.5), expected)
+    self.assertEqual(self.getAgeList(100.5, use_index=True), expected)
+    # the index is not written next to the log
+    self.assertEqual(sorted(os.listdir(self.base_dir)),
+                     ['index', 'stats.json.log'])
+    self.assertEqual(len(os.listdir(self.index_folder)), 1)
+    self.assertEqual(self.getAgeList(5, use_index=True), [])
+
+  def test_interval_rotated_log(self):
+    self.writeLog(self.log_file + '1', 100, 51)
+    self.writeLog(self.log_file, 50, 10)
+    expected = list(range(10, 81))
+    self.assertEqual(self.getAgeList(80.5), expected)
+    self.assertEqual(self.getAgeList(80.5, use_index=True), expected)
+
+  def test_interval_compressed_rotated_log(self):
+    self.writeLog(self.log_file + '.2', 20000, 101)
+    self.writeLog(self.log_file + '.1', 100, 51)
+    self.writeLog(self.log_file, 50, 10)
+    with open(self.log_file + '.2', 'rb') as f, \
+        gzip.open(self.log_file + '.2.gz', 'wb') as gz:
+      gz.write(f.read())
+    os.remove(self.log_file + '.2')
+    # compressed logs are skipped without index folder
+    self.assertEqual(self.getAgeList(150.5), list(range(10, 101)))
+    # only the end of the compressed log is decompressed
+    with mock.patch.object(gzipindex.GzipIndex, 'readSpan',
+        side_effect=gzipindex.GzipIndex.readSpan, autospec=True) as readSpan:
+      self.assertEqual(
+        self.getAgeList(150.5, cache_folder=self.index_folder),
+        list(range(10, 151)))
+    self.assertLessEqual(readSpan.call_count, 2)
+    # the index is not written next to the log
+    self.assertEqual(sorted(os.listdir(self.base_dir)), ['index',
+      'stats.json.log', 'stats.json.log.1', 'stats.json.log.2.gz'])
+    self.assertEqual(len(os.listdir(self.index_folder)), 1)
+
+  def test_index_update(self):
+    self.writeLog(self.log_file, 1000, 501)
+    with open(self.log_file, 'rb') as f:
+      time_index = JSONLogTimeIndex(self.log_file, self.index_folder, step=1024)
+      time_index.update(f)
+    first_entry_list = time_index.index['entry-list']
+    self.assertGreater(len(first_entry_list), 1)
+
+    # only new lines are indexed
+    self.writeLog(self.log_file, 500, 10, mode='a')
+    with open(self.log_file, 'rb') as f:
+      time_index = JSONLogTimeIndex(self.log_file, self.index_folder, step=1024)
+      time_index.update(f)
+      entry_list = time_index.index['entry-list']
+      self.assertGreater(len(entry_list), len(first_entry_list))
+      self.assertEqual(entry_list[:len(first_entry_list)], first_entry_list)
+      self.assertEqual(entry_list, sorted(entry_list))
+      for timestamp, offset in entry_list:
+        f.seek(offset)
+        line = json.loads(f.readline())
+        self.assertAlmostEqual(timestamp, (self.now - timedelta(
+          seconds=line['data']['age'])).timestamp(), delta=0.01)
+
+    # rotated log is indexed again
+    self.writeLog(self.log_file + '.new', 20, 10)
+    os.rename(self.log_file + '.new', self.log_file)
+    self.assertEqual(self.getAgeList(15.5, use_index=True),
+                     list(range(10, 16)))
+
+  def test_latest_timestamp(self):
+    self.writeLog(self.log_file, 100, 10)
+    self.assertAlmostEqual(
+      get_json_log_latest_timestamp(self.log_file),
+      (self.now - timedelta(seconds=10)).timestamp(), delta=0.01)
+
+
+class TestJSONLogWindowCache(JSONLogMixin, unittest.TestCase):
+
+  def getCachedAgeList(self, cache, interval):
+    return [q['age'] for _, q in cache.getEntryList(self.log_file, interval)]
+
+  def test_cache(self):
+    cache_folder = os.path.join(self.base_dir, 'cache')
+    self.writeLog(self.log_file, 100, 10)
+    cache = JSONLogWindowCache(cache_folder)
+    self.assertEqual(self.getCachedAgeList(cache, 50.5), list(range(10, 51)))
+    self.assertEqual((cache.hit_count, cache.miss_count), (0, 1))
+    # smaller windows are taken from the cached one
+    self.assertEqual(self.getCachedAgeList(cache, 20.5), list(range(10, 21)))
+    self.assertEqual(self.getCachedAgeList(cache, 50.5), list(range(10, 51)))
+    self.assertEqual((cache.hit_count, cache.miss_count), (2, 1))
+    self.assertEqual(self.getCachedAgeList(cache, 60.5), list(range(10, 61)))
+    self.assertEqual((cache.hit_count, cache.miss_count), (2, 2))
+
+    # windows are shared with other processes through the cache folder
+    other_cache = JSONLogWindowCache(cache_folder)
+    self.assertEqual(self.getCachedAgeList(other_cache, 60.5),
+                     list(range(10, 61)))
+    self.assertEqual((other_cache.hit_count, other_cache.miss_count), (1, 0))
+
+    # cached windows are dropped when the log changes
+    self.writeLog(self.log_file, 9, 5, mode='a')
+    self.assertEqual(self.getCachedAgeList(other_cache, 20.5),
+                     list(range(5, 21)))
+    self.assertEqual((other_cache.hit_count, other_cache.miss_count), (1, 1))
+
+  def test_shared_index(self):
+    cache_folder = os.path.join(self.base_dir, 'cache')
+    self.writeLog(self.log_file, 1000, 10)
+    self.assertEqual(
+      [q['age'] for q in get_json_log_data_interval(
+        self.log_file, 100.5, use_index=True, shared=True,
+        cache_folder=cache_folder)],
+      list(range(10, 101)))
+    # the time index is kept in the cache folder, not next to the log
+    self.assertFalse(os.path.exists(self.log_file + '.index'))
+    self.assertEqual(
+      JSONLogTimeIndex(self.log_file, cache_folder).load(
+        os.stat(self.log_file).st_ino)['size'],
+      os.stat(self.log_file).st_size)
+
+
+class TestJSONLogAggregate(JSONLogMixin, unittest.TestCase):
+
+  def setUp(self):
+    super(TestJSONLogAggregate, self).setUp()
+    self.logger = logging.Logger('test-json-logger')
+    handler = logging.FileHandler(self.log_file)
+    handler.setFormatter(logging.Formatter(
+      '{"time": "%(asctime)s", "log_level": "%(levelname)s"'
+      ', "message": "%(message)s", "data": %(data)s}'))
+    self.logger.addHandler(handler)
+    self.addCleanup(handler.close)
+    self.aggregate_folder = os.path.join(self.base_dir, 'aggregate')
+    self.aggregate = JSONLogAggregate(self.log_file, 'value', 60,
+                                      self.aggregate_folder)
+    self.logger.addHandler(JSONLogAggregateHandler(self.aggregate))
+
+  def log(self, age, value):
+    record = self.logger.makeRecord(
+      self.logger.name, logging.INFO, __file__, 0, "data", (), None,
+      extra={'data': json.dumps({'value': value})})
+    record.created = self.now.timestamp() - age
+    record.msecs = record.created % 1 * 1000
+    self.logger.handle(record)
+
+  def getLogStatistics(self, interval):
+    return get_value_statistics(
+      [(timestamp, data['value']) for timestamp, data in
+       _get_json_log_entry_interval(self.log_file, interval, False, self.now)])
+
+  def test_statistics(self):
+    random.seed(0)
+    for age in range(99, -1, -3):
+      self.log(age, random.uniform(20, 90))
+    for interval in 0.5, 10, 29.5, 45, 59:
+      statistics = self.aggregate.getStatistics(interval,
+                                                self.now.timestamp())
+      self.assertIsNotNone(statistics, interval)
+      self.assertEqual(statistics, self.getLogStatistics(interval), interval)
+      self.assertEqual(statistics['last'],
+                       json.loads(self.readLastLine())['data']['value'])
+    # the aggregate is not written next to the log
+    self.assertEqual(sorted(os.listdir(self.base_dir)),
+                     ['aggregate', 'stats.json.log'])
+    # larger than the period of the aggregate
+    self.assertIsNone(self.aggregate.getStatistics(
+      61, self.now.timestamp()))
+
+  def readLastLine(self):
+    with open(self.log_file) as f:
+      return f.readlines()[-1]
+
+  def test_reset(self):
+    # lines logged before the aggregate was created are not in it
+    self.writeLog(self.log_file, 100, 0)
+    self.aggregate.add(self.now.timestamp(), 0)
+    self.assertIsNone(self.aggregate.getStatistics(50, self.now.timestamp()))
+    entry_list = [(timestamp, data['age']) for timestamp, data in
+      _get_json_log_entry_interval(self.log_file, 50.5, False, self.now)]
+    self.aggregate.reset(entry_list, self.now.timestamp() - 50.5)
+    self.assertEqual(self.aggregate.getStatistics(50.5, self.now.timestamp()),
+                     {'count': 51, 'sum': 1275, 'avg': 25,
+                      'min': 0, 'max': 50, 'first': 50, 'last': 0})
+    # the aggregate is dropped when the log is rotated
+    os.rename(self.log_file, self.log_file + '.1')
+    self.writeLog(self.log_file, 10, 0)
+    self.assertIsNone(self.aggregate.getStatistics(5, self.now.timestamp()))
+
+
+class TestJSONLogFieldStatistics(JSONLogMixin, unittest.TestCase):
+
+  entry_list = [
+    (30., {'samples': {'rx': [{'max': -6.}, {'max': -3.5}]}}),
+    (20., {'samples': {'rx': [{'max': '-12'}]}}),
+    (10., {'samples': {'rx': [{'max': -2.}, {'max': None}]}}),
+    (0., {'rf': {}}),
+  ]
+  field_dict = {
+    0: ('samples', 'rx', 0, 'max'),
+    1: ('samples', 'rx', 1, 'max'),
+    'rf': ('rf',),
+    'missing': ('samples', 'tx'),
+    'time': None,
+  }
+
+  def test_array_dict(self):
+    array_dict = get_json_log_field_array_dict(self.entry_list,
+                                               self.field_dict)
+    self.assertEqual(sorted(array_dict, key=str),
+                     [0, 1, 'missing', 'rf', 'time'])
+    # missing and non numeric values are NaN
+    self.assertEqual([repr(float(x)) for x in array_dict[0]],
+                     ['-6.0', '-12.0', '-2.0', 'nan'])
+    self.assertEqual([repr(float(x)) for x in array_dict[1]],
+                     ['-3.5', 'nan', 'nan', 'nan'])
+    self.assertEqual(
+      [repr(float(x)) for x in array_dict['rf']], ['nan'] * 4)
+    self.assertEqual(list(array_dict['time']), [30, 20, 10, 0])
+
+  def test_statistics(self):
+    statistics_dict = get_json_log_field_statistics(
+      self.entry_list, self.field_dict, (50, 75))
+    self.assertEqual(statistics_dict[0], {
+      'count': 3, 'min': -12, 'max': -2, 'avg': -20 / 3.,
+      'p50': -6, 'p75': -4})
+    self.assertEqual(statistics_dict[1], {
+      'count': 1, 'min': -3.5, 'max': -3.5, 'avg': -3.5,
+      'p50': -3.5, 'p75': -3.5})
+    self.assertEqual(statistics_dict['missing'], {'count': 0})
+    self.assertEqual(statistics_dict['rf'], {'count': 0})
+    self.assertEqual(statistics_dict['time']['max'], 30)
+    self.assertEqual(get_json_log_field_statistics([], {'time': None}),
+                     {'time': {'count': 0}})
+
+  def test_statistics_log_window(self):
+    self.writeLog(self.log_file, 100, 10)
+    statistics = get_json_log_field_statistics(
+      get_json_log_entry_interval(self.log_file, 50.5),
+      {'age': ('age',)}, (50,))['age']
+    self.assertEqual(statistics, {'count': 41, 'min': 10, 'max': 50,
+                                  'avg': 30, 'p50': 30})
+
+
+class TestLogMinuteCounter(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    self.log_file = os.path.join(self.base_dir, 'error.log')
+    self.state_file = os.path.join(self.base_dir, 'counter', 'state.json')
+    self.gzip_index_folder = os.path.join(self.base_dir, 'counter', 'gzip')
+    self.minute = int(time.time() // 60)
+    self.parsed_line_list = []
+
+  def parseLine(self, line):
+    self.parsed_line_list.append(line)
+    age, name = line.split()
+    return self.minute - int(age), [name.decode()]
+
+  def writeLog(self, path, content, mode='a'):
+    with open(path, mode) as f:
+      f.write(content)
+
+  def update(self):
+    del self.parsed_line_list[:]
+    counter = LogMinuteCounter(self.log_file, self.state_file, self.parseLine,
+                               gzip_index_folder=self.gzip_index_folder)
+    counter.update()
+    return counter
+
+  def test_incremental(self):
+    self.writeLog(self.log_file, "90 error\n30 error\n0 warning\n0 err")
+    counter = self.update()
+    self.assertEqual(len(self.parsed_line_list), 3)
+    self.assertEqual(counter.getCount('error'), 2)
+    self.assertEqual(counter.getCount('error', 100 * 60), 2)
+    self.assertEqual(counter.getCount('error', 3600), 1)
+    self.assertEqual(counter.getCount('warning', 60), 1)
+
+    # only the added lines are parsed, with the line being written
+    self.writeLog(self.log_file, "or\n")
+    counter = self.update()
+    self.assertEqual(self.parsed_line_list, [b"0 error\n"])
+    self.assertEqual(counter.getCount('error', 60), 1)
+    counter = self.update()
+    self.assertEqual(self.parsed_line_list, [])
+    self.assertEqual(counter.getCount('error'), 3)
+
+  def test_rotation(self):
+    self.writeLog(self.log_file, "10 error\n")
+    self.update()
+    # lines added before the rotation are read from the rotated log
+    self.writeLog(self.log_file, "5 error\n")
+    os.rename(self.log_file, self.log_file + '1')
+    self.writeLog(self.log_file, "1 error\n")
+    counter = self.update()
+    self.assertEqual(self.parsed_line_list, [b"5 error\n", b"1 error\n"])
+    self.assertEqual(counter.getCount('error'), 3)
+
+    # truncated log is read again
+    self.writeLog(self.log_file, "0 x\n", mode='w')
+    counter = self.update()
+    self.assertEqual(self.parsed_line_list, [b"0 x\n"])
+    self.assertEqual(counter.getCount('x'), 1)
+
+  def compressLog(self, path):
+    with open(self.log_file, 'rb') as f, gzip.open(path, 'wb') as gz:
+      shutil.copyfileobj(f, gz)
+    os.remove(self.log_file)
+
+  def test_compressed_rotation(self):
+    self.writeLog(self.log_file, "10 error\n")
+    self.update()
+    # the rotated log is found once compressed, with another inode
+    self.writeLog(self.log_file, "5 error\n")
+    self.compressLog(self.log_file + '.1.gz')
+    self.writeLog(self.log_file, "1 error\n")
+    counter = self.update()
+    self.assertEqual(self.parsed_line_list, [b"5 error\n", b"1 error\n"])
+    self.assertEqual(counter.getCount('error'), 3)
+    # the index of the compressed log is not written next to it
+    self.assertEqual(sorted(os.listdir(self.base_dir)),
+                     ['counter', 'error.log', 'error.log.1.gz'])
+    self.assertEqual(len(os.listdir(self.gzip_index_folder)), 1)
+
+    self.writeLog(self.log_file, "0 error\n")
+    os.rename(self.log_file + '.1.gz', self.log_file + '.2.gz')
+    self.compressLog(self.log_file + '.1.gz')
+    self.writeLog(self.log_file, "0 warning\n")
+    counter = self.update()
+    self.assertEqual(self.parsed_line_list, [b"0 error\n", b"0 warning\n"])
+    self.assertEqual(counter.getCount('error'), 4)
+
+  def test_first_update_skips_rotated_logs(self):
+    self.writeLog(self.log_file, "10 error\n")
+    self.compressLog(self.log_file + '.1.gz')
+    self.writeLog(self.log_file + '.2', "20 error\n")
+    self.writeLog(self.log_file, "1 error\n")
+    with mock.patch('slapos.promise.logrotate.openGzip',
+        side_effect=gzipindex.openGzip) as openGzip:
+      counter = self.update()
+    # rotated logs are neither decompressed nor read
+    openGzip.assert_not_called()
+    self.assertEqual(sorted(os.listdir(self.base_dir)),
+                     ['counter', 'error.log', 'error.log.1.gz', 'error.log.2'])
+    self.assertEqual(self.parsed_line_list, [b"1 error\n"])
+    self.assertEqual(counter.getCount('error'), 1)
+
+  def test_retention(self):
+    self.writeLog(self.log_file, "20000 error\n0 error\n")
+    counter = self.update()
+    self.assertEqual(counter.getCount('error'), 1)
+
+  def test_tail_count(self):
+    counter = LogMinuteCounter(self.log_file, self.state_file, self.parseLine,
+                               tail_size=20)
+    self.writeLog(self.log_file, "30 error\n20 error\n")
+    counter.update()
+    self.assertEqual(counter.getTailCount('error'), 2)
+    # a line added after the errors does not hide them
+    self.writeLog(self.log_file, "0 warning\n")
+    counter.update()
+    self.assertEqual(counter.getTailCount('error'), 1)
+    self.assertEqual(counter.getTailCount('warning'), 1)
+    self.assertEqual(counter.getCount('error'), 2)
+    self.writeLog(self.log_file, "0 warning\n0 warning\n")
+    counter.update()
+    self.assertEqual(counter.getTailCount('error'), 0)
+    self.assertEqual(counter.getTailCount('warning'), 2)
+    self.assertEqual(len(counter.state['tail-list']), 2)
+
+    # lines of a rotated log are not in the tail of the current one
+    self.writeLog(self.log_file, "0 error\n")
+    os.rename(self.log_file, self.log_file + '.1')
+    self.writeLog(self.log_file, "0 warning\n")
+    counter.update()
+    self.assertEqual(counter.getTailCount('error'), 0)
+    self.assertEqual(counter.getTailCount('warning'), 1)
+    self.assertEqual(counter.getCount('error'), 3)
+
+class TestNetconfAlarmIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    self.log_file = os.path.join(self.base_dir, 'netconf.json.log')
+    self.state_file = os.path.join(self.base_dir, 'alarm', 'state.json')
+    self.gzip_index_folder = os.path.join(self.base_dir, 'alarm', 'gzip')
+
+  def writeAlarm(self, path, fault_id, source, cleared, newline=True):
+    with open(path, 'a') as f:
+      f.write(json.dumps({
+        'time': '2026-10-18 10:00:00,000',
+        'log_level': 'INFO',
+        'message': '',
+        'data': {'notification': {'alarm-notif': {
+          'fault-id': fault_id,
+          'fault-source': source,
+          'affected-objects': {'name': source},
+          'is-cleared': 'true' if cleared else 'false',
+        }}},
+      }) + ('\n' if newline else ''))
+
+  def update(self):
+    index = NetconfAlarmIndex(self.log_file, self.state_file,
+                              self.gzip_index_folder)
+    with mock.patch.object(NetconfAlarmIndex, 'readLine', autospec=True,
+        side_effect=NetconfAlarmIndex.readLine) as readLine:
+      index.update()
+    return index, readLine.call_count
+
+  def getState(self, index, fault_id):
+    return dict((source, alarm['is-cleared']) for source, alarm
+                in index.getAlarmDict(fault_id).items())
+
+  def test_incremental(self):
+    index, _ = self.update()
+    self.assertIsNone(index.getLatestAlarm('9'))
+    self.writeAlarm(self.log_file, '9', 'Antport0', False)
+    self.writeAlarm(self.log_file, '9', 'Antport1', False)
+    self.writeAlarm(self.log_file, '18', 'Sync', False)
+    with open(self.log_file, 'a') as f:
+      f.write('{"time": "2026-10-18 10:00:00,000", "data": {}}\n')
+    index, read_count = self.update()
+    self.assertEqual(read_count, 4)
+    self.assertEqual(self.getState(index, '9'),
+                     {'Antport0': 'false', 'Antport1': 'false'})
+    self.assertEqual(index.getLatestAlarm('9')['fault-source'], 'Antport1')
+
+    # only the added lines are read, the last one when it is complete
+    self.writeAlarm(self.log_file, '9', 'Antport0', True, newline=False)
+    index, read_count = self.update()
+    self.assertEqual(read_count, 1)
+    self.assertEqual(self.getState(index, '9'),
+                     {'Antport0': 'true', 'Antport1': 'false'})
+    self.assertEqual(index.getLatestAlarm('9')['fault-source'], 'Antport0')
+    self.assertEqual(index.getLatestAlarm('18')['is-cleared'], 'false')
+    with open(self.log_file, 'a') as f:
+      f.write('\n{"time": "2026-10-18 10:00:00,000", "data"')
+    index, read_count = self.update()
+    self.assertEqual(read_count, 1)
+    index, read_count = self.update()
+    self.assertEqual(read_count, 0)
+
+  def test_rotated_log(self):
+    # alarms of rotated logs are read when the index is created
+    self.writeAlarm(self.log_file + '1', '9', 'Antport0', False)
+    self.writeAlarm(self.log_file, '18', 'Sync', False)
+    index, read_count = self.update()
+    self.assertEqual(read_count, 2)
+    self.assertEqual(index.getLatestAlarm('9')['is-cleared'], 'false')
+
+    os.rename(self.log_file, self.log_file + '1')
+    self.writeAlarm(self.log_file, '9', 'Antport0', True)
+    index, read_count = self.update()
+    self.assertEqual(read_count, 1)
+    self.assertEqual(index.getLatestAlarm('9')['is-cleared'], 'true')
+    self.assertEqual(index.getLatestAlarm('18')['is-cleared'], 'false')
+
+  def test_compressed_rotated_log(self):
+    self.writeAlarm(self.log_file, '9', 'Antport0', False)
+    self.update()
+    # only the lines added since the last update are read from the
+    # compressed rotated log
+    self.writeAlarm(self.log_file, '18', 'Sync', False)
+    with open(self.log_file, 'rb') as f, \
+        gzip.open(self.log_file + '.1.gz', 'wb') as gz:
+      shutil.copyfileobj(f, gz)
+    os.remove(self.log_file)
+    self.writeAlarm(self.log_file, '9', 'Antport0', True)
+    index, read_count = self.update()
+    self.assertEqual(read_count, 2)
+    self.assertEqual(index.getLatestAlarm('9')['is-cleared'], 'true')
+    self.assertEqual(index.getLatestAlarm('18')['is-cleared'], 'false')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -27,6 +27,8 @@
 
 import unittest
 import os.path
+import shutil
+import tempfile
 import socket
 import time
 import psutil
@@ -39,6 +41,12 @@ class TestApacheMPMWatchdog(unittest.TestCase):
 
   base_path, = data.__path__
 
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.base_dir)
+
   def text_searchPidRegex(self):
 
     with open(self.base_path + "/server_status.html") as f:
@@ -70,9 +78,9 @@ class TestApacheMPMWatchdog(unittest.TestCase):
     current_pid = os.getpid() 
     self.assertEqual(None,
       writeJSONFile({"123482": 123, current_pid: 124},
-          os.path.join(self.base_path, "write_db.json")))
+          os.path.join(self.base_dir, "write_db.json")))
 
-    with open(os.path.join(self.base_path, "write_db.json")) as f:
+    with open(os.path.join(self.base_dir, "write_db.json")) as f:
       json_content = f.read()
       f.close()
 
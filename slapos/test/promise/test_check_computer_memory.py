@@ -31,6 +31,7 @@ import sqlite3
 
 from . import data
 from slapos.promise.check_computer_memory import getMemoryInfo, checkMemoryUsage
+from slapos.promise.collectordb import closeConnections
 
 total_memory_fetch_failure_message = "couldn't fetch total memory, collectordb is empty?"
 
@@ -99,6 +100,7 @@ class TestComputerMemory(unittest.TestCase):
     )
 
   def tearDown(self):
+    closeConnections()
     if os.path.exists(self.db_file):
       os.remove(self.db_file)
 if __name__ == '__main__':
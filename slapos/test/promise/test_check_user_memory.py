@@ -32,6 +32,7 @@ from datetime import datetime
 
 from . import data
 from slapos.promise.check_user_memory import getMemoryInfo, checkMemoryUsage
+from slapos.promise.collectordb import closeConnections
 
 no_result_message = "No result found in collector.db."
 
@@ -109,6 +110,7 @@ class TestUserMemory(unittest.TestCase):
     )
 
   def tearDown(self):
+    closeConnections()
     if os.path.exists(self.db_file):
       os.remove(self.db_file)
 if __name__ == '__main__':
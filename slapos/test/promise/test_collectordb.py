@@ -0,0 +1,189 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+import mock
+
+from slapos.collect.db import Database
+from slapos.promise.collectordb import (
+  CollectorDatabase,
+  ORDER_DESC,
+  SNAPSHOT_FAILURE_FILE_NAME,
+  SNAPSHOT_FILE_NAME,
+  closeConnections,
+  main,
+)
+
+
+class TestCollectorDatabase(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.snapshot_file = os.path.join(self.base_dir, SNAPSHOT_FILE_NAME)
+    database = Database(self.base_dir, create=True)
+    database.connect()
+    database.insertSystemSnapshot(1, 2, 3, 4, 5, 6, 7, 8, 9, 10,
+                                  '2026-10-18', '10:00:00')
+    database.commit()
+    database.close()
+
+  def tearDown(self):
+    closeConnections()
+    shutil.rmtree(self.base_dir)
+
+  def addSystemSnapshot(self, time):
+    database = Database(self.base_dir)
+    database.connect()
+    database.insertSystemSnapshot(1, 2, 3, 4, 5, 6, 7, 8, 9, 10,
+                                  '2026-10-18', time)
+    database.commit()
+    database.close()
+
+  def getTimeList(self, **kw):
+    kw.setdefault('snapshot_folder', self.base_dir)
+    database = CollectorDatabase(self.base_dir, **kw)
+    database.connect()
+    try:
+      return [q[0] for q in database.select("system", columns="time",
+                                            order="time")]
+    finally:
+      database.close()
+
+  def test_snapshot(self):
+    self.assertEqual(self.getTimeList(), ['10:00:00'])
+    self.assertTrue(os.path.exists(self.snapshot_file))
+    self.assertEqual(os.stat(self.snapshot_file).st_mtime_ns,
+                     os.stat(os.path.join(self.base_dir, 'collector.db')).st_mtime_ns)
+
+    # the lock is not writable by other users
+    self.assertFalse(
+      os.stat(self.snapshot_file + '.lock').st_mode & 0o022)
+
+    # the snapshot is not copied again before snapshot_max_age
+    self.addSystemSnapshot('10:01:00')
+    self.assertEqual(self.getTimeList(), ['10:00:00'])
+    # it is copied again when the collector wrote since
+    self.assertEqual(self.getTimeList(snapshot_max_age=0),
+                     ['10:00:00', '10:01:00'])
+
+  def test_recent_snapshot(self):
+    self.assertEqual(self.getTimeList(), ['10:00:00'])
+    snapshot_mtime = os.stat(self.snapshot_file).st_mtime_ns
+    # the snapshot is older than the queried minute: queries of the last
+    # minutes read collector.db, without copying it
+    self.addSystemSnapshot('10:01:00')
+    self.assertEqual(self.getTimeList(recent=True),
+                     ['10:00:00', '10:01:00'])
+    self.assertEqual(os.stat(self.snapshot_file).st_mtime_ns, snapshot_mtime)
+    # other queries accept the snapshot until snapshot_max_age
+    self.assertEqual(self.getTimeList(), ['10:00:00'])
+    # an up to date snapshot is read by all queries
+    self.assertEqual(self.getTimeList(snapshot_max_age=0),
+                     ['10:00:00', '10:01:00'])
+    with mock.patch('slapos.promise.collectordb.connectReadOnly',
+        side_effect=sqlite3.connect) as connectReadOnly:
+      self.assertEqual(self.getTimeList(recent=True),
+                       ['10:00:00', '10:01:00'])
+    # the pooled connection to the snapshot is reused
+    connectReadOnly.assert_not_called()
+
+  def test_computer_snapshot(self):
+    # made by collectordb-snapshot, next to collector.db
+    with mock.patch('sys.argv', ['collectordb-snapshot', '--collectordb',
+        os.path.join(self.base_dir, 'collector.db')]):
+      self.assertEqual(main(), 0)
+    self.assertTrue(os.path.exists(self.snapshot_file))
+    snapshot_mtime = os.stat(self.snapshot_file).st_mtime_ns
+    self.assertEqual(self.getTimeList(snapshot_folder=None, recent=True),
+                     ['10:00:00'])
+    # it is only copied again by collectordb-snapshot, not by readers
+    self.addSystemSnapshot('10:01:00')
+    self.assertEqual(self.getTimeList(snapshot_folder=None), ['10:00:00'])
+    self.assertEqual(self.getTimeList(snapshot_folder=None, recent=True),
+                     ['10:00:00', '10:01:00'])
+    self.assertEqual(
+      self.getTimeList(snapshot_folder=None, snapshot_max_age=0),
+      ['10:00:00', '10:01:00'])
+    self.assertEqual(os.stat(self.snapshot_file).st_mtime_ns, snapshot_mtime)
+
+  def test_snapshot_failure(self):
+    failure_file = os.path.join(self.base_dir, SNAPSHOT_FAILURE_FILE_NAME)
+    with mock.patch.object(CollectorDatabase, '_copySnapshot',
+        side_effect=sqlite3.OperationalError("too long")) as _copySnapshot:
+      # collector.db is read directly
+      self.assertEqual(self.getTimeList(), ['10:00:00'])
+      self.assertTrue(os.path.exists(failure_file))
+      # the copy is not tried again before snapshot_max_age
+      self.assertEqual(self.getTimeList(), ['10:00:00'])
+      self.assertEqual(_copySnapshot.call_count, 1)
+      self.assertEqual(self.getTimeList(snapshot_max_age=0), ['10:00:00'])
+      self.assertEqual(_copySnapshot.call_count, 2)
+    self.assertFalse(os.path.exists(self.snapshot_file))
+    self.assertEqual(self.getTimeList(snapshot_max_age=0), ['10:00:00'])
+    self.assertTrue(os.path.exists(self.snapshot_file))
+    self.assertFalse(os.path.exists(failure_file))
+
+  def test_no_snapshot(self):
+    self.assertEqual(self.getTimeList(snapshot_folder=None), ['10:00:00'])
+    self.assertEqual(self.getTimeList(snapshot_folder=''), ['10:00:00'])
+    self.assertFalse(os.path.exists(self.snapshot_file))
+    # collector.db is read directly if the snapshot folder is not usable
+    self.assertEqual(
+      self.getTimeList(snapshot_folder=os.path.join(self.base_dir, 'missing')),
+      ['10:00:00'])
+
+  def test_pooled_read_only_connection(self):
+    database = CollectorDatabase(self.base_dir)
+    database.connect()
+    connection = database.connection
+    database.close()
+    database = CollectorDatabase(self.base_dir)
+    database.connect()
+    self.assertIs(database.connection, connection)
+    with self.assertRaises(sqlite3.OperationalError):
+      database.insertSystemSnapshot(1, 2, 3, 4, 5, 6, 7, 8, 9, 10,
+                                    '2026-10-18', '10:01:00')
+    database.close()
+
+  def test_select_time_range(self):
+    for time in ('10:01:00', '10:02:00', '10:03:00'):
+      self.addSystemSnapshot(time)
+    database = CollectorDatabase(self.base_dir)
+    database.connect()
+    def getTimeList(**kw):
+      return [q[0] for q in database.selectTimeRange(
+        "system", columns="time", **kw)]
+    self.assertEqual(getTimeList(start='2026-10-18 10:01:00'),
+                     ['10:01:00', '10:02:00', '10:03:00'])
+    self.assertEqual(getTimeList(start='2026-10-18 10:01:00',
+                                 start_included=False),
+                     ['10:02:00', '10:03:00'])
+    self.assertEqual(getTimeList(start='2026-10-17 23:00:00',
+                                 end=datetime(2026, 10, 18, 10, 2)),
+                     ['10:00:00', '10:01:00', '10:02:00'])
+    self.assertEqual(getTimeList(end='2026-10-18 10:01:00', order=ORDER_DESC),
+                     ['10:01:00', '10:00:00'])
+    self.assertEqual(getTimeList(start='2026-10-19 00:00:00'), [])
+    self.assertEqual(getTimeList(end='2026-10-18 10:01:00', limit=1),
+                     ['10:00:00'])
+    # values are bound, not inserted in the query
+    self.assertEqual(getTimeList(start="2026-10-18 99' OR '1"), [])
+    database.close()
+
+  def test_snapshot_index(self):
+    self.assertEqual(self.getTimeList(), ['10:00:00'])
+    connection = sqlite3.connect(self.snapshot_file)
+    try:
+      plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT free FROM disk WHERE partition='/dev/sda1'"
+        " ORDER BY %s LIMIT 1" % ORDER_DESC).fetchall()
+    finally:
+      connection.close()
+    self.assertIn('disk_partition_date_time', str(plan))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,202 @@
+import base64
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from six.moves import BaseHTTPServer, socketserver
+
+from slapos.promise.httpprobe import (
+  ERROR_CONNECTION,
+  HTTPProbe,
+  SharedProbeFolder,
+)
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    server = self.server
+    with server.lock:
+      server.request_count += 1
+      server.in_flight += 1
+      server.max_in_flight = max(server.max_in_flight, server.in_flight)
+    try:
+      time.sleep(0.05)
+      if self.path == '/redirect':
+        self.send_response(302)
+        self.send_header('Location', '/chunked')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+      elif self.path == '/chunked':
+        self.send_response(201)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.write(b'5\r\nhello\r\n0\r\n\r\n')
+      elif self.path == '/trailer':
+        self.send_response(201)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Trailer', 'X-Checksum')
+        self.end_headers()
+        self.wfile.write(b'5\r\nhello\r\n0\r\nX-Checksum: 1\r\n\r\n')
+      elif self.path == '/bad-chunk':
+        self.send_response(201)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.write(b'zz\r\nhello\r\n')
+      elif self.path == '/auth':
+        authorization = 'Basic ' + base64.b64encode(b'user:p@ss').decode()
+        self.send_response(
+          200 if self.headers.get('Authorization') == authorization else 401)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+      else:
+        body = b'OK'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    finally:
+      with server.lock:
+        server.in_flight -= 1
+
+  def log_message(self, *args):
+    pass
+
+
+class KeepAliveServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(
+      self, ('127.0.0.1', 0), KeepAliveHandler)
+    self.lock = threading.Lock()
+    self.request_count = self.in_flight = self.max_in_flight = 0
+    self.connection_count = 0
+
+  def process_request(self, request, client_address):
+    self.connection_count += 1
+    socketserver.ThreadingMixIn.process_request(self, request, client_address)
+
+
+class TestHTTPProbe(unittest.TestCase):
+
+  def setUp(self):
+    self.server = KeepAliveServer()
+    self.url = 'http://127.0.0.1:%s/' % self.server.server_address[1]
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.base_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.base_dir)
+
+  def test_probe(self):
+    request_dict = dict(
+      ('%s' % i, {'url': self.url + '%s' % i}) for i in range(12))
+    request_dict['redirect'] = {'url': self.url + 'redirect'}
+    request_dict['off'] = {'url': 'http://127.0.0.1:1/'}
+    result_dict = HTTPProbe(concurrency=3).probe(request_dict)
+    self.assertEqual(sorted(result_dict), sorted(request_dict))
+    for i in range(12):
+      result = result_dict['%s' % i]
+      self.assertEqual(result['status-code'], 200)
+      self.assertEqual(sorted(result['timing']),
+                       ['connect', 'dns', 'tls', 'total', 'ttfb'])
+    # redirect followed to a chunked response
+    self.assertEqual(result_dict['redirect']['status-code'], 201)
+    self.assertEqual(result_dict['off']['error-type'], ERROR_CONNECTION)
+    # bounded concurrency, connections are reused
+    self.assertLessEqual(self.server.max_in_flight, 3)
+    self.assertEqual(self.server.request_count, 14)
+    self.assertLessEqual(self.server.connection_count, 3)
+    self.assertTrue(any(q.get('reused') for q in result_dict.values()))
+
+  def test_chunked_body(self):
+    probe = HTTPProbe(concurrency=1, pool_size=1)
+    # trailer fields are read, the connection is reused
+    result_dict = probe.probe({
+      '0': {'url': self.url + 'trailer'}, '1': {'url': self.url}})
+    self.assertEqual(result_dict['0']['status-code'], 201)
+    self.assertEqual(result_dict['1']['status-code'], 200)
+    self.assertTrue(result_dict['1']['reused'])
+    # the connection is not reused after an invalid chunk
+    result_dict = probe.probe({
+      '0': {'url': self.url + 'bad-chunk'}, '1': {'url': self.url}})
+    self.assertEqual(result_dict['0']['status-code'], 201)
+    self.assertEqual(result_dict['1']['status-code'], 200)
+    self.assertFalse(result_dict['1']['reused'])
+
+  def test_url_credentials(self):
+    url = self.url.replace('http://', 'http://user:p%40ss@') + 'auth'
+    result = HTTPProbe().probe({'0': {'url': url}})['0']
+    self.assertEqual(result['status-code'], 200)
+    # the url is a secret too
+    probe = SharedProbeFolder(self.base_dir)
+    self.assertEqual(probe.getResult({'url': url})['status-code'], 200)
+    self.assertRaises(ValueError, probe.register, {'url': url})
+    self.assertFalse(os.path.exists(os.path.join(self.base_dir, 'request')))
+
+  def test_shared_probe_folder_lock(self):
+    probe = SharedProbeFolder(self.base_dir)
+    probe.getResult({'url': self.url})
+    probe.max_age = 0
+    with open(os.path.join(self.base_dir, 'result.json.lock'), 'a') as lock:
+      # another promise is probing, only wait until the timeout
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      start = time.time()
+      self.assertIsNone(probe.getResult({'url': self.url}, timeout=0.3))
+      self.assertLess(time.time() - start, 1)
+    self.assertEqual(
+      probe.getResult({'url': self.url}, timeout=1)['status-code'], 200)
+
+  def test_shared_probe_folder(self):
+    probe = SharedProbeFolder(self.base_dir)
+    first = probe.getResult({'url': self.url + 'first'})
+    self.assertEqual(first['status-code'], 200)
+    # the result is fresh, the other registered requests are probed too
+    second_probe = SharedProbeFolder(self.base_dir)
+    second_probe.register({'url': self.url + 'second'})
+    self.assertEqual(probe.getResult({'url': self.url + 'first'}), first)
+    second = second_probe.getResult({'url': self.url + 'second'})
+    self.assertEqual(second['status-code'], 200)
+    self.assertEqual(self.server.request_count, 2)
+    with open(os.path.join(self.base_dir, 'result.json')) as f:
+      self.assertEqual(len(json.load(f)), 2)
+
+    # old results are probed again
+    probe.max_age = 0
+    self.assertGreater(
+      probe.getResult({'url': self.url + 'first'})['date'], first['date'])
+    self.assertEqual(self.server.request_count, 4)
+
+  def test_shared_probe_folder_credentials(self):
+    probe = SharedProbeFolder(self.base_dir)
+    probe.getResult({'url': self.url + 'public'})
+    request = {'url': self.url + 'private', 'username': 'user',
+               'password': 'secret'}
+    self.assertEqual(probe.getResult(request)['status-code'], 200)
+    self.assertRaises(ValueError, probe.register, request)
+    # the request with credentials is neither registered nor shared
+    request_folder = os.path.join(self.base_dir, 'request')
+    path_list = [os.path.join(request_folder, q)
+                 for q in os.listdir(request_folder)]
+    path_list.append(os.path.join(self.base_dir, 'result.json'))
+    self.assertEqual(len(path_list), 2)
+    for path in path_list:
+      self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+      with open(path) as f:
+        content = f.read()
+      self.assertNotIn('secret', content)
+      self.assertNotIn('private', content)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -28,7 +28,12 @@
 import unittest
 import os.path
 import socket
-from slapos.promise.is_local_tcp_port_opened import isLocalTcpPortOpened
+import mock
+from slapos.promise import sockdiag
+from slapos.promise.is_local_tcp_port_opened import (
+  areLocalTcpPortsOpened,
+  isLocalTcpPortOpened,
+)
 
 
 class TestLocalTcpPortOpened(unittest.TestCase):
@@ -59,7 +64,58 @@ class TestLocalTcpPortOpened(unittest.TestCase):
     finally:
       s.close()
 
-    
-  
+  def test_port_is_not_listening(self):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+      s.bind(("127.0.0.1", 0))
+      port = s.getsockname()[1]
+      self.assertEqual(isLocalTcpPortOpened("127.0.0.1",port), False)
+    finally:
+      s.close()
+
+  def listen(self, family, ip_address, count):
+    socket_list = []
+    for _ in range(count):
+      s = socket.socket(family, socket.SOCK_STREAM)
+      self.addCleanup(s.close)
+      s.bind((ip_address, 0))
+      s.listen(1)
+      socket_list.append(s)
+    return [(ip_address, s.getsockname()[1]) for s in socket_list]
+
+  def checkBatch(self):
+    address_list = self.listen(socket.AF_INET, "127.0.0.1", 3)
+    address6_list = self.listen(socket.AF_INET6, "::1", 2)
+    closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    closed.bind(("127.0.0.1", 0))
+    closed_address = closed.getsockname()
+    closed.close()
+    self.assertEqual(
+      sorted(areLocalTcpPortsOpened(
+        address_list + address6_list + [
+          closed_address,
+          ("127.0.0.2", address_list[0][1]),
+          ("::1", address_list[1][1]),
+          ("127.0.0.1", 65550),
+        ])),
+      sorted(address_list + address6_list))
+
+  def test_batch(self):
+    self.checkBatch()
+
+  def test_batch_proc(self):
+    with mock.patch.object(sockdiag, 'queryNetlink',
+                           side_effect=sockdiag.NetlinkError("No such file")):
+      self.checkBatch()
+
+  def test_batch_many_ports(self):
+    address_list = self.listen(socket.AF_INET, "127.0.0.1", 2)
+    port_list = [port for _, port in address_list]
+    with mock.patch.object(sockdiag, 'MAX_FILTERED_PORT_COUNT', 1):
+      self.assertEqual(
+        sockdiag.getListeningSocketSet(socket.AF_INET, port_list),
+        set((socket.inet_aton("127.0.0.1"), port) for port in port_list))
+
+
 if __name__ == '__main__':
   unittest.main()
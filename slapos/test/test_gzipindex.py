@@ -0,0 +1,159 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from slapos import gzipindex
+from slapos.gzipindex import (
+  GzipIndexError,
+  openGzip,
+  openLog,
+)
+
+
+class TestGzipIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.folder)
+    self.path = os.path.join(self.folder, 'access.log.1.gz')
+    rng = random.Random(0)
+    self.data = b''.join(
+      b'%d %x %s\n' % (i, rng.getrandbits(64), b'x' * rng.randrange(100))
+      for i in range(50000))
+    # 2 members, compressed with different levels
+    middle = len(self.data) // 3
+    with open(self.path, 'wb') as f:
+      f.write(gzip.compress(self.data[:middle], 9))
+      f.write(gzip.compress(self.data[middle:], 1))
+    self.index_folder = os.path.join(self.folder, 'index')
+
+  def openGzip(self, *args, **kw):
+    kw.setdefault('index_folder', self.index_folder)
+    return openGzip(self.path, *args, **kw)
+
+  def getIndexList(self):
+    return [q.rsplit('-', 1)[1] for q in os.listdir(self.index_folder)]
+
+  def checkRead(self, f):
+    rng = random.Random(1)
+    self.assertEqual(f.seek(0, os.SEEK_END), len(self.data))
+    for _ in range(100):
+      offset = rng.randrange(len(self.data))
+      size = rng.randrange(50000)
+      f.seek(offset)
+      self.assertEqual(f.read(size), self.data[offset:offset + size])
+    f.seek(-10, os.SEEK_END)
+    self.assertEqual(f.read(), self.data[-10:])
+    f.seek(0)
+    self.assertEqual(f.read(), self.data)
+
+  def getPointCount(self, f):
+    return len(f.raw._index.index['point-list'])
+
+  def test_read(self):
+    with self.openGzip(span=64 * 1024) as f:
+      self.assertGreater(self.getPointCount(f), 30)
+      self.checkRead(f)
+
+  def test_read_member_index(self):
+    with mock.patch.object(gzipindex, '_zlib_library', False):
+      with self.openGzip() as f:
+        self.assertEqual(self.getPointCount(f), 2)
+        self.checkRead(f)
+
+  def test_text_mode(self):
+    with self.openGzip('r') as f:
+      self.assertEqual(f.readline(), self.data[:self.data.index(b'\n') + 1]
+                                          .decode())
+
+  def test_index_reused(self):
+    self.openGzip().close()
+    self.assertEqual(self.getIndexList(),
+                     ['%s.index' % os.stat(self.path).st_ino])
+    # logrotate renames the file, the index is still used
+    os.rename(self.path, self.path.replace('.1.', '.2.'))
+    self.path = self.path.replace('.1.', '.2.')
+    with mock.patch.object(gzipindex.GzipIndex, 'build',
+                           side_effect=AssertionError):
+      with self.openGzip() as f:
+        self.checkRead(f)
+    # the index of a removed file is removed when another one is saved
+    os.remove(self.path)
+    self.path = os.path.join(self.folder, 'other.log.gz')
+    with open(self.path, 'wb') as f:
+      f.write(gzip.compress(b'other\n'))
+    with self.openGzip() as f:
+      self.assertEqual(f.read(), b'other\n')
+    self.assertEqual(self.getIndexList(),
+                     ['%s.index' % os.stat(self.path).st_ino])
+    self.assertEqual(sorted(os.listdir(self.folder)),
+                     ['index', 'other.log.gz'])
+
+  def test_index_folder_shared(self):
+    # the index of the files of other folders are kept
+    other_folder = os.path.join(self.folder, 'other')
+    os.mkdir(other_folder)
+    other_path = os.path.join(other_folder, 'other.log.gz')
+    with open(other_path, 'wb') as f:
+      f.write(gzip.compress(b'other\n'))
+    with openGzip(other_path, index_folder=self.index_folder) as f:
+      self.assertEqual(f.read(), b'other\n')
+    self.openGzip().close()
+    self.assertEqual(len(os.listdir(self.index_folder)), 2)
+
+  def test_no_index_folder(self):
+    # the file is read sequentially, nothing is written
+    with openGzip(self.path) as f:
+      self.assertIsInstance(f, gzip.GzipFile)
+      self.assertEqual(f.read(), self.data)
+    with openLog(self.path, 'r') as f:
+      self.assertEqual(f.readline(), self.data[:self.data.index(b'\n') + 1]
+                                          .decode())
+    self.assertEqual(os.listdir(self.folder), ['access.log.1.gz'])
+
+  def test_index_not_stored(self):
+    with mock.patch.object(gzipindex.GzipIndex, 'canSave',
+                           return_value=False), \
+        mock.patch.object(gzipindex.GzipIndex, 'build',
+                          side_effect=AssertionError):
+      with self.openGzip() as f:
+        self.assertIsInstance(f, gzip.GzipFile)
+        self.assertEqual(f.read(), self.data)
+      self.assertRaises(GzipIndexError, self.openGzip, fallback=False)
+    # an existing index is used even if no other one can be stored
+    self.openGzip().close()
+    with mock.patch.object(gzipindex.GzipIndex, 'canSave',
+                           return_value=False):
+      with self.openGzip(fallback=False) as f:
+        self.checkRead(f)
+
+  def test_modified_file(self):
+    self.openGzip().close()
+    self.data = b'new\n'
+    with open(self.path, 'wb') as f:
+      f.write(gzip.compress(self.data))
+    with self.openGzip() as f:
+      self.assertEqual(f.read(), self.data)
+
+  def test_truncated_file(self):
+    with open(self.path, 'rb') as f:
+      data = f.read()
+    with open(self.path, 'wb') as f:
+      f.write(data[:-1000])
+    self.assertRaises(GzipIndexError, self.openGzip)
+    self.assertEqual(os.listdir(self.index_folder), [])
+
+  def test_padding(self):
+    with open(self.path, 'ab') as f:
+      f.write(b'\0' * 100)
+    with self.openGzip() as f:
+      self.checkRead(f)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,150 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from click.testing import CliRunner
+
+from slapos import loganalyze
+from slapos.logscan import ChunkScanner, countMatches, findAll
+
+NODE_LOG = """\
+[2026-10-18 10:00:00,001] INFO     Processing Computer Partition slappart0.
+[2026-10-18 10:00:00,002] INFO       Software URL: https://lab.nexedi.com/nexedi/slapos/raw/1.0.300/software/erp5/software.cfg
+[2026-10-18 10:00:05,003] INFO     Installing part.
+[2026-10-18 10:00:09,004] INFO     Processing Computer Partition slappart1.
+[2026-10-18 10:00:09,005] INFO       Software URL: https://lab.nexedi.com/nexedi/slapos/raw/1.0.301/software/kvm/software.cfg
+[2026-10-18 10:00:12,006] ERROR    Failed to run buildout profile in directory '/srv/slapgrid/slappart1'
+While:
+  Installing.
+[2026-10-18 10:00:20,007] INFO     Processing Computer Partition slappart2.
+[2026-10-18 10:00:20,008] INFO       Software URL: /srv/software.cfg
+[2026-10-18 10:00:21,009] INFO     Installing part.
+"""
+
+
+class TestChunkScanner(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.folder)
+    self.path = os.path.join(self.folder, 'access.log')
+    with open(self.path, 'w') as f:
+      for i in range(1000):
+        f.write('line %d status %d\n' % (i, 500 if i % 7 == 0 else 200))
+
+  def test_chunk_list(self):
+    with open(self.path, 'rb') as f:
+      data = f.read()
+    chunk_list = ChunkScanner(chunk_size=100).getChunkList(data)
+    self.assertGreater(len(chunk_list), 100)
+    self.assertEqual(chunk_list[0][0], 0)
+    self.assertEqual(chunk_list[-1][1], len(data))
+    for (_, end), (start, _) in zip(chunk_list, chunk_list[1:]):
+      self.assertEqual(end, start)
+      self.assertEqual(data[end - 1:end], b'\n')
+
+  def test_chunk_list_no_newline(self):
+    data = b'a' * 250
+    self.assertEqual(ChunkScanner(chunk_size=100).getChunkList(data),
+                     [(0, 250)])
+    data = b'a' * 150 + b'\n' + b'b' * 150
+    self.assertEqual(ChunkScanner(chunk_size=100).getChunkList(data),
+                     [(0, 151), (151, 301)])
+
+  def checkScan(self, scanner):
+    self.assertEqual(
+      countMatches(self.path, br'status 500$', scanner=scanner), 143)
+    match_list = findAll(self.path, br'^line (\d+) status 500$',
+                         scanner=scanner)
+    self.assertEqual(match_list, [(b'%d' % i,) for i in range(0, 1000, 7)])
+    self.assertEqual(
+      findAll(self.path, br'^line 99\d', scanner=scanner),
+      [b'line 99%d' % i for i in range(10)])
+
+  def test_scan_one_process(self):
+    self.checkScan(ChunkScanner(1, chunk_size=1000))
+
+  def test_scan_process_pool(self):
+    self.checkScan(ChunkScanner(2, chunk_size=1000))
+
+  def test_scan_one_chunk(self):
+    self.checkScan(ChunkScanner(2))
+
+  def test_scan_gzip(self):
+    path = self.path + '.gz'
+    with open(self.path, 'rb') as f, gzip.open(path, 'wb') as gz:
+      gz.write(f.read())
+    self.path = path
+    # decompressed whole, nothing is written next to the log
+    self.checkScan(ChunkScanner(2, chunk_size=1000))
+    self.assertEqual(sorted(os.listdir(self.folder)),
+                     ['access.log', 'access.log.gz'])
+    # split in chunks with the index kept in the given folder
+    index_folder = os.path.join(self.folder, 'index')
+    self.checkScan(ChunkScanner(2, chunk_size=1000,
+                                gzip_index_folder=index_folder))
+    self.assertEqual(sorted(os.listdir(self.folder)),
+                     ['access.log', 'access.log.gz', 'index'])
+    self.assertTrue(os.listdir(index_folder))
+
+  def test_scan_empty(self):
+    open(self.path, 'w').close()
+    self.assertEqual(ChunkScanner(2).scan(self.path, len), [])
+    self.assertEqual(countMatches(self.path, b'status'), 0)
+
+
+class TestLogAnalyze(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.folder)
+    self.path = os.path.join(self.folder, 'slapos-node.log')
+    with open(self.path, 'w') as f:
+      f.write(NODE_LOG)
+
+  def analyze(self, *args):
+    result = CliRunner().invoke(loganalyze.main, list(args) + [self.path])
+    self.assertEqual(result.exit_code, 0, result.output)
+    return result.output
+
+  def test_main(self):
+    expected = (
+      "slappart0;2026-10-18 10:00:00;1.0.300;OK;5\n"
+      "slappart1;2026-10-18 10:00:09;1.0.301;ERR;3\n"
+      "slappart2;2026-10-18 10:00:20;/srv/software.cfg;UNK/LAST;1\n")
+    self.assertEqual(self.analyze('--process-count', '1'), expected)
+    # lines are split at chunk boundaries, the output is the same
+    with mock.patch('slapos.loganalyze.ChunkScanner',
+        lambda process_count, **kw: ChunkScanner(process_count,
+                                                  chunk_size=100, **kw)):
+      self.assertEqual(self.analyze('--process-count', '1'), expected)
+      self.assertEqual(self.analyze('--process-count', '2'), expected)
+
+  def test_main_gzip(self):
+    with open(self.path, 'rb') as f, gzip.open(self.path + '.gz', 'wb') as gz:
+      gz.write(f.read())
+    self.path += '.gz'
+    expected = (
+      "slappart0;2026-10-18 10:00:00;1.0.300;OK;5\n"
+      "slappart1;2026-10-18 10:00:09;1.0.301;ERR;3\n"
+      "slappart2;2026-10-18 10:00:20;/srv/software.cfg;UNK/LAST;1\n")
+    self.assertEqual(self.analyze(), expected)
+    self.assertNotIn('.gzip-index', os.listdir(self.folder))
+    index_folder = os.path.join(self.folder, 'index')
+    with mock.patch('slapos.loganalyze.ChunkScanner',
+        lambda process_count, **kw: ChunkScanner(process_count,
+                                                  chunk_size=100, **kw)):
+      self.assertEqual(
+        self.analyze('--process-count', '2',
+                     '--gzip-index-folder', index_folder),
+        expected)
+    self.assertNotIn('.gzip-index', os.listdir(self.folder))
+    self.assertTrue(os.listdir(index_folder))
+
+
+if __name__ == '__main__':
+  unittest.main()
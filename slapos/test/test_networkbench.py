@@ -26,7 +26,10 @@
 ##############################################################################
 
 import unittest
-from slapos.networkbench.ping import ping, ping6
+import mock
+from slapos.networkbench import icmp
+from slapos.networkbench.icmp import ICMPProbe, getStatistics
+from slapos.networkbench.ping import ping, ping6, pingMany
 
 class TestPing(unittest.TestCase):
 
@@ -65,3 +68,70 @@ class TestPing(unittest.TestCase):
     self.assertEqual(info[3], 'failed')
     self.assertEqual(info[4], -1)
     self.assertEqual(info[5], 'Fail to parser ping output')
+
+
+class TestICMPProbe(unittest.TestCase):
+
+  def test_statistics(self):
+    result = getStatistics(5, [4., 1., 3., 2.])
+    self.assertEqual(result['loss'], 20)
+    self.assertEqual((result['min'], result['avg'], result['max']),
+                     (1, 2.5, 4))
+    self.assertAlmostEqual(result['mdev'], 1.118, 3)
+    self.assertEqual(result['percentile']['50'], 2.5)
+    self.assertAlmostEqual(result['percentile']['90'], 3.7)
+    self.assertEqual(getStatistics(5, []),
+                     {'sent': 5, 'received': 0, 'loss': 100})
+
+  def test_probe(self):
+    result_dict = ICMPProbe(count=3, interval=0.1, timeout=5).probe(
+      ['127.0.0.1', '127.0.0.2', ('::1', icmp.socket.AF_INET6), 'couscous'])
+    for target in '127.0.0.1', '127.0.0.2', ('::1', icmp.socket.AF_INET6):
+      result = result_dict[target]
+      self.assertEqual((result['sent'], result['received'], result['loss']),
+                       (3, 3, 0), target)
+      self.assertIsNone(result['error'])
+      self.assertLessEqual(result['min'], result['percentile']['50'])
+      self.assertLessEqual(result['percentile']['99'], result['max'])
+    self.assertEqual(result_dict['127.0.0.2']['address'], '127.0.0.2')
+    self.assertEqual(result_dict['couscous']['sent'], 0)
+    self.assertTrue(result_dict['couscous']['error'])
+
+  def test_resolve_family(self):
+    probe = ICMPProbe()
+    self.assertEqual(probe.resolve('127.0.0.1'),
+                     (icmp.socket.AF_INET, ('127.0.0.1', 0)))
+    self.assertEqual(probe.resolve('::1', icmp.socket.AF_INET6)[0],
+                     icmp.socket.AF_INET6)
+    # literal addresses are pinged in their own family
+    self.assertEqual(probe.resolve('127.0.0.1', icmp.socket.AF_INET6),
+                     (icmp.socket.AF_INET, ('127.0.0.1', 0)))
+    self.assertEqual(probe.resolve('::1', icmp.socket.AF_INET)[0],
+                     icmp.socket.AF_INET6)
+
+  def test_ping_many(self):
+    info_list = pingMany([('127.0.0.1', '4'), ('::1', '6'), ('couscous', '4')],
+                         count=2)
+    self.assertEqual([info[:3] for info in info_list], [
+      ('PING', '127.0.0.1', 200),
+      ('PING6', '::1', 200),
+      ('PING', 'couscous', 600),
+    ])
+    self.assertEqual(info_list[0][4], '0')
+    self.assertEqual(info_list[2][4], -1)
+
+  def test_ping_command_fallback(self):
+    with mock.patch.object(icmp.ICMPProbe, 'probe',
+                           side_effect=icmp.ICMPError("no ICMP socket")), \
+        mock.patch('slapos.networkbench.ping.pingCommand',
+                   return_value='ping output') as pingCommand:
+      self.assertEqual(ping('127.0.0.1', count=2), 'ping output')
+    pingCommand.assert_called_once_with(
+      '127.0.0.1', timeout=10, protocol='4', count=2)
+
+  def test_socket_error(self):
+    # e.g. IPv6 disabled
+    with mock.patch.object(icmp.socket, 'socket', side_effect=OSError(
+        icmp.errno.EAFNOSUPPORT, "Address family not supported")):
+      with self.assertRaises(icmp.ICMPError):
+        icmp.ICMPSocket(icmp.socket.AF_INET6)